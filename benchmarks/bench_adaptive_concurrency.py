@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Simulación del control adaptativo (AIMD) de concurrencia frente a límites fijos.
+
+Levanta un servidor local que imita /v1/chat/completions con una curva de
+latencia configurable: hasta --capacity requests simultáneos cada uno tarda
+--base-latency; por encima, la latencia crece como (activos/capacity)^exponent
+y pasado --overload-at el servidor responde 503. Muchos llamadores concurrentes
+(historias + páginas + verificadores) compiten por él.
+
+Compara:
+- Límite fijo bajo (como max_workers: 3 de ParallelCuentacuentos)
+- Límite fijo alto (sin control efectivo)
+- AIMD entre 1 y --max-limit
+
+Uso:
+    python benchmarks/bench_adaptive_concurrency.py --callers 30 --calls 4
+    python benchmarks/bench_adaptive_concurrency.py --capacity 8 --exponent 2 --overload-at 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+from async_llm_client import AsyncLLMClient
+from llm_admission import AdmissionController
+from llm_concurrency import AdaptiveConcurrencyController
+
+COMPLETION_TOKENS = 100
+
+
+class SimulatedGPUHandler(BaseHTTPRequestHandler):
+    """Servidor cuya latencia depende de cuántos requests atiende a la vez"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    wbufsize = 64 * 1024
+
+    curve = {"base_latency": 0.1, "capacity": 6, "exponent": 1.5, "overload_at": 24}
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+    rejected = 0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        cls = SimulatedGPUHandler
+        with cls.lock:
+            cls.active += 1
+            active = cls.active
+            cls.max_active = max(cls.max_active, active)
+
+        try:
+            if active > cls.curve["overload_at"]:
+                with cls.lock:
+                    cls.rejected += 1
+                time.sleep(cls.curve["base_latency"] / 10)
+                return self.reply(503, {"error": "server overloaded"})
+
+            load = max(1.0, active / cls.curve["capacity"])
+            time.sleep(cls.curve["base_latency"] * load ** cls.curve["exponent"])
+            self.reply(200, {
+                "choices": [{"message": {"content": json.dumps({"ok": True})}}],
+                "usage": {"prompt_tokens": 50, "completion_tokens": COMPLETION_TOKENS,
+                          "total_tokens": 50 + COMPLETION_TOKENS}
+            })
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    """Inicia el servidor simulado en un puerto libre y retorna (server, url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SimulatedGPUHandler)
+    server.daemon_threads = True
+    server.request_queue_size = 256
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}/v1/chat/completions"
+
+
+async def run_scenario(url: str, limit: int, adaptive: bool, args) -> dict:
+    """Ejecuta callers x calls llamadas con un límite fijo o adaptativo"""
+    client = AsyncLLMClient()
+    client.endpoint = url
+    client.pool_size = limit  # Que el pool de conexiones no sea el cuello de botella
+    client.retry_delay = 0.05
+    client.cache = None
+    client.admission = AdmissionController(max_in_flight=limit, token_budget=0, policy="fifo")
+    client.concurrency = None
+    if adaptive:
+        client.concurrency = AdaptiveConcurrencyController(
+            client.admission, min_limit=1, max_limit=limit, initial_limit=3, window_size=50
+        )
+
+    SimulatedGPUHandler.max_active = 0
+    SimulatedGPUHandler.rejected = 0
+    latencies, errors = [], 0
+
+    async def caller(i):
+        nonlocal errors
+        for j in range(args.calls):
+            start = time.perf_counter()
+            try:
+                await client.generate("s", f"llamador {i} llamada {j}", use_cache=False)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[caller(i) for i in range(args.callers)])
+    elapsed = time.perf_counter() - start
+    await client.close()
+
+    result = {
+        "total": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) if latencies else 0,
+        "p95": sorted(latencies)[int(len(latencies) * 0.95) - 1] if latencies else 0,
+        "errors": errors,
+        "rejected_503": SimulatedGPUHandler.rejected,
+        "max_server_active": SimulatedGPUHandler.max_active
+    }
+    if adaptive:
+        result["final_limit"] = client.concurrency.get_stats()["limit"]
+    return result
+
+
+def print_result(name: str, r: dict):
+    extra = f"  límite final={r['final_limit']}" if "final_limit" in r else ""
+    print(f"{name:<22} total={r['total']:6.2f}s  {r['throughput']:6.1f} llamadas/s  "
+          f"p50={r['p50']:5.2f}s  p95={r['p95']:5.2f}s  fallidas={r['errors']:3d}  "
+          f"503={r['rejected_503']:4d}  máx. en servidor={r['max_server_active']:3d}{extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulación AIMD vs. límites fijos de concurrencia")
+    parser.add_argument("--callers", type=int, default=30, help="Llamadores concurrentes")
+    parser.add_argument("--calls", type=int, default=4, help="Llamadas secuenciales por llamador")
+    parser.add_argument("--base-latency", type=float, default=0.1, help="Latencia sin carga (s)")
+    parser.add_argument("--capacity", type=int, default=6, help="Requests simultáneos sin degradación")
+    parser.add_argument("--exponent", type=float, default=1.5, help="Curva de degradación sobre la capacidad")
+    parser.add_argument("--overload-at", type=int, default=24, help="Activos a partir de los que responde 503")
+    parser.add_argument("--low-limit", type=int, default=3, help="Límite fijo conservador")
+    parser.add_argument("--max-limit", type=int, default=32, help="Límite fijo agresivo y techo de AIMD")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    SimulatedGPUHandler.curve = {
+        "base_latency": args.base_latency,
+        "capacity": args.capacity,
+        "exponent": args.exponent,
+        "overload_at": args.overload_at
+    }
+    server, url = start_server()
+    print(f"Servidor simulado: capacidad={args.capacity}, latencia base={args.base_latency}s, "
+          f"exponente={args.exponent}, 503 sobre {args.overload_at} activos")
+    print(f"{args.callers} llamadores x {args.calls} llamadas\n")
+
+    print_result(f"Fijo {args.low_limit}", asyncio.run(run_scenario(url, args.low_limit, False, args)))
+    print_result(f"Fijo {args.max_limit}", asyncio.run(run_scenario(url, args.max_limit, False, args)))
+    print_result(f"AIMD 1..{args.max_limit}", asyncio.run(run_scenario(url, args.max_limit, True, args)))
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Simulación de reintentos y tokens por historia con y sin decodificación guiada.
+
+Levanta un servidor local que imita /v1/chat/completions. Sin JSON Schema en
+el request, una fracción --malformed-rate de las respuestas se sale del
+contrato como lo hace el modelo real: JSON cortado o con comas colgantes
+(falla el parseo y el cliente reintenta) o un campo requerido faltante
+(falla validate_output_structure y el runner vuelve a ejecutar el agente).
+Con schema (response_format o guided_json) el servidor siempre responde un
+JSON que cumple el contrato, como la decodificación guiada de vLLM.
+
+Una "historia" son los 12 agentes de v2 más las 10 páginas de cuentacuentos.
+Los tokens se cuentan del lado del servidor (prompt + completion de cada
+request, incluidos los intentos perdidos).
+
+Uso:
+    python benchmarks/bench_guided_json.py --stories 20 --malformed-rate 0.2
+    python benchmarks/bench_guided_json.py --mode guided_json
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+import config
+from async_llm_client import AsyncLLMClient, run_sync
+from json_schemas import CONTRACT_SCHEMAS, PAGE_SCHEMA_NAME
+from token_counter import heuristic_count
+
+AGENTES = [name for name in CONTRACT_SCHEMAS if name[:2].isdigit() and not name.endswith("_v3")
+           and name != PAGE_SCHEMA_NAME]
+
+STATS = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+STATS_LOCK = threading.Lock()
+
+
+def sample_from_schema(schema, rng):
+    """Instancia mínima que cumple el schema (con texto de largo variable)"""
+    kind = schema.get("type")
+    if kind == "object":
+        properties = schema.get("properties") or {"1": schema.get("additionalProperties", {})}
+        return {key: sample_from_schema(value, rng) for key, value in properties.items()}
+    if kind == "array":
+        count = schema.get("minItems", 3)
+        return [sample_from_schema(schema.get("items", {}), rng) for _ in range(count)]
+    if kind == "integer":
+        return rng.randint(1, 10)
+    if kind == "number":
+        return round(rng.random() * 100, 1)
+    if kind == "boolean":
+        return True
+    return " ".join(rng.choice(["Emilia", "mira", "el", "mar", "con", "su", "linterna", "mágica"])
+                    for _ in range(rng.randint(6, 20)))
+
+
+def make_handler(malformed_rate, seed):
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            schema = payload.get("guided_json") or (payload.get("response_format") or {}).get("json_schema", {}).get("schema")
+            agente = payload["messages"][0]["content"].split("|")[0]
+            with rng_lock:
+                content = sample_from_schema(schema or CONTRACT_SCHEMAS[agente], rng)
+                falla = None if schema else (rng.random() < malformed_rate and rng.choice(["parseo", "campo"]))
+            if falla == "campo":
+                content.pop(next(iter(content)))
+            text = json.dumps(content, ensure_ascii=False)
+            if falla == "parseo":
+                text = text[:int(len(text) * 0.7)] + ',"'
+
+            prompt_tokens = sum(heuristic_count(m["content"]) for m in payload["messages"])
+            completion_tokens = heuristic_count(text)
+            with STATS_LOCK:
+                STATS["requests"] += 1
+                STATS["prompt_tokens"] += prompt_tokens
+                STATS["completion_tokens"] += completion_tokens
+
+            body = json.dumps({
+                "choices": [{"message": {"content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def run_story(client, user_prompt, guided, max_runs):
+    """Ejecuta los agentes y páginas de una historia; retorna (ejecuciones, fallidas)"""
+    llamadas = [(agente, agente) for agente in AGENTES]
+    llamadas += [(PAGE_SCHEMA_NAME, f"pagina {n}") for n in range(1, 11)]
+    ejecuciones = fallidas = 0
+    for agente, etiqueta in llamadas:
+        schema = CONTRACT_SCHEMAS[agente]
+        for _ in range(max_runs):
+            ejecuciones += 1
+            try:
+                output = run_sync(client.generate(
+                    f"{agente}|Eres un agente de La Cuentería.", f"{user_prompt} - {etiqueta}",
+                    use_cache=False, agent_name=agente, json_schema=schema if guided else None
+                ))
+            except Exception:
+                fallidas += 1
+                continue
+            # Lo que haría validate_output_structure: volver a ejecutar si falta un campo
+            if all(field in output for field in schema["required"]):
+                break
+    return ejecuciones, fallidas
+
+
+def run_scenario(url, stories, guided, max_runs):
+    client = AsyncLLMClient()
+    client.endpoint = url
+    client.cache = None
+    client.concurrency = None
+    client.hedging = None
+    client.retry_delay = 0
+
+    for key in STATS:
+        STATS[key] = 0
+    llamadas = ejecuciones = fallidas = 0
+    for story in range(stories):
+        e, f = run_story(client, f"Brief de la historia {story}", guided, max_runs)
+        llamadas += len(AGENTES) + 10
+        ejecuciones += e
+        fallidas += f
+    run_sync(client.close())
+
+    requests = STATS["requests"]
+    return {
+        "requests_por_historia": requests / stories,
+        "tasa_reintento": (requests - llamadas) / requests,
+        "ejecuciones_extra_por_historia": (ejecuciones - llamadas) / stories,
+        "fallos_definitivos": fallidas,
+        "tokens_por_historia": (STATS["prompt_tokens"] + STATS["completion_tokens"]) / stories
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reintentos y tokens por historia con/sin decodificación guiada")
+    parser.add_argument("--stories", type=int, default=20, help="Historias simuladas por escenario")
+    parser.add_argument("--malformed-rate", type=float, default=0.2,
+                        help="Fracción de respuestas sin schema que rompen el contrato")
+    parser.add_argument("--mode", choices=["response_format", "guided_json"], default="response_format")
+    parser.add_argument("--max-runs", type=int, default=3, help="Ejecuciones por agente (como QUALITY_THRESHOLDS)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    config.LLM_SCHEMA_CONFIG["mode"] = args.mode
+
+    resultados = {}
+    for nombre, guided in (("sin schema", False), (f"con schema ({args.mode})", True)):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args.malformed_rate, args.seed))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+        resultados[nombre] = run_scenario(url, args.stories, guided, args.max_runs)
+        server.shutdown()
+
+    print(f"{args.stories} historias x {len(AGENTES) + 10} llamadas, "
+          f"{args.malformed_rate:.0%} de respuestas fuera de contrato sin schema\n")
+    print(f"{'escenario':<28}{'requests/hist':>14}{'reintentos':>12}{'reejec./hist':>14}{'fallos':>8}{'tokens/hist':>13}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:<28}{r['requests_por_historia']:>14.1f}{r['tasa_reintento']:>11.1%}"
+              f"{r['ejecuciones_extra_por_historia']:>14.2f}{r['fallos_definitivos']:>8}{r['tokens_por_historia']:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark de reparación de JSON sobre un corpus de salidas reales.
+
+Toma los JSON de runs/*/outputs/ (salidas de agentes, páginas, QA) y los
+re-serializa como los devuelve el modelo, limpios y con las fallas típicas:
+texto o bloque ```json alrededor, comas colgantes, saltos de línea crudos en
+strings y truncamiento a distintas alturas. Sin historias en runs/ se usan los
+JSON de ejemplo de la raíz del repositorio.
+
+Compara la limpieza anterior (recorte a la primera/última llave y cierres
+agregados por conteo, como _clean_json_response) con JSONRepairer:
+- parseo: la salida reparada es JSON válido
+- fiel: además es igual al original (solo variantes no truncadas)
+- MB/s sobre todo el corpus
+
+Uso:
+    python benchmarks/bench_json_repair.py
+    python benchmarks/bench_json_repair.py --runs-dir /ruta/a/runs --max-files 500
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+from config import RUNS_DIR
+from json_stream import repair_json
+
+REPO_DIR = Path(__file__).parent.parent
+
+
+def legacy_clean(content: str) -> str:
+    """Limpieza anterior: recorte por llaves y cierres por conteo de caracteres"""
+    content = content.replace("```json", "").replace("```", "").strip()
+    start_idx = 0
+    for i, char in enumerate(content):
+        if char in "{[":
+            start_idx = i
+            break
+    end_idx = len(content)
+    for i in range(len(content) - 1, -1, -1):
+        if content[i] in "}]":
+            end_idx = i + 1
+            break
+    cleaned = content[start_idx:end_idx]
+    if cleaned.count('{') > cleaned.count('}'):
+        cleaned += '}' * (cleaned.count('{') - cleaned.count('}'))
+    if cleaned.count('[') > cleaned.count(']'):
+        cleaned += ']' * (cleaned.count('[') - cleaned.count(']'))
+    return cleaned
+
+
+def load_corpus(runs_dir: Path, max_files: int):
+    """Documentos JSON (objeto o arreglo) de las salidas de historias"""
+    files = sorted(runs_dir.glob("*/outputs/**/*.json"))[:max_files]
+    origen = str(runs_dir)
+    if not files:
+        files = sorted(REPO_DIR.glob("*.json")) + sorted((REPO_DIR / "examples").glob("*.json"))
+        origen = "JSON de ejemplo del repositorio (no hay historias en runs/)"
+    docs = []
+    for path in files:
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if isinstance(data, (dict, list)) and data:
+            docs.append(data)
+    return docs, origen
+
+
+def variants(doc):
+    """(nombre, texto, truncada) con las fallas típicas de la salida del modelo"""
+    texto = json.dumps(doc, ensure_ascii=False, indent=2)
+    compacto = json.dumps(doc, ensure_ascii=False)
+    yield "limpia", texto, False
+    yield "bloque_y_texto", f"Aquí tienes el JSON solicitado:\n```json\n{texto}\n```\nEspero que te sirva.", False
+    yield "coma_colgante", texto[:-1].rstrip() + ",\n" + texto[-1], False
+    yield "salto_crudo", compacto.replace("\\n", "\n"), False
+    for fraccion in (0.5, 0.8, 0.95):
+        yield f"truncada_{int(fraccion * 100)}", texto[:int(len(texto) * fraccion)], True
+
+
+def evaluate(clean, doc, texto, truncada):
+    """(parsea, fiel) de una función de limpieza sobre una variante"""
+    try:
+        value = json.loads(clean(texto))
+    except ValueError:
+        return False, False
+    return True, (not truncada and value == doc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reparación de JSON: limpieza anterior vs JSONRepairer")
+    parser.add_argument("--runs-dir", type=Path, default=RUNS_DIR)
+    parser.add_argument("--max-files", type=int, default=1000)
+    args = parser.parse_args()
+
+    docs, origen = load_corpus(args.runs_dir, args.max_files)
+    if not docs:
+        print("No hay documentos JSON para el corpus")
+        return
+    casos = [(doc, nombre, texto, truncada) for doc in docs for nombre, texto, truncada in variants(doc)]
+    total_bytes = sum(len(texto.encode("utf-8")) for _, _, texto, _ in casos)
+    print(f"Corpus: {len(docs)} documentos de {origen}")
+    print(f"{len(casos)} variantes, {total_bytes / 1024:.0f} KB\n")
+
+    metodos = {
+        "limpieza anterior": legacy_clean,
+        "JSONRepairer": lambda texto: repair_json(texto)[0]
+    }
+    nombres = sorted({nombre for _, nombre, _, _ in casos}, key=lambda n: [c[1] for c in casos].index(n))
+    print(f"{'variante':<18}" + "".join(f"{m + ' parsea/fiel':>30}" for m in metodos))
+    for nombre in nombres:
+        fila = [c for c in casos if c[1] == nombre]
+        celdas = []
+        for clean in metodos.values():
+            resultados = [evaluate(clean, doc, texto, truncada) for doc, _, texto, truncada in fila]
+            parsea = sum(r[0] for r in resultados) / len(fila)
+            fiel = sum(r[1] for r in resultados) / len(fila)
+            celdas.append(f"{parsea:>23.0%} / {'-' if fila[0][3] else f'{fiel:.0%}':>4}")
+        print(f"{nombre:<18}" + "".join(celdas))
+
+    print()
+    for metodo, clean in metodos.items():
+        inicio = time.perf_counter()
+        for _, _, texto, _ in casos:
+            clean(texto)
+        elapsed = time.perf_counter() - inicio
+        print(f"{metodo:<18} {total_bytes / elapsed / 1e6:6.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
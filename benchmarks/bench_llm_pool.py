@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark del overhead por llamada del cliente LLM con y sin pool keep-alive.
+
+Levanta un servidor local que imita /v1/chat/completions (respuesta JSON fija,
+sin latencia de modelo) para que lo único que se mida sea el costo de
+conexión + serialización de cada llamada.
+
+Uso:
+    python benchmarks/bench_llm_pool.py --calls 200 --threads 3
+"""
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+import aiohttp
+
+from async_llm_client import AsyncLLMClient
+from llm_client import LLMClient
+
+RESPUESTA_FIJA = json.dumps({
+    "choices": [{"message": {"content": json.dumps({"ok": True, "texto": "hola"})}}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+}).encode("utf-8")
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Handler mínimo compatible con chat/completions (HTTP/1.1 keep-alive)"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    wbufsize = 64 * 1024  # Headers y cuerpo en un solo write (evita esperar el ACK retrasado)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPUESTA_FIJA)))
+        self.end_headers()
+        self.wfile.write(RESPUESTA_FIJA)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_standin_server():
+    """Inicia el servidor en un puerto libre y retorna (server, url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}/v1/chat/completions"
+
+
+class AsyncLLMClientSinPool(AsyncLLMClient):
+    """Variante que cierra la conexión tras cada llamada, como antes del pool"""
+
+    def _new_connector(self):
+        return aiohttp.TCPConnector(force_close=True)
+
+
+def run_calls(call, calls: int, threads: int):
+    """Ejecuta `call` N veces repartidas en un pool de hilos y retorna latencias en ms"""
+    latencies = []
+    lock = threading.Lock()
+
+    def one(_):
+        start = time.perf_counter()
+        call()
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(one, range(calls)))
+    return latencies
+
+
+def summarize(name: str, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<28} media={statistics.mean(latencies):7.2f}ms  "
+          f"p50={statistics.median(latencies):7.2f}ms  p95={p95:7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de pool keep-alive del LLMClient")
+    parser.add_argument("--calls", type=int, default=200, help="Llamadas por escenario")
+    parser.add_argument("--threads", type=int, default=3, help="Hilos concurrentes (como ParallelCuentacuentos)")
+    args = parser.parse_args()
+
+    server, url = start_standin_server()
+    payload = {"model": "bench", "messages": [{"role": "user", "content": "hola"}]}
+    print(f"Servidor local: {url} - {args.calls} llamadas, {args.threads} hilos\n")
+
+    # Sin pool: requests.post abre una conexión TCP nueva por llamada (comportamiento anterior)
+    sin_pool = run_calls(lambda: requests.post(url, json=payload, timeout=10), args.calls, args.threads)
+
+    # Con pool: LLMClient.generate completo sobre la sesión compartida
+    client = LLMClient()
+    client.endpoint = url
+    con_pool = run_calls(lambda: client.generate("sistema", "usuario", use_cache=False), args.calls, args.threads)
+
+    # Cliente sin pool: se fuerza una sesión nueva en cada llamada
+    client_sin_pool = LLMClient(async_client=AsyncLLMClientSinPool())
+    client_sin_pool.endpoint = url
+    cliente_sin_pool = run_calls(lambda: client_sin_pool.generate("sistema", "usuario", use_cache=False), args.calls, args.threads)
+
+    summarize("requests.post (sin pool)", sin_pool)
+    summarize("LLMClient sin pool", cliente_sin_pool)
+    summarize("LLMClient con pool", con_pool)
+
+    client.close()
+    client_sin_pool.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Benchmark end-to-end de StoryOrchestrator.process_story (v1, v2 y v3).
+
+Procesa cada brief de examples/brief_*.json con cada versión del pipeline
+contra el servidor LLM simulado (src/mock_llm_server.py, en un hilo de este
+proceso o uno externo con --mock-url) y mide por historia:
+
+- tiempo total (wall) y por agente (duración, latencia LLM, espera de admisión)
+- espera LLM: unión de los intervalos con al menos una llamada en curso
+- tiempo local: total - espera LLM (CPU, disco y pausas del pipeline)
+- CPU del proceso (incluye al mock si corre en este proceso)
+- llamadas, errores y tokens del cliente LLM, reintentos por QA
+- bytes escritos en la carpeta de la historia
+
+Cada ejecución se agrega a benchmarks/results/pipeline_history.jsonl (una
+línea por corrida) y pipeline_history.csv (una fila por historia). Con
+--save-baseline la corrida queda como línea base; con --compare se comparan
+las medianas contra esa línea base y --max-regression define cuánto más
+lento puede ser el tiempo total antes de salir con código 1.
+
+Uso:
+    python benchmarks/bench_pipeline.py --versions v1 v2 v3 --repeat 3
+    python benchmarks/bench_pipeline.py --time-scale 0.05 --save-baseline
+    python benchmarks/bench_pipeline.py --compare --max-regression 0.2
+"""
+import argparse
+import csv
+import json
+import logging
+import shutil
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+from config import BASE_DIR
+from llm_client import get_llm_client
+from mock_llm_server import start_mock_server
+from orchestrator import StoryOrchestrator
+
+RESULTS_DIR = Path(__file__).parent / "results"
+HISTORY_JSONL = RESULTS_DIR / "pipeline_history.jsonl"
+HISTORY_CSV = RESULTS_DIR / "pipeline_history.csv"
+BASELINE = RESULTS_DIR / "pipeline_baseline.json"
+
+CSV_FIELDS = ["corrida", "version", "brief", "repeticion", "estado", "tiempo_total", "espera_llm",
+              "tiempo_local", "cpu", "llamadas_llm", "errores_llm", "tokens_prompt",
+              "tokens_completion", "reintentos", "bytes_escritos"]
+
+
+class LLMRecorder:
+    """Registra intervalos, tokens y errores de cada llamada del cliente LLM"""
+
+    def __init__(self, async_client):
+        self.lock = threading.Lock()
+        self.reset()
+        generate = async_client.generate
+
+        async def recorded_generate(*args, **kwargs):
+            start = time.perf_counter()
+            failed = False
+            try:
+                result = await generate(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                with self.lock:
+                    self.intervals.append((start, time.perf_counter()))
+                    self.calls += 1
+                    self.errors += failed
+            tokens = (result[0] if isinstance(result, list) and result else result).get("_metadata_tokens", {})
+            with self.lock:
+                self.prompt_tokens += tokens.get("prompt_tokens", 0)
+                self.completion_tokens += tokens.get("completion_tokens", 0)
+            return result
+
+        # generate_batch llama a self.generate, así que las páginas también pasan por aquí
+        async_client.generate = recorded_generate
+
+    def reset(self):
+        with self.lock:
+            self.intervals: List[Tuple[float, float]] = []
+            self.calls = 0
+            self.errors = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+
+    def busy_time(self) -> float:
+        """Segundos con al menos una llamada en curso (las llamadas paralelas no se suman)"""
+        total, end = 0.0, None
+        for start, stop in sorted(self.intervals):
+            if end is None or start > end:
+                total += stop - start
+                end = stop
+            elif stop > end:
+                total += stop - end
+                end = stop
+        return total
+
+
+def directory_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def run_story(version: str, brief_path: Path, repetition: int, recorder: LLMRecorder, keep: bool) -> Dict[str, Any]:
+    """Procesa un brief con una versión del pipeline y retorna sus métricas"""
+    brief = json.loads(brief_path.read_text(encoding="utf-8"))
+    orchestrator = StoryOrchestrator(story_id=f"bench-{version}-{brief_path.stem}", pipeline_version=version)
+    recorder.reset()
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    result = orchestrator.process_story(brief)
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    llm_wait = recorder.busy_time()
+    manifest = orchestrator.manifest
+    agents = {
+        agent: {k: times[k] for k in ("duration", "llm_latency", "queue_wait") if k in times}
+        for agent, times in manifest.get("timestamps", {}).items()
+    }
+    metrics = {
+        "version": version,
+        "brief": brief_path.stem,
+        "repeticion": repetition,
+        "estado": manifest.get("estado", result["status"]),
+        "tiempo_total": round(wall, 3),
+        "espera_llm": round(llm_wait, 3),
+        "tiempo_local": round(wall - llm_wait, 3),
+        "cpu": round(cpu, 3),
+        "llamadas_llm": recorder.calls,
+        "errores_llm": recorder.errors,
+        "tokens_prompt": recorder.prompt_tokens,
+        "tokens_completion": recorder.completion_tokens,
+        "reintentos": sum(manifest.get("reintentos", {}).values()),
+        "bytes_escritos": directory_bytes(orchestrator.story_path),
+        "agentes": agents
+    }
+    if not keep:
+        shutil.rmtree(orchestrator.story_path, ignore_errors=True)
+    return metrics
+
+
+def summarize(stories: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """Medianas por versión/brief de las métricas numéricas"""
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for story in stories:
+        groups.setdefault(f"{story['version']}/{story['brief']}", []).append(story)
+    return {
+        key: {field: statistics.median(s[field] for s in group) for field in CSV_FIELDS[5:]}
+        for key, group in groups.items()
+    }
+
+
+def save_history(run: Dict[str, Any]):
+    """Agrega la corrida al historial JSONL y sus historias al CSV"""
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    with open(HISTORY_JSONL, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run, ensure_ascii=False) + "\n")
+    new_file = not HISTORY_CSV.exists()
+    with open(HISTORY_CSV, "a", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        if new_file:
+            writer.writeheader()
+        for story in run["historias"]:
+            writer.writerow(dict(story, corrida=run["corrida"]))
+
+
+def compare(summary: Dict[str, Dict[str, float]], baseline: Dict[str, Any], max_regression: float) -> bool:
+    """
+    Imprime la diferencia contra la línea base
+
+    Returns:
+        True si ninguna historia empeoró su tiempo total más de max_regression
+    """
+    ok = True
+    print(f"\nComparación con la línea base {baseline['corrida']}:")
+    print(f"{'historia':<28}{'total':>10}{'base':>10}{'delta':>9}{'llamadas':>10}{'tokens':>10}")
+    for key, current in summary.items():
+        base = baseline["resumen"].get(key)
+        if base is None:
+            print(f"{key:<28}{current['tiempo_total']:>10.2f}{'-':>10}")
+            continue
+        delta = (current["tiempo_total"] - base["tiempo_total"]) / base["tiempo_total"] if base["tiempo_total"] else 0.0
+        tokens = current["tokens_prompt"] + current["tokens_completion"]
+        base_tokens = base["tokens_prompt"] + base["tokens_completion"]
+        flag = ""
+        if delta > max_regression:
+            ok = False
+            flag = "  ⚠️ regresión"
+        print(f"{key:<28}{current['tiempo_total']:>10.2f}{base['tiempo_total']:>10.2f}{delta:>+9.1%}"
+              f"{current['llamadas_llm'] - base['llamadas_llm']:>+10.0f}{tokens - base_tokens:>+10.0f}{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end de process_story contra el LLM simulado")
+    parser.add_argument("--versions", nargs="+", default=["v1", "v2", "v3"])
+    parser.add_argument("--briefs", nargs="+", type=Path,
+                        default=sorted((BASE_DIR / "examples").glob("brief_*.json")))
+    parser.add_argument("--repeat", type=int, default=1, help="Repeticiones por versión y brief")
+    parser.add_argument("--mock-url", help="Servidor simulado externo (por defecto uno en este proceso)")
+    parser.add_argument("--time-scale", type=float, default=0.0,
+                        help="Escala de las latencias simuladas (0 = solo el overhead del pipeline)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--use-cache", action="store_true", help="Mantener la caché de respuestas del cliente")
+    parser.add_argument("--keep-runs", action="store_true", help="No borrar las historias generadas en runs/")
+    parser.add_argument("--save-baseline", action="store_true", help="Guardar esta corrida como línea base")
+    parser.add_argument("--compare", action="store_true", help="Comparar con la línea base guardada")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Aumento relativo del tiempo total tolerado al comparar")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    server = None
+    url = args.mock_url
+    if url is None:
+        server, _, url = start_mock_server(time_scale=args.time_scale, seed=args.seed)
+    client = get_llm_client()
+    client.endpoint = url
+    if not args.use_cache:
+        client.async_client.cache = None
+    recorder = LLMRecorder(client.async_client)
+
+    stories = []
+    for version in args.versions:
+        for brief_path in args.briefs:
+            for repetition in range(args.repeat):
+                story = run_story(version, brief_path, repetition, recorder, args.keep_runs)
+                stories.append(story)
+                print(f"{version} {brief_path.stem:<22} {story['estado']:<10} total {story['tiempo_total']:>7.2f}s  "
+                      f"LLM {story['espera_llm']:>7.2f}s  local {story['tiempo_local']:>6.2f}s  "
+                      f"{story['llamadas_llm']:>3} llamadas  {story['bytes_escritos'] / 1024:>7.1f} KB")
+    client.close()
+    if server is not None:
+        server.shutdown()
+
+    run = {
+        "corrida": datetime.now().isoformat(timespec="seconds"),
+        "parametros": {"time_scale": args.time_scale, "seed": args.seed, "repeat": args.repeat,
+                       "mock_url": args.mock_url},
+        "resumen": summarize(stories),
+        "historias": stories
+    }
+    save_history(run)
+    print(f"\nHistorial: {HISTORY_JSONL} y {HISTORY_CSV}")
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(run, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Línea base guardada en {args.baseline}")
+
+    if args.compare:
+        if not args.baseline.exists():
+            parser.error(f"No existe la línea base {args.baseline} (usar --save-baseline)")
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if not compare(run["resumen"], baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Huella de las entradas de cada agente para re-ejecución incremental
+
+Un agente se puede saltar al re-ejecutar una historia si nada de lo que
+determina su salida cambió desde la última vez que terminó bien: su prompt
+de sistema, los artefactos de los que depende, los parámetros de muestreo y
+su parte de la configuración de la versión. La huella es un sha256 de esas
+entradas; el manifest guarda la huella de cada agente completado junto con
+el digest de cada entrada, para poder decir qué cambió.
+
+Como los artefactos se comparan por contenido, si un agente se re-ejecuta y
+produce exactamente la misma salida sus descendientes siguen al día.
+"""
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from config import (
+    AGENT_MAX_TOKENS,
+    AGENT_TEMPERATURES,
+    BASE_DIR,
+    LLM_CONFIG,
+    get_agent_prompt_path,
+    get_artifact_path
+)
+
+# Cambiar si cambia lo que entra en la huella (invalida las huellas guardadas)
+FINGERPRINT_FORMAT = 1
+
+# Archivos de configuración que los agentes leen desde flujo/<versión> y no desde la historia
+_VERSION_FILES = ("configuracion_poetica/",)
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_digest(path: Path) -> Optional[str]:
+    """sha256 del archivo, o None si no existe"""
+    if not path.exists():
+        return None
+    return _digest(path.read_bytes())
+
+
+def _json_digest(value: Any) -> str:
+    return _digest(json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def _dependency_path(story_id: str, version: str, dependency_file: str) -> Path:
+    """Dónde lee AgentRunner cada dependencia (la copia de la historia o flujo/<versión>)"""
+    if dependency_file.startswith(_VERSION_FILES):
+        story_copy = get_artifact_path(story_id, Path("inputs") / dependency_file)
+        if story_copy.exists():
+            return story_copy
+        return BASE_DIR / "flujo" / version / dependency_file
+    return get_artifact_path(story_id, dependency_file)
+
+
+def _sampling_params(agent_name: str, version: str, version_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Modelo y parámetros de muestreo efectivos, con los mismos fallbacks que AgentRunner"""
+    agent_config = version_config.get("agent_config", {}).get(agent_name, {}) if version != "v1" else {}
+    temperature = agent_config.get("temperature")
+    if temperature is None:
+        temperature = AGENT_TEMPERATURES.get(agent_name)
+    max_tokens = agent_config.get("max_tokens") or AGENT_MAX_TOKENS.get(agent_name)
+    return {
+        "model": LLM_CONFIG["model"],
+        "temperature": temperature if temperature is not None else LLM_CONFIG["temperature"],
+        "max_tokens": max_tokens or LLM_CONFIG["max_tokens"],
+        "top_p": agent_config.get("top_p")
+    }
+
+
+def fingerprint_inputs(story_id: str,
+                       agent_name: str,
+                       version: str,
+                       version_config: Dict[str, Any],
+                       mode_verificador_qa: bool = True) -> Dict[str, Optional[str]]:
+    """
+    Digest de cada entrada de un agente
+
+    brief.json entra siempre (algunos agentes lo leen aunque no esté en
+    dependencies.json); las dependencias que aún no existen quedan en None.
+
+    Returns:
+        Dict entrada -> sha256 (o None)
+    """
+    inputs: Dict[str, Optional[str]] = {
+        "prompt": _file_digest(Path(get_agent_prompt_path(agent_name, version))),
+        "brief.json": _file_digest(get_artifact_path(story_id, "brief.json"))
+    }
+    for dependency_file in version_config.get("dependencies", {}).get(agent_name, []):
+        inputs[dependency_file] = _file_digest(_dependency_path(story_id, version, dependency_file))
+
+    criteria = BASE_DIR / "flujo" / version / "criterios_evaluacion" / f"{agent_name}.json"
+    if criteria.exists():
+        inputs["criterios_evaluacion"] = _file_digest(criteria)
+    if mode_verificador_qa:
+        inputs["verificador_qa"] = _file_digest(Path(get_agent_prompt_path("verificador_qa", version)))
+
+    inputs["sampling"] = _json_digest(_sampling_params(agent_name, version, version_config))
+    inputs["version_config"] = _json_digest({
+        "format": FINGERPRINT_FORMAT,
+        "version": version,
+        "mode_verificador_qa": mode_verificador_qa,
+        "qa_threshold": version_config.get("agent_qa_thresholds", {}).get(agent_name,
+                                                                          version_config.get("qa_threshold")),
+        "max_retries": version_config.get("max_retries"),
+        "agent_config": version_config.get("agent_config", {}).get(agent_name, {}),
+        "dependencies": version_config.get("dependencies", {}).get(agent_name, [])
+    })
+    return inputs
+
+
+def agent_fingerprint(inputs: Dict[str, Optional[str]]) -> str:
+    """Huella única a partir de los digests de fingerprint_inputs"""
+    return _json_digest(inputs)
+
+
+def changed_inputs(previous: Dict[str, Optional[str]], current: Dict[str, Optional[str]]) -> list:
+    """Entradas que cambiaron entre dos huellas (para explicar una re-ejecución)"""
+    return sorted(key for key in set(previous) | set(current) if previous.get(key) != current.get(key))
@@ -15,8 +15,16 @@ from config import (
     AGENT_DEPENDENCIES
 )
 from llm_client import get_llm_client
+from deadlines import Deadline
+from token_counter import count_tokens, get_token_counter
+from context_budget import dump_dependency, plan_context
+from token_sizing import get_max_tokens_sizer
+from json_schemas import get_agent_schema
 from quality_gates import get_quality_checker
 from conflict_analyzer import get_conflict_analyzer
+from tracing import span, traced
+from atomic_io import atomic_write_json
+from manifest_store import get_manifest_store
 
 logger = logging.getLogger(__name__)
 
@@ -47,13 +55,16 @@ class AgentRunner:
         if version != 'v1':
             self.conflict_analyzer = get_conflict_analyzer(version)
         
-    def run_agent(self, agent_name: str, retry_count: int = 0) -> Dict[str, Any]:
+    @traced("agent", "agent_name", "retry_count")
+    def run_agent(self, agent_name: str, retry_count: int = 0,
+                  deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """
         Ejecuta un agente específico
         
         Args:
             agent_name: Nombre del agente a ejecutar
             retry_count: Número de reintentos actuales
+            deadline: Plazo de la historia, propagado a cada llamada al LLM
             
         Returns:
             Diccionario con el resultado de la ejecución
@@ -67,7 +78,9 @@ class AgentRunner:
             logger.info(f"🚀 Usando procesamiento ESPECIAL para {agent_name}")
             try:
                 from parallel_cuentacuentos import ParallelCuentacuentos
-                processor = ParallelCuentacuentos(self.story_id, self.version, self.mode_verificador_qa)
+                processor = ParallelCuentacuentos(
+                    self.story_id, self.version, self.mode_verificador_qa, deadline=deadline
+                )
                 result = processor.run()
                 
                 # Adaptar resultado al formato esperado
@@ -100,10 +113,7 @@ class AgentRunner:
             # 2. Cargar las dependencias (artefactos previos)
             dependencies = self._load_dependencies(agent_name)
             
-            # 3. Construir el prompt del usuario
-            user_prompt = self._build_user_prompt(agent_name, dependencies)
-            
-            # 4. Obtener configuración específica del agente
+            # 3. Obtener configuración específica del agente
             agent_config = {}
             agent_temperature = None
             max_tokens = None
@@ -132,6 +142,31 @@ class AgentRunner:
             if top_p:
                 logger.info(f"📊 Usando top_p específico para {agent_name}: {top_p}")
             
+            # max_tokens según las respuestas históricas del agente (p99 + margen);
+            # el configurado queda como tope si la respuesta se trunca
+            configured_max_tokens = max_tokens or self.llm_client.max_tokens
+            max_tokens = get_max_tokens_sizer().recommend(agent_name, configured_max_tokens)
+            
+            # 4. Construir el prompt del usuario verificando que quepa en la ventana de contexto
+            # (si no, se quitan campos prescindibles, se compacta el JSON y se reduce max_tokens)
+            with span("plan_context", "cpu", agent=agent_name):
+                user_prompt, max_tokens, context_plan = plan_context(
+                    system_prompt,
+                    dependencies,
+                    lambda deps, compact: self._build_user_prompt(agent_name, deps, compact),
+                    max_tokens
+                )
+            max_tokens_ceiling = min(
+                configured_max_tokens,
+                context_plan["context_window"] - context_plan["safety_margin"] - context_plan["prompt_tokens"]
+            )
+            
+            # Caché de respuestas: opt-out por agente ("cache": false en agent_config.json)
+            # o por versión; los reintentos siempre piden una generación nueva
+            use_cache = agent_config.get('cache')
+            if retry_count > 0 or not self.version_config.get('optimizations', {}).get('enable_caching', True):
+                use_cache = False
+            
             # Guardar solicitud completa antes de enviar
             self._save_agent_request(
                 agent_name=agent_name,
@@ -141,17 +176,30 @@ class AgentRunner:
                 max_tokens=max_tokens,
                 top_p=top_p,
                 dependencies=list(dependencies.keys()) if dependencies else [],
-                retry_count=retry_count
+                retry_count=retry_count,
+                context_plan=context_plan
             )
             
             start_time = datetime.now()
             try:
+                if not context_plan["fits"]:
+                    # No ocupar la GPU con un request que terminaría en respuesta vacía
+                    raise ValueError(
+                        f"STOP: Contexto excedido antes de enviar: {context_plan['prompt_tokens']} tokens de prompt "
+                        f"en una ventana de {context_plan['context_window']}"
+                    )
                 agent_output = self.llm_client.generate(
                     system_prompt, 
                     user_prompt,
                     temperature=agent_temperature,
                     max_tokens=max_tokens,
-                    top_p=top_p
+                    top_p=top_p,
+                    use_cache=use_cache,
+                    agent_name=agent_name,
+                    priority=agent_config.get('priority', 0),
+                    deadline=deadline,
+                    max_tokens_ceiling=max_tokens_ceiling,
+                    json_schema=get_agent_schema(agent_name)
                 )
             except ValueError as ve:
                 # Capturar el caso especial de STOP
@@ -172,7 +220,9 @@ class AgentRunner:
                             "prompt_length": len(user_prompt),
                             "dependencies_size": sum(len(str(v)) for v in dependencies.values()) if dependencies else 0,
                             "total_chars": len(system_prompt) + len(user_prompt),
-                            "approx_tokens": (len(system_prompt) + len(user_prompt)) // 4
+                            "approx_tokens": count_tokens(system_prompt) + count_tokens(user_prompt),
+                            "token_counting": get_token_counter().backend_name,
+                            "plan_contexto": context_plan
                         },
                         "diagnostico": self._diagnosticar_problema_contenido(agent_name, user_prompt, dependencies),
                         "accion": "PROCESO DETENIDO - No se realizarán reintentos"
@@ -223,6 +273,11 @@ class AgentRunner:
             
             # Extraer información de tokens si está disponible
             tokens_info = agent_output.pop("_metadata_tokens", {})
+            if tokens_info.get("max_tokens_escalated"):
+                get_max_tokens_sizer().record_truncation(agent_name, tokens_info["max_tokens_escalated"])
+            
+            # Espera en cola de admisión vs. latencia del modelo y tokens del prefix cache (para el manifest)
+            llm_metrics = {k: tokens_info[k] for k in ("queue_wait", "llm_latency", "cached_tokens") if k in tokens_info}
             
             # 5. Validar estructura de salida
             valid_structure, structure_errors = self.quality_checker.validate_output_structure(
@@ -266,10 +321,6 @@ class AgentRunner:
                     
                     try:
                         # Llamar al verificador con temperatura baja para consistencia
-                        # Guardar configuración actual de timeout
-                        original_timeout = self.llm_client.timeout
-                        self.llm_client.timeout = 900  # 900 segundos para evitar truncamiento
-                        
                         # Guardar solicitud del verificador QA
                         verificador_system_prompt = self._load_system_prompt("verificador_qa")
                         self._save_agent_request(
@@ -286,12 +337,11 @@ class AgentRunner:
                             system_prompt=verificador_system_prompt,
                             user_prompt=verification_prompt,
                             temperature=0.3,  # Baja para evaluación consistente
-                            max_tokens=30000  # Masivo para evaluar contenidos grandes
+                            max_tokens=30000,  # Masivo para evaluar contenidos grandes
+                            agent_name=f"verificador_qa_{agent_name}",
+                            deadline=deadline  # Timeouts derivados de max_tokens, sin tocar el cliente
                         )
                         
-                        # Restaurar timeout original
-                        self.llm_client.timeout = original_timeout
-                        
                         # Parsear resultado del verificador si es necesario
                         import json
                         if isinstance(verificador_result, str):
@@ -359,7 +409,8 @@ class AgentRunner:
                             retry_count + 1,
                             conflict_analysis=conflict_analysis,
                             qa_issues=qa_issues,
-                            previous_output=agent_output
+                            previous_output=agent_output,
+                            deadline=deadline
                         )
                     else:
                         logger.error(f"Máximo de reintentos alcanzado para {agent_name}")
@@ -398,7 +449,8 @@ class AgentRunner:
                             "qa_scores": qa_scores,
                             "qa_issues": qa_issues,
                             "retry_count": retry_count,
-                            "execution_time": execution_time
+                            "execution_time": execution_time,
+                            "llm_metrics": llm_metrics
                         }
             else:
                 qa_scores = {}
@@ -415,7 +467,8 @@ class AgentRunner:
                 "qa_scores": qa_scores if agent_name != "validador" else None,
                 "execution_time": execution_time,
                 "temperature": agent_temperature or self.llm_client.temperature,
-                "max_tokens": max_tokens or self.llm_client.max_tokens,
+                "max_tokens": tokens_info.get("max_tokens_escalated", max_tokens),
+                "max_tokens_configured": configured_max_tokens,
                 "status": "success"
             }
             
@@ -431,7 +484,8 @@ class AgentRunner:
                 "output": agent_output,
                 "qa_scores": qa_scores,
                 "retry_count": retry_count,
-                "execution_time": execution_time
+                "execution_time": execution_time,
+                "llm_metrics": llm_metrics
             }
             
         except Exception as e:
@@ -460,6 +514,7 @@ class AgentRunner:
         # La información real viene del brief.json en el user_prompt
         return agent_config["content"]
     
+    @traced("io", "agent_name")
     def _load_dependencies(self, agent_name: str) -> Dict[str, Any]:
         """Carga las dependencias (artefactos previos) para un agente"""
         dependencies = {}
@@ -514,8 +569,8 @@ class AgentRunner:
         
         return dependencies
     
-    def _build_user_prompt(self, agent_name: str, dependencies: Dict[str, Any]) -> str:
-        """Construye el prompt del usuario con las dependencias"""
+    def _build_user_prompt(self, agent_name: str, dependencies: Dict[str, Any], compact: bool = False) -> str:
+        """Construye el prompt del usuario con las dependencias (JSON compacto si compact=True)"""
         prompt_parts = []
         
         # Agregar contexto de la historia
@@ -525,7 +580,7 @@ class AgentRunner:
         # Agregar cada dependencia
         for dep_name, dep_content in dependencies.items():
             prompt_parts.append(f"\n### {dep_name}:")
-            prompt_parts.append(json.dumps(dep_content, ensure_ascii=False, indent=2))
+            prompt_parts.append(dump_dependency(dep_content, compact))
             prompt_parts.append("")
         
         # Instrucciones específicas del agente
@@ -571,10 +626,6 @@ class AgentRunner:
             for dep_name in dependencies.keys():
                 prompt_parts.append(f"- {dep_name}")
         
-        prompt_parts.append("\nOUTPUT DEL AGENTE A EVALUAR:")
-        prompt_parts.append("=" * 50)
-        prompt_parts.append(json.dumps(agent_output, ensure_ascii=False, indent=2))
-        
         prompt_parts.append("\n\nINSTRUCCIONES DE EVALUACIÓN:")
         prompt_parts.append("=" * 50)
         
@@ -599,6 +650,12 @@ class AgentRunner:
         prompt_parts.append("- Las mejoras_especificas deben ser ACCIONABLES y CLARAS")
         prompt_parts.append("- Devuelve ÚNICAMENTE el JSON especificado")
         
+        # El output cambia en cada intento: al final, después de lo que se repite
+        # entre reintentos del mismo agente (prefijo reutilizable por vLLM)
+        prompt_parts.append("\nOUTPUT DEL AGENTE A EVALUAR:")
+        prompt_parts.append("=" * 50)
+        prompt_parts.append(json.dumps(agent_output, ensure_ascii=False, indent=2))
+        
         return "\n".join(prompt_parts)
     
     def _get_agent_instructions(self, agent_name: str) -> str:
@@ -626,7 +683,8 @@ class AgentRunner:
                                  retry_count: int,
                                  conflict_analysis: Optional[Dict[str, Any]] = None,
                                  qa_issues: Optional[List[str]] = None,
-                                 previous_output: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+                                 previous_output: Optional[Dict[str, Any]] = None,
+                                 deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """Reintenta un agente con instrucciones de mejora y feedback específico"""
         logger.info(f"Reintentando {agent_name} con mejoras (intento {retry_count})")
         
@@ -696,7 +754,7 @@ class AgentRunner:
         user_prompt += "=" * 50
         
         # Ejecutar de nuevo (recursivamente)
-        return self.run_agent(agent_name, retry_count)
+        return self.run_agent(agent_name, retry_count, deadline=deadline)
     
     def _get_output_filename(self, agent_name: str) -> str:
         """Genera el nombre del archivo de salida para un agente"""
@@ -704,6 +762,7 @@ class AgentRunner:
         # Para v1, usar solo el nombre del agente
         return f"{agent_name}.json"
     
+    @traced("io", "filename")
     def _save_output(self, filename: str, content: Dict[str, Any]):
         """Guarda la salida de un agente"""
         # Guardar en outputs/agents
@@ -713,16 +772,15 @@ class AgentRunner:
         
         output_path = outputs_dir / filename
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(content, f, ensure_ascii=False, indent=2)
+        # Escritura atómica: una caída nunca deja una salida a medias
+        atomic_write_json(output_path, content)
         
         # También guardar en raíz por compatibilidad
-        legacy_path = get_artifact_path(self.story_id, filename)
-        with open(legacy_path, 'w', encoding='utf-8') as f:
-            json.dump(content, f, ensure_ascii=False, indent=2)
+        atomic_write_json(get_artifact_path(self.story_id, filename), content)
         
         logger.info(f"Salida guardada en: {output_path}")
     
+    @traced("io", "agent_name")
     def _save_log(self, agent_name: str, log_entry: Dict[str, Any]):
         """Guarda una entrada de log para un agente"""
         log_dir = get_artifact_path(self.story_id, "logs")
@@ -738,8 +796,7 @@ class AgentRunner:
         
         logs.append(log_entry)
         
-        with open(log_file, 'w', encoding='utf-8') as f:
-            json.dump(logs, f, ensure_ascii=False, indent=2)
+        atomic_write_json(log_file, logs)
         
         logger.info(f"Log guardado para {agent_name}")
     
@@ -752,11 +809,11 @@ class AgentRunner:
         }
         
         # Analizar tamaño del prompt
-        prompt_tokens_approx = len(user_prompt) // 4  # Aproximación
-        diagnostico["metricas"]["prompt_tokens_aprox"] = prompt_tokens_approx
+        prompt_tokens = count_tokens(user_prompt)
+        diagnostico["metricas"]["prompt_tokens_aprox"] = prompt_tokens
         
-        if prompt_tokens_approx > 3000:
-            diagnostico["posibles_causas"].append("Prompt demasiado largo (>3000 tokens aprox)")
+        if prompt_tokens > 3000:
+            diagnostico["posibles_causas"].append(f"Prompt demasiado largo ({prompt_tokens} tokens)")
             diagnostico["recomendaciones"].append("Reducir tamaño de dependencias o simplificar prompt")
         
         # Analizar dependencias
@@ -789,48 +846,35 @@ class AgentRunner:
     def _registrar_alerta_temprana(self, alert_data: Dict[str, Any]):
         """Registra una alerta temprana en el manifest y logs"""
         try:
-            # Actualizar manifest con alerta
-            manifest_path = get_artifact_path(self.story_id, "manifest.json")
-            
-            if os.path.exists(manifest_path):
-                with open(manifest_path, 'r', encoding='utf-8') as f:
-                    manifest = json.load(f)
-            else:
-                manifest = {}
-            
-            # Agregar sección de alertas si no existe
-            if "alertas_tempranas" not in manifest:
-                manifest["alertas_tempranas"] = []
-            
-            manifest["alertas_tempranas"].append(alert_data)
-            
-            # También actualizar el campo de error si es relevante
-            if alert_data["intento"] == 1:  # Primer intento
-                manifest["primer_fallo_contenido"] = {
-                    "agente": alert_data["agente"],
-                    "timestamp": alert_data["timestamp"],
-                    "diagnostico_resumen": alert_data["diagnostico"]["posibles_causas"][:2] if alert_data["diagnostico"]["posibles_causas"] else []
-                }
-            
-            with open(manifest_path, 'w', encoding='utf-8') as f:
-                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            # Actualizar manifest con alerta (a través del store: el orquestador puede estar escribiéndolo)
+            with get_manifest_store(get_story_dir(self.story_id)).mutate() as manifest:
+                manifest.setdefault("alertas_tempranas", []).append(alert_data)
+                
+                # También actualizar el campo de error si es relevante
+                if alert_data["intento"] == 1:  # Primer intento
+                    manifest["primer_fallo_contenido"] = {
+                        "agente": alert_data["agente"],
+                        "timestamp": alert_data["timestamp"],
+                        "diagnostico_resumen": alert_data["diagnostico"]["posibles_causas"][:2] if alert_data["diagnostico"]["posibles_causas"] else []
+                    }
             
             # Guardar también en log específico de alertas
             alerts_dir = os.path.join(get_story_dir(self.story_id), "alerts")
             os.makedirs(alerts_dir, exist_ok=True)
             
             alert_file = os.path.join(alerts_dir, f"{alert_data['agente']}_alert.json")
-            with open(alert_file, 'w', encoding='utf-8') as f:
-                json.dump(alert_data, f, ensure_ascii=False, indent=2)
+            atomic_write_json(alert_file, alert_data)
             
             logger.warning(f"🚨 Alerta temprana registrada para {alert_data['agente']}: {alert_data['diagnostico']['posibles_causas'][:1]}")
             
         except Exception as e:
             logger.error(f"Error registrando alerta temprana: {e}")
     
+    @traced("io", "agent_name")
     def _save_agent_request(self, agent_name: str, system_prompt: str, user_prompt: str, 
                            temperature: float = None, max_tokens: int = None, top_p: float = None,
-                           dependencies: list = None, retry_count: int = 0):
+                           dependencies: list = None, retry_count: int = 0,
+                           context_plan: Optional[Dict[str, Any]] = None):
         """Guarda la solicitud completa enviada a un agente en la carpeta inputs/"""
         try:
             # Crear carpeta inputs si no existe
@@ -855,9 +899,13 @@ class AgentRunner:
                     "system_prompt_chars": len(system_prompt),
                     "user_prompt_chars": len(user_prompt),
                     "total_chars": len(system_prompt) + len(user_prompt),
-                    "approx_tokens": (len(system_prompt) + len(user_prompt)) // 4
+                    "approx_tokens": count_tokens(system_prompt) + count_tokens(user_prompt),
+                    "token_counting": get_token_counter().backend_name
                 }
             }
+            if context_plan is not None:
+                # Ajustes aplicados para caber en la ventana de contexto
+                request_data["context_plan"] = context_plan
             
             # Guardar en inputs/agents para agentes regulares
             if "cuentacuentos" not in agent_name:
@@ -868,8 +916,7 @@ class AgentRunner:
                 # Para cuentacuentos, mantener en inputs/ por ahora (se maneja en parallel_cuentacuentos)
                 request_file = os.path.join(inputs_dir, f"{agent_name}_request.json")
             
-            with open(request_file, 'w', encoding='utf-8') as f:
-                json.dump(request_data, f, ensure_ascii=False, indent=2)
+            atomic_write_json(request_file, request_data)
             
             logger.debug(f"📝 Solicitud guardada: {request_file}")
             
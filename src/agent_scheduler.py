@@ -0,0 +1,153 @@
+"""
+Ejecución de los agentes de una historia según su grafo de dependencias
+
+El pipeline de cada versión es una lista, pero dependencies.json dice qué
+artefactos necesita cada agente: en v2, por ejemplo, 09_sensibilidad y
+10_portadista solo dependen de agentes anteriores a ambos y pueden
+ejecutarse a la vez. AgentScheduler arranca cada agente apenas terminan
+los que producen sus dependencias, con hasta max_workers agentes en curso.
+
+Los callbacks (on_start, on_result, on_skip) se llaman siempre desde el
+hilo que llama a run(), así que quien actualiza el manifest no necesita
+locks; en los hilos del pool solo corre execute().
+"""
+import contextvars
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import PurePosixPath
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+def _artifact_agent(dependency_file: str, agents: Iterable[str]) -> Optional[str]:
+    """Agente que produce un artefacto ("05_ritmo_rima.json" -> "05_ritmo_rima"), o None"""
+    stem = PurePosixPath(dependency_file).stem
+    for agent in agents:
+        if stem == agent or stem == agent.lstrip("0123456789_"):
+            return agent
+    return None
+
+
+def build_agent_graph(pipeline: List[str],
+                      dependencies: Dict[str, List[str]],
+                      parallel_groups: Iterable[Iterable[str]] = ()) -> Dict[str, Set[str]]:
+    """
+    Agentes de los que depende cada agente del pipeline
+
+    Las dependencias de un agente son los agentes anteriores del pipeline
+    que producen algún archivo de su lista en dependencies.json (brief.json y
+    los archivos de configuración no son de ningún agente). Un agente sin
+    entrada en dependencies.json depende de todos los anteriores salvo los de
+    su mismo grupo en parallel_groups.
+
+    Args:
+        pipeline: Agentes en el orden de la versión
+        dependencies: dependencies.json de la versión
+        parallel_groups: Grupos de agentes que la versión declara paralelos
+
+    Returns:
+        Dict agente -> conjunto de agentes que deben terminar antes
+    """
+    groups = [set(group) for group in parallel_groups]
+    graph: Dict[str, Set[str]] = {}
+    for index, agent in enumerate(pipeline):
+        earlier = pipeline[:index]
+        if agent in dependencies:
+            upstream = set()
+            for dependency_file in dependencies[agent]:
+                producer = _artifact_agent(dependency_file, pipeline)
+                if producer is None:
+                    continue
+                if producer not in earlier:
+                    logger.warning(f"⚠️ {agent} depende de {producer}, que va después en el pipeline: se ignora")
+                    continue
+                upstream.add(producer)
+        else:
+            same_group = set().union(*(group for group in groups if agent in group))
+            upstream = {other for other in earlier if other not in same_group}
+        for group in groups:
+            conflicts = sorted(upstream & group) if agent in group else []
+            if conflicts:
+                logger.info(f"parallel_groups declara {agent} en paralelo con {conflicts}, "
+                            f"pero depende de su salida: se respeta la dependencia")
+        graph[agent] = upstream
+    return graph
+
+
+class AgentScheduler:
+    """Ejecuta los agentes de un grafo con hasta max_workers en paralelo"""
+
+    def __init__(self, graph: Dict[str, Set[str]], max_workers: int = 1):
+        """
+        Args:
+            graph: Dependencias de cada agente (ver build_agent_graph); el
+                orden de las claves desempata entre agentes listos
+            max_workers: Agentes ejecutándose a la vez (1 = orden del pipeline)
+        """
+        self.graph = graph
+        self.order = list(graph)
+        self.max_workers = max(1, max_workers)
+
+    def run(self,
+            execute: Callable[[str], Dict[str, Any]],
+            on_start: Callable[[str], None],
+            on_result: Callable[[str, Dict[str, Any]], bool],
+            skipped: Iterable[str] = (),
+            on_skip: Optional[Callable[[str], None]] = None) -> List[str]:
+        """
+        Ejecuta el grafo completo
+
+        Args:
+            execute: Ejecuta un agente (en un hilo del pool) y retorna su resultado
+            on_start: Se llama justo antes de lanzar cada agente
+            on_result: Recibe cada resultado; False detiene el pipeline (los
+                agentes en curso terminan y también se reportan)
+            skipped: Agentes deshabilitados, que no se ejecutan
+            on_skip: Se llama para cada agente deshabilitado cuando le toca
+
+        Returns:
+            Agentes que quedaron sin ejecutar porque el pipeline se detuvo
+        """
+        skipped = set(skipped)
+        done: Set[str] = set()
+        running: Dict[Future, str] = {}
+        stopped = False
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="agente") as pool:
+            while True:
+                launched = True
+                while launched and not stopped:
+                    launched = False
+                    for agent in self.order:
+                        if agent in done or agent in running.values() or not self.graph[agent] <= done:
+                            continue
+                        if agent in skipped:
+                            if on_skip is not None:
+                                on_skip(agent)
+                            done.add(agent)
+                            launched = True
+                            break
+                        if len(running) >= self.max_workers:
+                            break
+                        on_start(agent)
+                        # El contexto (traza activa) viaja con el agente a su hilo
+                        running[pool.submit(contextvars.copy_context().run, execute, agent)] = agent
+                        launched = True
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    agent = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Error ejecutando {agent}: {e}")
+                        result = {"status": "error", "agent": agent, "error": str(e)}
+                    done.add(agent)
+                    if not on_result(agent, result):
+                        stopped = True
+
+        return [agent for agent in self.order if agent not in done]
@@ -3,6 +3,7 @@ Servidor API REST para recibir solicitudes desde lacuenteria.cl
 """
 import json
 import logging
+import os
 import threading
 from datetime import datetime
 from pathlib import Path
@@ -15,12 +16,16 @@ load_dotenv()
 
 from config import (
     API_CONFIG,
+    JOURNAL_CONFIG,
+    RUNS_DIR,
     get_story_path,
     get_artifact_path,
     get_agent_prompt_path,
     validate_config
 )
 from orchestrator import StoryOrchestrator
+from manifest_store import get_manifest_store, read_manifest
+from story_journal import find_interrupted_stories
 from webhook_client import get_webhook_client
 from llm_client import get_llm_client
 
@@ -40,6 +45,51 @@ processing_queue = {}
 processing_lock = threading.Lock()
 
 
+def notify_story_result(story_id: str, story_path: Path, webhook_url: str, result: dict):
+    """
+    Envía el webhook con el resultado de una historia y lo registra en el manifest
+    
+    Args:
+        story_id: ID original de la historia
+        story_path: Carpeta de la historia
+        webhook_url: URL para notificaciones (None = no se notifica)
+        result: Resultado de process_story / resume_story
+    """
+    if webhook_url:
+        logger.info(f"Preparando envío de webhook para historia {story_id}, status: {result.get('status')}")
+        webhook_client = get_webhook_client(story_path)
+        
+        webhook_success = False
+        if result["status"] == "success":
+            logger.info(f"Enviando webhook de éxito para {story_id}")
+            webhook_success = webhook_client.send_story_complete(webhook_url, result)
+        else:
+            logger.info(f"Enviando webhook de error para {story_id}: {result.get('error')}")
+            webhook_success = webhook_client.send_story_error(
+                webhook_url, 
+                story_id, 
+                result.get("error", "Error desconocido")
+            )
+        
+        # Actualizar manifest con resultado del webhook (a través del store, único escritor)
+        try:
+            if (story_path / "manifest.json").exists():
+                manifest = get_manifest_store(story_path)
+                manifest.set("webhook_result", {
+                    "success": webhook_success,
+                    "timestamp": datetime.now().isoformat(),
+                    "url": webhook_url,
+                    "status": result.get("status")
+                })
+                manifest.flush()
+                
+                logger.info(f"Webhook result registrado en manifest: {'SUCCESS' if webhook_success else 'FAILED'}")
+        except Exception as e:
+            logger.error(f"Error actualizando manifest con resultado de webhook: {e}")
+    else:
+        logger.info(f"No hay webhook_url para historia {story_id}")
+
+
 def process_story_async(story_id: str, brief: dict, webhook_url: str, mode_verificador_qa: bool = True, pipeline_version: str = 'v1', prompt_metrics_id: str = None, pipeline_request_id: str = None):
     """
     Procesa una historia de forma asíncrona
@@ -74,46 +124,7 @@ def process_story_async(story_id: str, brief: dict, webhook_url: str, mode_verif
         result = orchestrator.process_story(brief, webhook_url)
         
         # Enviar webhook con resultado
-        if webhook_url:
-            logger.info(f"Preparando envío de webhook para historia {story_id}, status: {result.get('status')}")
-            # Obtener el path de la historia para el logging del webhook
-            story_path = orchestrator.story_path
-            webhook_client = get_webhook_client(story_path)
-            
-            webhook_success = False
-            if result["status"] == "success":
-                logger.info(f"Enviando webhook de éxito para {story_id}")
-                webhook_success = webhook_client.send_story_complete(webhook_url, result)
-            else:
-                logger.info(f"Enviando webhook de error para {story_id}: {result.get('error')}")
-                webhook_success = webhook_client.send_story_error(
-                    webhook_url, 
-                    story_id, 
-                    result.get("error", "Error desconocido")
-                )
-            
-            # Actualizar manifest con resultado del webhook
-            try:
-                manifest_path = story_path / "manifest.json"
-                if manifest_path.exists():
-                    with open(manifest_path, 'r', encoding='utf-8') as f:
-                        manifest = json.load(f)
-                    
-                    manifest["webhook_result"] = {
-                        "success": webhook_success,
-                        "timestamp": datetime.now().isoformat(),
-                        "url": webhook_url,
-                        "status": result.get("status")
-                    }
-                    
-                    with open(manifest_path, 'w', encoding='utf-8') as f:
-                        json.dump(manifest, f, ensure_ascii=False, indent=2)
-                    
-                    logger.info(f"Webhook result registrado en manifest: {'SUCCESS' if webhook_success else 'FAILED'}")
-            except Exception as e:
-                logger.error(f"Error actualizando manifest con resultado de webhook: {e}")
-        else:
-            logger.info(f"No hay webhook_url para historia {story_id}")
+        notify_story_result(story_id, orchestrator.story_path, webhook_url, result)
         
         # Actualizar estado en cola usando tanto el ID original como el timestamped
         with processing_lock:
@@ -151,6 +162,56 @@ def process_story_async(story_id: str, brief: dict, webhook_url: str, mode_verif
             webhook_client.send_story_error(webhook_url, story_id, str(e))
 
 
+def recover_interrupted_stories():
+    """
+    Reanuda las historias que quedaron a medias cuando el proceso murió
+    
+    Se buscan en los journal de runs/ (story_started sin story_finished) y
+    se procesan una tras otra en un hilo aparte, desde el último agente
+    confirmado, con el webhook de la solicitud original.
+    
+    Returns:
+        Carpetas de las historias re-encoladas
+    """
+    interrupted = find_interrupted_stories(RUNS_DIR)
+    if not interrupted:
+        return []
+    
+    def recover_all():
+        for story_path, state in interrupted:
+            started = state["inicio"]
+            story_id = started.get("original_story_id") or story_path.name
+            try:
+                orchestrator = StoryOrchestrator(
+                    story_path.name,
+                    mode_verificador_qa=started.get("mode_verificador_qa", True),
+                    pipeline_version=started.get("pipeline_version", "v1"),
+                    use_timestamp=False,
+                    prompt_metrics_id=started.get("prompt_metrics_id"),
+                    pipeline_request_id=started.get("pipeline_request_id")
+                )
+                result = orchestrator.recover_story()
+                notify_story_result(story_id, story_path, started.get("webhook_url"), result)
+                with processing_lock:
+                    processing_queue[story_id] = result
+                    processing_queue[story_path.name] = result
+                logger.info(f"♻️ Historia {story_path.name} recuperada: {result.get('status')}")
+            except Exception as e:
+                logger.error(f"Error recuperando historia {story_path.name}: {e}")
+    
+    logger.info(f"♻️ {len(interrupted)} historias interrumpidas, reanudando: {[p.name for p, _ in interrupted]}")
+    with processing_lock:
+        for story_path, state in interrupted:
+            processing_queue[state["inicio"].get("original_story_id") or story_path.name] = {
+                "status": "queued",
+                "queued_at": datetime.now().isoformat(),
+                "recovered": True
+            }
+    thread = threading.Thread(target=recover_all, name="recuperacion", daemon=True)
+    thread.start()
+    return [story_path for story_path, _ in interrupted]
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Endpoint de health check"""
@@ -173,7 +234,8 @@ def health_check():
             "checks": {
                 "llm_connection": llm_available,
                 "config_valid": config_valid
-            }
+            },
+            "llm_metrics": llm_client.get_metrics()
         }), 200 if (llm_available and config_valid) else 503
         
     except Exception as e:
@@ -406,12 +468,10 @@ def create_story_sync():
             story_result = json.load(f)
         
         # Leer manifest para obtener métricas
-        manifest_path = story_path / "manifest.json"
+        manifest = read_manifest(story_path)
         qa_scores = {}
-        if manifest_path.exists():
-            with open(manifest_path, 'r', encoding='utf-8') as f:
-                manifest = json.load(f)
-                qa_scores = manifest.get("qa_historial", {})
+        if manifest is not None:
+            qa_scores = manifest.get("qa_historial", {})
         
         # Devolver resultado completo directamente
         return jsonify({
@@ -455,10 +515,10 @@ def get_story_status(story_id):
                 "error": "Historia no encontrada"
             }), 404
         
-        # Leer manifest de la carpeta encontrada
-        manifest_path = story_path / "manifest.json"
-        with open(manifest_path, 'r', encoding='utf-8') as f:
-            manifest = json.load(f)
+        # Leer manifest de la carpeta encontrada (en memoria si la historia corre en este proceso)
+        manifest = read_manifest(story_path)
+        if manifest is None:
+            raise FileNotFoundError(f"No existe manifest.json en {story_path}")
         
         return jsonify({
             "story_id": story_id,
@@ -493,18 +553,14 @@ def get_story_result(story_id):
             }), 404
         
         # Verificar estado
-        manifest_path = story_path / "manifest.json"
-        if manifest_path.exists():
-            with open(manifest_path, 'r', encoding='utf-8') as f:
-                manifest = json.load(f)
-            
-            if manifest.get("estado") != "completo":
-                return jsonify({
-                    "status": "not_ready",
-                    "current_state": manifest.get("estado"),
-                    "message": "La historia aún no está completa",
-                    "folder": story_path.name
-                }), 202
+        manifest = read_manifest(story_path)
+        if manifest is not None and manifest.get("estado") != "completo":
+            return jsonify({
+                "status": "not_ready",
+                "current_state": manifest.get("estado"),
+                "message": "La historia aún no está completa",
+                "folder": story_path.name
+            }), 202
         
         # Detectar versión del pipeline desde manifest
         pipeline_version = manifest.get("pipeline_version", "v1")
@@ -535,7 +591,7 @@ def get_story_result(story_id):
         
         # Calcular QA scores
         qa_scores = {}
-        if manifest_path.exists():
+        if manifest is not None:
             qa_historial = manifest.get("qa_historial", {})
             if qa_historial:
                 all_scores = []
@@ -593,6 +649,30 @@ def get_story_result(story_id):
         }), 500
 
 
+@app.route('/api/stories/<story_id>/profile', methods=['GET'])
+def get_story_profile(story_id):
+    """Ruta crítica, holguras y desglose de latencia de una historia (la más reciente)"""
+    from config import get_latest_story_path
+    from story_profile import profile_story
+    
+    try:
+        story_path = get_latest_story_path(story_id)
+        if not story_path or read_manifest(story_path) is None:
+            return jsonify({
+                "status": "not_found",
+                "error": "Historia no encontrada"
+            }), 404
+        
+        return jsonify(profile_story(story_path)), 200
+        
+    except Exception as e:
+        logger.error(f"Error obteniendo perfil: {e}")
+        return jsonify({
+            "status": "error",
+            "error": str(e)
+        }), 500
+
+
 @app.route('/api/stories/<story_id>/logs', methods=['GET'])
 def get_story_logs(story_id):
     """Obtiene los logs de procesamiento de una historia"""
@@ -718,7 +798,8 @@ Recuerda responder ÚNICAMENTE con el JSON de evaluación crítica especificado.
             system_prompt=system_prompt,
             user_prompt=user_prompt,
             temperature=0.4,  # Baja para evaluación consistente
-            max_tokens=4000   # Suficiente para evaluación completa
+            max_tokens=4000,  # Suficiente para evaluación completa
+            agent_name="13_critico"
         )
         
         return evaluacion
@@ -891,11 +972,8 @@ def create_story_v1():
         # Verificar si existe
         story_path = get_story_path(story_id)
         if story_path.exists():
-            manifest_path = get_artifact_path(story_id, "manifest.json")
-            if manifest_path.exists():
-                with open(manifest_path, 'r', encoding='utf-8') as f:
-                    manifest = json.load(f)
-                
+            manifest = read_manifest(story_path)
+            if manifest is not None:
                 if manifest.get("estado") == "completo":
                     validador_path = get_artifact_path(story_id, "validador.json")
                     if validador_path.exists():
@@ -989,11 +1067,8 @@ def create_story_v2():
         # Verificar si existe
         story_path = get_story_path(story_id)
         if story_path.exists():
-            manifest_path = get_artifact_path(story_id, "manifest.json")
-            if manifest_path.exists():
-                with open(manifest_path, 'r', encoding='utf-8') as f:
-                    manifest = json.load(f)
-                
+            manifest = read_manifest(story_path)
+            if manifest is not None:
                 if manifest.get("estado") == "completo":
                     validador_path = get_artifact_path(story_id, "validador.json")
                     if validador_path.exists():
@@ -1070,14 +1145,13 @@ def retry_story(story_id):
         
         # Detectar versión desde el manifest si existe
         pipeline_version = 'v1'  # Default
-        manifest_path = get_artifact_path(story_id, "manifest.json")
-        if manifest_path.exists():
-            with open(manifest_path, 'r', encoding='utf-8') as f:
-                manifest = json.load(f)
-                pipeline_version = manifest.get('pipeline_version', 'v1')
+        manifest = read_manifest(story_path)
+        if manifest is not None:
+            pipeline_version = manifest.get('pipeline_version', 'v1')
         
         # Crear orquestador con la versión correcta
-        orchestrator = StoryOrchestrator(story_id, pipeline_version=pipeline_version)
+        # Sin timestamp: se reanuda en la misma carpeta (solo se re-ejecuta lo que cambió)
+        orchestrator = StoryOrchestrator(story_id, pipeline_version=pipeline_version, use_timestamp=False)
         
         # Reanudar en thread separado
         thread = threading.Thread(
@@ -1131,6 +1205,11 @@ def main():
             logger.error("No se pudo conectar al modelo LLM")
             logger.warning("El servidor iniciará pero las historias fallarán")
         
+        # Reanudar historias interrumpidas (con el reloader de debug, solo en el proceso hijo)
+        if JOURNAL_CONFIG["recover_on_startup"] and (
+                not API_CONFIG["debug"] or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+            recover_interrupted_stories()
+        
         # Iniciar servidor
         logger.info(f"Iniciando servidor en {API_CONFIG['host']}:{API_CONFIG['port']}")
         app.run(
@@ -0,0 +1,1129 @@
+"""
+Cliente asíncrono (asyncio) para el modelo gpt-oss-120b local
+
+Mantiene exactamente la semántica de LLMClient.generate (limpieza de JSON,
+detección de rechazos, STOP en contenido vacío al primer intento y
+_metadata_tokens), pero multiplexa todas las llamadas en un único event loop
+en lugar de bloquear un hilo del sistema por request.
+
+Una instancia de AsyncLLMClient pertenece al event loop donde hace su primera
+llamada (su sesión aiohttp queda ligada a ese loop). El cliente síncrono
+(LLMClient) ejecuta sus llamadas en un loop compartido que vive en un hilo de
+fondo; ver run_sync().
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import aiohttp
+
+from config import (LLM_CONFIG, LLM_CACHE_CONFIG, LLM_AIMD_CONFIG, LLM_HEDGE_CONFIG, LLM_SCHEMA_CONFIG,
+                    LLM_SIZING_CONFIG, PROCESSING_CONFIG)
+from deadlines import Deadline, DeadlineExceeded
+from json_stream import IncrementalJSONValidator, repair_json
+from llm_admission import get_admission_controller
+from llm_cache import get_llm_cache, request_fingerprint
+from llm_concurrency import get_adaptive_controller
+from llm_hedging import get_hedging_policy
+from llm_router import Endpoint, EndpointRouter, get_llm_router
+from llm_singleflight import get_single_flight
+from token_counter import count_tokens, get_token_counter
+
+logger = logging.getLogger(__name__)
+
+# Instrucción JSON que se agrega al system prompt de cada llamada
+JSON_INSTRUCTION = "\n\nIMPORTANTE: Tu respuesta debe ser ÚNICAMENTE un JSON válido, sin texto adicional antes o después."
+
+# Frases que delatan un rechazo en respuestas cortas
+RESPUESTAS_RECHAZO = [
+    "lo siento",
+    "no puedo",
+    "unable to",
+    "cannot comply",
+    "no es posible"
+]
+
+# Frases de rechazo buscadas cuando la respuesta no es JSON
+RESPUESTAS_RECHAZO_JSON = [
+    "i'm sorry", "i cannot", "unable to", "cannot comply",
+    "lo siento", "no puedo", "no es posible", "can't fulfill"
+]
+
+
+# Argumentos de un item de generate_batch que no distinguen un prompt de otro
+BATCH_ITEM_FIELDS = ("priority", "deadline")
+
+# Campos del payload con los que se pide decodificación guiada
+GUIDED_JSON_FIELDS = ("response_format", "guided_json")
+
+# Indicios de que un 400/422 se debe al schema y no al resto del request
+SCHEMA_ERROR_HINTS = ("response_format", "guided", "json_schema", "schema", "grammar")
+
+
+class TruncatedResponseError(ValueError):
+    """La respuesta se cortó por max_tokens antes de completar el JSON"""
+
+
+class SchemaNotSupportedError(Exception):
+    """El servidor rechazó el JSON Schema (no soporta decodificación guiada)"""
+
+
+def build_payload(model: str,
+                  system_prompt: str,
+                  user_prompt: str,
+                  temperature: float,
+                  max_tokens: int,
+                  top_p: Optional[float] = None,
+                  seed: Optional[int] = None,
+                  json_schema: Optional[Dict[str, Any]] = None,
+                  schema_name: str = "respuesta",
+                  schema_mode: str = "response_format",
+                  n: int = 1) -> Dict[str, Any]:
+    """
+    Construye el payload de chat/completions con la instrucción JSON incluida
+
+    Con json_schema se pide decodificación guiada: como response_format de
+    tipo json_schema (OpenAI, vLLM, SGLang) o como guided_json (vLLM antiguo)
+    según schema_mode. Con n > 1 el servidor genera n candidatos del mismo
+    prompt (un solo prefill).
+    """
+    messages = [
+        {"role": "system", "content": system_prompt + JSON_INSTRUCTION},
+        {"role": "user", "content": user_prompt}
+    ]
+
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+
+    # Agregar top_p si se proporciona
+    if top_p is not None:
+        payload["top_p"] = top_p
+
+    if seed is not None:
+        payload["seed"] = seed
+
+    if n > 1:
+        payload["n"] = n
+
+    if json_schema is not None:
+        if schema_mode == "guided_json":
+            payload["guided_json"] = json_schema
+        else:
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": schema_name, "schema": json_schema, "strict": False}
+            }
+
+    return payload
+
+
+def strip_json_schema(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Copia del payload sin decodificación guiada"""
+    return {key: value for key, value in payload.items() if key not in GUIDED_JSON_FIELDS}
+
+
+async def raise_if_schema_rejected(response: aiohttp.ClientResponse, payload: Dict[str, Any]):
+    """
+    Distingue un 400/422 causado por el schema de otros requests inválidos
+
+    Raises:
+        SchemaNotSupportedError: Si el error menciona el schema enviado
+    """
+    if response.status not in (400, 422) or not any(field in payload for field in GUIDED_JSON_FIELDS):
+        return
+    body = (await response.text()).lower()
+    if any(hint in body for hint in SCHEMA_ERROR_HINTS):
+        raise SchemaNotSupportedError(f"HTTP {response.status}: {body[:300]}")
+
+
+def cached_prompt_tokens(usage: Optional[Dict[str, Any]]) -> Optional[int]:
+    """
+    Tokens del prompt servidos desde el prefix cache del servidor
+
+    Returns:
+        usage.prompt_tokens_details.cached_tokens, o None si el servidor no lo
+        informa (vLLM lo incluye con --enable-prompt-tokens-details)
+    """
+    details = (usage or {}).get("prompt_tokens_details") or {}
+    return details.get("cached_tokens")
+
+
+def parse_completion(result: Dict[str, Any],
+                     attempt: int,
+                     system_prompt: str,
+                     user_prompt: str,
+                     temperature: Optional[float],
+                     max_tokens: Optional[int],
+                     timeout: float,
+                     metrics: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Interpreta la respuesta cruda de chat/completions
+
+    Args:
+        result: JSON devuelto por el servidor
+        attempt: Índice del intento actual (0 = primer intento)
+        system_prompt, user_prompt: Prompts enviados (para el diagnóstico)
+        temperature, max_tokens, timeout: Parámetros usados (para el diagnóstico)
+        metrics: Métricas de la llamada (espera en cola, latencia, TTFT) a incluir en _metadata_tokens
+
+    Returns:
+        JSON generado por el modelo, con _metadata_tokens si hay usage
+
+    Raises:
+        ValueError: Con prefijo "STOP:" si no debe reintentarse, o sin prefijo
+            si el intento falló pero puede reintentarse
+    """
+    # Extraer tokens consumidos si están disponibles
+    tokens_info = {}
+    if "usage" in result:
+        tokens_info = {
+            "prompt_tokens": result["usage"].get("prompt_tokens", 0),
+            "completion_tokens": result["usage"].get("completion_tokens", 0),
+            "total_tokens": result["usage"].get("total_tokens", 0)
+        }
+        cached_tokens = cached_prompt_tokens(result["usage"])
+        if cached_tokens is not None:
+            tokens_info["cached_tokens"] = cached_tokens
+        logger.debug(f"Tokens consumidos - Prompt: {tokens_info['prompt_tokens']}, Completion: {tokens_info['completion_tokens']}")
+    if metrics:
+        tokens_info.update(metrics)
+
+    # Extraer el contenido generado
+    if not ("choices" in result and len(result["choices"]) > 0):
+        raise ValueError(f"Respuesta inesperada del modelo: {result}")
+
+    content = result["choices"][0].get("message", {}).get("content")
+    finish_reason = result["choices"][0].get("finish_reason")
+    if tokens_info and finish_reason:
+        tokens_info["finish_reason"] = finish_reason
+
+    # Detectar contenido vacío o respuestas de rechazo
+    es_contenido_vacio = content is None or content == ""
+    es_rechazo = False
+
+    if content and len(content) < 200:  # Solo verificar respuestas cortas
+        contenido_lower = content.lower()
+        es_rechazo = any(frase in contenido_lower for frase in RESPUESTAS_RECHAZO)
+
+    if es_contenido_vacio or es_rechazo:
+        if es_contenido_vacio:
+            logger.error("🚨 ALERTA: El modelo devolvió contenido vacío")
+        else:
+            logger.error(f"🚨 ALERTA: El modelo rechazó la solicitud: {content[:100]}")
+
+        # Si es el primer intento, detener inmediatamente sin reintentar
+        if attempt == 0:
+            logger.error("❌ DETENIENDO: Contenido vacío en primer intento - NO se reintentará")
+            logger.error(f"   Contexto del fallo:")
+            logger.error(f"   - Max tokens: {max_tokens}")
+            logger.error(f"   - Temperature: {temperature}")
+            logger.error(f"   - Timeout: {timeout}s")
+            logger.error(f"   - Prompt length: {len(user_prompt)} chars")
+            logger.error(f"   - System prompt length: {len(system_prompt)} chars")
+            logger.error(f"   - Total: {len(system_prompt) + len(user_prompt)} chars "
+                         f"({count_tokens(system_prompt) + count_tokens(user_prompt)} tokens)")
+
+            # Lanzar excepción especial para indicar que no debe reintentarse
+            if es_rechazo:
+                raise ValueError(f"STOP: El modelo rechazó la solicitud en el primer intento: {content[:100]}")
+            else:
+                raise ValueError("STOP: El modelo no generó contenido en el primer intento - contexto probablemente excedido")
+        else:
+            logger.warning(f"Contenido vacío/rechazado en intento {attempt + 1}")
+            if es_rechazo:
+                raise ValueError(f"El modelo rechazó la solicitud: {content[:100]}")
+            else:
+                raise ValueError("El modelo no generó contenido")
+
+    # Detectar posibles respuestas truncadas
+    if content.rstrip().endswith(('...', '"', '\\', ',', '{', '[')):
+        logger.warning(f"Posible respuesta truncada detectada. Último carácter: '{content[-1]}'")
+        logger.debug(f"Longitud de respuesta: {len(content)} caracteres")
+
+    # Intentar parsear como JSON
+    try:
+        json_content = json.loads(content)
+        logger.info("Respuesta JSON válida recibida del LLM")
+        # Agregar información de tokens al resultado
+        if tokens_info:
+            json_content["_metadata_tokens"] = tokens_info
+        return json_content
+    except json.JSONDecodeError as e:
+        logger.warning(f"La respuesta no es JSON válido: {e}")
+        logger.debug(f"Contenido recibido: {content[:500]}")
+
+        # Cortada por max_tokens: limpiarla solo produciría un JSON incompleto
+        if finish_reason == "length":
+            logger.warning(f"✂️ Respuesta truncada por max_tokens={max_tokens} ({len(content)} caracteres)")
+            raise TruncatedResponseError(f"Respuesta truncada por max_tokens: {content[-200:]}")
+
+        # Verificar si es una respuesta de rechazo antes de intentar limpiar
+        contenido_lower = content.lower() if content else ""
+        es_rechazo_json = any(frase in contenido_lower for frase in RESPUESTAS_RECHAZO_JSON)
+
+        if es_rechazo_json and attempt == 0:
+            logger.error(f"🛑 STOP: Modelo rechazó generar JSON en primer intento: {content[:100]}")
+            raise ValueError(f"STOP: El modelo rechazó generar JSON: {content[:100]}")
+
+        # Reparar (texto alrededor, comas, strings y cierres) y parsear de nuevo
+        repaired, repairs = repair_json(content)
+        try:
+            json_content = json.loads(repaired)
+        except json.JSONDecodeError:
+            raise ValueError(f"No se pudo parsear la respuesta como JSON: {content[:500]}")
+        logger.info(f"🔧 Respuesta JSON reparada: {', '.join(f'{k}={v}' for k, v in repairs.items())}")
+        # Agregar información de tokens y de las reparaciones al resultado
+        if isinstance(json_content, dict):
+            json_content["_metadata_tokens"] = dict(tokens_info, json_repairs=repairs)
+        return json_content
+
+
+def parse_candidates(result: Dict[str, Any],
+                     attempt: int,
+                     system_prompt: str,
+                     user_prompt: str,
+                     temperature: Optional[float],
+                     max_tokens: Optional[int],
+                     timeout: float,
+                     metrics: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Interpreta una respuesta de chat/completions con varios candidatos (n > 1)
+
+    Cada choice se interpreta con parse_completion y los inválidos se
+    descartan. El usage es uno solo para todo el request y queda en el
+    _metadata_tokens del primer candidato.
+
+    Returns:
+        Candidatos válidos en el orden de choices
+
+    Raises:
+        ValueError: El error del último candidato si ninguno es válido
+    """
+    candidates = []
+    last_error = None
+    for index, choice in enumerate(result.get("choices") or []):
+        single = {"choices": [choice]}
+        if index == 0 and "usage" in result:
+            single["usage"] = result["usage"]
+        try:
+            candidates.append(parse_completion(
+                single, attempt, system_prompt, user_prompt, temperature, max_tokens, timeout,
+                metrics=metrics
+            ))
+        except ValueError as e:
+            last_error = e
+    if not candidates:
+        raise last_error or ValueError(f"Respuesta inesperada del modelo: {result}")
+    if last_error is not None:
+        logger.warning(f"🎲 {len(candidates)}/{len(result['choices'])} candidatos válidos: {last_error}")
+    return candidates
+
+
+class AsyncLLMClient:
+    """Cliente asyncio para el modelo LLM local gpt-oss-120b"""
+
+    def __init__(self):
+        # Réplicas de LLM_API_URL (balanceo por menos tokens comprometidos)
+        self.router = get_llm_router()
+        self.model = LLM_CONFIG["model"]
+        self.temperature = LLM_CONFIG["temperature"]
+        self.max_tokens = LLM_CONFIG["max_tokens"]
+        # Tope del timeout de lectura; cada llamada deriva el suyo con Deadline.for_completion()
+        self.timeout = 900
+        self.retry_attempts = LLM_CONFIG["retry_attempts"]
+        self.retry_delay = LLM_CONFIG["retry_delay"]
+        self.stream = LLM_CONFIG["stream"]
+
+        # Pool de conexiones keep-alive (conexiones ociosas se cierran tras pool_idle_timeout)
+        self.pool_size = LLM_CONFIG["pool_size"]
+        self.pool_idle_timeout = LLM_CONFIG["pool_idle_timeout"]
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        # Caché de respuestas compartida por el proceso (None = desactivada)
+        self.cache = get_llm_cache() if PROCESSING_CONFIG["enable_caching"] else None
+        # Coalescencia de llamadas idénticas en curso (compartida por el proceso)
+        self.single_flight = get_single_flight()
+        # Límite global de requests en curso y tokens comprometidos
+        self.admission = get_admission_controller()
+        # Ajuste AIMD del límite de admisión según latencia y errores observados
+        self.concurrency = get_adaptive_controller() if LLM_AIMD_CONFIG["enabled"] else None
+        # Duplicado de llamadas lentas de agentes cortos a otra réplica (opt-in)
+        self.hedging = get_hedging_policy() if LLM_HEDGE_CONFIG["enabled"] else None
+        # Conteo de tokens con el vocabulario de gpt-oss (heurística calibrada si no hay tokenizer)
+        self.token_counter = get_token_counter()
+        # Pasa a False si el servidor rechaza el JSON Schema (no se vuelve a enviar)
+        self.guided_json_supported = True
+        # Tokens de prompt enviados vs. servidos desde el prefix cache (requests que lo informan)
+        self.prefix_cache_stats = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+    @property
+    def endpoint(self) -> str:
+        """Endpoint principal (el primero de las réplicas configuradas)"""
+        return self.router.primary_url
+
+    @endpoint.setter
+    def endpoint(self, urls):
+        """Reemplaza las réplicas: una URL, varias separadas por coma o una lista"""
+        if isinstance(urls, str):
+            urls = [url.strip() for url in urls.split(",") if url.strip()]
+        self.router = EndpointRouter(list(urls))
+
+    def _new_connector(self) -> aiohttp.TCPConnector:
+        """Crea el conector con el pool de conexiones del tamaño configurado"""
+        return aiohttp.TCPConnector(
+            limit=self.pool_size,
+            keepalive_timeout=self.pool_idle_timeout
+        )
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Obtiene la sesión aiohttp (se crea en el loop de la primera llamada)"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=self._new_connector(),
+                headers={"Content-Type": "application/json"}
+            )
+        return self._session
+
+    @staticmethod
+    def _request_timeout(deadline: Deadline) -> aiohttp.ClientTimeout:
+        """Timeouts de conexión y lectura de un intento, acotados por lo que resta del plazo"""
+        return aiohttp.ClientTimeout(
+            total=deadline.remaining(),
+            sock_connect=deadline.connect_timeout,
+            sock_read=deadline.read_timeout
+        )
+
+    async def close(self):
+        """Cierra el pool de conexiones (se recrea en la siguiente llamada)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def generate(self,
+                       system_prompt: str,
+                       user_prompt: str,
+                       temperature: Optional[float] = None,
+                       max_tokens: Optional[int] = None,
+                       top_p: Optional[float] = None,
+                       stream: Optional[bool] = None,
+                       seed: Optional[int] = None,
+                       use_cache: Optional[bool] = None,
+                       agent_name: Optional[str] = None,
+                       priority: int = 0,
+                       deadline: Optional[Deadline] = None,
+                       max_tokens_ceiling: Optional[int] = None,
+                       json_schema: Optional[Dict[str, Any]] = None,
+                       n: int = 1) -> Dict[str, Any]:
+        """
+        Genera una respuesta del modelo LLM
+
+        Args:
+            system_prompt: Prompt del sistema (rol del agente)
+            user_prompt: Prompt del usuario (entrada específica)
+            temperature: Temperatura opcional (sobrescribe la configuración)
+            max_tokens: Tokens máximos opcionales (sobrescribe la configuración)
+            top_p: Top-p (nucleus sampling) opcional (sobrescribe la configuración)
+            stream: Si True consume la respuesta como event stream y aborta
+                apenas la salida es irrecuperable (por defecto LLM_STREAM)
+            seed: Semilla de muestreo opcional (forma parte de la clave de caché)
+            use_cache: False para no usar la caché ni compartir la llamada con
+                otras idénticas en curso; True para usar la caché aunque la
+                temperatura supere LLM_CACHE_MAX_TEMPERATURE
+            agent_name: Agente que origina la llamada (opt-out por agente y logs)
+            priority: Prioridad en la cola de admisión (mayor = antes; solo con
+                LLM_ADMISSION_POLICY=priority)
+            deadline: Plazo de la historia; de él se derivan los timeouts de
+                conexión y lectura de esta llamada (por defecto sin límite)
+            max_tokens_ceiling: Tope hasta el que se escala max_tokens si la
+                respuesta se trunca (por defecto no se escala); el valor final
+                queda en _metadata_tokens["max_tokens_escalated"]
+            json_schema: JSON Schema de la respuesta para decodificación guiada
+                (ver json_schemas.get_agent_schema); si el servidor no lo
+                soporta se continúa sin él
+            n: Candidatos a generar del mismo prompt en un solo request; con
+                n > 1 no se usa caché, coalescencia ni streaming
+
+        Returns:
+            Dict con la respuesta del modelo, o la lista de candidatos válidos
+            si n > 1
+
+        Raises:
+            ValueError: Con prefijo "STOP:" si el modelo no generó contenido
+                o rechazó la solicitud en el primer intento
+            DeadlineExceeded: Si el plazo vence antes de obtener respuesta
+            Exception: Si falla después de todos los reintentos
+        """
+        payload = build_payload(
+            self.model,
+            system_prompt,
+            user_prompt,
+            self.temperature if temperature is None else temperature,
+            max_tokens or self.max_tokens,
+            top_p,
+            seed,
+            json_schema=json_schema if self._guided_json_allowed(agent_name) else None,
+            schema_name=agent_name or "respuesta",
+            schema_mode=LLM_SCHEMA_CONFIG["mode"],
+            n=n
+        )
+
+        use_stream = self.stream if stream is None else stream
+        if n > 1:
+            # Los candidatos se interpretan de la respuesta completa y cada uno es distinto
+            use_stream = False
+            use_cache = False
+
+        cache_key = None
+        if self._cache_allowed(payload["temperature"], use_cache, agent_name):
+            cache_key = request_fingerprint(payload)
+            cached = await self._cache_get(cache_key)
+            if cached is not None:
+                logger.info(f"💾 Respuesta obtenida de caché{f' para {agent_name}' if agent_name else ''} ({cache_key[:12]})")
+                if isinstance(cached, dict):
+                    cached.setdefault("_metadata_tokens", {})["cache_hit"] = True
+                return cached
+
+        if use_cache is False:
+            return await self._generate_upstream(
+                payload, system_prompt, user_prompt, temperature, max_tokens, use_stream, cache_key,
+                priority, agent_name, deadline, max_tokens_ceiling
+            )
+
+        # Llamadas idénticas simultáneas comparten un único request al modelo
+        flight_key = cache_key or request_fingerprint(payload)
+        if use_stream:
+            flight_key += ":stream"
+        result, coalesced = await self.single_flight.do(
+            flight_key,
+            lambda: self._generate_upstream(
+                payload, system_prompt, user_prompt, temperature, max_tokens, use_stream, cache_key,
+                priority, agent_name, deadline, max_tokens_ceiling
+            )
+        )
+        if coalesced and isinstance(result, dict):
+            result.setdefault("_metadata_tokens", {})["coalesced"] = True
+        return result
+
+    async def generate_batch(self, requests: List[Dict[str, Any]], n: int = 1) -> List[Dict[str, Any]]:
+        """
+        Genera las respuestas de varios prompts en una sola ronda
+
+        chat/completions acepta una conversación por request, así que el lote
+        se envía completo y a la vez: vLLM junta los requests simultáneos en
+        el mismo batch (continuous batching) en lugar de recibirlos uno tras
+        otro. Los items idénticos (mismos prompts y parámetros de muestreo) se
+        agrupan en un único request con n candidatos, que comparte el prefill.
+
+        Args:
+            requests: Argumentos de generate() de cada item (system_prompt,
+                user_prompt y opcionales como temperature, agent_name, deadline
+                o json_schema; "n" fija los candidatos de ese item)
+            n: Candidatos por prompt por defecto
+
+        Returns:
+            Un dict por request, en el mismo orden:
+            {"status": "success", "output": primer candidato, "candidates": [...]}
+            o {"status": "error", "error": mensaje}; un item fallido no afecta al resto
+        """
+        groups: Dict[str, List[int]] = {}
+        for index, request in enumerate(requests):
+            sampling = {key: value for key, value in request.items() if key not in BATCH_ITEM_FIELDS}
+            sampling.setdefault("n", n)
+            groups.setdefault(json.dumps(sampling, sort_keys=True, default=str), []).append(index)
+
+        async def run_group(indices: List[int]) -> List[Tuple[int, Dict[str, Any]]]:
+            request = dict(requests[indices[0]])
+            per_item = request.pop("n", n)
+            total = per_item * len(indices)
+            try:
+                output = await self.generate(**request, n=total)
+            except Exception as e:
+                return [(index, {"status": "error", "error": str(e)}) for index in indices]
+            outputs = output if total > 1 else [output]
+            results = []
+            for position, index in enumerate(indices):
+                # Reparto intercalado: los candidatos descartados no dejan a un item sin respuesta
+                candidates = outputs[position::len(indices)][:per_item]
+                if candidates:
+                    results.append((index, {"status": "success", "output": candidates[0], "candidates": candidates}))
+                else:
+                    results.append((index, {"status": "error", "error": "Sin candidatos válidos"}))
+            return results
+
+        logger.info(f"📦 Lote de {len(requests)} requests en {len(groups)} llamadas al modelo")
+        results: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+        for group in await asyncio.gather(*(run_group(indices) for indices in groups.values())):
+            for index, result in group:
+                results[index] = result
+        return results
+
+    async def _generate_upstream(self,
+                                 payload: Dict[str, Any],
+                                 system_prompt: str,
+                                 user_prompt: str,
+                                 temperature: Optional[float],
+                                 max_tokens: Optional[int],
+                                 use_stream: bool,
+                                 cache_key: Optional[str],
+                                 priority: int = 0,
+                                 agent_name: Optional[str] = None,
+                                 deadline: Optional[Deadline] = None,
+                                 max_tokens_ceiling: Optional[int] = None) -> Dict[str, Any]:
+        """Envía el request al modelo con reintentos y guarda el resultado en caché"""
+        # Tokens que compromete cada intento ante el control de admisión
+        candidates = payload.get("n", 1)
+        prompt_tokens = self.token_counter.count_messages(payload["messages"])
+        request_tokens = prompt_tokens + payload["max_tokens"] * candidates
+        queue_wait = 0.0
+        # Timeouts propios de esta llamada (nunca se modifica self.timeout)
+        call_deadline = (deadline or Deadline()).for_completion(payload["max_tokens"], self.timeout, prompt_tokens)
+        escalated = False
+
+        # Intentar con reintentos
+        last_error = None
+        stop_error = None
+
+        for attempt in range(self.retry_attempts):
+            try:
+                logger.info(f"Intento {attempt + 1}/{self.retry_attempts} de llamada a LLM")
+                if call_deadline.expired:
+                    raise DeadlineExceeded(f"Plazo agotado antes del intento {attempt + 1}")
+                if not self.guided_json_supported:
+                    payload = strip_json_schema(payload)
+
+                # Esperar turno (la espera en cola no cuenta como latencia del modelo)
+                try:
+                    wait = await asyncio.wait_for(
+                        self.admission.acquire(request_tokens, priority),
+                        call_deadline.remaining()
+                    )
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded(f"Plazo agotado esperando turno en la cola de admisión ({queue_wait:.1f}s)")
+                queue_wait += wait
+                timeout = self._request_timeout(call_deadline)
+                if wait >= 0.5:
+                    logger.info(f"⏳ Espera en cola de admisión: {wait:.2f}s")
+                def parse(result, stream_metrics, attempt=attempt, max_tokens=payload["max_tokens"]):
+                    return (parse_candidates if candidates > 1 else parse_completion)(
+                        result, attempt, system_prompt, user_prompt,
+                        temperature, max_tokens, call_deadline.read_timeout,
+                        metrics=stream_metrics
+                    )
+
+                if self.hedging is not None:
+                    self.hedging.record_request()
+                hedge_delay = self._hedge_delay(agent_name)
+
+                request_start = time.monotonic()
+                parsed = None
+                stream_metrics = None
+                try:
+                    if hedge_delay is not None:
+                        result, parsed = await self._send_hedged(
+                            payload, attempt, use_stream, request_tokens, timeout, hedge_delay, parse
+                        )
+                    else:
+                        result, stream_metrics = await self._send_routed(
+                            payload, attempt, use_stream, request_tokens, timeout
+                        )
+                finally:
+                    self.admission.release(request_tokens)
+                llm_latency = time.monotonic() - request_start
+                if self.concurrency is not None:
+                    self.concurrency.record_success(
+                        llm_latency,
+                        (result.get("usage") or {}).get("completion_tokens", 0),
+                        agent_name
+                    )
+                if self.hedging is not None:
+                    self.hedging.record_latency(agent_name, llm_latency)
+                self.token_counter.observe(payload["messages"], (result.get("usage") or {}).get("prompt_tokens"))
+                self._record_prefix_cache(result.get("usage"))
+
+                if parsed is None:
+                    parsed = parse(result, stream_metrics)
+                for output in (parsed if candidates > 1 else [parsed]):
+                    if not isinstance(output, dict):
+                        continue
+                    output.setdefault("_metadata_tokens", {}).update({
+                        "queue_wait": round(queue_wait, 3),
+                        "llm_latency": round(llm_latency, 3)
+                    })
+                    if escalated:
+                        output["_metadata_tokens"]["max_tokens_escalated"] = payload["max_tokens"]
+                    if self.guided_json_supported and any(field in payload for field in GUIDED_JSON_FIELDS):
+                        output["_metadata_tokens"]["guided_json"] = LLM_SCHEMA_CONFIG["mode"]
+                if cache_key is not None:
+                    await self._cache_put(cache_key, parsed)
+                return parsed
+
+            except DeadlineExceeded:
+                raise
+
+            except asyncio.TimeoutError:
+                last_error = f"Timeout en intento {attempt + 1}"
+                logger.warning(last_error)
+                if call_deadline.expired:
+                    # Se agotó el plazo de la historia, no el servidor: no reintentar ni penalizar
+                    raise DeadlineExceeded(f"Plazo agotado durante el intento {attempt + 1}")
+                if self.concurrency is not None:
+                    self.concurrency.record_overload("timeout")
+
+            except aiohttp.ClientError as e:
+                last_error = f"Error de red en intento {attempt + 1}: {e}"
+                logger.warning(last_error)
+                if self.concurrency is not None and self._is_overload(e):
+                    self.concurrency.record_overload(f"error del servidor: {e}")
+
+            except TruncatedResponseError as te:
+                last_error = f"Error en intento {attempt + 1}: {te}"
+                logger.error(last_error)
+                if max_tokens_ceiling and payload["max_tokens"] < max_tokens_ceiling:
+                    # Reintentar con más espacio para la respuesta (hasta el valor configurado)
+                    new_max_tokens = min(max_tokens_ceiling,
+                                         int(payload["max_tokens"] * LLM_SIZING_CONFIG["escalation_factor"]))
+                    logger.warning(f"📈 Escalando max_tokens {payload['max_tokens']} → {new_max_tokens}")
+                    request_tokens += (new_max_tokens - payload["max_tokens"]) * candidates
+                    payload = dict(payload, max_tokens=new_max_tokens)
+                    call_deadline = (deadline or Deadline()).for_completion(new_max_tokens, self.timeout, prompt_tokens)
+                    escalated = True
+
+            except ValueError as ve:
+                # Si es el error especial de STOP, salir inmediatamente del bucle
+                if "STOP:" in str(ve):
+                    logger.error("🛑 Deteniendo proceso - No se realizarán reintentos")
+                    stop_error = ve
+                    break
+                else:
+                    last_error = f"Error en intento {attempt + 1}: {ve}"
+                    logger.error(last_error)
+
+            except Exception as e:
+                last_error = f"Error en intento {attempt + 1}: {e}"
+                logger.error(last_error)
+
+            # Esperar antes de reintentar
+            if attempt < self.retry_attempts - 1:
+                await asyncio.sleep(self.retry_delay)
+
+        # Verificar si debemos detener inmediatamente
+        if stop_error is not None:
+            raise stop_error
+
+        # Si llegamos aquí, todos los intentos fallaron normalmente
+        raise Exception(f"Fallo después de {self.retry_attempts} intentos. Último error: {last_error}")
+
+    def _hedge_delay(self, agent_name: Optional[str]) -> Optional[float]:
+        """Segundos tras los que duplicar la llamada, o None si no corresponde"""
+        if self.hedging is None or not self.hedging.enabled_for(agent_name):
+            return None
+        if len(self.router.endpoints) < 2:
+            return None
+        return self.hedging.hedge_delay(agent_name)
+
+    async def _send_hedged(self,
+                           payload: Dict[str, Any],
+                           attempt: int,
+                           use_stream: bool,
+                           request_tokens: int,
+                           timeout: aiohttp.ClientTimeout,
+                           hedge_delay: float,
+                           parse) -> Tuple[Dict[str, Any], Any]:
+        """
+        Envía el intento y, si tarda más que hedge_delay, un duplicado a otra réplica
+
+        Gana el primero que devuelva JSON válido según parse(); el otro se
+        cancela. Si ambos fallan se propaga el error de la llamada original.
+        El duplicado necesita su propio cupo en el control de admisión, sin
+        esperar en cola: bajo carga no se duplica.
+
+        Returns:
+            Tupla (result, parsed) con la respuesta cruda y la ya interpretada
+        """
+        primary_endpoint = self.router.pick(request_tokens)
+        primary = asyncio.ensure_future(
+            self._send_routed(payload, attempt, use_stream, request_tokens, timeout, endpoint=primary_endpoint)
+        )
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done and self.hedging.try_acquire():
+                # El duplicado ocupa su propio cupo: si no cabe ahora no se envía
+                if self.admission.try_acquire(request_tokens):
+                    hedge_endpoint = self.router.pick(request_tokens, exclude=primary_endpoint)
+                    logger.info(f"🪞 Llamada lenta (>{hedge_delay:.1f}s): duplicando en {hedge_endpoint.url}")
+                    hedge = asyncio.ensure_future(
+                        self._send_routed(payload, attempt, use_stream, request_tokens, timeout, endpoint=hedge_endpoint)
+                    )
+                    hedge.add_done_callback(lambda _: self.admission.release(request_tokens))
+                    tasks.add(hedge)
+                else:
+                    self.hedging.record_admission_denied()
+                    logger.info(f"🪞 Llamada lenta (>{hedge_delay:.1f}s) sin cupo de admisión: no se duplica")
+
+            errors = {}
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        result, stream_metrics = task.result()
+                        parsed = parse(result, stream_metrics)
+                    except Exception as e:
+                        errors[task] = e
+                        continue
+                    if task is not primary:
+                        self.hedging.record_win()
+                        logger.info("🪞 El duplicado respondió primero")
+                    return result, parsed
+            raise errors.get(primary) or next(iter(errors.values()))
+        finally:
+            # Cancelar al perdedor (cierra su conexión y el servidor aborta la generación)
+            losers = [task for task in tasks if not task.done()]
+            for task in losers:
+                task.cancel()
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+
+    async def _send_routed(self,
+                           payload: Dict[str, Any],
+                           attempt: int,
+                           use_stream: bool,
+                           request_tokens: int,
+                           timeout: aiohttp.ClientTimeout,
+                           endpoint: Optional[Endpoint] = None) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """
+        Envía un intento a la réplica elegida por el router y registra su resultado
+
+        Args:
+            timeout: Timeouts del intento (derivados del plazo de la llamada)
+            endpoint: Réplica ya reservada con router.pick() (por defecto se elige aquí)
+
+        Returns:
+            Tupla (result, stream_metrics) con la respuesta cruda del servidor
+        """
+        if endpoint is None:
+            endpoint = self.router.pick(request_tokens)
+        start = time.monotonic()
+        latency = None
+        failed = False
+        try:
+            result, stream_metrics = await self._send(endpoint.url, payload, attempt, use_stream, timeout)
+            latency = time.monotonic() - start
+            return result, stream_metrics
+        except asyncio.TimeoutError:
+            failed = True
+            raise
+        except aiohttp.ClientError as e:
+            failed = self._is_overload(e)
+            raise
+        finally:
+            self.router.finish(endpoint, request_tokens, latency, failed)
+
+    async def _send(self,
+                    url: str,
+                    payload: Dict[str, Any],
+                    attempt: int,
+                    use_stream: bool,
+                    timeout: aiohttp.ClientTimeout) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """Hace el POST a chat/completions (normal o streaming) en una réplica"""
+        session = self._get_session()
+        try:
+            if use_stream:
+                return await self._stream_completion(session, url, payload, attempt, timeout)
+            async with session.post(
+                url,
+                json=payload,
+                timeout=timeout
+            ) as response:
+                await raise_if_schema_rejected(response, payload)
+                response.raise_for_status()
+                return await response.json(content_type=None), None
+        except SchemaNotSupportedError as e:
+            # Reenviar sin schema en el mismo intento; el resto del proceso ya no lo envía
+            if self.guided_json_supported:
+                logger.warning(f"🧩 El servidor no soporta decodificación guiada, se continúa sin JSON Schema: {e}")
+            self.guided_json_supported = False
+            return await self._send(url, strip_json_schema(payload), attempt, use_stream, timeout)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Métricas del proceso para la capa de cliente LLM
+
+        Returns:
+            Dict con estadísticas de caché, coalescencia, admisión y réplicas
+        """
+        return {
+            "cache": dict(self.cache.stats) if self.cache is not None else None,
+            "single_flight": dict(self.single_flight.stats, in_flight=self.single_flight.in_flight),
+            "admission": self.admission.get_stats(),
+            "adaptive_concurrency": self.concurrency.get_stats() if self.concurrency is not None else None,
+            "endpoints": self.router.get_stats(),
+            "hedging": self.hedging.get_stats() if self.hedging is not None else None,
+            "tokenizer": self.token_counter.get_stats(),
+            "guided_json": {
+                "enabled": LLM_SCHEMA_CONFIG["enabled"],
+                "mode": LLM_SCHEMA_CONFIG["mode"],
+                "supported": self.guided_json_supported
+            },
+            "prefix_cache": dict(
+                self.prefix_cache_stats,
+                hit_rate=round(self.prefix_cache_stats["cached_tokens"] / self.prefix_cache_stats["prompt_tokens"], 3)
+                if self.prefix_cache_stats["prompt_tokens"] else None
+            )
+        }
+
+    def _record_prefix_cache(self, usage: Optional[Dict[str, Any]]):
+        """Acumula los tokens de prompt servidos desde el prefix cache"""
+        cached_tokens = cached_prompt_tokens(usage)
+        if cached_tokens is None:
+            return
+        self.prefix_cache_stats["requests"] += 1
+        self.prefix_cache_stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        self.prefix_cache_stats["cached_tokens"] += cached_tokens
+
+    @staticmethod
+    def _is_overload(error: aiohttp.ClientError) -> bool:
+        """Errores que indican saturación del servidor (y no un request inválido)"""
+        if isinstance(error, aiohttp.ClientResponseError):
+            return error.status >= 500 or error.status == 429
+        return isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ServerDisconnectedError))
+
+    def _guided_json_allowed(self, agent_name: Optional[str]) -> bool:
+        """Decide si una llamada envía su JSON Schema al servidor"""
+        if not LLM_SCHEMA_CONFIG["enabled"] or not self.guided_json_supported:
+            return False
+        return not (agent_name and agent_name in LLM_SCHEMA_CONFIG["disabled_agents"])
+
+    async def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Busca en la caché: el LRU en memoria en el loop, el disco en un executor"""
+        cached = self.cache.get_memory(key)
+        if cached is None:
+            cached = await asyncio.get_running_loop().run_in_executor(None, self.cache.get_disk, key)
+        return cached
+
+    async def _cache_put(self, key: str, value: Any):
+        """Guarda en la caché sin bloquear el loop con la escritura en disco"""
+        self.cache.put_memory(key, value)
+        await asyncio.get_running_loop().run_in_executor(None, self.cache.put_disk, key, value)
+
+    def _cache_allowed(self,
+                       temperature: float,
+                       use_cache: Optional[bool],
+                       agent_name: Optional[str]) -> bool:
+        """Decide si una llamada puede leer y escribir la caché de respuestas"""
+        if self.cache is None or use_cache is False:
+            return False
+        if use_cache:
+            return True
+        if agent_name and agent_name in LLM_CACHE_CONFIG["disabled_agents"]:
+            return False
+        if agent_name and agent_name in LLM_CACHE_CONFIG["agents"]:
+            return True
+        return temperature <= LLM_CACHE_CONFIG["max_temperature"]
+
+    async def _stream_completion(self,
+                                 session: aiohttp.ClientSession,
+                                 url: str,
+                                 payload: Dict[str, Any],
+                                 attempt: int,
+                                 timeout: aiohttp.ClientTimeout) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Consume la respuesta como event stream (SSE) validándola mientras llega
+
+        Cierra la conexión (el servidor cancela la generación) apenas la salida
+        es irrecuperable: rechazo en el texto inicial, texto que no es JSON o
+        corchetes cruzados. Una respuesta cortada por max_tokens también se
+        descarta sin intentar parsearla.
+
+        Returns:
+            Tupla (result, stream_metrics): result tiene la misma forma que la
+            respuesta no-streaming para reutilizar parse_completion
+
+        Raises:
+            ValueError: Con prefijo "STOP:" si el modelo rechazó en el primer intento
+        """
+        stream_payload = dict(payload, stream=True, stream_options={"include_usage": True})
+        validator = IncrementalJSONValidator()
+        parts = []
+        usage = None
+        finish_reason = None
+        deltas = 0
+        start = time.monotonic()
+        first_token_at = None
+
+        async with session.post(
+            url,
+            json=stream_payload,
+            timeout=timeout
+        ) as response:
+            await raise_if_schema_rejected(response, stream_payload)
+            response.raise_for_status()
+
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8", errors="replace").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+
+                event = json.loads(data)
+                if event.get("usage"):
+                    usage = event["usage"]
+
+                for choice in event.get("choices") or []:
+                    if choice.get("finish_reason"):
+                        finish_reason = choice["finish_reason"]
+                    delta = (choice.get("delta") or {}).get("content")
+                    if not delta:
+                        continue
+
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                        logger.debug(f"Primer token recibido en {first_token_at - start:.2f}s")
+                    deltas += 1
+                    parts.append(delta)
+                    validator.feed(delta)
+
+                    # Rechazo en el texto previo al JSON
+                    if not validator.started:
+                        prefix_lower = validator.prefix.lower()
+                        if any(frase in prefix_lower for frase in RESPUESTAS_RECHAZO + RESPUESTAS_RECHAZO_JSON):
+                            response.close()
+                            texto = "".join(parts)[:100]
+                            logger.error(f"🛑 Streaming abortado: el modelo está rechazando la solicitud: {texto}")
+                            if attempt == 0:
+                                raise ValueError(f"STOP: El modelo rechazó la solicitud en el primer intento: {texto}")
+                            raise ValueError(f"El modelo rechazó la solicitud: {texto}")
+
+                    # JSON irrecuperable
+                    if validator.error is not None:
+                        response.close()
+                        texto = "".join(parts)
+                        logger.warning(f"✂️ Streaming abortado tras {len(texto)} caracteres: {validator.error}")
+                        raise ValueError(f"No se pudo parsear la respuesta como JSON (streaming abortado: {validator.error}): {texto[:500]}")
+
+        content = "".join(parts)
+        end = time.monotonic()
+
+        if finish_reason == "length" and not validator.complete:
+            logger.warning(f"✂️ Respuesta truncada por max_tokens ({len(content)} caracteres, profundidad abierta {validator.depth})")
+            raise TruncatedResponseError(f"Respuesta truncada por max_tokens: {content[-200:]}")
+
+        completion_tokens = (usage or {}).get("completion_tokens") or deltas
+        generation_time = end - first_token_at if first_token_at else 0
+        stream_metrics = {
+            "time_to_first_token": round(first_token_at - start, 3) if first_token_at else None,
+            "tokens_per_second": round(completion_tokens / generation_time, 2) if generation_time > 0 else None,
+            "stream_duration": round(end - start, 3)
+        }
+        logger.info(f"📡 Streaming: TTFT={stream_metrics['time_to_first_token']}s, "
+                    f"{stream_metrics['tokens_per_second']} tokens/s")
+
+        result = {"choices": [{"message": {"content": content}, "finish_reason": finish_reason}]}
+        if usage:
+            result["usage"] = usage
+        return result, stream_metrics
+
+    async def validate_connection(self) -> bool:
+        """
+        Valida que el endpoint del LLM esté disponible
+
+        Returns:
+            True si alguna réplica responde, False en caso contrario
+        """
+        for endpoint in self.router.endpoints:
+            if await self._validate_endpoint(endpoint.url):
+                return True
+        return False
+
+    async def _validate_endpoint(self, url: str) -> bool:
+        """Valida una réplica concreta"""
+        session = self._get_session()
+        try:
+            # Primero intentar endpoint /v1/models
+            models_endpoint = url.replace("/v1/chat/completions", "/v1/models")
+            async with session.get(models_endpoint, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                if response.status == 200:
+                    return True
+        except Exception:
+            pass
+
+        try:
+            # Si no funciona, intentar con una petición mínima de chat
+            payload = {
+                "model": self.model,
+                "messages": [{"role": "user", "content": "test"}],
+                "max_tokens": 1
+            }
+            async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                return response.status == 200
+        except Exception:
+            return False
+
+    def estimate_tokens(self, text: str) -> int:
+        """
+        Cuenta los tokens de un texto con el vocabulario de gpt-oss
+
+        Usa el tokenizer del modelo si está disponible y, si no, una
+        heurística calibrada con los prompt_tokens reales del servidor.
+
+        Args:
+            text: Texto a contar
+
+        Returns:
+            Número de tokens
+        """
+        return self.token_counter.count(text)
+
+
+# ========== LOOP COMPARTIDO PARA LLAMADAS SÍNCRONAS ==========
+# Todos los hilos (historias, páginas de cuentacuentos, verificadores) envían sus
+# corrutinas a este único loop, que multiplexa los requests en curso.
+_shared_loop: Optional[asyncio.AbstractEventLoop] = None
+_shared_loop_thread: Optional[threading.Thread] = None
+_shared_loop_lock = threading.Lock()
+
+
+def get_shared_loop() -> asyncio.AbstractEventLoop:
+    """
+    Obtiene el event loop compartido, iniciándolo en un hilo daemon si no existe
+
+    Returns:
+        Event loop que atiende todas las llamadas síncronas al LLM
+    """
+    global _shared_loop, _shared_loop_thread
+    if _shared_loop is None:
+        with _shared_loop_lock:
+            if _shared_loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True)
+                thread.start()
+                _shared_loop_thread = thread
+                _shared_loop = loop
+    return _shared_loop
+
+
+def run_sync(coro):
+    """
+    Ejecuta una corrutina en el loop compartido y bloquea hasta su resultado
+
+    Args:
+        coro: Corrutina a ejecutar
+
+    Returns:
+        Resultado de la corrutina (las excepciones se propagan tal cual)
+    """
+    if threading.current_thread() is _shared_loop_thread:
+        coro.close()
+        raise RuntimeError("run_sync no puede llamarse desde el loop compartido; usa 'await' directamente")
+    future = asyncio.run_coroutine_threadsafe(coro, get_shared_loop())
+    return future.result()
@@ -0,0 +1,67 @@
+"""
+Escritura atómica de los archivos de una historia
+
+Escribir encima de manifest.json o de la salida de un agente deja un
+archivo truncado si el proceso muere a mitad de la escritura. Estas
+funciones escriben en un temporal del mismo directorio, hacen fsync y lo
+renombran sobre el destino (os.replace es atómico): quien lea ve el archivo
+anterior o el nuevo, nunca uno a medias.
+"""
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+
+from config import JOURNAL_CONFIG
+
+
+def _fsync_dir(directory: Path):
+    """fsync del directorio para que el rename sobreviva a un corte (no disponible en Windows)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_bytes(path: Path, data: bytes, fsync: Optional[bool] = None):
+    """
+    Reemplaza path con data de forma atómica
+
+    Args:
+        path: Archivo destino (su directorio debe existir)
+        data: Contenido completo
+        fsync: Forzar a disco antes del rename (por defecto JOURNAL_FSYNC)
+    """
+    path = Path(path)
+    fsync = JOURNAL_CONFIG["fsync"] if fsync is None else fsync
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        # mkstemp crea el archivo con permisos 0600
+        os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+    if fsync:
+        _fsync_dir(path.parent)
+
+
+def atomic_write_json(path: Path, content: Any, fsync: Optional[bool] = None):
+    """Reemplaza path con content como JSON (ensure_ascii=False, indent=2) de forma atómica"""
+    data = json.dumps(content, ensure_ascii=False, indent=2).encode("utf-8")
+    atomic_write_bytes(path, data, fsync=fsync)
@@ -14,14 +14,160 @@ RUNS_DIR = BASE_DIR / "runs"
 RUNS_DIR.mkdir(exist_ok=True)
 
 # Configuración del modelo LLM
+# LLM_API_URL acepta varias réplicas separadas por coma; api_url es la primera
+LLM_API_URLS = [
+    url.strip()
+    for url in os.getenv("LLM_API_URL", "http://69.19.136.204:8000/v1/chat/completions").split(",")
+    if url.strip()
+]
+
 LLM_CONFIG = {
-    "api_url": os.getenv("LLM_API_URL", "http://69.19.136.204:8000/v1/chat/completions"),
+    "api_url": LLM_API_URLS[0],
+    "api_urls": LLM_API_URLS,
     "model": os.getenv("LLM_MODEL", "openai/gpt-oss-120b"),
     "temperature": float(os.getenv("LLM_TEMPERATURE", "0.7")),
     "max_tokens": int(os.getenv("LLM_MAX_TOKENS", "20000")),
     "timeout": int(os.getenv("LLM_TIMEOUT", "900")),
     "retry_attempts": int(os.getenv("LLM_RETRY_ATTEMPTS", "3")),
-    "retry_delay": int(os.getenv("LLM_RETRY_DELAY", "2"))
+    "retry_delay": int(os.getenv("LLM_RETRY_DELAY", "2")),
+    # Streaming (SSE) con aborto temprano ante rechazo, truncamiento o JSON inválido
+    "stream": os.getenv("LLM_STREAM", "False").lower() == "true",
+    # Pool de conexiones keep-alive compartido por el singleton del cliente
+    "pool_size": int(os.getenv("LLM_POOL_SIZE", "10")),
+    "pool_idle_timeout": int(os.getenv("LLM_POOL_IDLE_TIMEOUT", "60"))  # Segundos sin uso antes de reciclar el pool
+}
+
+# Caché de respuestas del LLM (solo activa si PROCESSING_CONFIG["enable_caching"])
+LLM_CACHE_CONFIG = {
+    "dir": os.getenv("LLM_CACHE_DIR", str(BASE_DIR / "cache" / "llm")),
+    "memory_entries": int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256")),
+    "disk_max_mb": int(os.getenv("LLM_CACHE_DISK_MAX_MB", "512")),
+    "ttl_seconds": int(os.getenv("LLM_CACHE_TTL", "604800")),  # 7 días; 0 = sin expiración
+    # Respuestas con temperatura mayor no se cachean: los agentes creativos no repiten la misma historia
+    "max_temperature": float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.0")),
+    # Agentes que usan la caché aunque su temperatura supere el máximo (opt-in, separados por coma)
+    "agents": [a.strip() for a in os.getenv("LLM_CACHE_AGENTS", "").split(",") if a.strip()],
+    # Agentes que nunca usan la caché (separados por coma)
+    "disabled_agents": [a.strip() for a in os.getenv("LLM_CACHE_DISABLED_AGENTS", "").split(",") if a.strip()]
+}
+
+# Enrutamiento entre réplicas (cuando LLM_API_URL tiene varias)
+LLM_ROUTER_CONFIG = {
+    "eject_after_failures": int(os.getenv("LLM_EJECT_AFTER_FAILURES", "2")),  # Timeouts/5xx consecutivos
+    "probe_interval": float(os.getenv("LLM_PROBE_INTERVAL", "10")),  # Segundos entre sondeos de réplicas expulsadas
+    "latency_window": int(os.getenv("LLM_LATENCY_WINDOW", "200"))  # Latencias recientes por réplica
+}
+
+# Hedging: duplicar en otra réplica las llamadas lentas de agentes cortos (opt-in)
+LLM_HEDGE_CONFIG = {
+    "enabled": os.getenv("LLM_HEDGING", "False").lower() == "true",
+    "agents": [a.strip() for a in os.getenv(
+        "LLM_HEDGE_AGENTS", "10_portadista,11_loader,verificador_qa_03_cuentacuentos"
+    ).split(",") if a.strip()],
+    "percentile": float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95")),  # Latencia que dispara el duplicado
+    "budget": float(os.getenv("LLM_HEDGE_BUDGET", "0.1")),  # Máximo de duplicados / llamadas totales
+    "min_samples": int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "5")),
+    "window": int(os.getenv("LLM_HEDGE_WINDOW", "200"))  # Latencias recientes por agente
+}
+
+# Conteo de tokens: tokenizer de gpt-oss si está disponible, heurística calibrada si no
+TOKENIZER_CONFIG = {
+    "backend": os.getenv("TOKENIZER_BACKEND", "auto"),  # auto | tokenizers | tiktoken | heuristic
+    "path": os.getenv("TOKENIZER_PATH", ""),  # tokenizer.json del modelo (HuggingFace)
+    "encoding": os.getenv("TOKENIZER_ENCODING", "o200k_harmony"),  # Codificación de tiktoken (opcional, BPE en TIKTOKEN_CACHE_DIR)
+    "heuristic_factor": float(os.getenv("TOKENIZER_HEURISTIC_FACTOR", "1.0")),  # Factor inicial (se recalibra)
+    "memo_entries": int(os.getenv("TOKENIZER_MEMO_ENTRIES", "1024"))  # Textos con conteo memoizado
+}
+
+# Presupuesto de contexto: se verifica system + user + max_tokens antes de enviar
+LLM_CONTEXT_CONFIG = {
+    "context_window": int(os.getenv("LLM_CONTEXT_WINDOW", "131072")),  # Ventana de gpt-oss-120b
+    "safety_margin": int(os.getenv("LLM_CONTEXT_SAFETY_MARGIN", "1024")),  # Holgura por error de conteo
+    "min_max_tokens": int(os.getenv("LLM_CONTEXT_MIN_MAX_TOKENS", "2000")),  # Por debajo no se envía
+    # Campos de dependencias que se quitan primero (en este orden) si el prompt no cabe
+    "drop_fields": [field.strip() for field in os.getenv(
+        "LLM_CONTEXT_DROP_FIELDS",
+        "_metadata_tokens,metadata,qa,variantes,climax_alternativo,resolucion_alternativa,anotaciones"
+    ).split(",") if field.strip()]
+}
+
+# max_tokens aprendido por agente (p99 de completion_tokens históricos + margen)
+LLM_SIZING_CONFIG = {
+    "enabled": os.getenv("LLM_LEARNED_MAX_TOKENS", "True").lower() == "true",
+    "percentile": float(os.getenv("LLM_SIZING_PERCENTILE", "0.99")),
+    "margin": float(os.getenv("LLM_SIZING_MARGIN", "0.25")),  # Margen relativo sobre el percentil
+    "min_samples": int(os.getenv("LLM_SIZING_MIN_SAMPLES", "20")),  # Sin historial suficiente se usa el configurado
+    "min_tokens": int(os.getenv("LLM_SIZING_MIN_TOKENS", "1024")),
+    "round_to": 256,
+    "escalation_factor": float(os.getenv("LLM_SIZING_ESCALATION_FACTOR", "2.0")),  # Al detectar truncamiento
+    "window": int(os.getenv("LLM_SIZING_WINDOW", "500")),  # Respuestas recientes consideradas
+    "max_files": int(os.getenv("LLM_SIZING_MAX_FILES", "500"))
+}
+
+# Decodificación guiada: el JSON Schema del agente se envía al servidor para que solo genere JSON válido
+LLM_SCHEMA_CONFIG = {
+    "enabled": os.getenv("LLM_GUIDED_JSON", "True").lower() == "true",
+    "mode": os.getenv("LLM_GUIDED_JSON_MODE", "response_format").lower(),  # response_format | guided_json
+    # Agentes que nunca envían schema (separados por coma)
+    "disabled_agents": [a.strip() for a in os.getenv("LLM_GUIDED_JSON_DISABLED_AGENTS", "").split(",") if a.strip()]
+}
+
+# Plazos por llamada: timeouts derivados del tamaño de respuesta y del presupuesto de la historia
+LLM_DEADLINE_CONFIG = {
+    "connect_timeout": float(os.getenv("LLM_CONNECT_TIMEOUT", "10")),
+    # Lectura = base + tokens del prompt / ritmo de prefill + max_tokens / ritmo mínimo, con tope en LLM_TIMEOUT
+    "read_timeout_base": float(os.getenv("LLM_READ_TIMEOUT_BASE", "60")),
+    "min_tokens_per_second": float(os.getenv("LLM_MIN_TOKENS_PER_SECOND", "25")),
+    "min_prefill_tokens_per_second": float(os.getenv("LLM_MIN_PREFILL_TOKENS_PER_SECOND", "500")),
+    "story_budget": int(os.getenv("STORY_TIME_BUDGET", "0"))  # Segundos por historia; 0 = sin límite
+}
+
+# Control de admisión global de llamadas al LLM (compartido por todo el proceso)
+LLM_ADMISSION_CONFIG = {
+    "max_in_flight": int(os.getenv("LLM_MAX_IN_FLIGHT", "8")),
+    # Tokens comprometidos (prompt + max_tokens) de los requests en curso; 0 = sin límite
+    "token_budget": int(os.getenv("LLM_TOKEN_BUDGET", "200000")),
+    "policy": os.getenv("LLM_ADMISSION_POLICY", "fifo").lower()  # fifo | priority
+}
+
+# Concurrencia adaptativa (AIMD): ajusta el límite de admisión entre min_limit y LLM_MAX_IN_FLIGHT
+LLM_AIMD_CONFIG = {
+    "enabled": os.getenv("LLM_ADAPTIVE_CONCURRENCY", "True").lower() == "true",
+    "min_limit": int(os.getenv("LLM_AIMD_MIN_LIMIT", "1")),
+    "initial_limit": int(os.getenv("LLM_AIMD_INITIAL_LIMIT", "3")),
+    "decrease_factor": float(os.getenv("LLM_AIMD_DECREASE_FACTOR", "0.5")),
+    "latency_tolerance": float(os.getenv("LLM_AIMD_LATENCY_TOLERANCE", "2.0")),  # p95 / línea base
+    "error_threshold": float(os.getenv("LLM_AIMD_ERROR_THRESHOLD", "0.1")),
+    "window_size": int(os.getenv("LLM_AIMD_WINDOW", "50")),
+    # Respuestas seguidas sobre la tolerancia antes de reducir (un outlier aislado no cuenta)
+    "spike_persistence": int(os.getenv("LLM_AIMD_SPIKE_PERSISTENCE", "3"))
+}
+
+# Servidor LLM simulado (src/mock_llm_server.py) para pruebas y benchmarks sin GPU
+MOCK_LLM_CONFIG = {
+    "host": os.getenv("MOCK_LLM_HOST", "127.0.0.1"),
+    "port": int(os.getenv("MOCK_LLM_PORT", "8001")),
+    # Respuestas grabadas: historias de runs/ y cassettes JSONL (separados por coma)
+    "runs_dir": os.getenv("MOCK_LLM_RUNS_DIR", str(RUNS_DIR)),
+    "cassettes": [c.strip() for c in os.getenv("MOCK_LLM_CASSETTES", "").split(",") if c.strip()],
+    # Latencia base por request: fixed | uniform | exponential | lognormal (mediana y sigma en segundos)
+    "latency_distribution": os.getenv("MOCK_LLM_LATENCY_DIST", "lognormal").lower(),
+    "latency_median": float(os.getenv("MOCK_LLM_LATENCY_MEDIAN", "0.5")),
+    "latency_sigma": float(os.getenv("MOCK_LLM_LATENCY_SIGMA", "0.5")),
+    "prefill_tokens_per_second": float(os.getenv("MOCK_LLM_PREFILL_TPS", "5000")),
+    "tokens_per_second": float(os.getenv("MOCK_LLM_TOKENS_PER_SECOND", "60")),
+    "time_scale": float(os.getenv("MOCK_LLM_TIME_SCALE", "1.0")),  # Multiplica todas las esperas; 0 = sin espera
+    # Requests generando a la vez (slots del batch); el resto espera en cola hasta max_queue, luego 503
+    "max_concurrency": int(os.getenv("MOCK_LLM_MAX_CONCURRENCY", "16")),
+    "max_queue": int(os.getenv("MOCK_LLM_MAX_QUEUE", "64")),
+    # Fallas inyectadas (fracción de requests)
+    "timeout_rate": float(os.getenv("MOCK_LLM_TIMEOUT_RATE", "0")),
+    "empty_rate": float(os.getenv("MOCK_LLM_EMPTY_RATE", "0")),
+    "refusal_rate": float(os.getenv("MOCK_LLM_REFUSAL_RATE", "0")),
+    "truncation_rate": float(os.getenv("MOCK_LLM_TRUNCATION_RATE", "0")),
+    "server_error_rate": float(os.getenv("MOCK_LLM_SERVER_ERROR_RATE", "0")),
+    "hang_seconds": float(os.getenv("MOCK_LLM_HANG_SECONDS", "600")),  # Duración de un timeout inyectado
+    "seed": int(os.getenv("MOCK_LLM_SEED", "0"))
 }
 
 # Configuración de la API
@@ -172,6 +318,32 @@ LOGGING_CONFIG = {
     "file": os.getenv("LOG_FILE", "cuenteria.log")
 }
 
+# Traza de cada historia en runs/<id>/trace.json (formato Chrome trace-event)
+TRACE_CONFIG = {
+    "enabled": os.getenv("TRACE_ENABLED", "true").lower() == "true",
+    "max_events": int(os.getenv("TRACE_MAX_EVENTS", "50000"))  # Tope de spans por historia
+}
+
+# Journal por historia (runs/<id>/journal.jsonl) para recuperar historias tras una caída
+JOURNAL_CONFIG = {
+    "enabled": os.getenv("JOURNAL_ENABLED", "true").lower() == "true",
+    "fsync": os.getenv("JOURNAL_FSYNC", "true").lower() == "true",  # fsync en puntos de commit y escrituras atómicas
+    "recover_on_startup": os.getenv("RECOVER_ON_STARTUP", "true").lower() == "true"
+}
+
+# Manifest de cada historia: los cambios se agrupan y se escriben juntos cada debounce_seconds
+MANIFEST_CONFIG = {
+    "debounce_seconds": float(os.getenv("MANIFEST_DEBOUNCE", "0.5"))
+}
+
+# Agentes en paralelo en versiones con "parallel_execution": el grafo sale de dependencies.json
+# (config.json de la versión puede fijar "max_parallel_agents")
+# Con "incremental", re-ejecutar una historia salta los agentes cuyas entradas no cambiaron
+SCHEDULER_CONFIG = {
+    "max_parallel_agents": int(os.getenv("MAX_PARALLEL_AGENTS", "3")),
+    "incremental": os.getenv("INCREMENTAL_RERUN", "true").lower() == "true"
+}
+
 # Configuración de procesamiento
 PROCESSING_CONFIG = {
     "max_story_time": int(os.getenv("MAX_STORY_TIME", "600")),  # 10 minutos máximo por historia
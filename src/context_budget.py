@@ -0,0 +1,138 @@
+"""
+Plan de presupuesto de contexto previo a cada llamada
+
+Un prompt que no cabe en la ventana del modelo hoy solo se detecta como una
+respuesta vacía, después de ocupar la GPU. Antes de enviar se cuenta
+system + user + max_tokens y, si no cabe, se reduce en un orden fijo:
+
+1. Quitar de las dependencias los campos de poco valor para el siguiente
+   agente (autoevaluaciones qa, metadatos, variantes alternativas), de a uno
+2. Serializar las dependencias como JSON compacto (sin indentación)
+3. Reducir max_tokens hasta lo que quede de la ventana
+
+Si ni así cabe, la llamada no se envía.
+"""
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import LLM_CONTEXT_CONFIG
+from token_counter import TokenCounter, get_token_counter
+
+logger = logging.getLogger(__name__)
+
+
+def dump_dependency(content: Any, compact: bool = False) -> str:
+    """Serializa una dependencia para el prompt (indentada o compacta)"""
+    if compact:
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(content, ensure_ascii=False, indent=2)
+
+
+def drop_field(data: Any, field: str) -> Tuple[Any, int]:
+    """
+    Quita un campo a cualquier profundidad
+
+    Returns:
+        Tupla (copia sin el campo, apariciones quitadas)
+    """
+    if isinstance(data, dict):
+        removed = 1 if field in data else 0
+        result = {}
+        for key, value in data.items():
+            if key == field:
+                continue
+            result[key], count = drop_field(value, field)
+            removed += count
+        return result, removed
+    if isinstance(data, list):
+        result = []
+        removed = 0
+        for item in data:
+            item, count = drop_field(item, field)
+            result.append(item)
+            removed += count
+        return result, removed
+    return data, 0
+
+
+def plan_context(system_prompt: str,
+                 dependencies: Dict[str, Any],
+                 build_prompt: Callable[[Dict[str, Any], bool], str],
+                 max_tokens: int,
+                 counter: Optional[TokenCounter] = None,
+                 context_window: Optional[int] = None,
+                 drop_fields: Optional[List[str]] = None) -> Tuple[str, int, Dict[str, Any]]:
+    """
+    Ajusta el prompt y max_tokens a la ventana de contexto del modelo
+
+    Args:
+        system_prompt: Prompt del sistema del agente
+        dependencies: Dependencias cargadas (no se modifican)
+        build_prompt: Construye el user prompt a partir de (dependencias, compacto)
+        max_tokens: Tokens de respuesta pedidos
+        counter: Contador de tokens (por defecto el del proceso)
+        context_window: Ventana del modelo (por defecto LLM_CONTEXT_WINDOW)
+        drop_fields: Campos prescindibles en orden de descarte
+
+    Returns:
+        Tupla (user_prompt, max_tokens, plan); plan["fits"] es False si el
+        request no cabe ni aplicando todas las reducciones
+    """
+    counter = counter or get_token_counter()
+    context_window = context_window or LLM_CONTEXT_CONFIG["context_window"]
+    drop_fields = drop_fields if drop_fields is not None else LLM_CONTEXT_CONFIG["drop_fields"]
+    budget = context_window - LLM_CONTEXT_CONFIG["safety_margin"]
+
+    def prompt_tokens(user_prompt):
+        return counter.count_messages([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ])
+
+    compact = False
+    user_prompt = build_prompt(dependencies, compact)
+    tokens = prompt_tokens(user_prompt)
+    plan = {
+        "context_window": context_window,
+        "safety_margin": LLM_CONTEXT_CONFIG["safety_margin"],
+        "token_counting": counter.backend_name,
+        "prompt_tokens_initial": tokens,
+        "max_tokens_initial": max_tokens,
+        "steps": []
+    }
+
+    # 1. Campos de poco valor, de a uno y en orden
+    for field in drop_fields:
+        if tokens + max_tokens <= budget:
+            break
+        trimmed, removed = drop_field(dependencies, field)
+        if not removed:
+            continue
+        dependencies = trimmed
+        user_prompt = build_prompt(dependencies, compact)
+        tokens = prompt_tokens(user_prompt)
+        plan["steps"].append({"action": "drop_field", "field": field, "removed": removed, "prompt_tokens": tokens})
+
+    # 2. JSON compacto
+    if tokens + max_tokens > budget and dependencies:
+        compact = True
+        user_prompt = build_prompt(dependencies, compact)
+        tokens = prompt_tokens(user_prompt)
+        plan["steps"].append({"action": "compact_json", "prompt_tokens": tokens})
+
+    # 3. Respuesta más corta
+    fits = tokens + max_tokens <= budget
+    if not fits:
+        available = budget - tokens
+        if available >= LLM_CONTEXT_CONFIG["min_max_tokens"]:
+            plan["steps"].append({"action": "shrink_max_tokens", "from": max_tokens, "to": available})
+            max_tokens = available
+            fits = True
+
+    plan.update({"prompt_tokens": tokens, "max_tokens": max_tokens, "fits": fits})
+    if plan["steps"]:
+        actions = ", ".join(step.get("field", step["action"]) for step in plan["steps"])
+        logger.warning(f"✂️ Prompt ajustado a la ventana de contexto ({actions}): "
+                       f"{plan['prompt_tokens_initial']} → {tokens} tokens de prompt, max_tokens={max_tokens}")
+    return user_prompt, max_tokens, plan
@@ -0,0 +1,96 @@
+"""
+Plazos por llamada para el pipeline de historias
+
+Un Deadline es inmutable: el orquestador crea uno por historia, cada agente lo
+recibe como argumento y cada llamada al LLM deriva de él sus timeouts de
+conexión y lectura según el tamaño de respuesta esperado. Así ninguna llamada
+modifica estado compartido (como el timeout del cliente singleton) y una
+respuesta corta no hereda los 900 s pensados para las más largas.
+"""
+import time
+from typing import Any, Dict, Optional
+
+from config import LLM_DEADLINE_CONFIG
+
+
+class DeadlineExceeded(Exception):
+    """Se agotó el plazo de la historia antes de completar la llamada"""
+
+
+class Deadline:
+    """Instante límite absoluto (reloj monotónico) con timeouts de conexión y lectura"""
+
+    def __init__(self,
+                 expires_at: Optional[float] = None,
+                 connect_timeout: Optional[float] = None,
+                 read_timeout: Optional[float] = None):
+        """
+        Args:
+            expires_at: Instante límite según time.monotonic() (None = sin límite)
+            connect_timeout: Segundos máximos para establecer la conexión
+            read_timeout: Segundos máximos esperando datos del servidor
+        """
+        self.expires_at = expires_at
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+    @classmethod
+    def after(cls, seconds: Optional[float]) -> "Deadline":
+        """Plazo que vence dentro de `seconds` (None o <= 0 = sin límite)"""
+        if not seconds or seconds <= 0:
+            return cls()
+        return cls(expires_at=time.monotonic() + seconds)
+
+    @classmethod
+    def for_story(cls) -> "Deadline":
+        """Plazo de una historia completa según STORY_TIME_BUDGET"""
+        return cls.after(LLM_DEADLINE_CONFIG["story_budget"])
+
+    def remaining(self) -> Optional[float]:
+        """Segundos restantes (None si no hay límite; nunca negativo)"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        """True si el plazo ya venció"""
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def for_completion(self, max_tokens: int, max_read_timeout: float, prompt_tokens: int = 0) -> "Deadline":
+        """
+        Deriva el plazo de una llamada al LLM
+
+        El timeout de lectura cubre una latencia base, el prefill de
+        prompt_tokens y la generación de max_tokens, ambos al ritmo mínimo
+        aceptable, sin superar max_read_timeout ni lo que le queda a la
+        historia. Sin el término de prefill, un agente con mucho contexto y
+        un max_tokens chico se cortaba antes de empezar a generar.
+
+        Args:
+            max_tokens: Tokens máximos de la respuesta
+            max_read_timeout: Tope del timeout de lectura (LLM_TIMEOUT)
+            prompt_tokens: Tokens del prompt (system + user)
+
+        Returns:
+            Nuevo Deadline con el mismo instante límite y timeouts calculados
+        """
+        read_timeout = (LLM_DEADLINE_CONFIG["read_timeout_base"]
+                        + prompt_tokens / LLM_DEADLINE_CONFIG["min_prefill_tokens_per_second"]
+                        + max_tokens / LLM_DEADLINE_CONFIG["min_tokens_per_second"])
+        read_timeout = min(read_timeout, max_read_timeout)
+        remaining = self.remaining()
+        if remaining is not None:
+            read_timeout = min(read_timeout, remaining)
+        connect_timeout = min(LLM_DEADLINE_CONFIG["connect_timeout"], read_timeout)
+        return Deadline(self.expires_at, connect_timeout=connect_timeout, read_timeout=read_timeout)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Representación para logs y diagnósticos"""
+        remaining = self.remaining()
+        return {
+            "remaining": round(remaining, 1) if remaining is not None else None,
+            "connect_timeout": round(self.connect_timeout, 1) if self.connect_timeout is not None else None,
+            "read_timeout": round(self.read_timeout, 1) if self.read_timeout is not None else None
+        }
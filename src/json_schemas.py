@@ -0,0 +1,193 @@
+"""
+JSON Schema de la salida de cada agente para decodificación guiada
+
+Cada agente describe su contrato en el prompt y QualityGateChecker verifica
+los campos después de recibir la respuesta. Cuando el modelo se sale del
+contrato (texto antes del JSON, comillas sin cerrar, campos faltantes) el
+intento se pierde entero y se reintenta. Con el schema en response_format
+(o guided_json de vLLM) el servidor restringe la decodificación a JSON que
+cumple el contrato desde el primer token.
+
+Los schemas de v1 se derivan de REQUIRED_FIELDS; los de v2 y v3 transcriben
+el "Contrato JSON" de cada prompt en flujo/<versión>/agentes. Solo fijan la
+forma (campos, tipos y páginas "1".."10"); se permiten campos adicionales.
+"""
+from typing import Any, Dict, Optional
+
+from quality_gates import REQUIRED_FIELDS
+
+# Nombre del schema de las páginas de cuentacuentos en paralelo
+PAGE_SCHEMA_NAME = "03_cuentacuentos_pagina"
+
+PAGE_KEYS = [str(i) for i in range(1, 11)]
+
+_STRING = {"type": "string"}
+_INTEGER = {"type": "integer"}
+_NUMBER = {"type": "number"}
+_BOOLEAN = {"type": "boolean"}
+_OBJECT = {"type": "object"}
+
+
+def _object(properties: Dict[str, Any], required=None) -> Dict[str, Any]:
+    """Objeto con sus propiedades (todas requeridas salvo que se indique)"""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties if required is None else required)
+    }
+
+
+def _list(items: Dict[str, Any], count: Optional[int] = None) -> Dict[str, Any]:
+    """Arreglo, opcionalmente con un número exacto de elementos"""
+    schema = {"type": "array", "items": items}
+    if count is not None:
+        schema.update({"minItems": count, "maxItems": count})
+    return schema
+
+
+def _pages(value: Dict[str, Any]) -> Dict[str, Any]:
+    """Objeto con las páginas "1".."10" como claves de texto"""
+    return _object({key: value for key in PAGE_KEYS})
+
+
+_STRINGS = _list(_STRING)
+
+# Campos de v1 con validaciones propias en QualityGateChecker
+_V1_PROPERTIES = {
+    "qa": _OBJECT,
+    "paginas_texto": _pages(_STRING),
+    "paginas": _pages(_object({"texto": _STRING, "prompt": {}}))
+}
+
+# Contratos de los prompts de flujo/v2/agentes y flujo/v3/agentes
+CONTRACT_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "01_director": _object({
+        "leitmotiv": _STRING,
+        "beat_sheet": _list(_object(
+            {"pagina": _INTEGER, "objetivo": _STRING, "conflicto": _STRING, "resolucion": _STRING,
+             "emocion": _STRING, "imagen_nuclear": _STRING},
+            required=["pagina", "objetivo", "emocion", "imagen_nuclear"]
+        ), 10),
+        "variantes": _list(_object({"climax_alternativo": _STRING, "resolucion_alternativa": _STRING}))
+    }),
+    "02_psicoeducador": _object({
+        "edad_objetivo": _STRING,
+        "metas_generales": _STRINGS,
+        "mapa_psico_narrativo": _list(_object({
+            "pagina": _INTEGER, "micro_habilidad": _STRING, "frase_modelo": _STRING,
+            "recurso": _STRING, "evitar": _STRING
+        }), 10),
+        "banderas": _STRINGS
+    }),
+    "03_cuentacuentos": _object({
+        "paginas_texto": _pages(_STRING),
+        "leitmotiv_usado_en": _list(_INTEGER)
+    }),
+    "04_editor_claridad": _object({
+        "paginas_texto_claro": _pages(_STRING),
+        "glosario": _list(_object({"original": _STRING, "simple": _STRING})),
+        "cambios_clave": _STRINGS,
+        "porcentaje_editado": _pages(_NUMBER)
+    }, required=["paginas_texto_claro", "glosario", "cambios_clave"]),
+    "05_ritmo_rima": _object({
+        "paginas_texto_pulido": _pages(_STRING),
+        "esquema_rima": _pages(_STRING),
+        "finales_de_verso": _pages(_list(_STRING, 4)),
+        "coherencia_preservada": _BOOLEAN,
+        "configuracion_aplicada": _STRING
+    }, required=["paginas_texto_pulido", "esquema_rima", "finales_de_verso"]),
+    "06_continuidad": _object({
+        "character_bible": _list(_object({
+            "nombre": _STRING, "edad": _STRING, "rasgos_visibles": _STRING, "vestuario": _STRING,
+            "colores_clave": _STRINGS, "objeto_ancla": _STRING, "gestos": _STRING, "no_haria": _STRING
+        }, required=["nombre", "rasgos_visibles", "vestuario"])),
+        "continuidad_narrativa": _object({
+            "relaciones": _STRING,
+            "evolucion_emocional": _STRING,
+            "objeto_ancla_reapariciones": _list(_object({"personaje": _STRING, "paginas": _list(_INTEGER)}))
+        })
+    }),
+    "07_diseno_escena": _object({
+        "prompts_paginas": _pages(_STRING),
+        "anotaciones": _STRINGS
+    }),
+    "08_direccion_arte": _object({
+        "estilo_global": _STRING,
+        "color_script": _pages(_object({"paleta": _STRINGS, "momento": _STRING, "atmosfera": _STRING})),
+        "transiciones": _list(_object({"de_pagina": _INTEGER, "a_pagina": _INTEGER, "tipo": _STRING}))
+    }),
+    "09_sensibilidad": _object({
+        "riesgos_detectados": _list(_object({"pagina": _INTEGER, "detalle": _STRING, "riesgo": _STRING})),
+        "correcciones_sugeridas": _list(_object({"pagina": _INTEGER, "texto_o_prompt": _STRING})),
+        "apto_para_ninos": _BOOLEAN
+    }),
+    "10_portadista": _object({
+        "titulos": _STRINGS,
+        "portada": _object({"prompt": _STRING})
+    }),
+    "11_loader": _object({
+        "loader": _list(_STRING, 10)
+    }),
+    "12_validador": _object({
+        "titulo": _STRING,
+        "paginas": _pages(_object({"texto": _STRING, "prompt": _STRING})),
+        "portada": _object({"prompt": _STRING}),
+        "loader": _STRINGS
+    }),
+    PAGE_SCHEMA_NAME: _object({
+        "pagina": _INTEGER,
+        "versos": _list(_STRING, 4),
+        "palabras_finales": _list(_STRING, 4),
+        "esquema_usado": _STRING
+    }, required=["versos", "palabras_finales"]),
+    # v3: el número de páginas lo decide el director, no se fija
+    "01_director_v3": _object({
+        "titulo": _STRING,
+        "opciones_titulo": _STRINGS,
+        "idioma": _STRING,
+        "resumen_y_objetivos": _STRING,
+        "personajes": _list(_OBJECT),
+        "edad_objetivo": _STRING,
+        "paginas": _list(_object({"numero": _INTEGER}))
+    }, required=["titulo", "opciones_titulo", "idioma", "personajes", "paginas"]),
+    "02_escritor_v3": _object({
+        "paginas": _list(_object({"numero": _INTEGER, "texto": _STRING}))
+    }),
+    "03_directorarte_v3": _object({
+        "amc_elegido": _OBJECT,
+        "paginas": _list(_object({"numero": _INTEGER, "prompt": _OBJECT})),
+        "portada": _object({"prompt": _OBJECT})
+    }),
+    "04_consolidador_v3": _object({
+        "titulo": _STRING,
+        "paginas": {"type": "object", "additionalProperties": _object({"texto": _STRING, "prompt": {}})},
+        "portada": _OBJECT,
+        "loader": _list(_STRING, 10)
+    })
+}
+
+
+def _v1_schema(agent_name: str) -> Dict[str, Any]:
+    """Schema de un agente v1 a partir de sus campos requeridos"""
+    properties = {field: _V1_PROPERTIES.get(field, {}) for field in REQUIRED_FIELDS[agent_name]}
+    if agent_name == "loader":
+        properties["loader"] = _list(_STRING, 10)
+    return _object(properties)
+
+
+def get_agent_schema(agent_name: str) -> Optional[Dict[str, Any]]:
+    """
+    JSON Schema de la salida de un agente
+
+    Args:
+        agent_name: Nombre del agente (v1, v2 con prefijo numérico o v3) o
+            PAGE_SCHEMA_NAME para las páginas de cuentacuentos en paralelo
+
+    Returns:
+        Schema del contrato, o None si el agente no tiene uno registrado
+    """
+    if agent_name in CONTRACT_SCHEMAS:
+        return CONTRACT_SCHEMAS[agent_name]
+    if agent_name in REQUIRED_FIELDS:
+        return _v1_schema(agent_name)
+    return None
@@ -0,0 +1,436 @@
+"""
+Validación y reparación incremental de JSON para respuestas del modelo
+
+IncrementalJSONValidator permite decidir, mientras llegan los tokens, si la
+salida del modelo ya es irrecuperable (texto en vez de JSON, corchetes
+cruzados) para cancelar la generación sin esperar a los max_tokens completos.
+
+JSONRepairer reconstruye un JSON válido a partir de una salida casi correcta
+(texto alrededor, comas de más o de menos, strings o contenedores sin cerrar)
+e informa qué reparó.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Caracteres válidos fuera de strings en un documento JSON
+_JSON_STRUCTURAL_CHARS = set(' \t\r\n{}[],:-+.0123456789eEtrufalsn"')
+
+_CLOSERS = {'}': '{', ']': '['}
+
+
+class IncrementalJSONValidator:
+    """
+    Sigue el estado léxico de un JSON que llega por fragmentos
+
+    El texto previo al primer '{' o '[' (por ejemplo un bloque ```json) se
+    tolera hasta max_prefix_chars, porque la limpieza posterior lo descarta.
+    Lo que venga después de cerrar el valor raíz también se ignora.
+    """
+
+    def __init__(self, max_prefix_chars: int = 1000):
+        self.max_prefix_chars = max_prefix_chars
+        self.prefix = ""
+        self.started = False
+        self.complete = False
+        self.error: Optional[str] = None
+        self.chars_seen = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def depth(self) -> int:
+        """Profundidad actual de contenedores abiertos"""
+        return len(self._stack)
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Procesa un fragmento de la respuesta
+
+        Args:
+            chunk: Texto recibido
+
+        Returns:
+            True mientras la salida siga siendo recuperable, False si ya no lo es
+            (el motivo queda en self.error)
+        """
+        if self.error is not None:
+            return False
+        if self.complete:
+            return True
+
+        for char in chunk:
+            self.chars_seen += 1
+
+            if not self.started:
+                if char in "{[":
+                    self.started = True
+                    self._stack.append(char)
+                    continue
+                self.prefix += char
+                if len(self.prefix) > self.max_prefix_chars:
+                    self.error = f"Más de {self.max_prefix_chars} caracteres sin iniciar un JSON"
+                    return False
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._stack.append(char)
+            elif char in _CLOSERS:
+                if not self._stack or self._stack[-1] != _CLOSERS[char]:
+                    self.error = f"Cierre '{char}' no corresponde en la posición {self.chars_seen}"
+                    return False
+                self._stack.pop()
+                if not self._stack:
+                    self.complete = True
+                    return True
+            elif char not in _JSON_STRUCTURAL_CHARS:
+                self.error = f"Carácter inesperado fuera de string: {char!r} en la posición {self.chars_seen}"
+                return False
+
+        return True
+
+
+# Secuencias para caracteres de control crudos dentro de strings
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+
+# Tramo de string sin comillas, escapes ni caracteres de control
+_STRING_RUN = re.compile(r'[^"\\\x00-\x1f]+')
+
+# Espacios entre tokens y tramos de literal, número o clave sin comillas
+_WHITESPACE_RUN = re.compile(r'[ \t\r\n]+')
+_TOKEN_RUN = re.compile(r'[A-Za-z0-9_+.-]+')
+
+# Literales aceptados fuera de strings (los de Python se traducen)
+_LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+
+# Caracteres de literales, números y claves sin comillas
+_TOKEN_CHARS = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_-+.0123456789")
+
+_NUMBER = re.compile(r'-?(0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?$')
+
+_OPENER_CLOSE = {'{': '}', '[': ']'}
+
+
+class JSONRepairer:
+    """
+    Reconstruye un JSON válido a partir de la salida del modelo, por fragmentos
+
+    Sigue el estado léxico (strings y escapes) y sintáctico (clave, valor o
+    separador esperado en cada contenedor), así que las llaves y corchetes
+    dentro de strings nunca se confunden con estructura. Repara lo que el
+    modelo suele romper: bloques ```json y texto antes o después del JSON,
+    comas colgantes o faltantes, saltos de línea crudos dentro de strings,
+    literales de Python, claves sin comillas, cierres cruzados y contenedores
+    sin cerrar por truncamiento. Cada carácter se procesa una vez (tiempo
+    lineal) y cada reparación queda contada en `repairs`.
+
+    Lo que no es un JSON roto sino otra cosa (prosa entre llaves, una clave
+    sin ':' seguida de texto) no se inventa: queda en `error` y finish()
+    devuelve "".
+    """
+
+    def __init__(self):
+        self.started = False
+        self.complete = False
+        self.error: Optional[str] = None
+        self.repairs: Dict[str, int] = {}
+        self._out: List[str] = []
+        # Contenedores abiertos: [apertura, estado]; estado es lo que se espera
+        # a continuación: "key", "colon", "value" o "comma"
+        self._stack: List[List[str]] = []
+        self._in_string = False
+        self._string_is_key = False
+        self._escape = ""
+        self._token = ""
+        self._last_comma: Optional[int] = None
+        self._prefix: List[str] = []
+
+    def feed(self, chunk: str):
+        """
+        Procesa un fragmento de la respuesta
+
+        Args:
+            chunk: Texto recibido (puede cortar strings o literales)
+        """
+        i, n = 0, len(chunk)
+        while i < n and not self.complete and self.error is None:
+            if self._in_string:
+                i = self._feed_string(chunk, i)
+                continue
+
+            char = chunk[i]
+            if not self.started:
+                if char not in "{[":
+                    if len(self._prefix) < 200:
+                        self._prefix.append(char)
+                    i += 1
+                    continue
+                self.started = True
+                self._note_prefix()
+
+            if self._token and char not in _TOKEN_CHARS:
+                self._flush_token()
+                if self.complete or self.error is not None:
+                    break
+
+            if char in _TOKEN_CHARS:
+                if not self._token:
+                    self._before_value()
+                run = _TOKEN_RUN.match(chunk, i)
+                self._token += run.group()
+                i = run.end()
+                continue
+            elif char == '"':
+                self._before_value()
+                self._string_is_key = self._in_object() and self._state() == "key"
+                self._out.append(char)
+                self._in_string = True
+            elif char in "{[":
+                self._before_value()
+                self._out.append(char)
+                self._stack.append([char, "key" if char == "{" else "value"])
+            elif char in _CLOSERS:
+                self._close(char)
+            elif char == ":" and self._state() == "colon":
+                self._out.append(char)
+                self._set_state("value")
+            elif char == "," and self._state() == "comma":
+                self._out.append(char)
+                self._last_comma = len(self._out) - 1
+                self._set_state("key" if self._in_object() else "value")
+            elif char == "," and self._state() in ("key", "value"):
+                self._repair("coma_sobrante")
+            elif char in " \t\r\n":
+                run = _WHITESPACE_RUN.match(chunk, i)
+                self._out.append(run.group())
+                i = run.end()
+                continue
+            else:
+                self.error = f"Carácter inesperado {char!r} fuera de string"
+            i += 1
+
+        if self.complete and i < n and chunk[i:].strip().strip("`").strip():
+            self.repairs.setdefault("texto_posterior", 1)
+
+    def finish(self) -> Tuple[str, Dict[str, int]]:
+        """
+        Cierra lo que quedó abierto (respuesta truncada)
+
+        Returns:
+            Tupla (json_reparado, reparaciones); json_reparado es "" si la
+            respuesta no contenía un objeto ni un arreglo o no era reparable
+        """
+        if not self.started or self.error is not None:
+            return "", dict(self.repairs)
+
+        if not self.complete:
+            if self._in_string:
+                if self._escape:
+                    self._escape = ""
+                    self._repair("escape_truncado")
+                self._out.append('"')
+                self._in_string = False
+                self._repair("string_truncado")
+                self._end_string()
+            if self._token:
+                self._flush_token(final=True)
+            while self._stack:
+                self._close_top()
+                self._repair("cierre_truncado")
+
+        return "".join(self._out), dict(self.repairs)
+
+    # --- Estado sintáctico ---
+
+    def _repair(self, kind: str):
+        self.repairs[kind] = self.repairs.get(kind, 0) + 1
+
+    def _in_object(self) -> bool:
+        return bool(self._stack) and self._stack[-1][0] == "{"
+
+    def _state(self) -> str:
+        return self._stack[-1][1] if self._stack else "value"
+
+    def _set_state(self, state: str):
+        if self._stack:
+            self._stack[-1][1] = state
+
+    def _value_done(self):
+        if self._stack:
+            self._stack[-1][1] = "comma"
+        else:
+            self.complete = True
+
+    def _before_value(self):
+        """Inserta la coma que falte antes de un valor o clave"""
+        state = self._state()
+        if state == "comma":
+            self._out.append(",")
+            self._repair("coma_faltante")
+            self._set_state("key" if self._in_object() else "value")
+        elif state == "colon":
+            self.error = "Falta ':' después de una clave"
+        self._last_comma = None
+
+    def _note_prefix(self):
+        prefix = "".join(self._prefix)
+        if "```" in prefix:
+            self._repair("bloque_de_codigo")
+            prefix = prefix.replace("```json", "").replace("```", "")
+        if prefix.strip():
+            self._repair("texto_previo")
+        self._prefix = []
+
+    def _end_string(self):
+        if self._string_is_key:
+            self._set_state("colon")
+        else:
+            self._value_done()
+
+    def _close_top(self):
+        """Cierra el contenedor actual completando un par clave-valor pendiente"""
+        opener, state = self._stack[-1]
+        if state == "colon":
+            self._out.append(":null")
+            self._repair("valor_faltante")
+        elif state == "value" and opener == "{":
+            self._out.append("null")
+            self._repair("valor_faltante")
+        elif self._last_comma is not None:
+            self._out[self._last_comma] = ""
+            self._repair("coma_colgante")
+        self._last_comma = None
+        self._stack.pop()
+        self._out.append(_OPENER_CLOSE[opener])
+        self._value_done()
+
+    def _close(self, char: str):
+        opener = _CLOSERS[char]
+        if not any(entry[0] == opener for entry in self._stack):
+            self._repair("cierre_sobrante")
+            return
+        while self._stack[-1][0] != opener:
+            self._close_top()
+            self._repair("cierre_faltante")
+        self._close_top()
+
+    # --- Strings y literales ---
+
+    def _feed_string(self, chunk: str, i: int) -> int:
+        """Consume parte de un string desde i y retorna la siguiente posición"""
+        if self._escape:
+            return self._feed_escape(chunk, i)
+        run = _STRING_RUN.match(chunk, i)
+        if run:
+            self._out.append(run.group())
+            return run.end()
+        char = chunk[i]
+        if char == '"':
+            self._out.append(char)
+            self._in_string = False
+            self._end_string()
+        elif char == "\\":
+            self._escape = char
+        else:
+            self._out.append(_CONTROL_ESCAPES.get(char, f"\\u{ord(char):04x}"))
+            self._repair("caracter_de_control")
+        return i + 1
+
+    def _feed_escape(self, chunk: str, i: int) -> int:
+        char = chunk[i]
+        if self._escape == "\\":
+            if char in '"\\/bfnrt':
+                self._out.append("\\" + char)
+                self._escape = ""
+            elif char == "u":
+                self._escape += char
+            else:
+                # Escape inválido (\' o \x): se conserva el carácter literal
+                self._out.append(char if char == "'" else "\\\\" + char)
+                self._escape = ""
+                self._repair("escape_invalido")
+            return i + 1
+        if char in "0123456789abcdefABCDEF":
+            self._escape += char
+            if len(self._escape) == 6:
+                self._out.append(self._escape)
+                self._escape = ""
+            return i + 1
+        # \u incompleto: se escapa la barra y se reprocesa el carácter
+        self._out.append("\\" + self._escape)
+        self._escape = ""
+        self._repair("escape_invalido")
+        return i
+
+    def _flush_token(self, final: bool = False):
+        """Emite el literal, número o clave sin comillas acumulado"""
+        token, self._token = self._token, ""
+        if self._in_object() and self._state() == "key":
+            self._out.append(json.dumps(token, ensure_ascii=False))
+            self._repair("clave_sin_comillas")
+            self._set_state("colon")
+            return
+
+        if token in _LITERALS:
+            if _LITERALS[token] != token:
+                self._repair("literal_de_python")
+            self._out.append(_LITERALS[token])
+        elif _NUMBER.match(token):
+            self._out.append(token)
+        else:
+            literal = next((value for value in ("true", "false", "null") if final and value.startswith(token)), None)
+            number = token.rstrip("-+.eE")
+            if literal:
+                self._out.append(literal)
+                self._repair("literal_truncado")
+            elif number and _NUMBER.match(number):
+                self._out.append(number)
+                self._repair("numero_truncado" if final else "numero_invalido")
+            else:
+                self.error = f"Valor sin comillas: {token[:50]!r}"
+                return
+        self._value_done()
+
+
+def repair_json(content: str) -> Tuple[str, Dict[str, int]]:
+    """
+    Repara la salida completa del modelo
+
+    Args:
+        content: Respuesta cruda (con o sin texto alrededor del JSON)
+
+    Returns:
+        Tupla (json_reparado, reparaciones) con el conteo por tipo de reparación
+    """
+    repairer = JSONRepairer()
+    repairer.feed(content)
+    return repairer.finish()
+
+
+def loads_tolerant(content: str) -> Tuple[Any, Dict[str, int]]:
+    """
+    json.loads con reparación como respaldo
+
+    Returns:
+        Tupla (valor, reparaciones); reparaciones vacío si no hizo falta reparar
+
+    Raises:
+        json.JSONDecodeError: Si ni reparada la respuesta es un JSON válido
+    """
+    try:
+        return json.loads(content), {}
+    except json.JSONDecodeError:
+        repaired, repairs = repair_json(content)
+        return json.loads(repaired), repairs
@@ -0,0 +1,215 @@
+"""
+Control de admisión global para las llamadas al LLM
+
+Todas las historias, los pools de ParallelCuentacuentos y los verificadores
+comparten un único servidor vLLM. Este controlador limita, para todo el
+proceso, cuántos requests hay en curso y cuántos tokens (prompt + max_tokens)
+hay comprometidos; el resto espera en cola FIFO o por prioridad.
+
+El tiempo en cola se mide aparte de la latencia del modelo para poder
+distinguir saturación local de lentitud del servidor.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from config import LLM_ADMISSION_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class _Waiter:
+    """Llamada en espera de admisión (su future vive en el loop del llamador)"""
+
+    __slots__ = ("future", "loop", "tokens", "admitted", "cancelled")
+
+    def __init__(self, future: asyncio.Future, loop: asyncio.AbstractEventLoop, tokens: int):
+        self.future = future
+        self.loop = loop
+        self.tokens = tokens
+        self.admitted = False
+        self.cancelled = False
+
+
+class AdmissionController:
+    """Limita requests en curso y tokens comprometidos para todo el proceso"""
+
+    def __init__(self,
+                 max_in_flight: Optional[int] = None,
+                 token_budget: Optional[int] = None,
+                 policy: Optional[str] = None):
+        """
+        Args:
+            max_in_flight: Máximo de requests simultáneos al servidor
+            token_budget: Máximo de tokens comprometidos (0 = sin límite)
+            policy: "fifo" (orden de llegada) o "priority" (mayor prioridad primero)
+        """
+        self.max_in_flight = max_in_flight if max_in_flight is not None else LLM_ADMISSION_CONFIG["max_in_flight"]
+        self.token_budget = token_budget if token_budget is not None else LLM_ADMISSION_CONFIG["token_budget"]
+        self.policy = policy or LLM_ADMISSION_CONFIG["policy"]
+        if self.policy not in ("fifo", "priority"):
+            raise ValueError(f"Política de admisión inválida: {self.policy}")
+
+        # Los llamadores pueden vivir en loops distintos: el estado se protege con un lock
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._outstanding_tokens = 0
+        self._waiters = []  # heap de (clave de orden, secuencia, _Waiter)
+        self._seq = itertools.count()
+
+        self.stats = {"admitted": 0, "queued": 0, "total_queue_wait": 0.0, "max_queue_wait": 0.0}
+
+    @property
+    def in_flight(self) -> int:
+        """Requests admitidos que aún no terminaron"""
+        return self._in_flight
+
+    @property
+    def outstanding_tokens(self) -> int:
+        """Tokens comprometidos por los requests en curso"""
+        return self._outstanding_tokens
+
+    @property
+    def queued(self) -> int:
+        """Llamadas esperando admisión"""
+        return sum(1 for _, _, waiter in self._waiters if not waiter.cancelled)
+
+    def set_limit(self, max_in_flight: int):
+        """Cambia el máximo de requests en curso y admite a quien ya quepa"""
+        with self._lock:
+            self.max_in_flight = max(1, int(max_in_flight))
+            self._wake_locked()
+
+    async def acquire(self, tokens: int, priority: int = 0) -> float:
+        """
+        Espera hasta que el request pueda enviarse
+
+        Un request que por sí solo supera el presupuesto de tokens se admite
+        cuando no hay otros en curso, para no bloquearlo para siempre.
+
+        Args:
+            tokens: Tokens que compromete el request (prompt + max_tokens)
+            priority: Con política "priority", mayor valor se atiende antes
+
+        Returns:
+            Segundos de espera en cola
+        """
+        start = time.monotonic()
+        with self._lock:
+            if not self._waiters and self._fits(tokens):
+                self._admit(tokens)
+                return 0.0
+            loop = asyncio.get_running_loop()
+            waiter = _Waiter(loop.create_future(), loop, tokens)
+            order = -priority if self.policy == "priority" else 0
+            heapq.heappush(self._waiters, (order, next(self._seq), waiter))
+            self.stats["queued"] += 1
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.admitted:
+                    self._release_locked(tokens)
+                else:
+                    # Si bloqueaba la cabeza de la cola, los siguientes pueden pasar
+                    waiter.cancelled = True
+                    self._wake_locked()
+            raise
+
+        queue_wait = time.monotonic() - start
+        self.stats["total_queue_wait"] += queue_wait
+        self.stats["max_queue_wait"] = max(self.stats["max_queue_wait"], queue_wait)
+        return queue_wait
+
+    def try_acquire(self, tokens: int) -> bool:
+        """
+        Admite el request solo si cabe ahora mismo y nadie espera (no bloquea)
+
+        Returns:
+            True si quedó admitido (hay que llamar a release al terminar)
+        """
+        with self._lock:
+            if self._waiters or not self._fits(tokens):
+                return False
+            self._admit(tokens)
+            return True
+
+    def release(self, tokens: int):
+        """Libera el cupo de un request terminado (con éxito o error)"""
+        with self._lock:
+            self._release_locked(tokens)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estado actual y acumulados del controlador"""
+        with self._lock:
+            return dict(
+                self.stats,
+                policy=self.policy,
+                max_in_flight=self.max_in_flight,
+                token_budget=self.token_budget,
+                in_flight=self._in_flight,
+                outstanding_tokens=self._outstanding_tokens,
+                queued=sum(1 for _, _, waiter in self._waiters if not waiter.cancelled)
+            )
+
+    # ---------- Internos (con self._lock tomado) ----------
+
+    def _fits(self, tokens: int) -> bool:
+        if self._in_flight >= self.max_in_flight:
+            return False
+        if self.token_budget > 0 and self._in_flight > 0 and self._outstanding_tokens + tokens > self.token_budget:
+            return False
+        return True
+
+    def _admit(self, tokens: int):
+        self._in_flight += 1
+        self._outstanding_tokens += tokens
+        self.stats["admitted"] += 1
+
+    def _release_locked(self, tokens: int):
+        self._in_flight -= 1
+        self._outstanding_tokens -= tokens
+        self._wake_locked()
+
+    def _wake_locked(self):
+        """Admite en orden a los que esperan mientras quepan (sin saltarse la cabeza)"""
+        while self._waiters:
+            waiter = self._waiters[0][2]
+            if waiter.cancelled:
+                heapq.heappop(self._waiters)
+                continue
+            if not self._fits(waiter.tokens):
+                break
+            heapq.heappop(self._waiters)
+            self._admit(waiter.tokens)
+            waiter.admitted = True
+            waiter.loop.call_soon_threadsafe(self._resolve, waiter)
+
+    @staticmethod
+    def _resolve(waiter: _Waiter):
+        if not waiter.future.done():
+            waiter.future.set_result(None)
+
+
+# Singleton compartido por todos los clientes del proceso
+_admission_instance = None
+_admission_lock = threading.Lock()
+
+def get_admission_controller() -> AdmissionController:
+    """
+    Obtiene la instancia singleton del controlador de admisión
+
+    Returns:
+        Instancia de AdmissionController
+    """
+    global _admission_instance
+    if _admission_instance is None:
+        with _admission_lock:
+            if _admission_instance is None:
+                _admission_instance = AdmissionController()
+    return _admission_instance
@@ -0,0 +1,237 @@
+"""
+Caché de respuestas del LLM direccionada por contenido
+
+La clave es un hash de todo lo que determina la respuesta (modelo, mensajes,
+temperatura, top_p, max_tokens y seed). Tiene dos niveles:
+- Memoria: LRU con un número máximo de entradas
+- Disco: un archivo JSON por respuesta, con expiración por TTL y un tamaño
+  máximo total (se eliminan primero las entradas más antiguas)
+
+Así, reanudar una historia, /retry, re-ejecutar /evaluate o los scripts de
+prueba que repiten los mismos prompts no vuelven a ocupar la GPU.
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from config import LLM_CACHE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Campos del payload que determinan la respuesta del modelo
+FINGERPRINT_FIELDS = ("model", "messages", "temperature", "top_p", "max_tokens", "seed")
+
+
+def request_fingerprint(payload: Dict[str, Any]) -> str:
+    """
+    Calcula la huella de un request de chat/completions
+
+    Args:
+        payload: Payload enviado al servidor
+
+    Returns:
+        Hash sha256 hexadecimal de los campos relevantes en forma canónica
+    """
+    relevant = {field: payload.get(field) for field in FINGERPRINT_FIELDS}
+    canonical = json.dumps(relevant, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """Caché LRU en memoria + disco para respuestas JSON del LLM"""
+
+    def __init__(self,
+                 cache_dir: Optional[Path] = None,
+                 memory_entries: Optional[int] = None,
+                 disk_max_bytes: Optional[int] = None,
+                 ttl_seconds: Optional[int] = None):
+        self.cache_dir = Path(cache_dir or LLM_CACHE_CONFIG["dir"])
+        self.memory_entries = memory_entries if memory_entries is not None else LLM_CACHE_CONFIG["memory_entries"]
+        self.disk_max_bytes = disk_max_bytes if disk_max_bytes is not None else LLM_CACHE_CONFIG["disk_max_mb"] * 1024 * 1024
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else LLM_CACHE_CONFIG["ttl_seconds"]
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()  # LRU en memoria (operaciones cortas)
+        self._disk_lock = threading.Lock()  # Nivel de disco (lecturas, escrituras y expulsión)
+        self._disk_bytes = None  # Se calcula al primer acceso al disco
+
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    # ---------- API pública ----------
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Busca una respuesta en memoria y luego en disco
+
+        Returns:
+            Copia de la respuesta guardada, o None si no existe o expiró
+        """
+        value = self.get_memory(key)
+        if value is None:
+            value = self.get_disk(key)
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """Guarda una respuesta en ambos niveles"""
+        self.put_memory(key, value)
+        self.put_disk(key, value)
+
+    def get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        """Busca solo en el LRU en memoria (no bloquea: apto para el event loop)"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            created_at, value = entry
+            if self._expired(created_at, now):
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return copy.deepcopy(value)
+
+    def get_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Busca solo en disco y, si la encuentra, la sube a memoria
+
+        Hace I/O de archivos: el cliente asíncrono la llama en un executor.
+        """
+        now = time.time()
+        with self._disk_lock:
+            value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            self._memory_put(key, value, now)
+        return copy.deepcopy(value)
+
+    def put_memory(self, key: str, value: Dict[str, Any]):
+        """Guarda una respuesta solo en memoria"""
+        with self._lock:
+            self._memory_put(key, copy.deepcopy(value), time.time())
+            self.stats["stores"] += 1
+
+    def put_disk(self, key: str, value: Dict[str, Any]):
+        """Guarda una respuesta solo en disco, con expulsión por tamaño (I/O: usar en un executor)"""
+        with self._disk_lock:
+            self._disk_put(key, value, time.time())
+
+    def clear(self):
+        """Vacía ambos niveles"""
+        with self._lock:
+            self._memory.clear()
+        with self._disk_lock:
+            if self.cache_dir.exists():
+                for path in self.cache_dir.glob("*/*.json"):
+                    path.unlink(missing_ok=True)
+            self._disk_bytes = 0
+
+    # ---------- Memoria ----------
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def _memory_put(self, key: str, value: Dict[str, Any], created_at: float):
+        if self.memory_entries <= 0:
+            return
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    # ---------- Disco ----------
+
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _disk_get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        path = self._path_for(key)
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Entrada de caché corrupta, se descarta: {path.name} ({e})")
+            self._disk_remove(path)
+            return None
+
+        if self._expired(entry.get("created_at", 0), now):
+            self._disk_remove(path)
+            return None
+        return entry.get("response")
+
+    def _disk_put(self, key: str, value: Dict[str, Any], created_at: float):
+        if self.disk_max_bytes <= 0:
+            return
+        path = self._path_for(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            data = json.dumps({"created_at": created_at, "response": value}, ensure_ascii=False).encode("utf-8")
+            previous = path.stat().st_size if path.exists() else 0
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._ensure_disk_size()
+            self._disk_bytes += len(data) - previous
+            self._evict_disk()
+        except OSError as e:
+            logger.warning(f"No se pudo escribir la caché en disco: {e}")
+
+    def _disk_remove(self, path: Path):
+        try:
+            size = path.stat().st_size
+            path.unlink()
+            if self._disk_bytes is not None:
+                self._disk_bytes -= size
+        except OSError:
+            pass
+
+    def _ensure_disk_size(self):
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(p.stat().st_size for p in self.cache_dir.glob("*/*.json"))
+
+    def _evict_disk(self):
+        """Elimina entradas expiradas y luego las más antiguas hasta respetar el tamaño máximo"""
+        if self._disk_bytes <= self.disk_max_bytes:
+            return
+        now = time.time()
+        entries = sorted(
+            ((p.stat().st_mtime, p) for p in self.cache_dir.glob("*/*.json")),
+            key=lambda item: item[0]
+        )
+        for mtime, path in entries:
+            if self._disk_bytes <= self.disk_max_bytes and not self._expired(mtime, now):
+                break
+            self._disk_remove(path)
+            self.stats["evictions"] += 1
+
+
+# Singleton compartido por todos los clientes del proceso
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+def get_llm_cache() -> LLMResponseCache:
+    """
+    Obtiene la instancia singleton de la caché de respuestas
+
+    Returns:
+        Instancia de LLMResponseCache
+    """
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                _cache_instance = LLMResponseCache()
+    return _cache_instance
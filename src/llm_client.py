@@ -1,319 +1,215 @@
 """
 Cliente para interactuar con el modelo gpt-oss-120b local
+
+Envoltorio síncrono sobre AsyncLLMClient: cada llamada se ejecuta en el event
+loop compartido, de modo que todos los hilos comparten un único pool de
+conexiones y ningún hilo extra queda bloqueado en I/O de red.
 """
-import json
-import time
 import logging
-import requests
-from typing import Dict, Any, Optional
-from config import LLM_CONFIG
+import threading
+from typing import Dict, Any, List, Optional
+
+from async_llm_client import AsyncLLMClient, run_sync
+from json_stream import repair_json
+from deadlines import Deadline
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
+# Campos de _metadata_tokens que se copian al span de cada llamada
+TRACE_TOKEN_FIELDS = ("prompt_tokens", "completion_tokens", "cached_tokens", "queue_wait",
+                      "llm_latency", "finish_reason", "max_tokens_escalated")
+
+
+def _trace_tokens(llm_span: Dict[str, Any], output: Any):
+    """Agrega al span los tokens y tiempos de una respuesta"""
+    tokens = output.get("_metadata_tokens", {}) if isinstance(output, dict) else {}
+    llm_span.update({field: tokens[field] for field in TRACE_TOKEN_FIELDS if field in tokens})
+
+
+def _delegated(name: str) -> property:
+    """Propiedad que lee y escribe el atributo homónimo del cliente asíncrono"""
+    return property(
+        lambda self: getattr(self.async_client, name),
+        lambda self, value: setattr(self.async_client, name, value)
+    )
+
 
 class LLMClient:
     """Cliente para el modelo LLM local gpt-oss-120b"""
-    
-    def __init__(self):
-        self.endpoint = LLM_CONFIG["api_url"]
-        self.model = LLM_CONFIG["model"]
-        self.temperature = LLM_CONFIG["temperature"]
-        self.max_tokens = LLM_CONFIG["max_tokens"]
-        self.timeout = 900  # Aumentar timeout a 900 segundos para respuestas largas
-        self.retry_attempts = LLM_CONFIG["retry_attempts"]
-        self.retry_delay = LLM_CONFIG["retry_delay"]
-        
-    def generate(self, 
-                 system_prompt: str, 
+
+    def __init__(self, async_client: Optional[AsyncLLMClient] = None):
+        """
+        Args:
+            async_client: Cliente asíncrono a envolver (por defecto uno nuevo)
+        """
+        self.async_client = async_client or AsyncLLMClient()
+
+    # Configuración delegada al cliente asíncrono (lectura y escritura)
+    endpoint = _delegated("endpoint")
+    model = _delegated("model")
+    temperature = _delegated("temperature")
+    max_tokens = _delegated("max_tokens")
+    timeout = _delegated("timeout")
+    retry_attempts = _delegated("retry_attempts")
+    retry_delay = _delegated("retry_delay")
+    stream = _delegated("stream")
+
+    def close(self):
+        """Cierra el pool de conexiones (se recrea en la siguiente llamada)"""
+        run_sync(self.async_client.close())
+
+    def generate(self,
+                 system_prompt: str,
                  user_prompt: str,
                  temperature: Optional[float] = None,
                  max_tokens: Optional[int] = None,
-                 top_p: Optional[float] = None) -> Dict[str, Any]:
+                 top_p: Optional[float] = None,
+                 stream: Optional[bool] = None,
+                 seed: Optional[int] = None,
+                 use_cache: Optional[bool] = None,
+                 agent_name: Optional[str] = None,
+                 priority: int = 0,
+                 deadline: Optional[Deadline] = None,
+                 max_tokens_ceiling: Optional[int] = None,
+                 json_schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Genera una respuesta del modelo LLM
-        
+
         Args:
             system_prompt: Prompt del sistema (rol del agente)
             user_prompt: Prompt del usuario (entrada específica)
             temperature: Temperatura opcional (sobrescribe la configuración)
             max_tokens: Tokens máximos opcionales (sobrescribe la configuración)
             top_p: Top-p (nucleus sampling) opcional (sobrescribe la configuración)
-            
+            stream: Si True usa streaming con aborto temprano (por defecto LLM_STREAM)
+            seed: Semilla de muestreo opcional
+            use_cache: False para no usar la caché ni coalescer con llamadas idénticas
+            agent_name: Agente que origina la llamada
+            priority: Prioridad en la cola de admisión (mayor = antes)
+            deadline: Plazo de la historia (define los timeouts de esta llamada)
+            max_tokens_ceiling: Tope para escalar max_tokens si la respuesta se trunca
+            json_schema: JSON Schema de la respuesta para decodificación guiada
+
         Returns:
             Dict con la respuesta del modelo
-            
+
         Raises:
             Exception: Si falla después de todos los reintentos
         """
-        # Construir el prompt completo
-        # Incluir instrucción JSON en el system prompt
-        json_instruction = "\n\nIMPORTANTE: Tu respuesta debe ser ÚNICAMENTE un JSON válido, sin texto adicional antes o después."
-        messages = [
-            {"role": "system", "content": system_prompt + json_instruction},
-            {"role": "user", "content": user_prompt}
-        ]
-        
-        # Preparar el payload para chat/completions
-        payload = {
-            "model": self.model,
-            "messages": messages,
-            "temperature": temperature or self.temperature,
-            "max_tokens": max_tokens or self.max_tokens
-        }
-        
-        # Agregar top_p si se proporciona
-        if top_p is not None:
-            payload["top_p"] = top_p
-        
-        # Intentar con reintentos
-        last_error = None
-        stop_immediately = False
-        stop_error = None
-        
-        for attempt in range(self.retry_attempts):
-            try:
-                logger.info(f"Intento {attempt + 1}/{self.retry_attempts} de llamada a LLM")
-                
-                # Hacer la petición
-                response = requests.post(
-                    self.endpoint,
-                    json=payload,
-                    timeout=self.timeout,
-                    headers={"Content-Type": "application/json"}
-                )
-                
-                # Verificar respuesta
-                response.raise_for_status()
-                
-                # Parsear respuesta
-                result = response.json()
-                
-                # Extraer tokens consumidos si están disponibles
-                tokens_info = {}
-                if "usage" in result:
-                    tokens_info = {
-                        "prompt_tokens": result["usage"].get("prompt_tokens", 0),
-                        "completion_tokens": result["usage"].get("completion_tokens", 0),
-                        "total_tokens": result["usage"].get("total_tokens", 0)
-                    }
-                    logger.debug(f"Tokens consumidos - Prompt: {tokens_info['prompt_tokens']}, Completion: {tokens_info['completion_tokens']}")
-                
-                # Extraer el contenido generado
-                if "choices" in result and len(result["choices"]) > 0:
-                    content = result["choices"][0].get("message", {}).get("content")
-                    
-                    # Detectar contenido vacío o respuestas de rechazo
-                    respuestas_rechazo = [
-                        "lo siento",
-                        "no puedo",
-                        "unable to",
-                        "cannot comply",
-                        "no es posible"
-                    ]
-                    
-                    es_contenido_vacio = content is None or content == ""
-                    es_rechazo = False
-                    
-                    if content and len(content) < 200:  # Solo verificar respuestas cortas
-                        contenido_lower = content.lower()
-                        es_rechazo = any(frase in contenido_lower for frase in respuestas_rechazo)
-                    
-                    if es_contenido_vacio or es_rechazo:
-                        if es_contenido_vacio:
-                            logger.error("🚨 ALERTA: El modelo devolvió contenido vacío")
-                        else:
-                            logger.error(f"🚨 ALERTA: El modelo rechazó la solicitud: {content[:100]}")
-                        
-                        # Si es el primer intento, detener inmediatamente sin reintentar
-                        if attempt == 0:
-                            logger.error("❌ DETENIENDO: Contenido vacío en primer intento - NO se reintentará")
-                            logger.error(f"   Contexto del fallo:")
-                            logger.error(f"   - Max tokens: {max_tokens}")
-                            logger.error(f"   - Temperature: {temperature}")
-                            logger.error(f"   - Timeout: {self.timeout}s")
-                            logger.error(f"   - Prompt length: {len(user_prompt)} chars")
-                            logger.error(f"   - System prompt length: {len(system_prompt)} chars")
-                            logger.error(f"   - Total: {len(system_prompt) + len(user_prompt)} chars (~{(len(system_prompt) + len(user_prompt))//4} tokens)")
-                            
-                            # Lanzar excepción especial para indicar que no debe reintentarse
-                            if es_rechazo:
-                                raise ValueError(f"STOP: El modelo rechazó la solicitud en el primer intento: {content[:100]}")
-                            else:
-                                raise ValueError("STOP: El modelo no generó contenido en el primer intento - contexto probablemente excedido")
-                        else:
-                            logger.warning(f"Contenido vacío/rechazado en intento {attempt + 1}")
-                            if es_rechazo:
-                                raise ValueError(f"El modelo rechazó la solicitud: {content[:100]}")
-                            else:
-                                raise ValueError("El modelo no generó contenido")
-                    
-                    # Detectar posibles respuestas truncadas
-                    if content.rstrip().endswith(('...', '"', '\\', ',', '{', '[')):
-                        logger.warning(f"Posible respuesta truncada detectada. Último carácter: '{content[-1]}'")
-                        logger.debug(f"Longitud de respuesta: {len(content)} caracteres")
-                    
-                    # Intentar parsear como JSON
-                    try:
-                        json_content = json.loads(content)
-                        logger.info("Respuesta JSON válida recibida del LLM")
-                        # Agregar información de tokens al resultado
-                        if tokens_info:
-                            json_content["_metadata_tokens"] = tokens_info
-                        return json_content
-                    except json.JSONDecodeError as e:
-                        logger.warning(f"La respuesta no es JSON válido: {e}")
-                        logger.debug(f"Contenido recibido: {content[:500]}")
-                        
-                        # Verificar si es una respuesta de rechazo antes de intentar limpiar
-                        respuestas_rechazo_json = [
-                            "i'm sorry", "i cannot", "unable to", "cannot comply",
-                            "lo siento", "no puedo", "no es posible", "can't fulfill"
-                        ]
-                        contenido_lower = content.lower() if content else ""
-                        es_rechazo_json = any(frase in contenido_lower for frase in respuestas_rechazo_json)
-                        
-                        if es_rechazo_json and attempt == 0:
-                            logger.error(f"🛑 STOP: Modelo rechazó generar JSON en primer intento: {content[:100]}")
-                            raise ValueError(f"STOP: El modelo rechazó generar JSON: {content[:100]}")
-                        
-                        # Intentar limpiar y parsear de nuevo
-                        cleaned_content = self._clean_json_response(content)
-                        try:
-                            json_content = json.loads(cleaned_content)
-                            logger.info("Respuesta JSON limpiada y parseada exitosamente")
-                            # Agregar información de tokens al resultado
-                            if tokens_info:
-                                json_content["_metadata_tokens"] = tokens_info
-                            return json_content
-                        except:
-                            raise ValueError(f"No se pudo parsear la respuesta como JSON: {content[:500]}")
-                else:
-                    raise ValueError(f"Respuesta inesperada del modelo: {result}")
-                    
-            except requests.exceptions.Timeout:
-                last_error = f"Timeout en intento {attempt + 1}"
-                logger.warning(last_error)
-                
-            except requests.exceptions.RequestException as e:
-                last_error = f"Error de red en intento {attempt + 1}: {e}"
-                logger.warning(last_error)
-                
-            except ValueError as ve:
-                # Si es el error especial de STOP, salir inmediatamente del bucle
-                if "STOP:" in str(ve):
-                    logger.error("🛑 Deteniendo proceso - No se realizarán reintentos")
-                    stop_immediately = True
-                    stop_error = ve
-                    break  # Salir del bucle for inmediatamente
-                else:
-                    last_error = f"Error en intento {attempt + 1}: {ve}"
-                    logger.error(last_error)
-                    
-            except Exception as e:
-                last_error = f"Error en intento {attempt + 1}: {e}"
-                logger.error(last_error)
-                
-            # Esperar antes de reintentar
-            if attempt < self.retry_attempts - 1:
-                time.sleep(self.retry_delay)
-        
-        # Verificar si debemos detener inmediatamente
-        if stop_immediately:
-            raise stop_error
-        
-        # Si llegamos aquí, todos los intentos fallaron normalmente
-        raise Exception(f"Fallo después de {self.retry_attempts} intentos. Último error: {last_error}")
-    
+        with span(f"llm {agent_name or 'generate'}", "llm", agent=agent_name, max_tokens=max_tokens) as llm_span:
+            result = run_sync(self.async_client.generate(
+                system_prompt,
+                user_prompt,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+                stream=stream,
+                seed=seed,
+                use_cache=use_cache,
+                agent_name=agent_name,
+                priority=priority,
+                deadline=deadline,
+                max_tokens_ceiling=max_tokens_ceiling,
+                json_schema=json_schema
+            ))
+            _trace_tokens(llm_span, result)
+        return result
+
+    def generate_batch(self, requests: List[Dict[str, Any]], n: int = 1) -> List[Dict[str, Any]]:
+        """
+        Genera las respuestas de varios prompts en una sola ronda
+
+        Args:
+            requests: Argumentos de generate() de cada item
+            n: Candidatos por prompt (cada item puede fijar el suyo con "n")
+
+        Returns:
+            Un dict por request, en el mismo orden, con status "success"
+            (output y candidates) o "error" (error); ver AsyncLLMClient.generate_batch
+        """
+        with span("llm batch", "llm", requests=len(requests), n=n) as llm_span:
+            results = run_sync(self.async_client.generate_batch(requests, n=n))
+            llm_span["errors"] = sum(1 for result in results if result["status"] == "error")
+            for field in ("prompt_tokens", "completion_tokens"):
+                llm_span[field] = sum(result.get("output", {}).get("_metadata_tokens", {}).get(field, 0)
+                                      for result in results if isinstance(result.get("output"), dict))
+        return results
+
     def _clean_json_response(self, content: str) -> str:
         """
         Intenta limpiar una respuesta para hacerla JSON válido
-        
+
         Args:
             content: Contenido a limpiar
-            
+
         Returns:
-            Contenido limpio
+            Contenido limpio (ver json_stream.JSONRepairer)
         """
-        # Remover posibles marcadores de código
-        content = content.replace("```json", "").replace("```", "")
-        
-        # Remover espacios en blanco al inicio y final
-        content = content.strip()
-        
-        # Si no empieza con { o [, buscar el primer carácter válido
-        start_idx = 0
-        for i, char in enumerate(content):
-            if char in "{[":
-                start_idx = i
-                break
-        
-        # Si no termina con } o ], buscar el último carácter válido
-        end_idx = len(content)
-        for i in range(len(content) - 1, -1, -1):
-            if content[i] in "}]":
-                end_idx = i + 1
-                break
-        
-        return content[start_idx:end_idx]
-    
+        return repair_json(content)[0]
+
     def validate_connection(self) -> bool:
         """
         Valida que el endpoint del LLM esté disponible
-        
+
         Returns:
             True si el endpoint responde, False en caso contrario
         """
         try:
-            # Primero intentar endpoint /v1/models
-            models_endpoint = self.endpoint.replace("/v1/chat/completions", "/v1/models")
-            response = requests.get(models_endpoint, timeout=5)
-            if response.status_code == 200:
-                return True
-        except:
-            pass
-        
-        try:
-            # Si no funciona, intentar con una petición mínima de chat
-            payload = {
-                "model": self.model,
-                "messages": [{"role": "user", "content": "test"}],
-                "max_tokens": 1
-            }
-            response = requests.post(
-                self.endpoint,
-                json=payload,
-                timeout=5,
-                headers={"Content-Type": "application/json"}
-            )
-            return response.status_code == 200
-        except:
+            return run_sync(self.async_client.validate_connection())
+        except Exception:
             return False
-    
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Métricas del proceso para la capa de cliente LLM
+
+        Returns:
+            Dict con estadísticas de caché, coalescencia y admisión
+        """
+        return self.async_client.get_metrics()
+
     def estimate_tokens(self, text: str) -> int:
         """
-        Estima el número de tokens en un texto
-        Aproximación simple: 1 token ≈ 4 caracteres
-        
+        Cuenta los tokens de un texto con el vocabulario de gpt-oss
+
         Args:
-            text: Texto a estimar
-            
+            text: Texto a contar
+
         Returns:
-            Número estimado de tokens
+            Número de tokens (estimado si no hay tokenizer disponible)
         """
-        return len(text) // 4
+        return self.async_client.estimate_tokens(text)
 
 
-# Singleton para reutilizar el cliente
+# Singleton para reutilizar el cliente (y su pool de conexiones)
 _client_instance = None
+_client_lock = threading.Lock()
 
 def get_llm_client() -> LLMClient:
     """
     Obtiene una instancia singleton del cliente LLM
-    
+
     Returns:
         Instancia de LLMClient
     """
     global _client_instance
     if _client_instance is None:
-        _client_instance = LLMClient()
-    return _client_instance
\ No newline at end of file
+        with _client_lock:
+            if _client_instance is None:
+                _client_instance = LLMClient()
+    return _client_instance
+
+
+def get_async_llm_client() -> AsyncLLMClient:
+    """
+    Obtiene el cliente asíncrono del singleton, ligado al loop compartido
+
+    Las corrutinas que lo usen deben ejecutarse en ese loop (por ejemplo con
+    run_sync o asyncio.run_coroutine_threadsafe). Para un event loop propio,
+    crear una instancia nueva de AsyncLLMClient.
+
+    Returns:
+        Instancia de AsyncLLMClient
+    """
+    return get_llm_client().async_client
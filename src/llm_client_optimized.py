@@ -3,11 +3,18 @@ Cliente optimizado para interactuar con el modelo gpt-oss-120b
 Incluye parámetros avanzados para control fino de generación
 """
 import json
+import os
+import sys
 import time
 import logging
 import requests
 from typing import Dict, Any, Optional, List
 from src.config import LLM_CONFIG
+from src.json_stream import repair_json
+
+# token_counter importa config desde src/ (mismo contador que el cliente async)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from token_counter import count_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -207,7 +214,8 @@ FORMATO CRÍTICO:
                         logger.warning(f"   - Longitud de respuesta: {len(content)} caracteres")
                         logger.warning(f"   - Brackets: {{ {content.count('{')} vs }} {content.count('}')}")
                         logger.warning(f"   - Square brackets: [ {content.count('[')} vs ] {content.count(']')}")
-                        logger.warning(f"   - Comillas: \" {content.count('\"')} (desbalanceadas: {content.count('\"') % 2 != 0})")
+                        quotes = content.count('"')
+                        logger.warning(f"   - Comillas: \" {quotes} (desbalanceadas: {quotes % 2 != 0})")
                         logger.warning(f"   - Termina con: '{content[-20:]}'" if len(content) > 20 else f"   - Contenido: '{content}'")
                         
                         if tokens_info:
@@ -292,56 +300,21 @@ FORMATO CRÍTICO:
         """
         Detecta si una respuesta parece estar truncada
         """
-        content = content.rstrip()
-        
-        # Solo considerar truncado si:
-        # 1. Los brackets/braces no están balanceados
-        brackets_unbalanced = content.count('{') != content.count('}')
-        square_unbalanced = content.count('[') != content.count(']')
-        
-        # 2. Termina con elipsis explícito
-        ends_with_ellipsis = content.endswith('...')
-        
-        # 3. Termina en medio de un string (comilla sin cerrar al final)
-        # Contar comillas que no están escapadas
-        quotes = content.count('"') - content.count('\\"')
-        quotes_unbalanced = quotes % 2 != 0
-        
-        return brackets_unbalanced or square_unbalanced or ends_with_ellipsis or quotes_unbalanced
+        # Strings o contenedores sin cerrar según el estado léxico (las llaves
+        # dentro de strings no cuentan), o elipsis explícita al final
+        _, repairs = repair_json(content)
+        return (content.rstrip().endswith('...')
+                or "string_truncado" in repairs
+                or "cierre_truncado" in repairs)
     
     def _clean_json_response(self, content: str) -> str:
         """
-        Intenta limpiar una respuesta para hacerla JSON válido
+        Intenta limpiar una respuesta para hacerla JSON válido (ver json_stream.JSONRepairer)
         """
-        # Remover posibles marcadores de código
-        content = content.replace("```json", "").replace("```", "")
-        
-        # Remover espacios en blanco al inicio y final
-        content = content.strip()
-        
-        # Si no empieza con { o [, buscar el primer carácter válido
-        start_idx = 0
-        for i, char in enumerate(content):
-            if char in "{[":
-                start_idx = i
-                break
-        
-        # Si no termina con } o ], buscar el último carácter válido
-        end_idx = len(content)
-        for i in range(len(content) - 1, -1, -1):
-            if content[i] in "}]":
-                end_idx = i + 1
-                break
-        
-        cleaned = content[start_idx:end_idx]
-        
-        # Intentar arreglar JSON truncado común
-        if cleaned.count('{') > cleaned.count('}'):
-            cleaned += '}' * (cleaned.count('{') - cleaned.count('}'))
-        if cleaned.count('[') > cleaned.count(']'):
-            cleaned += ']' * (cleaned.count('[') - cleaned.count(']'))
-            
-        return cleaned
+        repaired, repairs = repair_json(content)
+        if repairs:
+            logger.info(f"🔧 Respuesta JSON reparada: {', '.join(f'{k}={v}' for k, v in repairs.items())}")
+        return repaired
     
     def validate_connection(self) -> bool:
         """
@@ -375,10 +348,10 @@ FORMATO CRÍTICO:
     
     def estimate_tokens(self, text: str) -> int:
         """
-        Estima el número de tokens en un texto
-        Aproximación: 1 token ≈ 4 caracteres
+        Cuenta los tokens de un texto con el vocabulario de gpt-oss
+        (tokenizer del modelo o heurística calibrada, ver token_counter)
         """
-        return len(text) // 4
+        return count_tokens(text)
 
 
 # Singleton optimizado
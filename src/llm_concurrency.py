@@ -0,0 +1,190 @@
+"""
+Control adaptativo (AIMD) de la concurrencia hacia el LLM
+
+Ajusta el límite de requests en curso del control de admisión según cómo
+responde el servidor:
+- Crecimiento aditivo (+1) por cada ventana completa de respuestas sanas
+- Reducción multiplicativa (x0.5) ante timeouts, errores 5xx/429 o picos
+  de latencia
+
+La latencia se normaliza por token generado y se compara con la línea base
+de cada agente y largo de respuesta, porque un verificador de 30000 tokens
+y un director no tardan lo mismo aunque el servidor esté igual de cargado,
+y en una respuesta corta pesa más el prefill. Solo se reduce si el pico se
+mantiene varias respuestas seguidas: un outlier aislado no es congestión.
+"""
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from config import LLM_AIMD_CONFIG, LLM_ADMISSION_CONFIG
+from llm_admission import AdmissionController, get_admission_controller
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(values, fraction: float) -> float:
+    """Percentil simple (nearest-rank) de una secuencia no vacía"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class AdaptiveConcurrencyController:
+    """Ventana de concurrencia AIMD aplicada sobre un AdmissionController"""
+
+    def __init__(self,
+                 admission: AdmissionController,
+                 min_limit: Optional[int] = None,
+                 max_limit: Optional[int] = None,
+                 initial_limit: Optional[int] = None,
+                 decrease_factor: Optional[float] = None,
+                 latency_tolerance: Optional[float] = None,
+                 error_threshold: Optional[float] = None,
+                 window_size: Optional[int] = None,
+                 spike_persistence: Optional[int] = None):
+        """
+        Args:
+            admission: Control de admisión cuyo límite se ajusta
+            min_limit, max_limit: Rango de la ventana de concurrencia
+            initial_limit: Ventana inicial
+            decrease_factor: Factor multiplicativo ante congestión
+            latency_tolerance: Latencia (relativa a la línea base) que se considera pico
+            error_threshold: Tasa de errores máxima para seguir creciendo
+            window_size: Respuestas recientes consideradas para p95 y tasa de errores
+            spike_persistence: Respuestas seguidas sobre la tolerancia para reducir
+        """
+        self.admission = admission
+        self.min_limit = min_limit if min_limit is not None else LLM_AIMD_CONFIG["min_limit"]
+        self.max_limit = max_limit if max_limit is not None else LLM_ADMISSION_CONFIG["max_in_flight"]
+        self.decrease_factor = decrease_factor if decrease_factor is not None else LLM_AIMD_CONFIG["decrease_factor"]
+        self.latency_tolerance = latency_tolerance if latency_tolerance is not None else LLM_AIMD_CONFIG["latency_tolerance"]
+        self.error_threshold = error_threshold if error_threshold is not None else LLM_AIMD_CONFIG["error_threshold"]
+        self.spike_persistence = spike_persistence if spike_persistence is not None else LLM_AIMD_CONFIG["spike_persistence"]
+        window_size = window_size if window_size is not None else LLM_AIMD_CONFIG["window_size"]
+
+        initial = initial_limit if initial_limit is not None else LLM_AIMD_CONFIG["initial_limit"]
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+
+        self._lock = threading.Lock()
+        self._baselines: Dict[Tuple[str, int], float] = {}  # (agente, largo) -> segundos por token sin carga
+        self._spike_streak = 0  # Respuestas seguidas sobre la tolerancia
+        self._ratios = deque(maxlen=window_size)   # latencia relativa a la línea base
+        self._outcomes = deque(maxlen=window_size)  # True = respuesta sana, False = congestión
+        self._healthy_since_change = 0
+        self._last_decrease = 0.0
+        self._last_latency = 0.0
+
+        self.stats = {"increases": 0, "decreases": 0, "overloads": 0, "latency_spikes": 0}
+        self.admission.set_limit(int(self.limit))
+
+    def record_success(self, latency: float, completion_tokens: int = 0, agent_name: Optional[str] = None):
+        """
+        Registra una respuesta completa del servidor
+
+        Args:
+            latency: Segundos del request (sin la espera en cola)
+            completion_tokens: Tokens generados (0 si no se conocen)
+            agent_name: Agente de la llamada (cada uno tiene su línea base)
+        """
+        per_token = latency / completion_tokens if completion_tokens > 0 else latency
+        # Línea base por agente y por largo de respuesta (potencias de 2 de tokens generados)
+        key = (agent_name or "default", max(0, completion_tokens).bit_length())
+
+        with self._lock:
+            self._last_latency = latency
+            baseline = self._baselines.get(key)
+            if baseline is None or per_token < baseline:
+                baseline = per_token
+            else:
+                # La línea base sube lentamente para adaptarse a cambios del servidor
+                baseline += 0.01 * (per_token - baseline)
+            self._baselines[key] = baseline
+
+            ratio = per_token / baseline if baseline > 0 else 1.0
+            self._ratios.append(ratio)
+            self._outcomes.append(True)
+
+            self._spike_streak = self._spike_streak + 1 if ratio > self.latency_tolerance else 0
+            if self._spike_streak >= self.spike_persistence:
+                self.stats["latency_spikes"] += 1
+                self._decrease_locked(f"pico de latencia sostenido ({self._spike_streak} respuestas, "
+                                      f"última {ratio:.1f}x la línea base)")
+                return
+            if self._spike_streak:
+                return
+
+            error_rate = self._outcomes.count(False) / len(self._outcomes)
+            if error_rate > self.error_threshold:
+                return
+
+            # Crecimiento aditivo: +1 por cada ventana completa de respuestas sanas
+            self._healthy_since_change += 1
+            if self._healthy_since_change >= int(self.limit) and self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1)
+                self._healthy_since_change = 0
+                self.stats["increases"] += 1
+                self.admission.set_limit(int(self.limit))
+                logger.debug(f"📈 Concurrencia LLM aumentada a {int(self.limit)}")
+
+    def record_overload(self, reason: str):
+        """
+        Registra una señal de congestión (timeout, 5xx, 429, conexión rechazada)
+
+        Args:
+            reason: Descripción para el log
+        """
+        with self._lock:
+            self._outcomes.append(False)
+            self.stats["overloads"] += 1
+            self._decrease_locked(reason)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Ventana actual y contadores de ajustes"""
+        with self._lock:
+            return dict(
+                self.stats,
+                limit=int(self.limit),
+                min_limit=self.min_limit,
+                max_limit=self.max_limit,
+                p95_latency_ratio=round(_percentile(self._ratios, 0.95), 2) if self._ratios else None,
+                error_rate=round(self._outcomes.count(False) / len(self._outcomes), 3) if self._outcomes else 0.0
+            )
+
+    def _decrease_locked(self, reason: str):
+        """Reducción multiplicativa, como máximo una vez por latencia observada"""
+        now = time.monotonic()
+        self._healthy_since_change = 0
+        if now - self._last_decrease < self._last_latency:
+            return
+        previous = int(self.limit)
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self._last_decrease = now
+        # Las muestras previas a la reducción ya no describen la nueva carga
+        self._ratios.clear()
+        self._spike_streak = 0
+        self.stats["decreases"] += 1
+        self.admission.set_limit(int(self.limit))
+        logger.warning(f"📉 Concurrencia LLM reducida de {previous} a {int(self.limit)}: {reason}")
+
+
+# Singleton compartido por todos los clientes del proceso
+_adaptive_instance = None
+_adaptive_lock = threading.Lock()
+
+def get_adaptive_controller() -> AdaptiveConcurrencyController:
+    """
+    Obtiene la instancia singleton del control adaptativo (sobre el control de admisión global)
+
+    Returns:
+        Instancia de AdaptiveConcurrencyController
+    """
+    global _adaptive_instance
+    if _adaptive_instance is None:
+        with _adaptive_lock:
+            if _adaptive_instance is None:
+                _adaptive_instance = AdaptiveConcurrencyController(get_admission_controller())
+    return _adaptive_instance
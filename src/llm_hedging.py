@@ -0,0 +1,135 @@
+"""
+Requests de cobertura (hedging) para agentes cortos
+
+Si una llamada de un agente habilitado supera el percentil de latencia que ese
+agente suele tener, se envía un duplicado a otra réplica y se usa el primer
+JSON válido; el perdedor se cancela. Los percentiles se aprenden de los logs
+históricos (runs/*/logs/<agente>.log) y de las llamadas del proceso.
+
+Un presupuesto limita los duplicados a una fracción de todas las llamadas
+(10% por defecto), para no agravar la carga justo cuando el servidor está lento.
+"""
+import logging
+import math
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from config import LLM_HEDGE_CONFIG
+from log_history import load_agent_log_entries
+
+logger = logging.getLogger(__name__)
+
+
+class HedgingPolicy:
+    """Decide cuándo duplicar una llamada y lleva el presupuesto de duplicados"""
+
+    def __init__(self,
+                 agents: Optional[List[str]] = None,
+                 percentile: Optional[float] = None,
+                 budget: Optional[float] = None,
+                 min_samples: Optional[int] = None):
+        """
+        Args:
+            agents: Agentes habilitados (el resto nunca se duplica)
+            percentile: Percentil de latencia que dispara el duplicado
+            budget: Fracción máxima de duplicados sobre el total de llamadas
+            min_samples: Latencias mínimas conocidas para estimar el percentil
+        """
+        self.agents = set(agents if agents is not None else LLM_HEDGE_CONFIG["agents"])
+        self.percentile = percentile if percentile is not None else LLM_HEDGE_CONFIG["percentile"]
+        self.budget = budget if budget is not None else LLM_HEDGE_CONFIG["budget"]
+        self.min_samples = min_samples if min_samples is not None else LLM_HEDGE_CONFIG["min_samples"]
+
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, deque] = {}
+        self.stats = {"requests": 0, "hedges": 0, "hedge_wins": 0, "budget_denied": 0, "admission_denied": 0}
+
+    def enabled_for(self, agent_name: Optional[str]) -> bool:
+        """True si las llamadas de este agente pueden duplicarse"""
+        return agent_name is not None and agent_name in self.agents
+
+    def hedge_delay(self, agent_name: str) -> Optional[float]:
+        """
+        Segundos tras los que conviene enviar el duplicado
+
+        Returns:
+            Percentil de latencia del agente, o None si aún no hay suficientes datos
+        """
+        with self._lock:
+            samples = self._samples_locked(agent_name)
+            if len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(self.percentile * len(ordered)) - 1))
+        return ordered[index]
+
+    def record_request(self):
+        """Cuenta una llamada al servidor (base del presupuesto)"""
+        with self._lock:
+            self.stats["requests"] += 1
+
+    def record_latency(self, agent_name: Optional[str], latency: float):
+        """Agrega la latencia de una llamada completada del agente"""
+        if not self.enabled_for(agent_name):
+            return
+        with self._lock:
+            self._samples_locked(agent_name).append(latency)
+
+    def try_acquire(self) -> bool:
+        """Reserva un duplicado si el presupuesto lo permite"""
+        with self._lock:
+            if self.stats["hedges"] + 1 > self.budget * self.stats["requests"]:
+                self.stats["budget_denied"] += 1
+                return False
+            self.stats["hedges"] += 1
+            return True
+
+    def record_admission_denied(self):
+        """El control de admisión no tenía cupo: el duplicado reservado no se envió"""
+        with self._lock:
+            self.stats["hedges"] -= 1
+            self.stats["admission_denied"] += 1
+
+    def record_win(self):
+        """El duplicado respondió antes que la llamada original"""
+        with self._lock:
+            self.stats["hedge_wins"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Contadores de duplicados y presupuesto"""
+        with self._lock:
+            return dict(self.stats, agents=sorted(self.agents), budget=self.budget)
+
+    def _samples_locked(self, agent_name: str) -> deque:
+        """Latencias del agente, sembradas desde los logs la primera vez"""
+        samples = self._latencies.get(agent_name)
+        if samples is None:
+            samples = deque(maxlen=LLM_HEDGE_CONFIG["window"])
+            for entry in reversed(load_agent_log_entries(agent_name)):
+                if entry.get("status") != "success":
+                    continue
+                latency = (entry.get("tokens_consumed") or {}).get("llm_latency") or entry.get("execution_time")
+                if latency:
+                    samples.append(float(latency))
+            self._latencies[agent_name] = samples
+        return samples
+
+
+# Singleton compartido por todos los clientes del proceso
+_hedging_instance = None
+_hedging_lock = threading.Lock()
+
+def get_hedging_policy() -> HedgingPolicy:
+    """
+    Obtiene la instancia singleton de la política de hedging
+
+    Returns:
+        Instancia de HedgingPolicy
+    """
+    global _hedging_instance
+    if _hedging_instance is None:
+        with _hedging_lock:
+            if _hedging_instance is None:
+                _hedging_instance = HedgingPolicy()
+    return _hedging_instance
@@ -0,0 +1,209 @@
+"""
+Enrutamiento de llamadas entre varias réplicas vLLM
+
+LLM_API_URL acepta una lista de endpoints separados por coma. Cada request va a
+la réplica sana con menos tokens comprometidos (prompt + max_tokens de los
+requests en curso). Las réplicas que fallan con timeouts, 5xx o errores de
+conexión se expulsan pasivamente y un sondeo en segundo plano las readmite
+cuando /v1/models vuelve a responder.
+"""
+import asyncio
+import itertools
+import logging
+import math
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from config import LLM_CONFIG, LLM_ROUTER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class Endpoint:
+    """Estado y estadísticas de una réplica"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = True
+        self.outstanding_requests = 0
+        self.outstanding_tokens = 0
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+        self.latencies = deque(maxlen=LLM_ROUTER_CONFIG["latency_window"])
+
+    @property
+    def models_url(self) -> str:
+        """URL usada por el sondeo de salud"""
+        return self.url.replace("/v1/chat/completions", "/v1/models")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadísticas de latencia y errores de la réplica"""
+        ordered = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))], 3)
+
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejections": self.ejections,
+            "outstanding_requests": self.outstanding_requests,
+            "outstanding_tokens": self.outstanding_tokens,
+            "latency_mean": round(sum(ordered) / len(ordered), 3) if ordered else None,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95)
+        }
+
+
+class EndpointRouter:
+    """Balanceo por menos tokens comprometidos con expulsión pasiva"""
+
+    def __init__(self, urls: List[str],
+                 eject_after_failures: Optional[int] = None,
+                 probe_interval: Optional[float] = None):
+        """
+        Args:
+            urls: Endpoints de chat/completions de cada réplica
+            eject_after_failures: Fallos consecutivos antes de expulsar una réplica
+            probe_interval: Segundos entre sondeos de las réplicas expulsadas
+        """
+        if not urls:
+            raise ValueError("Se requiere al menos un endpoint LLM")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.eject_after_failures = eject_after_failures or LLM_ROUTER_CONFIG["eject_after_failures"]
+        self.probe_interval = probe_interval if probe_interval is not None else LLM_ROUTER_CONFIG["probe_interval"]
+        # Las llamadas pueden venir de loops distintos: el estado se protege con un lock
+        self._lock = threading.Lock()
+        self._round_robin = itertools.count()
+        self._probe_task: Optional[asyncio.Task] = None
+
+    @property
+    def primary_url(self) -> str:
+        """Primer endpoint configurado (compatibilidad con LLM_CONFIG["api_url"])"""
+        return self.endpoints[0].url
+
+    def pick(self, tokens: int = 0, exclude: Optional[Endpoint] = None) -> Endpoint:
+        """
+        Elige la réplica para un request y la marca como ocupada
+
+        Si todas las réplicas están expulsadas se usa igualmente la menos
+        cargada: es preferible intentar a fallar sin enviar nada.
+
+        Args:
+            tokens: Tokens que compromete el request (prompt + max_tokens)
+            exclude: Réplica a evitar si hay otra disponible (p. ej. para un hedge)
+
+        Returns:
+            Endpoint elegido; llamar a finish() al terminar
+        """
+        self._ensure_probe()
+        with self._lock:
+            candidates = [ep for ep in self.endpoints if ep.healthy and ep is not exclude]
+            if not candidates:
+                candidates = [ep for ep in self.endpoints if ep is not exclude] or self.endpoints
+            # Desempate rotativo para repartir cuando todas están libres
+            offset = next(self._round_robin)
+            count = len(self.endpoints)
+            endpoint = min(
+                candidates,
+                key=lambda ep: (ep.outstanding_tokens, ep.outstanding_requests,
+                                (self.endpoints.index(ep) - offset) % count)
+            )
+            endpoint.outstanding_requests += 1
+            endpoint.outstanding_tokens += tokens
+            endpoint.requests += 1
+            return endpoint
+
+    def finish(self, endpoint: Endpoint, tokens: int, latency: Optional[float] = None, failed: bool = False):
+        """
+        Registra el fin de un request
+
+        Args:
+            endpoint: Réplica usada
+            tokens: Tokens comprometidos al elegirla
+            latency: Segundos de respuesta (None si no hubo respuesta completa)
+            failed: True si falló por causas de la réplica (timeout, 5xx, conexión)
+        """
+        with self._lock:
+            endpoint.outstanding_requests -= 1
+            endpoint.outstanding_tokens -= tokens
+            if latency is not None:
+                endpoint.latencies.append(latency)
+            if not failed:
+                endpoint.consecutive_failures = 0
+                return
+            endpoint.errors += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.healthy and endpoint.consecutive_failures >= self.eject_after_failures:
+                endpoint.healthy = False
+                endpoint.ejections += 1
+                logger.warning(f"🚫 Réplica LLM expulsada tras {endpoint.consecutive_failures} fallos: {endpoint.url}")
+        self._ensure_probe()
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Estadísticas por réplica (para configuracion_modelo del manifest)"""
+        with self._lock:
+            return [ep.get_stats() for ep in self.endpoints]
+
+    # ---------- Sondeo de réplicas expulsadas ----------
+
+    def _ensure_probe(self):
+        """Inicia el sondeo en el loop actual si hay réplicas expulsadas y no corre ninguno"""
+        if all(ep.healthy for ep in self.endpoints):
+            return
+        if self._probe_task is not None and not self._probe_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._probe_task = loop.create_task(self._probe_loop())
+
+    async def _probe_loop(self):
+        async with aiohttp.ClientSession() as session:
+            while True:
+                ejected = [ep for ep in self.endpoints if not ep.healthy]
+                if not ejected:
+                    return
+                await asyncio.sleep(self.probe_interval)
+                for endpoint in ejected:
+                    if await self._probe(session, endpoint):
+                        with self._lock:
+                            endpoint.healthy = True
+                            endpoint.consecutive_failures = 0
+                        logger.info(f"✅ Réplica LLM readmitida: {endpoint.url}")
+
+    async def _probe(self, session: aiohttp.ClientSession, endpoint: Endpoint) -> bool:
+        try:
+            async with session.get(endpoint.models_url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                return response.status == 200
+        except Exception:
+            return False
+
+
+# Singleton compartido por todos los clientes del proceso
+_router_instance = None
+_router_lock = threading.Lock()
+
+def get_llm_router() -> EndpointRouter:
+    """
+    Obtiene la instancia singleton del router (endpoints de LLM_API_URL)
+
+    Returns:
+        Instancia de EndpointRouter
+    """
+    global _router_instance
+    if _router_instance is None:
+        with _router_lock:
+            if _router_instance is None:
+                _router_instance = EndpointRouter(LLM_CONFIG["api_urls"])
+    return _router_instance
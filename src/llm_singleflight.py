@@ -0,0 +1,89 @@
+"""
+Single-flight: coalescencia de llamadas idénticas en curso
+
+Si llegan varias llamadas con la misma huella mientras la primera sigue
+esperando al modelo (reintentos del Edge Function, dos operadores evaluando la
+misma historia), solo la primera va al servidor; las demás esperan ese mismo
+resultado o reciben la misma excepción.
+"""
+import asyncio
+import copy
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Agrupa corrutinas con la misma clave en una única ejecución"""
+
+    def __init__(self):
+        # (id del loop, clave) -> tarea en curso; una tarea solo puede
+        # esperarse desde el loop donde se creó
+        self._calls: Dict[Tuple[int, str], asyncio.Task] = {}
+        self.stats = {"calls": 0, "upstream": 0, "coalesced": 0}
+
+    @property
+    def in_flight(self) -> int:
+        """Número de llamadas distintas en curso"""
+        return len(self._calls)
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Ejecuta factory() o se une a la ejecución en curso con la misma clave
+
+        La ejecución compartida corre en su propia tarea: cancelar a uno de los
+        que esperan no cancela la llamada de los demás.
+
+        Args:
+            key: Huella de la llamada
+            factory: Función que crea la corrutina a ejecutar
+
+        Returns:
+            Tupla (resultado, coalesced): cada llamador recibe su propia copia
+            del resultado; coalesced es True si no originó la llamada
+        """
+        loop = asyncio.get_running_loop()
+        slot = (id(loop), key)
+        self.stats["calls"] += 1
+
+        task = self._calls.get(slot)
+        coalesced = task is not None
+        if coalesced:
+            self.stats["coalesced"] += 1
+            logger.info(f"🔗 Llamada idéntica en curso, esperando su resultado ({key[:12]})")
+        else:
+            self.stats["upstream"] += 1
+            task = loop.create_task(factory())
+            self._calls[slot] = task
+            task.add_done_callback(lambda t: self._finish(slot, t))
+
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result), coalesced
+
+    def _finish(self, slot: Tuple[int, str], task: asyncio.Task):
+        if self._calls.get(slot) is task:
+            del self._calls[slot]
+        # Marcar la excepción como recuperada aunque todos los llamadores se hayan ido
+        if not task.cancelled():
+            task.exception()
+
+
+# Singleton compartido por todos los clientes del proceso
+_single_flight_instance = None
+_single_flight_lock = threading.Lock()
+
+def get_single_flight() -> SingleFlight:
+    """
+    Obtiene la instancia singleton de SingleFlight
+
+    Returns:
+        Instancia de SingleFlight
+    """
+    global _single_flight_instance
+    if _single_flight_instance is None:
+        with _single_flight_lock:
+            if _single_flight_instance is None:
+                _single_flight_instance = SingleFlight()
+    return _single_flight_instance
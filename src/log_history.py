@@ -0,0 +1,126 @@
+"""
+Lectura de los logs históricos de agentes (runs/*/logs/<agente>.log)
+
+Cada log de agente es una lista JSON de ejecuciones con execution_time,
+max_tokens y tokens_consumed; los logs por página de cuentacuentos
+(03_cuentacuentos_pagina_XX_intento_N.log) tienen una sola ejecución. Otros módulos aprenden de ellos (latencias típicas, tokens
+realmente generados) sin tener que recorrer el disco en cada llamada: el
+contenido de cada archivo se memoiza mientras no cambie su mtime.
+"""
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import RUNS_DIR
+
+logger = logging.getLogger(__name__)
+
+# Ruta -> (mtime, entradas)
+_file_cache: Dict[Path, tuple] = {}
+_cache_lock = threading.Lock()
+
+
+def read_log_entries(path: Path) -> List[Dict[str, Any]]:
+    """Entradas de un archivo de log (memoizadas mientras no cambie su mtime)"""
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return []
+    with _cache_lock:
+        cached = _file_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            entries = [entries]
+        elif not isinstance(entries, list):
+            entries = []
+    except (OSError, json.JSONDecodeError) as e:
+        logger.debug(f"Log ilegible, se ignora: {path} ({e})")
+        entries = []
+    with _cache_lock:
+        _file_cache[path] = (mtime, entries)
+    return entries
+
+
+def load_agent_log_entries(agent_name: str,
+                           max_files: int = 200,
+                           runs_dir: Optional[Path] = None) -> List[Dict[str, Any]]:
+    """
+    Obtiene las entradas de log de un agente en las historias más recientes
+
+    Args:
+        agent_name: Nombre del agente (nombre del archivo .log)
+        max_files: Máximo de historias a considerar (las más recientes)
+        runs_dir: Directorio de historias (por defecto RUNS_DIR)
+
+    Returns:
+        Entradas de log, de la historia más reciente a la más antigua
+    """
+    return load_log_entries(f"{agent_name}.log", max_files, runs_dir)
+
+
+def load_log_entries(pattern: str,
+                     max_files: int = 200,
+                     runs_dir: Optional[Path] = None) -> List[Dict[str, Any]]:
+    """
+    Obtiene las entradas de los logs que coinciden con un patrón glob
+
+    Args:
+        pattern: Nombre de archivo dentro de logs/ (admite *, p. ej. "03_cuentacuentos_pagina_*.log")
+        max_files: Máximo de archivos a considerar (los más recientes)
+        runs_dir: Directorio de historias (por defecto RUNS_DIR)
+
+    Returns:
+        Entradas de log, del archivo más reciente al más antiguo
+    """
+    entries = []
+    for path in find_log_files(pattern, max_files, runs_dir):
+        entries.extend(read_log_entries(path))
+    return entries
+
+
+def find_log_files(pattern: str,
+                   max_files: int = 200,
+                   runs_dir: Optional[Path] = None) -> List[Path]:
+    """
+    Archivos de log de todas las historias que coinciden con un patrón glob
+
+    Recorre runs/*/logs/: quien lo llame seguido debe guardar el resultado.
+
+    Returns:
+        Rutas, de la más reciente a la más antigua (como máximo max_files)
+    """
+    base = Path(runs_dir or RUNS_DIR)
+    paths = []
+    for path in base.glob(f"*/logs/{pattern}"):
+        try:
+            paths.append((path.stat().st_mtime, path))
+        except OSError:
+            continue
+    paths.sort(reverse=True)
+    return [path for _, path in paths[:max_files]]
+
+
+def load_run_log_entries(story_path: Path, pattern: str) -> List[Dict[str, Any]]:
+    """
+    Entradas de los logs de una sola historia que coinciden con un patrón glob
+
+    Returns:
+        Entradas de log, del archivo más reciente al más antiguo
+    """
+    paths = []
+    for path in (Path(story_path) / "logs").glob(pattern):
+        try:
+            paths.append((path.stat().st_mtime, path))
+        except OSError:
+            continue
+    paths.sort(reverse=True)
+    entries = []
+    for _, path in paths:
+        entries.extend(read_log_entries(path))
+    return entries
@@ -0,0 +1,236 @@
+"""
+Manifest de cada historia en memoria, con un único escritor
+
+Antes el orquestador reescribía manifest.json completo en cada paso, y
+AgentRunner (alertas tempranas) y la API (resultado del webhook) lo leían
+y reescribían por su cuenta: con agentes en paralelo una escritura podía
+pisar la de otro. ManifestStore es el único objeto que escribe el manifest
+de una historia dentro del proceso:
+
+- los cambios entran por métodos (set, set_in, append_to, mutate...) bajo
+  un lock, y las lecturas devuelven copias
+- las escrituras se agrupan: un cambio programa un guardado a los
+  MANIFEST_DEBOUNCE segundos y los cambios de ese intervalo salen juntos;
+  flush() escribe de inmediato (inicio y fin de la historia)
+- cada escritura es atómica (temporal + rename)
+
+get_manifest_store da la misma instancia a todos los que trabajan sobre la
+misma carpeta y read_manifest la usa para las consultas de la API; el estado que debe sobrevivir a una caída está en el journal.
+"""
+import atexit
+import copy
+import json
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+from atomic_io import atomic_write_bytes
+from config import MANIFEST_CONFIG
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+
+
+class ManifestStore:
+    """Manifest de una historia con escrituras agrupadas y atómicas"""
+
+    def __init__(self, story_path: Path, debounce: Optional[float] = None):
+        """
+        Args:
+            story_path: Carpeta de la historia en runs/
+            debounce: Segundos para agrupar cambios antes de escribir
+                (0 = escribir en cada cambio; por defecto MANIFEST_DEBOUNCE)
+        """
+        self.path = Path(story_path) / MANIFEST_FILE
+        self.debounce = MANIFEST_CONFIG["debounce_seconds"] if debounce is None else debounce
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._dirty = False
+        self.writes = 0
+        self._data: Dict[str, Any] = self._load()
+
+    def _load(self) -> Dict[str, Any]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except json.JSONDecodeError as e:
+            # Manifest truncado por una caída anterior a las escrituras atómicas: se reconstruye
+            logger.warning(f"⚠️ Manifest corrupto en {self.path} ({e}), se inicia uno nuevo")
+            return {}
+
+    # ---- lectura ----
+
+    def exists(self) -> bool:
+        """True si el manifest tiene contenido (cargado de disco o inicializado)"""
+        with self._lock:
+            return bool(self._data)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Copia del valor de key"""
+        with self._lock:
+            return copy.deepcopy(self._data.get(key, default))
+
+    def __getitem__(self, key: str) -> Any:
+        with self._lock:
+            return copy.deepcopy(self._data[key])
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Copia completa del manifest"""
+        with self._lock:
+            return copy.deepcopy(self._data)
+
+    # ---- cambios ----
+
+    def initialize(self, data: Dict[str, Any]):
+        """Contenido inicial si el manifest aún no existe (no se escribe hasta el primer cambio)"""
+        with self._lock:
+            if not self._data:
+                self._data = copy.deepcopy(data)
+
+    def set(self, key: str, value: Any):
+        """manifest[key] = value"""
+        with self.mutate() as data:
+            data[key] = copy.deepcopy(value)
+
+    def __setitem__(self, key: str, value: Any):
+        self.set(key, value)
+
+    def update(self, values: Dict[str, Any]):
+        """Varios campos de primer nivel de una vez"""
+        with self.mutate() as data:
+            data.update(copy.deepcopy(values))
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        """Quita key y retorna su valor"""
+        with self.mutate() as data:
+            return data.pop(key, default)
+
+    def set_in(self, section: str, key: str, value: Any):
+        """manifest[section][key] = value (crea la sección si falta)"""
+        with self.mutate() as data:
+            data.setdefault(section, {})[key] = copy.deepcopy(value)
+
+    def pop_in(self, section: str, key: str) -> Any:
+        """Quita manifest[section][key] si existe"""
+        with self.mutate() as data:
+            return data.get(section, {}).pop(key, None)
+
+    def append_to(self, key: str, item: Any):
+        """manifest[key].append(item) (crea la lista si falta)"""
+        with self.mutate() as data:
+            data.setdefault(key, []).append(copy.deepcopy(item))
+
+    @contextmanager
+    def mutate(self) -> Iterator[Dict[str, Any]]:
+        """
+        Cambios compuestos sobre el manifest (bajo el lock, sin anidar)
+
+        Ejemplo:
+            with store.mutate() as manifest:
+                manifest["estado"] = "error"
+                manifest.setdefault("error", {...})
+        """
+        with self._lock:
+            yield self._data
+            self._dirty = True
+            immediate = self.debounce <= 0
+            if not immediate and self._timer is None:
+                self._timer = threading.Timer(self.debounce, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if immediate:
+            self.flush()
+
+    # ---- escritura ----
+
+    def flush(self) -> bool:
+        """
+        Escribe el manifest ahora si hay cambios pendientes
+
+        Returns:
+            True si se escribió
+        """
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return False
+                data = json.dumps(self._data, ensure_ascii=False, indent=2).encode("utf-8")
+                self._dirty = False
+            try:
+                atomic_write_bytes(self.path, data)
+            except Exception:
+                with self._lock:
+                    self._dirty = True
+                raise
+            self.writes += 1
+            return True
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error guardando manifest {self.path}: {e}")
+
+
+# Un manifest por carpeta de historia, compartido por orquestador, agentes y API; la
+# instancia vive mientras alguien la use o tenga un guardado pendiente (el timer la referencia)
+_stores: "weakref.WeakValueDictionary[Path, ManifestStore]" = weakref.WeakValueDictionary()
+_stores_lock = threading.Lock()
+
+
+def get_manifest_store(story_path: Path) -> ManifestStore:
+    """Obtiene el manifest de una historia (una instancia por carpeta)"""
+    key = Path(story_path).resolve()
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = ManifestStore(key)
+            _stores[key] = store
+        return store
+
+
+def read_manifest(story_path: Path) -> Optional[Dict[str, Any]]:
+    """
+    Manifest de una historia para consultar (API)
+
+    Si el proceso tiene un store con contenido para la carpeta se lee su
+    estado en memoria, que puede ir hasta MANIFEST_DEBOUNCE por delante del
+    archivo; si no, se lee manifest.json sin crear un store.
+
+    Returns:
+        Copia del manifest, o None si la historia no tiene manifest
+    """
+    key = Path(story_path).resolve()
+    with _stores_lock:
+        store = _stores.get(key)
+    if store is not None and store.exists():
+        return store.snapshot()
+    path = key / MANIFEST_FILE
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@atexit.register
+def flush_all():
+    """Escribe los cambios pendientes de todos los manifests (al salir del proceso)"""
+    for store in list(_stores.values()):
+        try:
+            store.flush()
+        except Exception as e:
+            logger.error(f"Error guardando manifest {store.path}: {e}")
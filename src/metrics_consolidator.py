@@ -84,6 +84,7 @@ def collect_available_metrics(story_id: str, logs_dir: Path) -> List[Dict[str, A
             if log_data:
                 # Procesar el último intento (puede haber múltiples si hubo reintentos)
                 last_attempt = log_data[-1] if isinstance(log_data, list) else log_data
+                tokens = last_attempt.get("tokens_consumed") or {}
                 
                 metrics.append({
                     "agente": agent_name,
@@ -95,7 +96,9 @@ def collect_available_metrics(story_id: str, logs_dir: Path) -> List[Dict[str, A
                     "qa_detalle": last_attempt.get("qa_scores", {}),
                     "reintentos": last_attempt.get("retry_count", 0),
                     "status": last_attempt.get("status", "unknown"),
-                    "timestamp": last_attempt.get("timestamp", "N/A")
+                    "timestamp": last_attempt.get("timestamp", "N/A"),
+                    "prompt_tokens": tokens.get("prompt_tokens"),
+                    "cached_tokens": tokens.get("cached_tokens")
                 })
             else:
                 metrics.append({
@@ -194,6 +197,12 @@ def calculate_statistics(agent_metrics: List[Dict[str, Any]]) -> Dict[str, Any]:
             score_int = int(promedio)
             qa_distribucion[str(score_int)] = qa_distribucion.get(str(score_int), 0) + 1
     
+    # Tokens de prompt servidos desde el prefix cache (solo agentes cuyo log lo informa)
+    con_cache = [m for m in available_metrics
+                 if isinstance(m.get("cached_tokens"), int) and isinstance(m.get("prompt_tokens"), int)]
+    prompt_tokens = sum(m["prompt_tokens"] for m in con_cache)
+    cached_tokens = sum(m["cached_tokens"] for m in con_cache)
+    
     # Identificar agentes con QA bajo umbral (< 4.0)
     agentes_bajo_umbral = [
         m["agente"] for m in available_metrics 
@@ -235,6 +244,12 @@ def calculate_statistics(agent_metrics: List[Dict[str, Any]]) -> Dict[str, Any]:
             "mejor_agente": identify_best_qa_agent(available_metrics),
             "agente_menor_qa": identify_worst_qa_agent(available_metrics)
         },
+        "prefix_cache": {
+            "agentes_con_datos": len(con_cache),
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "tasa_acierto": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else None
+        },
         "agentes_procesados": len(available_metrics),
         "agentes_faltantes": [m["agente"] for m in agent_metrics if not m["disponible"]]
     }
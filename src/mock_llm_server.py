@@ -0,0 +1,595 @@
+"""
+Servidor LLM simulado, compatible con /v1/chat/completions de OpenAI/vLLM
+
+Permite ejecutar el pipeline, los test_*.py y los benchmarks sin la GPU:
+basta con apuntar LLM_API_URL a este servidor.
+
+Respuestas, en orden de preferencia:
+1. Grabadas: las historias de runs/ (inputs/**/*_request.json con su salida
+   en outputs/) y los cassettes JSONL grabados con --record-to, indexados por
+   la huella de los mensajes (system sin la instrucción JSON + user). Los
+   parámetros de muestreo no entran en la clave porque max_tokens cambia con
+   el dimensionamiento histórico.
+2. Sintéticas: una instancia del JSON Schema del request (response_format o
+   guided_json) o del agente reconocido por su system prompt; el
+   verificador QA siempre aprueba.
+
+El costo de cada request se simula como latencia base (según la
+distribución configurada) + prefill + decodificación a tokens_per_second,
+con max_concurrency requests generando a la vez y el resto en cola. Se
+pueden inyectar timeouts, contenido vacío, rechazos, truncamiento por
+max_tokens y errores 500. Soporta streaming (SSE con usage), n candidatos
+y usage.prompt_tokens_details.cached_tokens (prefix cache por system prompt).
+
+Uso:
+    python src/mock_llm_server.py --port 8001
+    LLM_API_URL=http://127.0.0.1:8001/v1/chat/completions python test_v2.py
+    python src/mock_llm_server.py --time-scale 0 --truncation-rate 0.1
+    python src/mock_llm_server.py --record-to runs/cassette.jsonl \\
+        --upstream http://69.19.136.204:8000/v1/chat/completions
+"""
+import argparse
+import hashlib
+import json
+import logging
+import math
+import random
+import sys
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Permitir ejecutar el módulo como script
+sys.path.append(str(Path(__file__).parent))
+
+from async_llm_client import JSON_INSTRUCTION
+from config import BASE_DIR, MOCK_LLM_CONFIG
+from json_schemas import get_agent_schema
+from token_counter import heuristic_count
+
+logger = logging.getLogger(__name__)
+
+# Fallas que se pueden inyectar, con su clave de configuración
+FAULTS = ("timeout", "empty", "refusal", "truncation", "server_error")
+
+REFUSAL_TEXT = "Lo siento, no puedo ayudar con eso."
+
+# Respuesta del verificador QA cuando no hay una grabada (siempre aprueba)
+QA_RESPONSE = {
+    "qa_scores": {"general": 4.6},
+    "promedio": 4.6,
+    "qa_score": 4.6,
+    "pasa_umbral": True,
+    "problemas_detectados": [],
+    "mejoras_especificas": []
+}
+
+_WORDS = ["Emilia", "mira", "el", "mar", "con", "su", "linterna", "mágica", "luna", "brilla",
+          "camina", "despacio", "sonríe", "abrazo", "estrella", "canta", "bosque", "amiga"]
+
+# Prompts de sistema recordados para simular el prefix cache
+_PREFIX_CACHE_ENTRIES = 256
+
+
+def replay_key(system_prompt: str, user_prompt: str) -> str:
+    """Huella de los mensajes de un request (sin la instrucción JSON del cliente)"""
+    if system_prompt.endswith(JSON_INSTRUCTION):
+        system_prompt = system_prompt[:-len(JSON_INSTRUCTION)]
+    canonical = json.dumps([system_prompt, user_prompt], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def sample_from_schema(schema: Dict[str, Any], rng: random.Random, field: str = "") -> Any:
+    """Instancia que cumple el schema, con texto de largo variable"""
+    kind = schema.get("type")
+    if field == "qa" and not schema.get("properties"):
+        # Autoevaluación de v1: scores entre 1 y 5 que pasan el umbral
+        return {"coherencia": 4.5, "claridad": 4.5}
+    if kind == "object":
+        properties = schema.get("properties")
+        if properties is None:
+            extra = schema.get("additionalProperties")
+            return {str(i): sample_from_schema(extra, rng) for i in range(1, 11)} if extra else {}
+        return {key: sample_from_schema(value, rng, key) for key, value in properties.items()}
+    if kind == "array":
+        count = schema.get("minItems", 3)
+        return [sample_from_schema(schema.get("items", {}), rng) for _ in range(count)]
+    if kind == "integer":
+        return rng.randint(1, 10)
+    if kind == "number":
+        return round(rng.uniform(4.0, 5.0), 1)
+    if kind == "boolean":
+        return True
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 20)))
+
+
+def _strip_metadata(output: Any) -> Any:
+    """Quita los campos que agrega el pipeline a la salida del modelo"""
+    if isinstance(output, dict):
+        return {k: v for k, v in output.items() if k not in ("_metadata_tokens", "_qa_metadata")}
+    return output
+
+
+def _read_json(path: Path) -> Optional[Any]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+class ReplayStore:
+    """Respuestas grabadas indexadas por la huella de los mensajes"""
+
+    def __init__(self):
+        self.responses: Dict[str, str] = {}
+        self.agents: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.responses)
+
+    def add(self, system_prompt: str, user_prompt: str, content: str, agent: Optional[str] = None):
+        key = replay_key(system_prompt, user_prompt)
+        self.responses[key] = content
+        if agent:
+            self.agents[key] = agent
+
+    def lookup(self, system_prompt: str, user_prompt: str) -> Optional[str]:
+        return self.responses.get(replay_key(system_prompt, user_prompt))
+
+    def load_runs(self, runs_dir: Path) -> int:
+        """
+        Indexa las llamadas grabadas en las historias de runs/
+
+        Returns:
+            Número de pares request/respuesta agregados
+        """
+        before = len(self)
+        for request_file in sorted(runs_dir.glob("*/inputs/**/*_request.json")):
+            request = _read_json(request_file)
+            if not isinstance(request, dict):
+                continue
+            story = request_file.parents[1] if request_file.parent.name == "inputs" else request_file.parents[2]
+            if "prompts" in request:
+                # Página de cuentacuentos: inputs/pages/X_request.json -> outputs/pages/X_result.json
+                result_file = story / "outputs" / "pages" / request_file.name.replace("_request.json", "_result.json")
+                result = _read_json(result_file) or {}
+                output = result.get("response")
+                system_prompt, user_prompt = request["prompts"].get("system"), request["prompts"].get("user")
+                agent = "03_cuentacuentos"
+            else:
+                agent = request.get("agent")
+                output = None
+                for candidate in (story / "outputs" / "agents" / f"{agent}.json", story / f"{agent}.json"):
+                    output = _read_json(candidate)
+                    if output is not None:
+                        break
+                system_prompt, user_prompt = request.get("system_prompt"), request.get("user_prompt")
+            if output is None or system_prompt is None or user_prompt is None:
+                continue
+            self.add(system_prompt, user_prompt, json.dumps(_strip_metadata(output), ensure_ascii=False), agent)
+        return len(self) - before
+
+    def load_cassette(self, path: Path) -> int:
+        """Agrega las llamadas de un cassette JSONL grabado con --record-to"""
+        before = len(self)
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self.add(entry["system_prompt"], entry["user_prompt"], entry["content"], entry.get("agent"))
+        return len(self) - before
+
+
+def load_agent_prompts() -> List[Tuple[str, str]]:
+    """(contenido, agente) de los prompts de agentes/ y flujo/*/agentes, del más largo al más corto"""
+    prompts = []
+    for path in list((BASE_DIR / "agentes").glob("*.json")) + list(BASE_DIR.glob("flujo/*/agentes/*.json")):
+        data = _read_json(path)
+        if isinstance(data, dict) and data.get("content"):
+            prompts.append((data["content"], path.stem))
+    return sorted(prompts, key=lambda item: -len(item[0]))
+
+
+class MockLLM:
+    """Estado del servidor simulado: respuestas, fallas, latencias y estadísticas"""
+
+    def __init__(self,
+                 config: Optional[Dict[str, Any]] = None,
+                 store: Optional[ReplayStore] = None,
+                 upstream: Optional[str] = None,
+                 record_to: Optional[Path] = None):
+        """
+        Args:
+            config: Configuración (por defecto MOCK_LLM_CONFIG)
+            store: Respuestas grabadas (por defecto las de runs_dir y cassettes)
+            upstream: Servidor real al que reenviar (modo grabación)
+            record_to: Cassette JSONL donde grabar lo que responde upstream
+        """
+        self.config = dict(MOCK_LLM_CONFIG, **(config or {}))
+        if store is None:
+            store = ReplayStore()
+            store.load_runs(Path(self.config["runs_dir"]))
+            for cassette in self.config["cassettes"]:
+                store.load_cassette(Path(cassette))
+        self.store = store
+        self.upstream = upstream
+        self.record_to = record_to
+        self.agent_prompts = load_agent_prompts()
+        self.rng = random.Random(self.config["seed"])
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(max(1, self.config["max_concurrency"]))
+        self.waiting = 0
+        self.active = 0
+        self.seen_prefixes: "OrderedDict[str, None]" = OrderedDict()
+        self.stats = {"requests": 0, "replayed": 0, "synthesized": 0, "recorded": 0,
+                      "rejected": 0, "max_active": 0, "max_waiting": 0,
+                      "faults": {fault: 0 for fault in FAULTS}}
+
+    # ----- Respuestas -----
+
+    def identify_agent(self, payload: Dict[str, Any], system_prompt: str) -> Optional[str]:
+        """Agente del request: nombre del schema o prompt de sistema conocido"""
+        response_format = payload.get("response_format") or {}
+        name = (response_format.get("json_schema") or {}).get("name")
+        if name and name != "respuesta":
+            return name
+        for content, agent in self.agent_prompts:
+            if system_prompt.startswith(content):
+                return agent
+        return None
+
+    def synthesize(self, payload: Dict[str, Any], agent: Optional[str]) -> str:
+        """Respuesta que cumple el schema del request o del agente"""
+        schema = payload.get("guided_json") or ((payload.get("response_format") or {}).get("json_schema") or {}).get("schema")
+        with self.lock:
+            if agent and "verificador" in agent:
+                output = QA_RESPONSE
+            elif schema or (agent and get_agent_schema(agent)):
+                output = sample_from_schema(schema or get_agent_schema(agent), self.rng)
+            else:
+                output = {"respuesta": sample_from_schema({"type": "string"}, self.rng)}
+        return json.dumps(output, ensure_ascii=False)
+
+    def respond(self, payload: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        Contenido de la respuesta a un request
+
+        Returns:
+            Tuple de (contenido, origen) con origen "replayed" o "synthesized"
+        """
+        messages = payload.get("messages") or []
+        system_prompt = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        user_prompt = next((m["content"] for m in messages if m.get("role") == "user"), "")
+        content = self.store.lookup(system_prompt, user_prompt)
+        if content is not None:
+            return content, "replayed"
+        return self.synthesize(payload, self.identify_agent(payload, system_prompt)), "synthesized"
+
+    def choose_fault(self) -> Optional[str]:
+        """Falla a inyectar en este request según las tasas configuradas"""
+        with self.lock:
+            draw = self.rng.random()
+        for fault in FAULTS:
+            draw -= self.config[f"{fault}_rate"]
+            if draw < 0:
+                return fault
+        return None
+
+    def cached_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        """Tokens del system prompt si ya se había visto (prefix cache simulado)"""
+        system_prompt = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        key = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+        with self.lock:
+            hit = key in self.seen_prefixes
+            self.seen_prefixes[key] = None
+            self.seen_prefixes.move_to_end(key)
+            while len(self.seen_prefixes) > _PREFIX_CACHE_ENTRIES:
+                self.seen_prefixes.popitem(last=False)
+        return heuristic_count(system_prompt) if hit else 0
+
+    # ----- Tiempos -----
+
+    def base_latency(self) -> float:
+        """Latencia fija por request según la distribución configurada"""
+        median = self.config["latency_median"]
+        sigma = self.config["latency_sigma"]
+        distribution = self.config["latency_distribution"]
+        with self.lock:
+            if distribution == "fixed":
+                return median
+            if distribution == "uniform":
+                return self.rng.uniform(max(0.0, median - sigma), median + sigma)
+            if distribution == "exponential":
+                return self.rng.expovariate(math.log(2) / median) if median > 0 else 0.0
+            return self.rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+    def sleep(self, seconds: float):
+        scaled = seconds * self.config["time_scale"]
+        if scaled > 0:
+            time.sleep(scaled)
+
+    # ----- Cola y slots -----
+
+    def acquire(self) -> bool:
+        """Espera un slot de generación; False si la cola está llena (503)"""
+        with self.lock:
+            if self.waiting >= self.config["max_queue"]:
+                self.stats["rejected"] += 1
+                return False
+            self.waiting += 1
+            self.stats["max_waiting"] = max(self.stats["max_waiting"], self.waiting)
+        self.slots.acquire()
+        with self.lock:
+            self.waiting -= 1
+            self.active += 1
+            self.stats["max_active"] = max(self.stats["max_active"], self.active)
+        return True
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+        self.slots.release()
+
+    def count(self, key: str, fault: Optional[str] = None):
+        with self.lock:
+            if key:
+                self.stats[key] += 1
+            if fault:
+                self.stats["faults"][fault] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return json.loads(json.dumps(dict(self.stats, active=self.active, waiting=self.waiting,
+                                              recorded_responses=len(self.store))))
+
+    # ----- Grabación -----
+
+    def forward(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Reenvía el request al servidor real y graba la respuesta en el cassette"""
+        upstream_payload = {k: v for k, v in payload.items() if k not in ("stream", "stream_options")}
+        request = urllib.request.Request(
+            self.upstream, data=json.dumps(upstream_payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=self.config["hang_seconds"]) as response:
+            result = json.loads(response.read())
+        messages = payload.get("messages") or []
+        system_prompt = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        user_prompt = next((m["content"] for m in messages if m.get("role") == "user"), "")
+        content = result["choices"][0]["message"].get("content") or ""
+        if system_prompt.endswith(JSON_INSTRUCTION):
+            system_prompt = system_prompt[:-len(JSON_INSTRUCTION)]
+        entry = {"agent": self.identify_agent(payload, system_prompt), "system_prompt": system_prompt,
+                 "user_prompt": user_prompt, "content": content, "usage": result.get("usage")}
+        with self.lock:
+            with open(self.record_to, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.store.add(system_prompt, user_prompt, content, entry["agent"])
+            self.stats["recorded"] += 1
+        return result
+
+
+def _chunks(text: str, size: int) -> Iterator[str]:
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+def make_handler(mock: MockLLM):
+    """Handler HTTP ligado al estado del servidor simulado"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_json(self, status: int, body: Dict[str, Any]):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.endswith("/v1/models"):
+                self.send_json(200, {"object": "list", "data": [{"id": "openai/gpt-oss-120b", "object": "model"}]})
+            elif self.path.endswith("/mock/stats"):
+                self.send_json(200, mock.get_stats())
+            else:
+                self.send_json(404, {"error": {"message": f"Ruta desconocida: {self.path}"}})
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                self.send_json(404, {"error": {"message": f"Ruta desconocida: {self.path}"}})
+                return
+            mock.count("requests")
+
+            if mock.upstream:
+                try:
+                    result = mock.forward(payload)
+                except Exception as e:
+                    self.send_json(502, {"error": {"message": f"Upstream falló: {e}"}})
+                    return
+                self.reply(payload, [c["message"].get("content") or "" for c in result["choices"]],
+                           [c.get("finish_reason") or "stop" for c in result["choices"]], 0.0, simulate=False)
+                return
+
+            if not mock.acquire():
+                self.send_json(503, {"error": {"message": "Servidor saturado: cola llena"}})
+                return
+            try:
+                self.generate(payload)
+            finally:
+                mock.release()
+
+        def generate(self, payload: Dict[str, Any]):
+            fault = mock.choose_fault()
+            mock.count(None, fault)
+            if fault == "server_error":
+                mock.sleep(mock.base_latency())
+                self.send_json(500, {"error": {"message": "Error interno simulado"}})
+                return
+            if fault == "timeout":
+                # Sin respuesta: el cliente agota su timeout de lectura
+                time.sleep(mock.config["hang_seconds"])
+                self.close_connection = True
+                return
+
+            contents, finish_reasons = [], []
+            max_tokens = payload.get("max_tokens") or 0
+            for _ in range(max(1, payload.get("n", 1))):
+                content, origin = mock.respond(payload)
+                mock.count(origin)
+                finish_reason = "stop"
+                if fault == "empty":
+                    content = ""
+                elif fault == "refusal":
+                    content = REFUSAL_TEXT
+                elif fault == "truncation":
+                    with mock.lock:
+                        content = content[:int(len(content) * mock.rng.uniform(0.3, 0.9))]
+                    finish_reason = "length"
+                if max_tokens and heuristic_count(content) > max_tokens:
+                    # Cortar donde lo haría max_tokens
+                    content = content[:int(len(content) * max_tokens / heuristic_count(content))]
+                    finish_reason = "length"
+                contents.append(content)
+                finish_reasons.append(finish_reason)
+
+            prompt_tokens = sum(heuristic_count(m.get("content") or "") for m in payload.get("messages") or [])
+            ttft = mock.base_latency() + prompt_tokens / mock.config["prefill_tokens_per_second"]
+            self.reply(payload, contents, finish_reasons, ttft)
+
+        def reply(self, payload: Dict[str, Any], contents: List[str], finish_reasons: List[str],
+                  ttft: float, simulate: bool = True):
+            """Envía la respuesta completa o como event stream, con los tiempos simulados"""
+            messages = payload.get("messages") or []
+            prompt_tokens = sum(heuristic_count(m.get("content") or "") for m in messages)
+            completion_tokens = sum(heuristic_count(content) for content in contents)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": mock.cached_tokens(messages)}
+            }
+            tokens_per_second = mock.config["tokens_per_second"]
+            model = payload.get("model", "openai/gpt-oss-120b")
+
+            if not payload.get("stream"):
+                if simulate:
+                    mock.sleep(ttft + max(map(heuristic_count, contents)) / tokens_per_second)
+                self.send_json(200, {
+                    "id": f"mock-{time.time_ns()}",
+                    "object": "chat.completion",
+                    "model": model,
+                    "choices": [{"index": i, "message": {"role": "assistant", "content": content},
+                                 "finish_reason": finish_reasons[i]} for i, content in enumerate(contents)],
+                    "usage": usage
+                })
+                return
+
+            # Event stream: sin Content-Length, la conexión se cierra al terminar
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            if simulate:
+                mock.sleep(ttft)
+            try:
+                for i, content in enumerate(contents):
+                    for piece in _chunks(content, 64):
+                        self.send_event({"choices": [{"index": i, "delta": {"content": piece}, "finish_reason": None}]})
+                        if simulate:
+                            mock.sleep(heuristic_count(piece) / tokens_per_second)
+                    self.send_event({"choices": [{"index": i, "delta": {}, "finish_reason": finish_reasons[i]}]})
+                if (payload.get("stream_options") or {}).get("include_usage"):
+                    self.send_event({"choices": [], "usage": usage})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # El cliente abortó el streaming (salida irrecuperable)
+                pass
+
+        def send_event(self, event: Dict[str, Any]):
+            self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return Handler
+
+
+def start_mock_server(port: int = 0, **overrides) -> Tuple[ThreadingHTTPServer, MockLLM, str]:
+    """
+    Levanta el servidor simulado en un hilo de fondo
+
+    Args:
+        port: Puerto (0 = uno libre)
+        **overrides: Claves de MOCK_LLM_CONFIG a reemplazar, o store/upstream/record_to
+
+    Returns:
+        Tuple de (servidor, estado, URL de chat/completions); detener con server.shutdown()
+    """
+    extra = {key: overrides.pop(key) for key in ("store", "upstream", "record_to") if key in overrides}
+    mock = MockLLM(overrides, **extra)
+    server = ThreadingHTTPServer((mock.config["host"], port), make_handler(mock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://{mock.config['host']}:{server.server_address[1]}/v1/chat/completions"
+    return server, mock, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor LLM simulado compatible con chat/completions")
+    parser.add_argument("--host", default=MOCK_LLM_CONFIG["host"])
+    parser.add_argument("--port", type=int, default=MOCK_LLM_CONFIG["port"])
+    parser.add_argument("--runs-dir", default=MOCK_LLM_CONFIG["runs_dir"], help="Historias con respuestas grabadas")
+    parser.add_argument("--cassette", action="append", default=list(MOCK_LLM_CONFIG["cassettes"]),
+                        help="Cassette JSONL con respuestas grabadas (repetible)")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "exponential", "lognormal"],
+                        default=MOCK_LLM_CONFIG["latency_distribution"])
+    parser.add_argument("--latency-median", type=float, default=MOCK_LLM_CONFIG["latency_median"])
+    parser.add_argument("--latency-sigma", type=float, default=MOCK_LLM_CONFIG["latency_sigma"])
+    parser.add_argument("--tokens-per-second", type=float, default=MOCK_LLM_CONFIG["tokens_per_second"])
+    parser.add_argument("--time-scale", type=float, default=MOCK_LLM_CONFIG["time_scale"])
+    parser.add_argument("--max-concurrency", type=int, default=MOCK_LLM_CONFIG["max_concurrency"])
+    parser.add_argument("--max-queue", type=int, default=MOCK_LLM_CONFIG["max_queue"])
+    for fault in FAULTS:
+        parser.add_argument(f"--{fault.replace('_', '-')}-rate", type=float, default=MOCK_LLM_CONFIG[f"{fault}_rate"])
+    parser.add_argument("--seed", type=int, default=MOCK_LLM_CONFIG["seed"])
+    parser.add_argument("--upstream", help="Servidor real al que reenviar (modo grabación)")
+    parser.add_argument("--record-to", type=Path, help="Cassette JSONL donde grabar las respuestas de --upstream")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if bool(args.upstream) != bool(args.record_to):
+        parser.error("--upstream y --record-to van juntos")
+
+    config = {
+        "host": args.host, "runs_dir": args.runs_dir, "cassettes": args.cassette,
+        "latency_distribution": args.latency_dist, "latency_median": args.latency_median,
+        "latency_sigma": args.latency_sigma, "tokens_per_second": args.tokens_per_second,
+        "time_scale": args.time_scale, "max_concurrency": args.max_concurrency,
+        "max_queue": args.max_queue, "seed": args.seed
+    }
+    for fault in FAULTS:
+        config[f"{fault}_rate"] = getattr(args, f"{fault}_rate")
+
+    server, mock, url = start_mock_server(args.port, upstream=args.upstream, record_to=args.record_to, **config)
+    logger.info(f"🧪 Servidor LLM simulado en {url} ({len(mock.store)} respuestas grabadas)")
+    if args.upstream:
+        logger.info(f"🎙️ Grabando respuestas de {args.upstream} en {args.record_to}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
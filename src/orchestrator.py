@@ -4,9 +4,10 @@ Orquestador principal del pipeline de Cuentería
 import json
 import logging
 import argparse
+import os
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Set
 import uuid
 from dotenv import load_dotenv
 
@@ -18,13 +19,35 @@ from config import (
     get_story_path,
     get_artifact_path,
     PROCESSING_CONFIG,
+    SCHEDULER_CONFIG,
     validate_config
 )
 from agent_runner import AgentRunner
+from agent_fingerprint import agent_fingerprint, changed_inputs, fingerprint_inputs
+from atomic_io import atomic_write_bytes, atomic_write_json
+from story_journal import file_sha256, get_story_journal
+from manifest_store import get_manifest_store
+from agent_scheduler import AgentScheduler, build_agent_graph
 from llm_client import get_llm_client
+from deadlines import Deadline
+from token_sizing import get_max_tokens_sizer
+from tracing import current_tracer, new_tracer, span, traced
 
 logger = logging.getLogger(__name__)
 
+# Agente cuya salida se copia cuando se salta un agente (si también está saltado, se sigue la cadena)
+SKIPPED_AGENT_SOURCES = {
+    "04_editor_claridad": "03_cuentacuentos",
+    "05_ritmo_rima": "04_editor_claridad",  # Si editor está saltado, usa cuentacuentos
+    "06_continuidad": "05_ritmo_rima",
+    "07_diseno_escena": "05_ritmo_rima",
+    "08_direccion_arte": "07_diseno_escena",
+    "09_sensibilidad": "05_ritmo_rima",
+    "10_portadista": "05_ritmo_rima",
+    "11_loader": "10_portadista",
+    "12_validador": "05_ritmo_rima"
+}
+
 
 class StoryOrchestrator:
     """Orquesta el pipeline completo de generación de cuentos"""
@@ -56,7 +79,14 @@ class StoryOrchestrator:
         self.prompt_metrics_id = prompt_metrics_id
         self.pipeline_request_id = pipeline_request_id
         self.agent_runner = AgentRunner(self.story_id, mode_verificador_qa=mode_verificador_qa, version=pipeline_version)
-        self.manifest = self._init_manifest()
+        self.journal = get_story_journal(self.story_path)
+        # Único escritor del manifest de esta historia (compartido con AgentRunner y la API)
+        self.manifest = get_manifest_store(self.story_path)
+        self.manifest.initialize(self._new_manifest())
+        # Al abrir una historia existente se conserva su ID original (el de la BD)
+        self.original_story_id = self.manifest.get("original_story_id", self.original_story_id)
+        # Al reanudar historias sin huellas se conservan las salidas que ya existen
+        self._adopt_existing_outputs = False
         
         logger.info(f"Orchestrator inicializado - story_id: {self.story_id}, original_id: {self.original_story_id}, mode_verificador_qa: {mode_verificador_qa}, version: {pipeline_version}")
         
@@ -66,38 +96,34 @@ class StoryOrchestrator:
         unique_id = str(uuid.uuid4())[:8]
         return f"{timestamp}_{unique_id}"
     
-    def _init_manifest(self) -> Dict[str, Any]:
-        """Inicializa o carga el manifest de la historia"""
-        manifest_path = get_artifact_path(self.story_id, "manifest.json")
-        
-        if manifest_path.exists():
-            with open(manifest_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            from config import LLM_CONFIG
-            return {
-                "story_id": self.story_id,
-                "original_story_id": self.original_story_id,
-                "source": "local",
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat(),
-                "estado": "iniciado",
-                "paso_actual": None,
-                "qa_historial": {},
-                "devoluciones": [],
-                "reintentos": {},
-                "timestamps": {},
-                "webhook_url": None,
-                "webhook_attempts": 0,
-                "pipeline_version": getattr(self, 'pipeline_version', 'v1'),
-                "configuracion_modelo": {
-                    "modelo": LLM_CONFIG["model"],
-                    "endpoint": LLM_CONFIG.get("api_url", "http://69.19.136.204:8000/v1/chat/completions"),
-                    "timeout": self.agent_runner.llm_client.timeout,
-                    "default_temperature": LLM_CONFIG["temperature"],
-                    "default_max_tokens": LLM_CONFIG["max_tokens"]
-                }
+    def _new_manifest(self) -> Dict[str, Any]:
+        """Manifest inicial de una historia nueva (si ya existe, el store usa el de disco)"""
+        from config import LLM_CONFIG
+        return {
+            "story_id": self.story_id,
+            "original_story_id": self.original_story_id,
+            "source": "local",
+            "created_at": datetime.now().isoformat(),
+            "updated_at": datetime.now().isoformat(),
+            "estado": "iniciado",
+            "paso_actual": None,
+            "qa_historial": {},
+            "devoluciones": [],
+            "reintentos": {},
+            "timestamps": {},
+            "fingerprints": {},
+            "webhook_url": None,
+            "webhook_attempts": 0,
+            "pipeline_version": getattr(self, 'pipeline_version', 'v1'),
+            "configuracion_modelo": {
+                "modelo": LLM_CONFIG["model"],
+                "endpoint": LLM_CONFIG.get("api_url", "http://69.19.136.204:8000/v1/chat/completions"),
+                "endpoints": LLM_CONFIG.get("api_urls", []),
+                "timeout": self.agent_runner.llm_client.timeout,
+                "default_temperature": LLM_CONFIG["temperature"],
+                "default_max_tokens": LLM_CONFIG["max_tokens"]
             }
+        }
     
     def process_story(self, brief: Dict[str, Any], webhook_url: Optional[str] = None) -> Dict[str, Any]:
         """
@@ -110,7 +136,37 @@ class StoryOrchestrator:
         Returns:
             Diccionario con el resultado del procesamiento
         """
+        return self._run_traced("process_story", self._process_story, brief, webhook_url)
+    
+    def _run_traced(self, name: str, run, *args) -> Dict[str, Any]:
+        """
+        Ejecuta run(*args) como span raíz de la traza y la guarda en trace.json
+        
+        Al terminar, las respuestas de la historia pasan al historial del
+        dimensionador de max_tokens (solo se leen los logs de esta carpeta).
+        """
+        if current_tracer() is not None:
+            # Ya dentro de una traza (resume_story que vuelve a empezar)
+            with span(name, "pipeline"):
+                return run(*args)
+        
+        tracer = new_tracer(self.story_id)
+        if tracer is None:
+            result = run(*args)
+        else:
+            with tracer.activate():
+                with span(name, "pipeline", story_id=self.story_id, version=self.pipeline_version) as root_span:
+                    result = run(*args)
+                    root_span["status"] = result.get("status")
+            tracer.save(get_artifact_path(self.story_id, "trace.json"))
+        get_max_tokens_sizer().refresh_run(self.story_path)
+        return result
+    
+    def _process_story(self, brief: Dict[str, Any], webhook_url: Optional[str]) -> Dict[str, Any]:
+        """Cuerpo de process_story"""
         logger.info(f"Iniciando procesamiento de historia: {self.story_id}")
+        # Plazo de la historia (STORY_TIME_BUDGET), propagado a cada agente y llamada al LLM
+        self.deadline = Deadline.for_story()
         
         try:
             # Validar configuración
@@ -122,111 +178,82 @@ class StoryOrchestrator:
             logs_dir.mkdir(exist_ok=True)
             
             # Guardar brief
-            brief_path = get_artifact_path(self.story_id, "brief.json")
-            with open(brief_path, 'w', encoding='utf-8') as f:
-                json.dump(brief, f, ensure_ascii=False, indent=2)
+            atomic_write_json(get_artifact_path(self.story_id, "brief.json"), brief)
             
-            # Actualizar manifest
-            self.manifest["webhook_url"] = webhook_url
-            # Guardar prompt_metrics_id si fue proporcionado al orchestrator
-            if self.prompt_metrics_id:
-                self.manifest["prompt_metrics_id"] = self.prompt_metrics_id
-            # Guardar pipeline_request_id si fue proporcionado
-            if self.pipeline_request_id:
-                self.manifest["pipeline_request_id"] = self.pipeline_request_id
-            self.manifest["estado"] = "en_progreso"
+            # Datos de la solicitud en el manifest
+            with self.manifest.mutate() as manifest:
+                manifest["webhook_url"] = webhook_url
+                # Guardar prompt_metrics_id si fue proporcionado al orchestrator
+                if self.prompt_metrics_id:
+                    manifest["prompt_metrics_id"] = self.prompt_metrics_id
+                # Guardar pipeline_request_id si fue proporcionado
+                if self.pipeline_request_id:
+                    manifest["pipeline_request_id"] = self.pipeline_request_id
+        except Exception as e:
+            return self._fail_story(e)
+        
+        return self._run_pipeline(
+            "story_started",
+            original_story_id=self.original_story_id,
+            pipeline_version=self.pipeline_version,
+            mode_verificador_qa=self.mode_verificador_qa,
+            webhook_url=webhook_url,
+            prompt_metrics_id=self.prompt_metrics_id,
+            pipeline_request_id=self.pipeline_request_id
+        )
+    
+    def _run_pipeline(self, journal_event: str, **journal_fields) -> Dict[str, Any]:
+        """
+        Ejecuta el grafo de agentes sobre la carpeta ya preparada de la historia
+        
+        Args:
+            journal_event: story_started (historia nueva) o story_resumed
+                (reanudación en la misma carpeta)
+            **journal_fields: Datos del evento en el journal
+        """
+        try:
+            with self.manifest.mutate() as manifest:
+                manifest["estado"] = "en_progreso"
+                manifest.pop("error", None)
+                manifest.setdefault("fingerprints", {})
             self._save_manifest()
             
+            # Desde aquí una caída deja la historia como interrumpida en el journal
+            self.journal.append(journal_event, commit=True, pid=os.getpid(), **journal_fields)
+            
             # Obtener pipeline de la versión configurada
             pipeline = self.agent_runner.version_config.get('pipeline', AGENT_PIPELINE)
             
             # Obtener toggles de agentes (por defecto todos habilitados)
             agent_toggles = self.agent_runner.version_config.get('agent_toggles', {})
             
-            # Ejecutar pipeline
-            for agent_name in pipeline:
-                # Verificar si el agente está habilitado
-                if not agent_toggles.get(agent_name, True):
-                    logger.info(f"Saltando agente deshabilitado: {agent_name}")
-                    self._handle_skipped_agent(agent_name)
-                    continue
-                
-                logger.info(f"Ejecutando agente: {agent_name}")
-                
-                # Actualizar manifest
-                self.manifest["paso_actual"] = agent_name
-                self.manifest["updated_at"] = datetime.now().isoformat()
-                self._save_manifest()
-                
-                # Ejecutar agente
-                start_time = datetime.now()
-                result = self.agent_runner.run_agent(agent_name)
-                execution_time = (datetime.now() - start_time).total_seconds()
-                
-                # Registrar en manifest
-                self.manifest["timestamps"][agent_name] = {
-                    "start": start_time.isoformat(),
-                    "end": datetime.now().isoformat(),
-                    "duration": execution_time
-                }
-                
-                # Verificar resultado
-                if result["status"] == "error":
-                    logger.error(f"Error en agente {agent_name}: {result.get('error')}")
-                    self.manifest["estado"] = "error"
-                    self.manifest["error"] = {
-                        "agent": agent_name,
-                        "message": result.get("error"),
-                        "timestamp": datetime.now().isoformat()
-                    }
-                    self._save_manifest()
-                    return self._build_error_response(agent_name, result.get("error"))
-                
-                elif result["status"] == "qa_failed":
-                    logger.warning(f"QA falló para {agent_name} después de reintentos")
-                    
-                    # Registrar QA scores
-                    if "qa_scores" in result:
-                        self.manifest["qa_historial"][agent_name] = result["qa_scores"]
-                    
-                    # Registrar devolución
-                    self.manifest["devoluciones"].append({
-                        "paso": agent_name,
-                        "motivo": "QA bajo umbral después de reintentos",
-                        "qa_scores": result.get("qa_scores"),
-                        "issues": result.get("qa_issues"),
-                        "timestamp": datetime.now().isoformat()
-                    })
-                    
-                    # Registrar reintentos
-                    if agent_name not in self.manifest["reintentos"]:
-                        self.manifest["reintentos"][agent_name] = 0
-                    self.manifest["reintentos"][agent_name] = result.get("retry_count", 0)
-                    
-                    self.manifest["estado"] = "qa_failed"
-                    self._save_manifest()
-                    
-                    # Continuar con advertencia (o detener según configuración)
-                    logger.warning(f"Continuando pipeline a pesar de QA bajo para {agent_name}")
-                
-                else:  # success
-                    logger.info(f"Agente {agent_name} completado exitosamente")
-                    
-                    # Registrar QA scores
-                    if "qa_scores" in result:
-                        self.manifest["qa_historial"][agent_name] = result["qa_scores"]
-                    
-                    # Registrar reintentos si hubo
-                    if result.get("retry_count", 0) > 0:
-                        self.manifest["reintentos"][agent_name] = result["retry_count"]
-                
+            # Ejecutar pipeline: cada agente arranca cuando terminan los que producen sus dependencias
+            skipped = [agent for agent in pipeline if not agent_toggles.get(agent, True)]
+            scheduler = AgentScheduler(self._build_agent_graph(pipeline, skipped), self._max_parallel_agents())
+            self._agent_starts = {}
+            # Huellas de la ejecución anterior: los agentes con las mismas entradas no se re-ejecutan
+            self._previous_fingerprints = self.manifest.get("fingerprints", {})
+            self._rerun_agents = []
+            scheduler.run(
+                self._execute_agent,
+                on_start=self._start_agent,
+                on_result=self._record_agent_result,
+                skipped=skipped,
+                on_skip=self._handle_skipped_agent
+            )
+            self.manifest.pop("pasos_en_curso")
+            
+            if self.manifest.get("estado") == "error":
+                error = self.manifest["error"]
                 self._save_manifest()
+                self.journal.append("story_finished", commit=True, estado="error", agent=error["agent"])
+                return self._build_error_response(error["agent"], error["message"])
             
             # Pipeline completado
             logger.info("Pipeline completado exitosamente")
-            self.manifest["estado"] = "completo"
-            self.manifest["updated_at"] = datetime.now().isoformat()
+            self.manifest.update({"estado": "completo", "updated_at": datetime.now().isoformat()})
             self._save_manifest()
+            self.journal.append("story_finished", commit=True, estado="completo")
             
             # Obtener resultado final
             final_result = self._get_final_result()
@@ -254,14 +281,201 @@ class StoryOrchestrator:
             return result_dict
             
         except Exception as e:
-            logger.error(f"Error fatal en pipeline: {e}")
-            self.manifest["estado"] = "error"
-            self.manifest["error"] = {
+            return self._fail_story(e)
+    
+    def _fail_story(self, e: Exception) -> Dict[str, Any]:
+        """Marca la historia con error fatal y cierra su ejecución en el journal"""
+        logger.error(f"Error fatal en pipeline: {e}")
+        self.manifest.update({
+            "estado": "error",
+            "error": {
                 "message": str(e),
                 "timestamp": datetime.now().isoformat()
             }
-            self._save_manifest()
-            return self._build_error_response("orchestrator", str(e))
+        })
+        self._save_manifest()
+        self.journal.append("story_finished", commit=True, estado="error", error=str(e))
+        return self._build_error_response("orchestrator", str(e))
+    
+    def _build_agent_graph(self, pipeline: List[str], skipped: List[str]) -> Dict[str, Set[str]]:
+        """
+        Agentes que deben terminar antes de cada agente del pipeline
+        
+        Sin "parallel_execution" en la versión, cada agente espera a todos los
+        anteriores (orden del pipeline). Con paralelismo, el grafo sale de
+        dependencies.json y parallel_groups; un agente saltado además espera
+        al agente cuya salida copia.
+        """
+        version_config = self.agent_runner.version_config
+        if not version_config.get('parallel_execution', False):
+            return {agent: set(pipeline[:index]) for index, agent in enumerate(pipeline)}
+        
+        graph = build_agent_graph(
+            pipeline,
+            version_config.get('dependencies', {}),
+            version_config.get('parallel_groups', [])
+        )
+        for agent_name in skipped:
+            source_agent = self._skip_source(agent_name)
+            if source_agent in graph and source_agent != agent_name:
+                graph[agent_name].add(source_agent)
+        return graph
+    
+    def _max_parallel_agents(self) -> int:
+        """Agentes en ejecución simultánea (config.json de la versión o MAX_PARALLEL_AGENTS)"""
+        version_config = self.agent_runner.version_config
+        if not version_config.get('parallel_execution', False):
+            return 1
+        return version_config.get('max_parallel_agents', SCHEDULER_CONFIG["max_parallel_agents"])
+    
+    def _start_agent(self, agent_name: str):
+        """Registra en el manifest que un agente empieza"""
+        logger.info(f"Ejecutando agente: {agent_name}")
+        self._agent_starts[agent_name] = datetime.now()
+        self.journal.append("agent_started", agent=agent_name)
+        
+        # Actualizar manifest (la huella vuelve cuando termine bien: su salida puede cambiar)
+        with self.manifest.mutate() as manifest:
+            manifest.setdefault("fingerprints", {}).pop(agent_name, None)
+            manifest["paso_actual"] = agent_name
+            manifest["pasos_en_curso"] = sorted(self._agent_starts)
+            manifest["updated_at"] = datetime.now().isoformat()
+    
+    def _execute_agent(self, agent_name: str) -> Dict[str, Any]:
+        """
+        Ejecuta un agente (en un hilo del scheduler)
+        
+        Si sus entradas tienen la misma huella que en la última ejecución
+        exitosa y su salida sigue en la historia, no se llama al LLM y el
+        resultado es "up_to_date".
+        """
+        with span(agent_name, "agent") as agent_span:
+            inputs = fingerprint_inputs(
+                self.story_id, agent_name, self.pipeline_version,
+                self.agent_runner.version_config, self.mode_verificador_qa
+            )
+            fingerprint = {"hash": agent_fingerprint(inputs), "inputs": inputs}
+            if self._is_up_to_date(agent_name, fingerprint):
+                agent_span["status"] = "up_to_date"
+                return {"status": "up_to_date", "agent": agent_name, "fingerprint": fingerprint}
+            result = self.agent_runner.run_agent(agent_name, deadline=self.deadline)
+            agent_span.update(status=result["status"], retries=result.get("retry_count", 0))
+        result["fingerprint"] = fingerprint
+        return result
+    
+    def _is_up_to_date(self, agent_name: str, fingerprint: Dict[str, Any]) -> bool:
+        """True si el agente puede reutilizar su salida anterior"""
+        if not SCHEDULER_CONFIG["incremental"]:
+            return False
+        if not get_artifact_path(self.story_id, self._get_agent_output_file(agent_name)).exists():
+            return False
+        
+        previous = self._previous_fingerprints.get(agent_name)
+        if previous is None:
+            return self._adopt_existing_outputs
+        if previous["hash"] == fingerprint["hash"]:
+            return True
+        changed = changed_inputs(previous.get("inputs", {}), fingerprint["inputs"])
+        logger.info(f"🔄 {agent_name} se re-ejecuta, cambió: {', '.join(changed) or 'formato de huella'}")
+        return False
+    
+    def _record_agent_result(self, agent_name: str, result: Dict[str, Any]) -> bool:
+        """
+        Registra en el manifest el resultado de un agente
+        
+        Returns:
+            False si el agente falló y el pipeline debe detenerse
+        """
+        start_time = self._agent_starts.pop(agent_name)
+        self._journal_agent_result(agent_name, result)
+        self._record_endpoint_stats()
+        
+        with self.manifest.mutate() as manifest:
+            manifest["pasos_en_curso"] = sorted(self._agent_starts)
+            
+            if result["status"] == "up_to_date":
+                logger.info(f"⏭️ {agent_name} al día (mismas entradas), se reutiliza su salida")
+                # Se conservan start/end/duration de la ejecución que produjo la salida reutilizada
+                manifest["timestamps"].setdefault(agent_name, {}).update({
+                    "up_to_date": True,
+                    "reused_at": datetime.now().isoformat()
+                })
+                manifest["fingerprints"][agent_name] = result["fingerprint"]
+                return True
+            self._rerun_agents.append(agent_name)
+            
+            # Registrar en manifest
+            manifest["timestamps"][agent_name] = {
+                "start": start_time.isoformat(),
+                "end": datetime.now().isoformat(),
+                "duration": (datetime.now() - start_time).total_seconds()
+            }
+            # Tiempo esperando cupo en el control de admisión vs. tiempo del modelo
+            if result.get("llm_metrics"):
+                manifest["timestamps"][agent_name].update(result["llm_metrics"])
+            
+            # Verificar resultado
+            if result["status"] == "error":
+                logger.error(f"Error en agente {agent_name}: {result.get('error')}")
+                manifest["estado"] = "error"
+                # Con agentes en paralelo se reporta el primer error
+                manifest.setdefault("error", {
+                    "agent": agent_name,
+                    "message": result.get("error"),
+                    "timestamp": datetime.now().isoformat()
+                })
+                return False
+            
+            elif result["status"] == "qa_failed":
+                logger.warning(f"QA falló para {agent_name} después de reintentos")
+                
+                # Registrar QA scores
+                if "qa_scores" in result:
+                    manifest["qa_historial"][agent_name] = result["qa_scores"]
+                
+                # Registrar devolución
+                manifest["devoluciones"].append({
+                    "paso": agent_name,
+                    "motivo": "QA bajo umbral después de reintentos",
+                    "qa_scores": result.get("qa_scores"),
+                    "issues": result.get("qa_issues"),
+                    "timestamp": datetime.now().isoformat()
+                })
+                
+                # Registrar reintentos
+                manifest["reintentos"][agent_name] = result.get("retry_count", 0)
+                
+                if manifest["estado"] != "error":
+                    manifest["estado"] = "qa_failed"
+                
+                # Continuar con advertencia (o detener según configuración)
+                logger.warning(f"Continuando pipeline a pesar de QA bajo para {agent_name}")
+            
+            else:  # success
+                logger.info(f"Agente {agent_name} completado exitosamente")
+                
+                # Registrar QA scores
+                if "qa_scores" in result:
+                    manifest["qa_historial"][agent_name] = result["qa_scores"]
+                
+                # Registrar reintentos si hubo
+                if result.get("retry_count", 0) > 0:
+                    manifest["reintentos"][agent_name] = result["retry_count"]
+                
+                # Huella de las entradas con las que se obtuvo esta salida
+                if "fingerprint" in result:
+                    manifest["fingerprints"][agent_name] = result["fingerprint"]
+        
+        return True
+    
+    def _journal_agent_result(self, agent_name: str, result: Dict[str, Any]):
+        """Registra en el journal el hash de la salida del agente y confirma su fin (fsync)"""
+        if result["status"] in ("success", "up_to_date", "qa_failed"):
+            output_file = self._get_agent_output_file(agent_name)
+            self.journal.append("artifact", agent=agent_name, file=output_file,
+                                sha256=file_sha256(get_artifact_path(self.story_id, output_file)))
+        self.journal.append("agent_finished", commit=True, agent=agent_name, status=result["status"],
+                            fingerprint=result.get("fingerprint"), error=result.get("error"))
     
     def resume_story(self) -> Dict[str, Any]:
         """
@@ -270,7 +484,12 @@ class StoryOrchestrator:
         Returns:
             Diccionario con el resultado
         """
+        return self._run_traced("resume_story", self._resume_story)
+    
+    def _resume_story(self) -> Dict[str, Any]:
+        """Cuerpo de resume_story"""
         logger.info(f"Reanudando historia: {self.story_id}")
+        self.deadline = Deadline.for_story()
         
         # Cargar brief
         brief_path = get_artifact_path(self.story_id, "brief.json")
@@ -280,6 +499,9 @@ class StoryOrchestrator:
         with open(brief_path, 'r', encoding='utf-8') as f:
             brief = json.load(f)
         
+        if SCHEDULER_CONFIG["incremental"]:
+            return self._resume_incremental()
+        
         # Determinar desde dónde continuar
         last_completed = self._find_last_completed_agent()
         
@@ -311,25 +533,24 @@ class StoryOrchestrator:
         for agent_name in remaining_agents:
             logger.info(f"Ejecutando agente: {agent_name}")
             
-            self.manifest["paso_actual"] = agent_name
-            self.manifest["updated_at"] = datetime.now().isoformat()
-            self._save_manifest()
+            self.manifest.update({"paso_actual": agent_name, "updated_at": datetime.now().isoformat()})
             
-            result = self.agent_runner.run_agent(agent_name)
+            with span(agent_name, "agent") as agent_span:
+                result = self.agent_runner.run_agent(agent_name, deadline=self.deadline)
+                agent_span.update(status=result["status"], retries=result.get("retry_count", 0))
+            self._record_endpoint_stats()
             
             if result["status"] == "error":
                 logger.error(f"Error en agente {agent_name}: {result.get('error')}")
-                self.manifest["estado"] = "error"
+                self.manifest.set("estado", "error")
                 self._save_manifest()
                 return self._build_error_response(agent_name, result.get("error"))
             
             if "qa_scores" in result:
-                self.manifest["qa_historial"][agent_name] = result["qa_scores"]
-            
-            self._save_manifest()
+                self.manifest.set_in("qa_historial", agent_name, result["qa_scores"])
         
         # Completado
-        self.manifest["estado"] = "completo"
+        self.manifest.set("estado", "completo")
         self._save_manifest()
         
         result_dict = {
@@ -345,6 +566,62 @@ class StoryOrchestrator:
         
         return result_dict
     
+    def recover_story(self) -> Dict[str, Any]:
+        """
+        Reanuda una historia interrumpida por una caída del proceso
+        
+        Las huellas del manifest se reemplazan por las de los agentes
+        confirmados en el journal cuya salida en disco tiene el hash
+        registrado; el resto (en curso al caer, o con la salida dañada) se
+        vuelve a ejecutar junto con sus descendientes.
+        """
+        state = self.journal.state()
+        fingerprints = {}
+        for agent_name, committed in state["confirmados"].items():
+            on_disk = file_sha256(get_artifact_path(self.story_id, committed["file"]))
+            if committed.get("fingerprint") and on_disk == committed["sha256"]:
+                fingerprints[agent_name] = committed["fingerprint"]
+            else:
+                logger.warning(f"⚠️ {agent_name}: su salida no coincide con la confirmada en el journal, se re-ejecuta")
+        
+        logger.info(f"♻️ Recuperando {self.story_id}: {len(fingerprints)} agentes confirmados, "
+                    f"en curso al caer: {state['en_curso'] or 'ninguno'}")
+        self.manifest.set("fingerprints", fingerprints)
+        self.journal.append("story_recovered", commit=True, confirmados=sorted(fingerprints),
+                            en_curso=state["en_curso"])
+        return self.resume_story()
+    
+    def _resume_incremental(self) -> Dict[str, Any]:
+        """
+        Reanuda re-ejecutando el grafo completo con huellas
+        
+        Solo se ejecutan los agentes cuyas entradas cambiaron (o que no
+        terminaron) y sus descendientes; editar el prompt de un agente
+        cuesta solo el subgrafo afectado. La carpeta ya existe: el brief y
+        los datos de la solicitud no se reescriben y el journal registra
+        story_resumed en vez de un segundo story_started.
+        """
+        was_complete = self.manifest.get("estado") == "completo"
+        self._adopt_existing_outputs = "fingerprints" not in self.manifest
+        result = self._run_pipeline(
+            "story_resumed",
+            pipeline_version=self.pipeline_version,
+            mode_verificador_qa=self.mode_verificador_qa
+        )
+        if result["status"] != "success":
+            return result
+        
+        if was_complete and not self._rerun_agents:
+            logger.info("Historia ya completada")
+            return {
+                "status": "already_completed",
+                "story_id": self.original_story_id,  # Usar ID original para compatibilidad con BD
+                "result": result["result"]
+            }
+        result["resumed"] = True
+        result["metadata"]["rerun_agents"] = list(self._rerun_agents)
+        return result
+    
     def get_status(self) -> Dict[str, Any]:
         """
         Obtiene el estado actual de la historia
@@ -378,53 +655,42 @@ class StoryOrchestrator:
         # Usar solo el nombre del agente sin numeración para evitar problemas de dependencias
         return f"{agent_name}.json"
     
+    def _skip_source(self, agent_name: str) -> Optional[str]:
+        """Agente cuya salida reemplaza a la de un agente saltado (None si no tiene)"""
+        source_agent = SKIPPED_AGENT_SOURCES.get(agent_name)
+        
+        # Si el agente fuente también fue saltado, buscar recursivamente
+        agent_toggles = self.agent_runner.version_config.get('agent_toggles', {})
+        while source_agent in SKIPPED_AGENT_SOURCES and not agent_toggles.get(source_agent, True):
+            source_agent = SKIPPED_AGENT_SOURCES[source_agent]
+        return source_agent
+    
+    @traced("agent", "agent_name", name="skipped_agent")
     def _handle_skipped_agent(self, agent_name: str):
         """
         Maneja un agente que fue saltado, creando los archivos necesarios
         para que los siguientes agentes encuentren sus dependencias.
         """
-        import shutil
-        
-        # Mapeo de qué archivo usar cuando se salta un agente
-        dependency_mapping = {
-            "04_editor_claridad": "03_cuentacuentos",
-            "05_ritmo_rima": "04_editor_claridad",  # Si editor está saltado, usa cuentacuentos
-            "06_continuidad": "05_ritmo_rima",
-            "07_diseno_escena": "05_ritmo_rima",
-            "08_direccion_arte": "07_diseno_escena",
-            "09_sensibilidad": "05_ritmo_rima",
-            "10_portadista": "05_ritmo_rima",
-            "11_loader": "10_portadista",
-            "12_validador": "05_ritmo_rima"
-        }
+        logger.info(f"Saltando agente deshabilitado: {agent_name}")
         
         # Si el agente saltado tiene un mapeo, copiar el archivo anterior
-        if agent_name in dependency_mapping:
-            source_agent = dependency_mapping[agent_name]
-            
-            # Si el agente fuente también fue saltado, buscar recursivamente
-            agent_toggles = self.agent_runner.version_config.get('agent_toggles', {})
-            while source_agent in dependency_mapping and not agent_toggles.get(source_agent, True):
-                source_agent = dependency_mapping[source_agent]
-            
-            # Remover números del inicio del nombre del agente para el archivo
-            source_file_name = source_agent.lstrip('0123456789_')
-            target_file_name = agent_name.lstrip('0123456789_')
-            
-            source_file = get_artifact_path(self.story_id, f"{source_file_name}.json")
-            target_file = get_artifact_path(self.story_id, f"{target_file_name}.json")
+        source_agent = self._skip_source(agent_name)
+        if source_agent is not None:
+            # Mismo nombre de archivo con el que AgentRunner guarda y carga las salidas
+            source_file = get_artifact_path(self.story_id, self._get_agent_output_file(source_agent))
+            target_file = get_artifact_path(self.story_id, self._get_agent_output_file(agent_name))
             
             if source_file.exists():
                 logger.info(f"Copiando {source_file.name} como {target_file.name} para mantener dependencias")
-                shutil.copy2(source_file, target_file)
+                atomic_write_bytes(target_file, source_file.read_bytes())
+                self.journal.append("agent_skipped", agent=agent_name, source=source_agent)
                 
                 # Registrar en manifest que el agente fue saltado
-                self.manifest["timestamps"][agent_name] = {
+                self.manifest.set_in("timestamps", agent_name, {
                     "skipped": True,
                     "source_file": source_agent,
                     "timestamp": datetime.now().isoformat()
-                }
-                self._save_manifest()
+                })
             else:
                 logger.warning(f"No se pudo encontrar archivo fuente {source_file} para agente saltado {agent_name}")
     
@@ -462,21 +728,37 @@ class StoryOrchestrator:
         return {"overall": 0.0, "by_agent": qa_historial}
     
     def _calculate_total_time(self) -> float:
-        """Calcula el tiempo total de procesamiento"""
-        timestamps = self.manifest.get("timestamps", {})
-        total_time = 0
+        """
+        Calcula el tiempo total de procesamiento
         
-        for agent_times in timestamps.values():
-            if "duration" in agent_times:
-                total_time += agent_times["duration"]
+        Con agentes en paralelo las duraciones se solapan: se toma desde el
+        primer inicio hasta el último fin en vez de sumarlas.
+        """
+        timestamps = [t for t in self.manifest.get("timestamps", {}).values() if "start" in t and "end" in t]
+        if not timestamps:
+            return 0.0
         
-        return round(total_time, 2)
+        first_start = min(datetime.fromisoformat(t["start"]) for t in timestamps)
+        last_end = max(datetime.fromisoformat(t["end"]) for t in timestamps)
+        return round((last_end - first_start).total_seconds(), 2)
+    
+    def _record_endpoint_stats(self):
+        """Registra latencia y errores por réplica LLM en configuracion_modelo"""
+        try:
+            stats = self.agent_runner.llm_client.get_metrics()["endpoints"]
+            self.manifest.set_in("configuracion_modelo", "endpoint_stats", stats)
+        except Exception as e:
+            logger.warning(f"No se pudieron obtener estadísticas de endpoints: {e}")
     
+    @traced("io")
     def _save_manifest(self):
-        """Guarda el manifest actualizado"""
-        manifest_path = get_artifact_path(self.story_id, "manifest.json")
-        with open(manifest_path, 'w', encoding='utf-8') as f:
-            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        """
+        Escribe ya los cambios pendientes del manifest
+        
+        Los cambios se guardan solos cada MANIFEST_DEBOUNCE segundos; esto es
+        para los límites de fase (inicio, error y fin de la historia).
+        """
+        self.manifest.flush()
     
     def _build_error_response(self, agent: str, error: str) -> Dict[str, Any]:
         """Construye una respuesta de error"""
@@ -485,7 +767,7 @@ class StoryOrchestrator:
             "story_id": self.original_story_id,  # Usar ID original para compatibilidad con BD
             "agent": agent,
             "error": error,
-            "manifest": self.manifest
+            "manifest": self.manifest.snapshot()
         }
 
 
@@ -497,6 +779,8 @@ def main():
     parser.add_argument("--resume", action="store_true", help="Reanudar historia existente")
     parser.add_argument("--validate", help="Validar historia por ID")
     parser.add_argument("--status", help="Ver estado de historia por ID")
+    parser.add_argument("--profile", help="Ruta crítica y desglose de latencia de una historia por ID")
+    parser.add_argument("--json", action="store_true", help="Con --profile, imprimir el perfil en JSON")
     parser.add_argument("--log-level", default="INFO", help="Nivel de logging")
     
     args = parser.parse_args()
@@ -507,6 +791,18 @@ def main():
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     
+    # El perfil solo lee archivos de la historia (no necesita el modelo)
+    if args.profile:
+        from config import get_latest_story_path
+        from story_profile import format_profile, profile_story
+        story_path = get_latest_story_path(args.profile)
+        if story_path is None:
+            logger.error(f"Historia no encontrada: {args.profile}")
+            return 1
+        profile = profile_story(story_path)
+        print(json.dumps(profile, ensure_ascii=False, indent=2) if args.json else format_profile(profile))
+        return 0
+    
     # Validar modelo LLM disponible
     llm_client = get_llm_client()
     if not llm_client.validate_connection():
@@ -515,7 +811,18 @@ def main():
     
     # Ejecutar según argumentos
     if args.resume and args.story_id:
-        orchestrator = StoryOrchestrator(args.story_id)
+        # Reanudar sobre la carpeta existente (la más reciente), con su versión del pipeline
+        from config import get_latest_story_path
+        story_path = get_latest_story_path(args.story_id)
+        if story_path is None:
+            logger.error(f"Historia no encontrada: {args.story_id}")
+            return 1
+        manifest_path = story_path / "manifest.json"
+        pipeline_version = 'v1'
+        if manifest_path.exists():
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                pipeline_version = json.load(f).get('pipeline_version', 'v1')
+        orchestrator = StoryOrchestrator(story_path.name, pipeline_version=pipeline_version, use_timestamp=False)
         result = orchestrator.resume_story()
         print(json.dumps(result, ensure_ascii=False, indent=2))
         
@@ -6,25 +6,50 @@ import json
 import logging
 import os
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, Any, List, Set, Optional, Tuple
 import time
 
 from llm_client import get_llm_client
+from deadlines import Deadline
+from token_sizing import PAGE_SIZING_KEY, get_max_tokens_sizer
+from json_schemas import PAGE_SCHEMA_NAME, get_agent_schema
+from prompt_layout import build_prompt
+from tracing import traced
+from atomic_io import atomic_write_json
 from config import get_story_path, get_artifact_path
 
 logger = logging.getLogger(__name__)
 
+# Contrato de cuentacuentos por página: idéntico en las 10 páginas (prefijo reutilizable)
+PAGE_CONTRACT = """Eres un experto en versos infantiles. Tu tarea es crear EXACTAMENTE 4 versos para la página del cuento indicada al final del mensaje.
+
+REGLA ABSOLUTA #1: NUNCA uses la misma palabra para rimar.
+REGLA ABSOLUTA #2: Usa el esquema de rima indicado para la página.
+REGLA ABSOLUTA #3: Cada verso debe tener entre 8-15 sílabas.
+
+Responde ÚNICAMENTE con este JSON:
+{
+  "pagina": <número de la página>,
+  "versos": ["verso 1", "verso 2", "verso 3", "verso 4"],
+  "palabras_finales": ["palabra1", "palabra2", "palabra3", "palabra4"],
+  "esquema_usado": "<esquema de la página>"
+}"""
+
+# QA de una página sin criterios específicos de evaluación
+DEFAULT_QA_RESULT = {"qa_score": 4.0, "pasa_umbral": True, "problemas_detectados": []}
+
 
 class ParallelCuentacuentos:
     """Procesador paralelo para el agente cuentacuentos"""
     
-    def __init__(self, story_id: str, version: str = 'v2', mode_verificador_qa: bool = True):
+    def __init__(self, story_id: str, version: str = 'v2', mode_verificador_qa: bool = True,
+                 deadline: Optional[Deadline] = None):
         self.story_id = story_id
         self.version = version
         self.mode_verificador_qa = mode_verificador_qa
+        self.deadline = deadline  # Plazo de la historia para cada llamada al LLM
         self.llm_client = get_llm_client()
         
         # Thread-safe para tracking de rimas usadas
@@ -81,6 +106,22 @@ class ParallelCuentacuentos:
                     })
         
         logger.info(f"📊 Configuración paralela cargada: {self.config}")
+    
+    @property
+    def adaptive_concurrency(self) -> bool:
+        """True si el control AIMD del cliente LLM regula la concurrencia hacia el servidor"""
+        return self.llm_client.async_client.concurrency is not None
+    
+    @traced("sleep", "seconds", name="pause")
+    def _pace(self, seconds: float):
+        """
+        Pausa fija entre páginas o antes de reintentar
+        
+        Con concurrencia adaptativa el control de admisión ya frena las
+        llamadas cuando el servidor se satura, así que no se espera.
+        """
+        if not self.adaptive_concurrency:
+            time.sleep(seconds)
         
     def load_dependencies(self):
         """Carga los artefactos necesarios del director y psicoeducador"""
@@ -152,6 +193,10 @@ class ParallelCuentacuentos:
         """
         Crea prompts específicos para una página individual
         
+        El system prompt es el mismo para las 10 páginas y el contexto de la
+        historia abre el user prompt; lo propio de la página va al final para
+        que vLLM reutilice el prefijo entre páginas (ver prompt_layout).
+        
         Returns:
             Tuple de (system_prompt, user_prompt)
         """
@@ -176,27 +221,21 @@ class ParallelCuentacuentos:
         with self.used_rimas_lock:
             rimas_prohibidas = list(self.used_rimas)
         
-        # System prompt simplificado y enfocado
-        system_prompt = f"""Eres un experto en versos infantiles. Tu tarea es crear EXACTAMENTE 4 versos para la página {page_num} del cuento.
+        # El brief puede traer los personajes como nombres o como dicts con "nombre"
+        personajes = [p.get('nombre', '') if isinstance(p, dict) else str(p)
+                      for p in (self.brief_data or {}).get('personajes', [])]
 
-REGLA ABSOLUTA #1: NUNCA uses la misma palabra para rimar.
-REGLA ABSOLUTA #2: Usar esquema {rima_scheme} ({rima_nombre}): {scheme_instructions}
-REGLA ABSOLUTA #3: Cada verso debe tener entre 8-15 sílabas.
+        # Contexto común a todas las páginas de la historia
+        shared_context = f"""HISTORIA:
+- Edad objetivo: {edad} años (usa vocabulario muy simple)
+- Personajes: {', '.join(personajes) if self.brief_data else 'Emilia y Caty'}
+- Leitmotiv: '{leitmotiv}'"""
 
-Edad objetivo: {edad} años (usa vocabulario muy simple).
+        # Lo propio de esta página, al final
+        call = f"""PÁGINA {page_num} - CONTEXTO:
 
-{"INCLUYE EL LEITMOTIV: '" + leitmotiv + "' en algún verso." if include_leitmotiv else ""}
-
-Responde ÚNICAMENTE con este JSON:
-{{
-  "pagina": {page_num},
-  "versos": {self.get_scheme_example(rima_scheme)},
-  "palabras_finales": ["palabra1", "palabra2", "palabra3", "palabra4"],
-  "esquema_usado": "{rima_scheme}"
-}}"""
-
-        # User prompt con contexto específico
-        user_prompt = f"""PÁGINA {page_num} - CONTEXTO:
+ESQUEMA DE RIMA: {rima_scheme} ({rima_nombre}): {scheme_instructions}
+Patrón de los versos: {self.get_scheme_example(rima_scheme)}
 
 NARRATIVA (Director):
 - Objetivo: {beat.get('objetivo', '')}
@@ -208,56 +247,64 @@ PSICOEDUCACIÓN:
 - Habilidad: {psico.get('micro_habilidad', '')}
 - Frase modelo: {psico.get('frase_modelo', '')}
 
-PERSONAJES: {', '.join(self.brief_data.get('personajes', [])) if self.brief_data else 'Emilia y Caty'}
+{"INCLUYE EL LEITMOTIV: '" + leitmotiv + "' en algún verso." if include_leitmotiv else ""}
 
 {"PALABRAS YA USADAS PARA RIMAR (NO REPETIR): " + ', '.join(rimas_prohibidas) if rimas_prohibidas else ""}
 
-Crea 4 versos que:
+Crea 4 versos para la página {page_num} que:
 1. Cuenten esta parte de la historia
 2. {"Incluyan el leitmotiv '" + leitmotiv + "'" if include_leitmotiv else "Mantengan fluidez narrativa"}
 3. NO repitan ninguna palabra para rimar
-4. Sean comprensibles para {edad} años"""
+4. Sigan el esquema {rima_scheme}
+5. Sean comprensibles para {edad} años"""
         
-        return system_prompt, user_prompt
+        return build_prompt(PAGE_CONTRACT, shared_context=shared_context, call=call)
     
-    def run_qa_verification(self, page_result: Dict, page_num: int, retry: int) -> Dict[str, Any]:
+    def build_qa_request(self, page_result: Dict, page_num: int) -> Optional[Dict[str, Any]]:
         """
-        Ejecuta verificación QA externa usando el agente verificador_qa
+        Arma la llamada al verificador_qa para una página
         
         Returns:
-            Dict con resultados del QA incluyendo score y feedback
+            Argumentos de generate() o None si la página no tiene criterios específicos
         """
-        try:
-            # Cargar prompt del verificador QA
-            qa_prompt_path = self.base_dir / 'flujo' / self.version / 'agentes' / 'verificador_qa.json'
-            with open(qa_prompt_path, 'r', encoding='utf-8') as f:
-                qa_data = json.load(f)
-            
-            # Cargar criterios específicos para la página
-            criterios_path = self.base_dir / 'flujo' / self.version / 'criterios_evaluacion' / '03_cuentacuentos.json'
-            with open(criterios_path, 'r', encoding='utf-8') as f:
-                criterios = json.load(f)
-            
-            # Extraer criterios específicos de la página
-            page_key = f"pagina_{page_num}"
-            if page_key not in criterios["metricas"]:
-                logger.warning(f"No hay criterios específicos para página {page_num}")
-                return {"qa_score": 4.0, "pasa_umbral": True, "problemas_detectados": []}
-            
-            page_criteria = criterios["metricas"][page_key]
-            
-            # Construir prompt de verificación
-            qa_user_prompt = f"""EVALÚA LA PÁGINA {page_num} DEL CUENTACUENTOS
+        # Cargar prompt del verificador QA
+        qa_prompt_path = self.base_dir / 'flujo' / self.version / 'agentes' / 'verificador_qa.json'
+        with open(qa_prompt_path, 'r', encoding='utf-8') as f:
+            qa_data = json.load(f)
+        
+        # Cargar criterios específicos para la página
+        criterios_path = self.base_dir / 'flujo' / self.version / 'criterios_evaluacion' / '03_cuentacuentos.json'
+        with open(criterios_path, 'r', encoding='utf-8') as f:
+            criterios = json.load(f)
+        
+        # Extraer criterios específicos de la página
+        page_key = f"pagina_{page_num}"
+        if page_key not in criterios["metricas"]:
+            logger.warning(f"No hay criterios específicos para página {page_num}")
+            return None
+        
+        page_criteria = criterios["metricas"][page_key]
+        
+        # Construir prompt de verificación: configuración e instrucciones (iguales
+        # para las 10 páginas) primero, la página a evaluar al final
+        criteria = f"""=== CONFIGURACIÓN ===
+{json.dumps(criterios["configuracion"], ensure_ascii=False, indent=2)}
 
-=== PÁGINA A EVALUAR ===
-{json.dumps(page_result, ensure_ascii=False, indent=2)}
+=== INSTRUCCIONES ===
+1. Evalúa cada criterio de la página como true/false
+2. Calcula el porcentaje de cumplimiento
+3. Proporciona feedback específico para mejorar
+4. Sé JUSTO pero RIGUROSO con las rimas repetidas
+
+RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
+        
+        shared_context = f"LEITMOTIV: {self.director_data.get('leitmotiv', '') if self.director_data else ''}"
+        
+        call = f"""EVALÚA LA PÁGINA {page_num} DEL CUENTACUENTOS
 
 === CRITERIOS DE EVALUACIÓN ===
 {json.dumps(page_criteria, ensure_ascii=False, indent=2)}
 
-=== CONFIGURACIÓN ===
-{json.dumps(criterios["configuracion"], ensure_ascii=False, indent=2)}
-
 === DATOS DE CONTEXTO ===
 DIRECTOR (beat_sheet[{page_num-1}]):
 {json.dumps(self.director_data['beat_sheet'][page_num-1] if self.director_data else {}, ensure_ascii=False, indent=2)}
@@ -265,47 +312,102 @@ DIRECTOR (beat_sheet[{page_num-1}]):
 PSICOEDUCADOR (mapa_psico_narrativo[{page_num-1}]):
 {json.dumps(self.psicoeducador_data['mapa_psico_narrativo'][page_num-1] if self.psicoeducador_data else {}, ensure_ascii=False, indent=2)}
 
-LEITMOTIV: {self.director_data.get('leitmotiv', '') if self.director_data else ''}
-
 === ESQUEMA DE RIMA CONFIGURADO ===
 PÁGINA {page_num}: {self.rima_config.get('pages', {}).get(str(page_num), {}).get('scheme', 'AABB')}
 Nombre: {self.rima_config.get('pages', {}).get(str(page_num), {}).get('nombre', 'Rima pareada')}
 Instrucción: {self.get_scheme_instructions(self.rima_config.get('pages', {}).get(str(page_num), {}).get('scheme', 'AABB'))}
 
-=== INSTRUCCIONES ===
-1. Evalúa cada criterio como true/false
-2. Calcula el porcentaje de cumplimiento
-3. Proporciona feedback específico para mejorar
-4. Sé JUSTO pero RIGUROSO con las rimas repetidas
-
-RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
+=== PÁGINA A EVALUAR ===
+{json.dumps(page_result, ensure_ascii=False, indent=2)}"""
+        
+        qa_system_prompt, qa_user_prompt = build_prompt(
+            qa_data["content"], criteria=criteria, shared_context=shared_context, call=call
+        )
+        
+        return {
+            "system_prompt": qa_system_prompt,
+            "user_prompt": qa_user_prompt,
+            "temperature": 0.3,  # Baja temperatura para consistencia
+            "max_tokens": 30000,  # AUMENTADO: 30000 tokens para QA completo
+            "agent_name": "verificador_qa_03_cuentacuentos",
+            "deadline": self.deadline
+        }
+    
+    def handle_qa_response(self, page_num: int, retry: int, response: Any) -> Dict[str, Any]:
+        """Parsea y guarda la respuesta del verificador_qa de una página"""
+        qa_result = json.loads(response) if isinstance(response, str) else response
+        self.save_qa_verification(page_num, retry, qa_result)
+        return qa_result
+    
+    def qa_fallback(self, page_num: int, error: Any) -> Dict[str, Any]:
+        """QA por defecto cuando la verificación falla"""
+        logger.error(f"Error en verificación QA para página {page_num}: {error}")
+        return {
+            "qa_score": 3.0,
+            "pasa_umbral": False,
+            "problemas_detectados": [f"Error en verificación: {str(error)}"],
+            "mejoras_especificas": []
+        }
+    
+    @traced("qa", "page_num", "retry")
+    def run_qa_verification(self, page_result: Dict, page_num: int, retry: int) -> Dict[str, Any]:
+        """
+        Ejecuta verificación QA externa usando el agente verificador_qa
+        
+        Returns:
+            Dict con resultados del QA incluyendo score y feedback
+        """
+        try:
+            request = self.build_qa_request(page_result, page_num)
+            if request is None:
+                return dict(DEFAULT_QA_RESULT)
             
             # Llamar al LLM con el verificador QA
-            response = self.llm_client.generate(
-                system_prompt=qa_data["content"],
-                user_prompt=qa_user_prompt,
-                temperature=0.3,  # Baja temperatura para consistencia
-                max_tokens=30000  # AUMENTADO: 30000 tokens para QA completo
-            )
-            
-            # Parsear respuesta
-            qa_result = json.loads(response) if isinstance(response, str) else response
-            
-            # Guardar resultado QA
-            self.save_qa_verification(page_num, retry, qa_result)
-            
-            return qa_result
+            response = self.llm_client.generate(**request)
+            return self.handle_qa_response(page_num, retry, response)
             
         except Exception as e:
-            logger.error(f"Error en verificación QA para página {page_num}: {e}")
             # Retornar QA por defecto si falla
-            return {
-                "qa_score": 3.0,
-                "pasa_umbral": False,
-                "problemas_detectados": [f"Error en verificación: {str(e)}"],
-                "mejoras_especificas": []
-            }
+            return self.qa_fallback(page_num, e)
+    
+    @traced("qa", "retry")
+    def run_qa_batch(self, page_results: Dict[int, Dict], retry: int) -> Dict[int, Dict[str, Any]]:
+        """
+        Verifica varias páginas con el verificador_qa en una sola ronda
+        
+        Args:
+            page_results: Resultado de cada página a verificar
+            retry: Intento actual (para los archivos de QA)
+        
+        Returns:
+            QA de cada página (el por defecto si su verificación falla)
+        """
+        qa_results = {}
+        requests = {}
+        for page_num, page_result in page_results.items():
+            try:
+                request = self.build_qa_request(page_result, page_num)
+            except Exception as e:
+                qa_results[page_num] = self.qa_fallback(page_num, e)
+                continue
+            if request is None:
+                qa_results[page_num] = dict(DEFAULT_QA_RESULT)
+            else:
+                requests[page_num] = request
+        
+        if requests:
+            logger.info(f"🔍 Ejecutando verificación QA en lote para páginas {list(requests)}, intento {retry+1}")
+            responses = self.llm_client.generate_batch(list(requests.values()))
+            for page_num, item in zip(requests, responses):
+                try:
+                    if item["status"] != "success":
+                        raise RuntimeError(item["error"])
+                    qa_results[page_num] = self.handle_qa_response(page_num, retry, item["output"])
+                except Exception as e:
+                    qa_results[page_num] = self.qa_fallback(page_num, e)
+        return qa_results
     
+    @traced("io", "page_num", "retry")
     def save_qa_verification(self, page_num: int, retry: int, qa_result: Dict):
         """Guarda el resultado de verificación QA de una página"""
         story_path = get_story_path(self.story_id)
@@ -322,11 +424,11 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
             "qa_result": qa_result
         }
         
-        with open(qa_file, 'w', encoding='utf-8') as f:
-            json.dump(qa_data, f, ensure_ascii=False, indent=2)
+        atomic_write_json(qa_file, qa_data)
         
         logger.info(f"📊 QA guardado: {filename}")
     
+    @traced("io", "page_num", "retry")
     def save_qa_feedback(self, page_num: int, retry: int, feedback: List[str]):
         """Guarda el feedback consolidado para el siguiente intento"""
         story_path = get_story_path(self.story_id)
@@ -343,8 +445,7 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
             "feedback_items": feedback
         }
         
-        with open(feedback_file, 'w', encoding='utf-8') as f:
-            json.dump(feedback_data, f, ensure_ascii=False, indent=2)
+        atomic_write_json(feedback_file, feedback_data)
     
     def build_feedback_prompt(self, page_num: int, retry: int) -> str:
         """
@@ -371,6 +472,169 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
         
         return ""
     
+    @traced("cpu", "page_num", "retry")
+    def build_page_request(self, page_num: int, retry: int) -> Dict[str, Any]:
+        """
+        Arma la llamada al LLM para un intento de una página y guarda su input
+        
+        Returns:
+            Argumentos de generate()
+        """
+        # Crear prompts para esta página
+        system_prompt, user_prompt = self.create_page_prompt(page_num, retry)
+        
+        # Si es un reintento, agregar feedback del intento anterior
+        if retry > 0:
+            feedback_prompt = self.build_feedback_prompt(page_num, retry)
+            if feedback_prompt:
+                user_prompt = f"{user_prompt}\n\n{feedback_prompt}"
+        
+        # max_tokens según las páginas históricas; el configurado es el tope si se trunca
+        max_tokens = get_max_tokens_sizer().recommend(PAGE_SIZING_KEY, self.config["max_tokens"])
+        
+        # Guardar input de esta página
+        self.save_page_input(page_num, retry, system_prompt, user_prompt, max_tokens)
+        
+        return {
+            "system_prompt": system_prompt,
+            "user_prompt": user_prompt,
+            "temperature": self.config["temperature"],
+            "max_tokens": max_tokens,
+            "top_p": self.config["top_p"],
+            "use_cache": False if retry > 0 else None,  # Reintentos piden generación nueva
+            "agent_name": "03_cuentacuentos",
+            "deadline": self.deadline,
+            "max_tokens_ceiling": self.config["max_tokens"],
+            "json_schema": get_agent_schema(PAGE_SCHEMA_NAME)
+        }
+    
+    @traced("cpu", "page_num", "retry")
+    def handle_page_response(self, page_num: int, retry: int, response: Any,
+                             start_time: float) -> Tuple[Dict, bool, List[str]]:
+        """
+        Guarda la respuesta de un intento de una página y valida su estructura
+        
+        Returns:
+            Tuple de (resultado, estructura_valida, problemas)
+        """
+        escalated = isinstance(response, dict) and (response.get("_metadata_tokens") or {}).get("max_tokens_escalated")
+        if escalated:
+            get_max_tokens_sizer().record_truncation(PAGE_SIZING_KEY, escalated)
+        
+        # Guardar respuesta/output de esta página
+        self.save_page_output(page_num, retry, response, time.time() - start_time)
+        
+        # Parsear respuesta
+        if isinstance(response, str):
+            result = json.loads(response)
+        else:
+            result = response
+        
+        # Validar estructura básica primero
+        structure_valid, structure_issues = self.validate_page_structure(result, page_num)
+        return result, structure_valid, structure_issues
+    
+    @traced("cpu", "page_num", "retry")
+    def resolve_page(self, page_num: int, retry: int, result: Dict, structure_valid: bool,
+                     structure_issues: List[str], qa_verification: Optional[Dict],
+                     start_time: float) -> Optional[Dict[str, Any]]:
+        """
+        Decide el resultado de un intento de una página a partir de su QA
+        
+        Args:
+            qa_verification: Resultado del verificador_qa (None si no se ejecutó)
+        
+        Returns:
+            Resultado final de la página, o None si corresponde otro intento
+        """
+        qa_score = 3.0  # Score por defecto
+        qa_passed = False
+        qa_issues = structure_issues.copy()
+        
+        if structure_valid:
+            # Verificación QA condicional basada en mode_verificador_qa
+            if self.mode_verificador_qa:
+                qa_passed = qa_verification.get('pasa_umbral', False)
+                logger.info(f"📊 QA resultado para página {page_num}: pasa={qa_passed}")
+                
+                # Extraer score del QA
+                if isinstance(qa_verification.get('promedio'), dict) and 'nota_final' in qa_verification['promedio']:
+                    qa_score = qa_verification['promedio']['nota_final']
+                else:
+                    qa_score = qa_verification.get('qa_score', 3.0)
+            else:
+                # Si mode_verificador_qa es False, aprobar automáticamente
+                logger.info(f"⚡ Saltando verificación QA para página {page_num} (mode_verificador_qa=False)")
+                qa_passed = True
+                qa_score = 4.5  # Score por defecto cuando no hay verificación
+                qa_verification = {
+                    'pasa_umbral': True,
+                    'qa_score': qa_score,
+                    'nota': 'QA automático (verificador deshabilitado)'
+                }
+            
+            if not qa_passed:
+                # QA externo falló, actualizar issues
+                qa_issues = qa_verification.get('problemas_detectados', [])
+                
+                # Guardar feedback para siguiente intento si no es el último
+                if retry < self.config["max_retries_per_page"] - 1:
+                    mejoras = qa_verification.get('mejoras_especificas', [])
+                    self.save_qa_feedback(page_num, retry, mejoras if mejoras else qa_issues)
+        else:
+            # Si falló validación de estructura, score bajo y no ejecutar QA
+            qa_score = 1.0
+            logger.warning(f"⚠️ Página {page_num} falló validación de estructura: {structure_issues}")
+        
+        if qa_passed:
+            # Agregar palabras finales a la lista global (thread-safe)
+            if "palabras_finales" in result:
+                with self.used_rimas_lock:
+                    self.used_rimas.update(result["palabras_finales"])
+            
+            # Preparar resultado exitoso
+            logger.info(f"✅ Página {page_num} completada exitosamente (QA: {qa_score:.1f})")
+            return {
+                "page_num": page_num,
+                "success": True,
+                "versos": result.get("versos", []),
+                "palabras_finales": result.get("palabras_finales", []),
+                "qa_score": qa_score,
+                "qa_verification": qa_verification,
+                "retry_count": retry,
+                "processing_time": time.time() - start_time
+            }
+        
+        logger.warning(f"⚠️ Página {page_num} falló QA (intento {retry + 1}): {qa_issues}")
+        if retry == self.config["max_retries_per_page"] - 1:
+            # Último intento fallido
+            return {
+                "page_num": page_num,
+                "success": False,
+                "error": f"QA failed after {retry + 1} attempts",
+                "qa_issues": qa_issues,
+                "processing_time": time.time() - start_time
+            }
+        return None
+    
+    def page_error(self, page_num: int, retry: int, error: Any, start_time: float) -> Optional[Dict[str, Any]]:
+        """
+        Registra el error de un intento de una página
+        
+        Returns:
+            Resultado fallido si era el último intento, o None si corresponde otro
+        """
+        logger.error(f"❌ Error procesando página {page_num}: {error}")
+        if retry == self.config["max_retries_per_page"] - 1:
+            return {
+                "page_num": page_num,
+                "success": False,
+                "error": str(error),
+                "processing_time": time.time() - start_time
+            }
+        return None
+    
+    @traced("page", "page_num")
     def process_single_page(self, page_num: int) -> Dict[str, Any]:
         """
         Procesa una página individual con reintentos si es necesario
@@ -383,121 +647,25 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
         
         for retry in range(self.config["max_retries_per_page"]):
             try:
-                # Crear prompts para esta página
-                system_prompt, user_prompt = self.create_page_prompt(page_num, retry)
-                
-                # Si es un reintento, agregar feedback del intento anterior
-                if retry > 0:
-                    feedback_prompt = self.build_feedback_prompt(page_num, retry)
-                    if feedback_prompt:
-                        user_prompt = f"{user_prompt}\n\n{feedback_prompt}"
-                
-                # Guardar input de esta página
-                self.save_page_input(page_num, retry, system_prompt, user_prompt)
-                
                 # Llamar al LLM
-                response = self.llm_client.generate(
-                    system_prompt=system_prompt,
-                    user_prompt=user_prompt,
-                    temperature=self.config["temperature"],
-                    max_tokens=self.config["max_tokens"],
-                    top_p=self.config["top_p"]
+                response = self.llm_client.generate(**self.build_page_request(page_num, retry))
+                result, structure_valid, structure_issues = self.handle_page_response(
+                    page_num, retry, response, start_time
                 )
                 
-                # Guardar respuesta/output de esta página
-                self.save_page_output(page_num, retry, response, time.time() - start_time)
-                
-                # Parsear respuesta
-                if isinstance(response, str):
-                    result = json.loads(response)
-                else:
-                    result = response
-                
-                # Validar estructura básica primero
-                structure_valid, structure_issues = self.validate_page_structure(result, page_num)
-                
-                # Si la estructura es válida, ejecutar QA externo SIEMPRE
+                # Si la estructura es válida, ejecutar QA externo
                 qa_verification = None
-                qa_score = 3.0  # Score por defecto
-                qa_passed = False
-                qa_issues = structure_issues.copy()
+                if structure_valid and self.mode_verificador_qa:
+                    logger.info(f"🔍 Ejecutando verificación QA para página {page_num}, intento {retry+1}")
+                    qa_verification = self.run_qa_verification(result, page_num, retry)
                 
-                if structure_valid:
-                    # Verificación QA condicional basada en mode_verificador_qa
-                    if self.mode_verificador_qa:
-                        logger.info(f"🔍 Ejecutando verificación QA para página {page_num}, intento {retry+1}")
-                        qa_verification = self.run_qa_verification(result, page_num, retry)
-                        qa_passed = qa_verification.get('pasa_umbral', False)
-                        logger.info(f"📊 QA resultado para página {page_num}: pasa={qa_passed}")
-                        
-                        # Extraer score del QA
-                        if 'promedio' in qa_verification and 'nota_final' in qa_verification['promedio']:
-                            qa_score = qa_verification['promedio']['nota_final']
-                        else:
-                            qa_score = qa_verification.get('qa_score', 3.0)
-                    else:
-                        # Si mode_verificador_qa es False, aprobar automáticamente
-                        logger.info(f"⚡ Saltando verificación QA para página {page_num} (mode_verificador_qa=False)")
-                        qa_passed = True
-                        qa_score = 4.5  # Score por defecto cuando no hay verificación
-                        qa_verification = {
-                            'pasa_umbral': True,
-                            'qa_score': qa_score,
-                            'nota': 'QA automático (verificador deshabilitado)'
-                        }
-                    
-                    if not qa_passed:
-                        # QA externo falló, actualizar issues
-                        qa_issues = qa_verification.get('problemas_detectados', [])
-                        
-                        # Guardar feedback para siguiente intento si no es el último
-                        if retry < self.config["max_retries_per_page"] - 1:
-                            mejoras = qa_verification.get('mejoras_especificas', [])
-                            self.save_qa_feedback(page_num, retry, mejoras if mejoras else qa_issues)
-                else:
-                    # Si falló validación de estructura, score bajo y no ejecutar QA
-                    qa_score = 1.0
-                    logger.warning(f"⚠️ Página {page_num} falló validación de estructura: {structure_issues}")
-                
-                if qa_passed:
-                    # Agregar palabras finales a la lista global (thread-safe)
-                    if "palabras_finales" in result:
-                        with self.used_rimas_lock:
-                            self.used_rimas.update(result["palabras_finales"])
-                    
-                    # Preparar resultado exitoso
-                    logger.info(f"✅ Página {page_num} completada exitosamente (QA: {qa_score:.1f})")
-                    return {
-                        "page_num": page_num,
-                        "success": True,
-                        "versos": result.get("versos", []),
-                        "palabras_finales": result.get("palabras_finales", []),
-                        "qa_score": qa_score,
-                        "qa_verification": qa_verification,
-                        "retry_count": retry,
-                        "processing_time": time.time() - start_time
-                    }
-                else:
-                    logger.warning(f"⚠️ Página {page_num} falló QA (intento {retry + 1}): {qa_issues}")
-                    if retry == self.config["max_retries_per_page"] - 1:
-                        # Último intento fallido
-                        return {
-                            "page_num": page_num,
-                            "success": False,
-                            "error": f"QA failed after {retry + 1} attempts",
-                            "qa_issues": qa_issues,
-                            "processing_time": time.time() - start_time
-                        }
-                    
+                outcome = self.resolve_page(
+                    page_num, retry, result, structure_valid, structure_issues, qa_verification, start_time
+                )
             except Exception as e:
-                logger.error(f"❌ Error procesando página {page_num}: {e}")
-                if retry == self.config["max_retries_per_page"] - 1:
-                    return {
-                        "page_num": page_num,
-                        "success": False,
-                        "error": str(e),
-                        "processing_time": time.time() - start_time
-                    }
+                outcome = self.page_error(page_num, retry, e, start_time)
+            if outcome is not None:
+                return outcome
         
         return {
             "page_num": page_num,
@@ -506,6 +674,7 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
             "processing_time": time.time() - start_time
         }
     
+    
     def validate_rima_scheme(self, palabras: List[str], scheme: str) -> Tuple[bool, str]:
         """
         Valida que las palabras finales sigan el esquema de rima configurado
@@ -651,6 +820,7 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
         
         return len(issues) == 0, issues
     
+    @traced("cpu")
     def consolidate_results(self, page_results: List[Dict]) -> Dict[str, Any]:
         """
         Consolida los resultados de todas las páginas en el formato final
@@ -696,7 +866,9 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
             }
         }
     
-    def save_page_input(self, page_num: int, retry: int, system_prompt: str, user_prompt: str):
+    @traced("io", "page_num", "retry")
+    def save_page_input(self, page_num: int, retry: int, system_prompt: str, user_prompt: str,
+                        max_tokens: Optional[int] = None):
         """Guarda el input/request de una página específica"""
         story_path = get_story_path(self.story_id)
         inputs_dir = story_path / "inputs" / "pages"
@@ -712,7 +884,8 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
             "timestamp": datetime.now().isoformat(),
             "config": {
                 "temperature": self.config["temperature"],
-                "max_tokens": self.config["max_tokens"],
+                "max_tokens": max_tokens or self.config["max_tokens"],
+                "max_tokens_configured": self.config["max_tokens"],
                 "top_p": self.config["top_p"]
             },
             "prompts": {
@@ -721,11 +894,11 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
             }
         }
         
-        with open(input_file, 'w', encoding='utf-8') as f:
-            json.dump(input_data, f, ensure_ascii=False, indent=2)
+        atomic_write_json(input_file, input_data)
         
         logger.debug(f"📝 Guardado input para página {page_num}, intento {retry+1}")
     
+    @traced("io", "page_num", "retry")
     def save_page_output(self, page_num: int, retry: int, response: Any, processing_time: float):
         """Guarda el output/resultado de una página específica"""
         story_path = get_story_path(self.story_id)
@@ -752,15 +925,14 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
         }
         
         # Guardar en outputs/pages
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, ensure_ascii=False, indent=2)
+        atomic_write_json(output_file, output_data)
         
         # Guardar en logs (por compatibilidad)
-        with open(log_file, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, ensure_ascii=False, indent=2)
+        atomic_write_json(log_file, output_data)
         
         logger.debug(f"📝 Guardado output para página {page_num}, intento {retry+1}")
     
+    @traced("io", "page_num")
     def save_partial_progress(self, page_num: int, result: Dict):
         """Guarda progreso parcial para monitoreo en tiempo real"""
         story_path = get_story_path(self.story_id)
@@ -770,14 +942,14 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
             self.pages_completed[page_num] = result
             
             # Escribir archivo parcial
-            with open(partial_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "pages_completed": list(self.pages_completed.keys()),
-                    "total_pages": 10,
-                    "status": "processing",
-                    "timestamp": datetime.now().isoformat()
-                }, f, ensure_ascii=False, indent=2)
+            atomic_write_json(partial_file, {
+                "pages_completed": list(self.pages_completed.keys()),
+                "total_pages": 10,
+                "status": "processing",
+                "timestamp": datetime.now().isoformat()
+            })
     
+    @traced("agent", name="cuentacuentos_paginas")
     def run(self) -> Dict[str, Any]:
         """
         Ejecuta el procesamiento de todas las páginas
@@ -794,6 +966,7 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
             logger.info(f"📊 Configuración: {self.config['max_workers']} workers, {self.config['max_retries_per_page']} reintentos por página")
             return self.process_parallel()
     
+    @traced("pipeline")
     def process_sequential(self) -> Dict[str, Any]:
         """
         Procesa las páginas de forma completamente secuencial
@@ -822,7 +995,7 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
                 # Intento adicional de recuperación para páginas críticas
                 if page_num in [1, 2, 5, 10]:  # Páginas críticas (inicio, leitmotiv, final)
                     logger.warning(f"⚠️ Reintentando página crítica {page_num} con configuración especial...")
-                    time.sleep(3)
+                    self._pace(3)
                     
                     # Reintento con parámetros ajustados
                     retry_result = self.process_single_page(page_num)
@@ -832,53 +1005,103 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
             
             # Delay entre páginas para evitar saturación
             if page_num < 10:
-                time.sleep(self.config.get("delay_between_pages", 2))
+                self._pace(self.config.get("delay_between_pages", 2))
         
         # Consolidar y validar resultados
         return self.finalize_results(page_results, start_time)
     
+    @traced("page", "pages", "retry")
+    def process_wave(self, pages: List[int], retry: int, start_time: float) -> Dict[int, Optional[Dict[str, Any]]]:
+        """
+        Procesa un intento de varias páginas en un lote
+        
+        Los prompts se arman con las rimas aprobadas hasta ahora, así que las
+        páginas de la misma oleada no se ven entre sí pero sí a las anteriores.
+        
+        Returns:
+            page_num -> resultado final, o None si corresponde otro intento
+        """
+        outcomes: Dict[int, Optional[Dict[str, Any]]] = {}
+        
+        requests = {}
+        for page_num in pages:
+            try:
+                requests[page_num] = self.build_page_request(page_num, retry)
+            except Exception as e:
+                outcomes[page_num] = self.page_error(page_num, retry, e, start_time)
+        
+        # Todas las páginas de la oleada en una sola llamada al cliente
+        evaluated = {}
+        responses = self.llm_client.generate_batch(list(requests.values())) if requests else []
+        for page_num, item in zip(requests, responses):
+            try:
+                if item["status"] != "success":
+                    raise RuntimeError(item["error"])
+                evaluated[page_num] = self.handle_page_response(page_num, retry, item["output"], start_time)
+            except Exception as e:
+                outcomes[page_num] = self.page_error(page_num, retry, e, start_time)
+        
+        # QA en lote de las páginas con estructura válida
+        qa_results = {}
+        if self.mode_verificador_qa:
+            qa_results = self.run_qa_batch(
+                {page_num: result for page_num, (result, valid, _) in evaluated.items() if valid}, retry
+            )
+        
+        for page_num, (result, structure_valid, structure_issues) in evaluated.items():
+            try:
+                outcomes[page_num] = self.resolve_page(
+                    page_num, retry, result, structure_valid, structure_issues,
+                    qa_results.get(page_num), start_time
+                )
+            except Exception as e:
+                outcomes[page_num] = self.page_error(page_num, retry, e, start_time)
+        return outcomes
+    
+    @traced("pipeline")
     def process_parallel(self) -> Dict[str, Any]:
         """
-        Procesa las páginas en paralelo (método original mejorado)
+        Procesa las páginas en paralelo por rondas
+        
+        Cada ronda envía las páginas pendientes en oleadas de max_workers: las
+        páginas de una oleada van en un solo lote al LLM y luego se verifican
+        con QA, también en un lote. Las rimas de las páginas aprobadas entran
+        en las palabras prohibidas de las oleadas siguientes. Las páginas
+        rechazadas pasan a la ronda siguiente con su feedback.
         """
-        logger.info(f"📊 Configuración: {self.config['max_workers']} workers, {self.config['max_retries_per_page']} reintentos por página")
+        wave_size = max(1, self.config["max_workers"])
+        logger.info(f"📊 Configuración: oleadas de hasta {wave_size} páginas, "
+                    f"{self.config['max_retries_per_page']} reintentos por página")
         start_time = time.time()
-        page_results = []
+        results: Dict[int, Dict[str, Any]] = {}
+        pending = list(range(1, 11))
         
-        # Crear ThreadPool y procesar páginas en paralelo con delay
-        with ThreadPoolExecutor(max_workers=self.config["max_workers"]) as executor:
-            # Lanzar todas las tareas con delay entre ellas
-            futures = {}
-            for page_num in range(1, 11):
-                future = executor.submit(self.process_single_page, page_num)
-                futures[future] = page_num
-                # Agregar delay entre solicitudes para evitar saturación
-                if page_num < 10:
-                    time.sleep(self.config.get("delay_between_pages", 1))
+        for retry in range(self.config["max_retries_per_page"]):
+            if not pending:
+                break
+            logger.info(f"📦 Ronda {retry + 1}: {len(pending)} páginas pendientes {pending}")
+            outcomes: Dict[int, Optional[Dict[str, Any]]] = {}
+            for index in range(0, len(pending), wave_size):
+                outcomes.update(self.process_wave(pending[index:index + wave_size], retry, start_time))
             
-            # Procesar resultados conforme se completan
-            for future in as_completed(futures):
-                page_num = futures[future]
-                try:
-                    result = future.result(timeout=self.config["page_timeout"])
-                    page_results.append(result)
-                    
-                    # Guardar progreso parcial
-                    self.save_partial_progress(page_num, result)
-                    
-                    # Log de progreso
-                    if result["success"]:
-                        logger.info(f"✅ Página {page_num} completada en {result['processing_time']:.2f}s")
-                    else:
-                        logger.warning(f"❌ Página {page_num} falló: {result.get('error', 'Unknown error')}")
-                        
-                except Exception as e:
-                    logger.error(f"❌ Error procesando página {page_num}: {e}")
-                    page_results.append({
-                        "page_num": page_num,
-                        "success": False,
-                        "error": str(e)
-                    })
+            pending = []
+            for page_num in sorted(outcomes):
+                result = outcomes[page_num]
+                if result is None:
+                    pending.append(page_num)
+                    continue
+                results[page_num] = result
+                
+                # Guardar progreso parcial
+                self.save_partial_progress(page_num, result)
+                
+                # Log de progreso
+                if result["success"]:
+                    logger.info(f"✅ Página {page_num} completada en {result['processing_time']:.2f}s")
+                else:
+                    logger.warning(f"❌ Página {page_num} falló: {result.get('error', 'Unknown error')}")
+        
+        page_results = list(results.values())
         
         # IMPORTANTE: Reintentar páginas fallidas de forma secuencial
         failed_pages = [r["page_num"] for r in page_results if not r["success"]]
@@ -886,7 +1109,7 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
             logger.warning(f"⚠️ Reintentando {len(failed_pages)} páginas fallidas de forma secuencial: {failed_pages}")
             for page_num in failed_pages:
                 logger.info(f"🔄 Reintentando página {page_num} de forma secuencial...")
-                time.sleep(2)  # Mayor delay antes de reintentar
+                self._pace(2)  # Mayor delay antes de reintentar
                 retry_result = self.process_single_page(page_num)
                 
                 # Reemplazar el resultado fallido con el nuevo intento
@@ -901,6 +1124,7 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
         # Consolidar y validar resultados
         return self.finalize_results(page_results, start_time)
     
+    @traced("io")
     def finalize_results(self, page_results: List[Dict], start_time: float) -> Dict[str, Any]:
         """
         Consolida, valida y guarda los resultados finales
@@ -934,9 +1158,7 @@ RESPONDE ÚNICAMENTE CON EL JSON ESPECIFICADO."""
         
         # Guardar resultado final solo si está completo
         story_path = get_story_path(self.story_id)
-        output_file = story_path / "03_cuentacuentos.json"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(final_result, f, ensure_ascii=False, indent=2)
+        atomic_write_json(story_path / "03_cuentacuentos.json", final_result)
         
         # Limpiar archivo parcial
         partial_file = story_path / "03_cuentacuentos_partial.json"
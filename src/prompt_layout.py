@@ -0,0 +1,48 @@
+"""
+Armado de prompts con el contenido estable primero
+
+vLLM reutiliza el KV cache de un prefijo ya procesado (automatic prefix
+caching), pero solo hasta el primer token en que dos requests difieren. Si
+el número de página o el esquema de rima aparecen en la primera línea del
+system prompt, ninguna llamada comparte prefijo con otra y todo el prompt
+se vuelve a procesar.
+
+build_prompt ordena las partes de la más estable a la más variable:
+1. contrato del agente (igual en todas sus llamadas, de todas las historias)
+2. criterios de evaluación (iguales en todas las llamadas del agente)
+3. contexto compartido de la historia (brief, dependencias, leitmotiv)
+4. variables de la llamada (página, esquema, salida a evaluar, feedback)
+
+Las partes 1 y 2 forman el system prompt y las 3 y 4 el user prompt. La
+instrucción JSON que agrega el cliente va al final del system prompt, que
+sigue siendo idéntico entre llamadas del mismo agente.
+"""
+from typing import Tuple
+
+# Separador entre secciones de un mismo mensaje
+SECTION_SEPARATOR = "\n\n"
+
+
+def join_sections(*sections: str) -> str:
+    """Une las secciones no vacías en el orden dado"""
+    return SECTION_SEPARATOR.join(section.strip("\n") for section in sections if section and section.strip())
+
+
+def build_prompt(contract: str,
+                 criteria: str = "",
+                 shared_context: str = "",
+                 call: str = "") -> Tuple[str, str]:
+    """
+    Arma el par (system_prompt, user_prompt) de una llamada
+
+    Args:
+        contract: Rol, reglas y formato de salida del agente; no debe incluir
+            nada propio de la historia ni de la llamada
+        criteria: Criterios o configuración fijos del agente
+        shared_context: Contexto común a todas las llamadas de la historia
+        call: Lo que cambia en cada llamada (va siempre al final)
+
+    Returns:
+        Tuple de (system_prompt, user_prompt)
+    """
+    return join_sections(contract, criteria), join_sections(shared_context, call)
@@ -8,6 +8,22 @@ from config import QUALITY_THRESHOLDS
 
 logger = logging.getLogger(__name__)
 
+# Campos requeridos por agente (también definen el JSON Schema de json_schemas.py)
+REQUIRED_FIELDS = {
+    "director": ["leitmotiv", "beat_sheet", "variantes", "qa"],
+    "psicoeducador": ["metas_generales", "mapa_psico_narrativo", "banderas", "qa"],
+    "cuentacuentos": ["paginas_texto", "leitmotiv_usado_en", "qa"],
+    "editor_claridad": ["paginas_texto_claro", "glosario", "cambios_clave", "qa"],
+    "ritmo_rima": ["paginas_texto_pulido", "esquema_rima", "finales_de_verso", "qa"],
+    "continuidad": ["character_bible", "continuidad_narrativa", "qa"],
+    "diseno_escena": ["prompts_paginas", "anotaciones", "qa"],
+    "direccion_arte": ["estilo_global", "color_script", "transiciones", "qa"],
+    "sensibilidad": ["riesgos_detectados", "correcciones_sugeridas", "apto_para_ninos", "qa"],
+    "portadista": ["titulos", "portada", "qa"],
+    "loader": ["loader", "qa"],
+    "validador": ["titulo", "paginas", "portada", "loader"]
+}
+
 
 class QualityGateChecker:
     """Validador de quality gates para las salidas de los agentes"""
@@ -241,25 +257,9 @@ class QualityGateChecker:
         """
         errors = []
         
-        # Definir campos requeridos por agente
-        required_fields = {
-            "director": ["leitmotiv", "beat_sheet", "variantes", "qa"],
-            "psicoeducador": ["metas_generales", "mapa_psico_narrativo", "banderas", "qa"],
-            "cuentacuentos": ["paginas_texto", "leitmotiv_usado_en", "qa"],
-            "editor_claridad": ["paginas_texto_claro", "glosario", "cambios_clave", "qa"],
-            "ritmo_rima": ["paginas_texto_pulido", "esquema_rima", "finales_de_verso", "qa"],
-            "continuidad": ["character_bible", "continuidad_narrativa", "qa"],
-            "diseno_escena": ["prompts_paginas", "anotaciones", "qa"],
-            "direccion_arte": ["estilo_global", "color_script", "transiciones", "qa"],
-            "sensibilidad": ["riesgos_detectados", "correcciones_sugeridas", "apto_para_ninos", "qa"],
-            "portadista": ["titulos", "portada", "qa"],
-            "loader": ["loader", "qa"],
-            "validador": ["titulo", "paginas", "portada", "loader"]
-        }
-        
         # Verificar campos requeridos
-        if agent_name in required_fields:
-            for field in required_fields[agent_name]:
+        if agent_name in REQUIRED_FIELDS:
+            for field in REQUIRED_FIELDS[agent_name]:
                 if field not in agent_output:
                     errors.append(f"Campo requerido '{field}' no encontrado")
         
@@ -0,0 +1,214 @@
+"""
+Journal de ejecución de cada historia (write-ahead, solo append)
+
+Si el proceso muere a mitad de una historia, los JSON de la carpeta no
+dicen qué pasos terminaron de verdad. runs/<id>/journal.jsonl registra, una
+línea JSON por evento, el inicio de la historia, el inicio y fin de cada
+agente y el sha256 de la salida que dejó. Los eventos que confirman un paso
+(story_started, story_resumed, agent_finished, story_finished) hacen fsync: lo que está en
+el journal antes de un commit sobrevive a la caída.
+
+Al arrancar la API, find_interrupted_stories encuentra las historias con
+story_started (o story_resumed) sin story_finished y se reanudan desde el último agente
+confirmado cuya salida en disco coincide con el hash del journal.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import JOURNAL_CONFIG
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILE = "journal.jsonl"
+
+# Estados con los que un agente deja una salida válida
+_COMMITTED_STATUSES = {"success", "up_to_date"}
+
+
+def file_sha256(path: Path) -> Optional[str]:
+    """sha256 del archivo, o None si no existe"""
+    path = Path(path)
+    if not path.exists():
+        return None
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def read_journal(path: Path) -> List[Dict[str, Any]]:
+    """
+    Eventos del journal en orden
+
+    Una línea incompleta al final (escritura cortada por la caída) se
+    ignora: solo cuentan los eventos escritos enteros.
+    """
+    path = Path(path)
+    if not path.exists():
+        return []
+    events = []
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"⚠️ Journal {path}: línea {number} incompleta, se ignora desde ahí")
+                break
+    return events
+
+
+def journal_state(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Estado de la historia según su journal
+
+    Returns:
+        Dict con:
+        - interrumpida: hay un story_started (o story_resumed) sin story_finished
+        - inicio: el último evento story_started (o None), con el pid de la
+          última reanudación
+        - confirmados: agente -> {file, sha256, fingerprint} de su último
+          agent_finished válido que no fue seguido de otro agent_started
+        - en_curso: agentes iniciados sin fin en la última ejecución
+    """
+    started = None
+    running = False
+    committed: Dict[str, Dict[str, Any]] = {}
+    in_progress: List[str] = []
+    artifacts: Dict[str, Dict[str, Any]] = {}
+
+    for event in events:
+        kind = event.get("event")
+        agent = event.get("agent")
+        if kind == "story_started":
+            started, running, in_progress = event, True, []
+        elif kind == "story_resumed":
+            # Los datos de la solicitud siguen siendo los del story_started original
+            started, running, in_progress = dict(started or event, pid=event.get("pid")), True, []
+        elif kind == "story_finished":
+            running, in_progress = False, []
+        elif kind == "agent_started":
+            committed.pop(agent, None)
+            artifacts.pop(agent, None)
+            if agent not in in_progress:
+                in_progress.append(agent)
+        elif kind == "artifact":
+            artifacts[agent] = {"file": event.get("file"), "sha256": event.get("sha256")}
+        elif kind == "agent_finished":
+            if agent in in_progress:
+                in_progress.remove(agent)
+            if event.get("status") in _COMMITTED_STATUSES and agent in artifacts:
+                committed[agent] = dict(artifacts[agent], fingerprint=event.get("fingerprint"))
+
+    return {
+        "interrumpida": running,
+        "inicio": started,
+        "confirmados": committed,
+        "en_curso": in_progress
+    }
+
+
+class StoryJournal:
+    """Journal append-only de una historia"""
+
+    def __init__(self, story_path: Path, fsync: Optional[bool] = None):
+        """
+        Args:
+            story_path: Carpeta de la historia en runs/
+            fsync: fsync en los commits (por defecto JOURNAL_FSYNC)
+        """
+        self.path = Path(story_path) / JOURNAL_FILE
+        self.enabled = JOURNAL_CONFIG["enabled"]
+        self.fsync = JOURNAL_CONFIG["fsync"] if fsync is None else fsync
+        self._lock = threading.Lock()
+
+    def append(self, event: str, commit: bool = False, **fields) -> Dict[str, Any]:
+        """
+        Agrega un evento al journal
+
+        Args:
+            event: Tipo de evento (story_started, agent_started, artifact, ...)
+            commit: Hacer fsync antes de retornar (punto de commit)
+            **fields: Datos del evento (deben ser serializables a JSON)
+        """
+        record = {"ts": datetime.now().isoformat(), "event": event, **fields}
+        if not self.enabled:
+            return record
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                if commit and self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        return record
+
+    def events(self) -> List[Dict[str, Any]]:
+        """Eventos escritos hasta ahora"""
+        with self._lock:
+            return read_journal(self.path)
+
+    def state(self) -> Dict[str, Any]:
+        """journal_state de esta historia"""
+        return journal_state(self.events())
+
+
+# Un journal por carpeta, compartido por los orquestadores de la misma historia
+_journals: Dict[Path, StoryJournal] = {}
+_journals_lock = threading.Lock()
+
+
+def get_story_journal(story_path: Path) -> StoryJournal:
+    """Obtiene el journal de una historia (una instancia por carpeta)"""
+    key = Path(story_path).resolve()
+    journal = _journals.get(key)
+    if journal is None:
+        with _journals_lock:
+            journal = _journals.get(key)
+            if journal is None:
+                journal = StoryJournal(key)
+                _journals[key] = journal
+    return journal
+
+
+def _process_alive(pid: Optional[int]) -> bool:
+    """True si pid es otro proceso vivo (la historia sigue en curso allí)"""
+    if not pid or pid == os.getpid():
+        return False
+    if os.name == "nt":
+        # os.kill(pid, 0) en Windows envía CTRL_C_EVENT: se asume que el proceso murió
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def find_interrupted_stories(runs_dir: Path) -> List[Tuple[Path, Dict[str, Any]]]:
+    """
+    Historias que quedaron a medias (story_started sin story_finished)
+
+    Se ignoran las que otro proceso vivo sigue ejecutando.
+
+    Returns:
+        Lista de (carpeta de la historia, estado del journal), de la más antigua a la más nueva
+    """
+    interrupted = []
+    for journal_path in sorted(Path(runs_dir).glob(f"*/{JOURNAL_FILE}")):
+        state = journal_state(read_journal(journal_path))
+        if not state["interrumpida"]:
+            continue
+        if _process_alive(state["inicio"].get("pid")):
+            logger.info(f"Historia {journal_path.parent.name} sigue en curso en el proceso {state['inicio']['pid']}")
+            continue
+        interrupted.append((journal_path.parent, state))
+    interrupted.sort(key=lambda item: item[1]["inicio"].get("ts", ""))
+    return interrupted
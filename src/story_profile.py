@@ -0,0 +1,247 @@
+"""
+Perfil de latencia de una historia ya procesada
+
+Con agentes en paralelo la suma de duraciones ya no explica cuánto tardó
+una historia: la acota la cadena de dependencias más larga (ruta crítica).
+profile_story lee el manifest (inicio y fin de cada agente), el grafo de
+dependencies.json de la versión y, si existen, la traza (trace.json) y los
+logs de los agentes, y calcula:
+
+- la ruta crítica con las duraciones medidas y la holgura de cada agente
+  fuera de ella (cuánto podría tardar más sin alargar la historia)
+- la espera de cada agente entre que sus dependencias terminaron y su inicio
+- el desglose del tiempo en cola del LLM, generación, verificación QA,
+  reintentos, pausas, I/O local y resto (CPU)
+
+Con trace.json el desglose sale de los spans de cada agente; sin traza se
+usan queue_wait y llm_latency de los logs y el resto queda como "otro".
+"""
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from agent_scheduler import build_agent_graph
+from config import load_version_config
+from manifest_store import read_manifest
+
+logger = logging.getLogger(__name__)
+
+# Categorías del desglose; "reintentos" se solapa con las demás (tiempo dentro de reintentos)
+BREAKDOWN_FIELDS = ("cola_llm", "generacion", "verificacion_qa", "pausas", "io_local", "otro")
+
+# Categorías de span que se atribuyen al desglose (las demás solo agrupan)
+_COUNTED_CATEGORIES = {"llm", "qa", "io", "sleep"}
+
+
+def critical_path(graph: Dict[str, set], durations: Dict[str, float]) -> Tuple[List[str], float, Dict[str, float]]:
+    """
+    Ruta crítica de un grafo de agentes (método de la ruta crítica)
+
+    Args:
+        graph: Dependencias de cada agente, en orden topológico
+        durations: Segundos de cada agente (los que faltan cuentan 0)
+
+    Returns:
+        Tuple de (agentes de la ruta crítica, su duración, holgura por agente)
+    """
+    earliest_finish: Dict[str, float] = {}
+    for agent, upstream in graph.items():
+        start = max((earliest_finish[u] for u in upstream), default=0.0)
+        earliest_finish[agent] = start + durations.get(agent, 0.0)
+    total = max(earliest_finish.values(), default=0.0)
+
+    latest_finish = {agent: total for agent in graph}
+    for agent in reversed(list(graph)):
+        latest_start = latest_finish[agent] - durations.get(agent, 0.0)
+        for upstream in graph[agent]:
+            latest_finish[upstream] = min(latest_finish[upstream], latest_start)
+    slack = {agent: round(max(latest_finish[agent] - earliest_finish[agent], 0.0), 3) for agent in graph}
+
+    path = []
+    current = max(earliest_finish, key=earliest_finish.get) if earliest_finish else None
+    while current is not None:
+        path.append(current)
+        upstream = graph[current]
+        current = max(upstream, key=earliest_finish.get) if upstream else None
+    return list(reversed(path)), round(total, 3), slack
+
+
+def _load_json(path: Path) -> Optional[Any]:
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _empty_breakdown() -> Dict[str, float]:
+    return dict({field: 0.0 for field in BREAKDOWN_FIELDS}, reintentos=0.0)
+
+
+def _contained(inner: Dict[str, Any], outer: Dict[str, Any]) -> bool:
+    return outer["ts"] <= inner["ts"] and inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"] and inner is not outer
+
+
+def breakdown_from_trace(trace: Dict[str, Any], agents: List[str]) -> Dict[str, Dict[str, float]]:
+    """
+    Desglose del tiempo de cada agente a partir de los spans de la traza
+
+    Un span cuenta para el agente si está en su mismo hilo dentro de su
+    intervalo; los spans contenidos en otro ya contado no se suman dos veces.
+    """
+    spans = [e for e in trace.get("traceEvents", []) if e.get("ph") == "X"]
+    result = {}
+    for agent_span in spans:
+        if agent_span.get("cat") != "agent" or agent_span["name"] not in agents:
+            continue
+        children = [e for e in spans if e["tid"] == agent_span["tid"] and _contained(e, agent_span)]
+        counted = [e for e in children if e.get("cat") in _COUNTED_CATEGORIES]
+        counted = [e for e in counted if not any(_contained(e, other) for other in counted)]
+        retries = [e for e in children if e["name"] == "run_agent" and (e.get("args") or {}).get("retry_count", 0) > 0]
+        retries = [e for e in retries if not any(_contained(e, other) for other in retries)]
+
+        breakdown = _empty_breakdown()
+        for event in counted:
+            seconds = event["dur"] / 1e6
+            args = event.get("args") or {}
+            if event["cat"] == "qa" or str(args.get("agent") or "").startswith("verificador_qa"):
+                breakdown["verificacion_qa"] += seconds
+            elif event["cat"] == "llm":
+                queue_wait = min(args.get("queue_wait") or 0.0, seconds)
+                breakdown["cola_llm"] += queue_wait
+                breakdown["generacion"] += seconds - queue_wait
+            elif event["cat"] == "sleep":
+                breakdown["pausas"] += seconds
+            else:
+                breakdown["io_local"] += seconds
+        breakdown["reintentos"] = sum(e["dur"] for e in retries) / 1e6
+        breakdown["otro"] = max(agent_span["dur"] / 1e6 - sum(breakdown[f] for f in BREAKDOWN_FIELDS), 0.0)
+        result[agent_span["name"]] = {key: round(value, 3) for key, value in breakdown.items()}
+    return result
+
+
+def breakdown_from_logs(logs_dir: Path, agent: str, duration: float) -> Dict[str, float]:
+    """Desglose aproximado con queue_wait y llm_latency de los logs del agente"""
+    breakdown = _empty_breakdown()
+    for entry in _load_json(logs_dir / f"{agent}.log") or []:
+        tokens = entry.get("tokens_consumed") or {}
+        breakdown["cola_llm"] += tokens.get("queue_wait", 0.0)
+        breakdown["generacion"] += tokens.get("llm_latency", 0.0)
+    breakdown["otro"] = max(duration - breakdown["cola_llm"] - breakdown["generacion"], 0.0)
+    return {key: round(value, 3) for key, value in breakdown.items()}
+
+
+def profile_story(story_path: Path) -> Dict[str, Any]:
+    """
+    Ruta crítica, holguras y desglose de latencia de una historia
+
+    Args:
+        story_path: Carpeta de la historia en runs/
+
+    Returns:
+        Dict con tiempo_total, ruta_critica, duracion_ruta_critica, agentes
+        (duración, inicio/fin relativos, espera, holgura, desglose) y el
+        desglose total
+
+    Raises:
+        FileNotFoundError: Si la historia no tiene manifest
+    """
+    manifest = read_manifest(story_path)
+    if manifest is None:
+        raise FileNotFoundError(f"No existe {story_path / 'manifest.json'}")
+
+    version = manifest.get("pipeline_version", "v1")
+    version_config = load_version_config(version)
+    pipeline = version_config["pipeline"]
+    graph = build_agent_graph(pipeline, version_config.get("dependencies", {}),
+                              version_config.get("parallel_groups", []))
+
+    timestamps = manifest.get("timestamps", {})
+    # Los agentes al día conservan los tiempos de una ejecución anterior: no son de esta
+    times = {
+        agent: (datetime.fromisoformat(t["start"]), datetime.fromisoformat(t["end"]))
+        for agent, t in timestamps.items() if "start" in t and "end" in t and not t.get("up_to_date")
+    }
+    origin = min((start for start, _ in times.values()), default=None)
+    durations = {agent: (end - start).total_seconds() for agent, (start, end) in times.items()}
+    path, path_length, slack = critical_path(graph, durations)
+
+    trace = _load_json(story_path / "trace.json")
+    trace_breakdown = breakdown_from_trace(trace, pipeline) if trace else {}
+
+    # Fin efectivo de cada agente; uno saltado termina cuando terminan sus dependencias
+    finished: Dict[str, datetime] = {}
+    for agent, upstream in graph.items():
+        finished[agent] = times[agent][1] if agent in times else max(
+            (finished[u] for u in upstream if finished[u] is not None), default=origin
+        )
+
+    agents = {}
+    totals = _empty_breakdown()
+    for agent in pipeline:
+        if agent not in times:
+            if timestamps.get(agent, {}).get("skipped"):
+                agents[agent] = {"saltado": True, "copia_de": timestamps[agent].get("source_file")}
+            elif timestamps.get(agent, {}).get("up_to_date"):
+                agents[agent] = {"al_dia": True, "duracion_previa": timestamps[agent].get("duration")}
+            continue
+        start, end = times[agent]
+        ready = max((finished[u] for u in graph[agent]), default=origin)
+        breakdown = trace_breakdown.get(agent) or breakdown_from_logs(story_path / "logs", agent, durations[agent])
+        for key, value in breakdown.items():
+            totals[key] += value
+        agents[agent] = {
+            "duracion": round(durations[agent], 3),
+            "inicio": round((start - origin).total_seconds(), 3),
+            "fin": round((end - origin).total_seconds(), 3),
+            "espera": round(max((start - ready).total_seconds(), 0.0), 3),
+            "holgura": slack.get(agent, 0.0),
+            "critico": agent in path,
+            "reintentos": manifest.get("reintentos", {}).get(agent, 0),
+            "desglose": breakdown
+        }
+
+    total_time = max((end for _, end in times.values()), default=origin) - origin if origin else None
+    return {
+        "story_id": manifest.get("story_id", story_path.name),
+        "pipeline_version": version,
+        "estado": manifest.get("estado"),
+        "tiempo_total": round(total_time.total_seconds(), 3) if total_time is not None else 0.0,
+        "suma_duraciones": round(sum(durations.values()), 3),
+        "ruta_critica": [agent for agent in path if agent in times],
+        "duracion_ruta_critica": path_length,
+        "agentes": agents,
+        "desglose": {key: round(value, 3) for key, value in totals.items()},
+        "fuente_desglose": "trace" if trace_breakdown else "logs"
+    }
+
+
+def format_profile(profile: Dict[str, Any]) -> str:
+    """Reporte de texto del perfil (para la CLI)"""
+    lines = [
+        f"Historia {profile['story_id']} ({profile['pipeline_version']}, {profile['estado']})",
+        f"Tiempo total {profile['tiempo_total']:.2f}s, suma de agentes {profile['suma_duraciones']:.2f}s, "
+        f"ruta crítica {profile['duracion_ruta_critica']:.2f}s",
+        f"Ruta crítica: {' -> '.join(profile['ruta_critica'])}",
+        "",
+        f"{'agente':<22}{'inicio':>8}{'dur.':>8}{'espera':>8}{'holgura':>9}  "
+        + "".join(f"{field:>16}" for field in BREAKDOWN_FIELDS + ('reintentos',))
+    ]
+    for agent, data in profile["agentes"].items():
+        if data.get("saltado"):
+            lines.append(f"{agent:<22}{'saltado (copia de ' + str(data['copia_de']) + ')':>33}")
+            continue
+        if data.get("al_dia"):
+            lines.append(f"{agent:<22}{'al día (no se re-ejecutó)':>33}")
+            continue
+        mark = "*" if data["critico"] else " "
+        lines.append(
+            f"{mark}{agent:<21}{data['inicio']:>8.2f}{data['duracion']:>8.2f}{data['espera']:>8.2f}{data['holgura']:>9.2f}  "
+            + "".join(f"{data['desglose'][field]:>16.2f}" for field in BREAKDOWN_FIELDS + ('reintentos',))
+        )
+    lines.append(f"{'total':<54}  " + "".join(
+        f"{profile['desglose'][field]:>16.2f}" for field in BREAKDOWN_FIELDS + ("reintentos",)
+    ))
+    lines.append(f"\n* ruta crítica; desglose desde {profile['fuente_desglose']}")
+    return "\n".join(lines)
@@ -0,0 +1,260 @@
+"""
+Conteo de tokens con el vocabulario de gpt-oss
+
+El tokenizer se carga de forma perezosa la primera vez que se cuenta algo:
+1. tokenizers (HuggingFace) con el tokenizer.json de TOKENIZER_PATH
+2. tiktoken (dependencia opcional) con la codificación TOKENIZER_ENCODING
+   (o200k_harmony), solo si su BPE ya está en la caché local de tiktoken:
+   nunca se descarga desde el event loop
+3. Heurística calibrada: cuenta palabras, números, puntuación e indentación
+   por separado (len(text) // 4 sobreestima la indentación del JSON y
+   subestima la puntuación) y ajusta un factor con los prompt_tokens reales
+   que devuelve el servidor
+
+Los conteos se memoizan por texto: los system prompts y las piezas estáticas
+se cuentan una sola vez por proceso.
+"""
+import hashlib
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import TOKENIZER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Tokens de la plantilla de chat (harmony) por mensaje y por request
+MESSAGE_OVERHEAD = 4
+REQUEST_OVERHEAD = 3
+
+# Piezas de la heurística: palabras, números, salto de línea con indentación,
+# otros espacios y secuencias de puntuación
+_PIECES = re.compile(r"[^\W\d_]+|\d+|[\r\n]+[ \t]*|[ \t]+|(?:[^\w\s]|_)+")
+
+# Archivo BPE de cada codificación de tiktoken (o200k_harmony usa el de o200k_base)
+_TIKTOKEN_BLOBS = {
+    "o200k_harmony": "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken",
+    "o200k_base": "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken",
+    "cl100k_base": "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+}
+
+
+def heuristic_count(text: str) -> int:
+    """
+    Estimación de tokens sin tokenizer, según el pre-tokenizado de o200k
+
+    Las palabras comunes (con o sin tildes) son un token y las largas se
+    parten en trozos de ~4 caracteres; los números van en grupos de 3 dígitos;
+    el salto de línea con su indentación es un token; un espacio simple se une
+    a la palabra siguiente; la puntuación se agrupa de a dos (`": "`, `},`).
+    """
+    tokens = 0
+    for piece in _PIECES.findall(text):
+        first = piece[0]
+        if first.isalpha():
+            tokens += 1 if len(piece) <= 6 else 1 + math.ceil((len(piece) - 6) / 4)
+        elif first.isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        elif first in "\r\n":
+            tokens += 1
+        elif first in " \t":
+            tokens += 0 if len(piece) == 1 else 1
+        else:
+            tokens += math.ceil(len(piece) / 2)
+    return tokens
+
+
+def tiktoken_cached(encoding: str) -> bool:
+    """
+    True si el BPE de la codificación ya está en la caché local de tiktoken
+
+    tiktoken.get_encoding descarga el archivo sin timeout cuando no está en
+    caché; el conteo corre dentro del event loop, así que sin caché no se usa.
+    Misma ubicación que tiktoken: TIKTOKEN_CACHE_DIR, DATA_GYM_CACHE_DIR o
+    <tmp>/data-gym-cache, con el sha1 de la URL como nombre.
+    """
+    blob = _TIKTOKEN_BLOBS.get(encoding)
+    if blob is None:
+        return False
+    if "TIKTOKEN_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["TIKTOKEN_CACHE_DIR"]
+    elif "DATA_GYM_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["DATA_GYM_CACHE_DIR"]
+    else:
+        cache_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if not cache_dir:
+        return False
+    return (Path(cache_dir) / hashlib.sha1(blob.encode()).hexdigest()).is_file()
+
+
+class TokenCounter:
+    """Cuenta tokens con el tokenizer de gpt-oss o con la heurística calibrada"""
+
+    def __init__(self,
+                 backend: Optional[str] = None,
+                 tokenizer_path: Optional[str] = None,
+                 encoding: Optional[str] = None,
+                 memo_entries: Optional[int] = None):
+        """
+        Args:
+            backend: auto, tokenizers, tiktoken o heuristic
+            tokenizer_path: tokenizer.json del modelo (para tokenizers)
+            encoding: Codificación de tiktoken
+            memo_entries: Textos cuyo conteo se memoiza
+        """
+        self.backend = backend or TOKENIZER_CONFIG["backend"]
+        self.tokenizer_path = tokenizer_path if tokenizer_path is not None else TOKENIZER_CONFIG["path"]
+        self.encoding = encoding or TOKENIZER_CONFIG["encoding"]
+        self.memo_entries = memo_entries if memo_entries is not None else TOKENIZER_CONFIG["memo_entries"]
+        # Factor real / heurística, ajustado con los prompt_tokens del servidor
+        self.heuristic_factor = TOKENIZER_CONFIG["heuristic_factor"]
+
+        self._lock = threading.Lock()
+        self._encode = None
+        self._backend_name: Optional[str] = None
+        self._memo: "OrderedDict[tuple, int]" = OrderedDict()
+        self.stats = {"counts": 0, "memo_hits": 0, "calibrations": 0}
+
+    @property
+    def backend_name(self) -> str:
+        """Backend efectivo (carga el tokenizer si aún no se hizo)"""
+        self._ensure_backend()
+        return self._backend_name
+
+    @property
+    def exact(self) -> bool:
+        """True si los conteos vienen del tokenizer real"""
+        return self.backend_name != "heuristic"
+
+    def count(self, text: str) -> int:
+        """
+        Tokens de un texto
+
+        Args:
+            text: Texto a contar
+
+        Returns:
+            Número de tokens (estimado si no hay tokenizer)
+        """
+        if not text:
+            return 0
+        self._ensure_backend()
+        raw = self._raw_count(text)
+        if self._encode is None:
+            return math.ceil(raw * self.heuristic_factor)
+        return raw
+
+    def count_messages(self, messages: List[Dict[str, Any]]) -> int:
+        """Tokens de prompt de un request de chat (contenido + plantilla)"""
+        return REQUEST_OVERHEAD + sum(MESSAGE_OVERHEAD + self.count(m.get("content") or "") for m in messages)
+
+    def observe(self, messages: List[Dict[str, Any]], prompt_tokens: int):
+        """
+        Calibra la heurística con los prompt_tokens reales de una respuesta
+
+        Args:
+            messages: Mensajes enviados
+            prompt_tokens: usage.prompt_tokens informado por el servidor
+        """
+        if not prompt_tokens or self.exact:
+            return
+        raw = sum(self._raw_count(m.get("content") or "") for m in messages)
+        actual = prompt_tokens - REQUEST_OVERHEAD - MESSAGE_OVERHEAD * len(messages)
+        if raw < 200 or actual <= 0:
+            return  # Prompts muy cortos: la plantilla domina y el ratio es ruido
+        ratio = min(2.0, max(0.5, actual / raw))
+        with self._lock:
+            self.heuristic_factor += 0.2 * (ratio - self.heuristic_factor)
+            self.stats["calibrations"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Backend, aciertos de memoización y factor de calibración"""
+        with self._lock:
+            return dict(self.stats, backend=self._backend_name, memo_size=len(self._memo),
+                        heuristic_factor=round(self.heuristic_factor, 4))
+
+    def _raw_count(self, text: str) -> int:
+        """Conteo sin calibrar, memoizado por texto"""
+        key = (len(text), hash(text))
+        with self._lock:
+            self.stats["counts"] += 1
+            cached = self._memo.get(key)
+            if cached is not None:
+                self._memo.move_to_end(key)
+                self.stats["memo_hits"] += 1
+                return cached
+
+        raw = len(self._encode(text)) if self._encode is not None else heuristic_count(text)
+
+        with self._lock:
+            self._memo[key] = raw
+            while len(self._memo) > self.memo_entries:
+                self._memo.popitem(last=False)
+        return raw
+
+    def _ensure_backend(self):
+        if self._backend_name is not None:
+            return
+        with self._lock:
+            if self._backend_name is not None:
+                return
+            encode, name = self._load_backend()
+            self._encode = encode
+            self._backend_name = name
+        if name == "heuristic":
+            logger.info("🔢 Sin tokenizer de gpt-oss disponible: conteo de tokens heurístico calibrado")
+        else:
+            logger.info(f"🔢 Conteo de tokens con {name}")
+
+    def _load_backend(self):
+        """Retorna (encode, nombre) del primer backend disponible"""
+        if self.backend in ("auto", "tokenizers") and self.tokenizer_path and Path(self.tokenizer_path).is_file():
+            try:
+                from tokenizers import Tokenizer
+                tokenizer = Tokenizer.from_file(str(self.tokenizer_path))
+                return (lambda text: tokenizer.encode(text, add_special_tokens=False).ids), "tokenizers"
+            except Exception as e:
+                logger.warning(f"No se pudo cargar {self.tokenizer_path} con tokenizers: {e}")
+
+        if self.backend in ("auto", "tiktoken"):
+            if not tiktoken_cached(self.encoding):
+                logger.debug(f"tiktoken: {self.encoding} no está en la caché local, no se descarga")
+                return None, "heuristic"
+            try:
+                import tiktoken
+                encoding = tiktoken.get_encoding(self.encoding)
+                return (lambda text: encoding.encode(text, disallowed_special=())), f"tiktoken:{self.encoding}"
+            except Exception as e:
+                logger.debug(f"tiktoken no disponible ({self.encoding}): {e}")
+
+        return None, "heuristic"
+
+
+# Singleton compartido por todo el proceso
+_counter_instance = None
+_counter_lock = threading.Lock()
+
+def get_token_counter() -> TokenCounter:
+    """
+    Obtiene la instancia singleton del contador de tokens
+
+    Returns:
+        Instancia de TokenCounter
+    """
+    global _counter_instance
+    if _counter_instance is None:
+        with _counter_lock:
+            if _counter_instance is None:
+                _counter_instance = TokenCounter()
+    return _counter_instance
+
+
+def count_tokens(text: str) -> int:
+    """Atajo: tokens de un texto con el contador del proceso"""
+    return get_token_counter().count(text)
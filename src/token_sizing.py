@@ -0,0 +1,199 @@
+"""
+max_tokens aprendido por agente a partir de las respuestas históricas
+
+AGENT_MAX_TOKENS y agent_config.json reservan 20000-100000 tokens de respuesta
+aunque un agente nunca genere más de unos pocos miles. vLLM reserva KV-cache
+según max_tokens, así que ese sobredimensionamiento reduce cuántas llamadas
+caben en un batch.
+
+El tamaño recomendado es el percentil 99 de completion_tokens de las
+ejecuciones exitosas en runs/*/logs/<agente>.log más un margen, redondeado
+y acotado por el valor configurado. Sin historial suficiente se usa el valor
+configurado. Si una respuesta se trunca, el cliente escala max_tokens hasta el
+valor configurado y el tamaño escalado pasa a ser el piso de ese agente en el
+resto del proceso.
+
+El historial de cada agente se lee de runs/ una sola vez por proceso; al
+terminar cada historia, refresh_run agrega solo los logs de esa carpeta.
+"""
+import logging
+import math
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import LLM_SIZING_CONFIG
+from log_history import find_log_files, load_run_log_entries, read_log_entries
+
+logger = logging.getLogger(__name__)
+
+# Clave de tamaño de las páginas de cuentacuentos (patrón de sus logs por página)
+PAGE_SIZING_KEY = "03_cuentacuentos_pagina_*"
+
+
+def _completion_tokens(entry: Dict[str, Any]) -> Optional[int]:
+    """completion_tokens de una ejecución exitosa (log de agente o de página)"""
+    if entry.get("status") != "success":
+        return None
+    tokens = entry.get("tokens_consumed")
+    if tokens is None and isinstance(entry.get("response"), dict):
+        tokens = entry["response"].get("_metadata_tokens")
+    value = (tokens or {}).get("completion_tokens")
+    return int(value) if value else None
+
+
+class MaxTokensSizer:
+    """Recomienda max_tokens por agente según su historial de respuestas"""
+
+    def __init__(self,
+                 percentile: Optional[float] = None,
+                 margin: Optional[float] = None,
+                 min_samples: Optional[int] = None,
+                 runs_dir=None):
+        """
+        Args:
+            percentile: Percentil de completion_tokens a cubrir
+            margin: Margen relativo sobre el percentil
+            min_samples: Respuestas históricas mínimas para recomendar
+            runs_dir: Directorio de historias (por defecto RUNS_DIR)
+        """
+        self.percentile = percentile if percentile is not None else LLM_SIZING_CONFIG["percentile"]
+        self.margin = margin if margin is not None else LLM_SIZING_CONFIG["margin"]
+        self.min_samples = min_samples if min_samples is not None else LLM_SIZING_CONFIG["min_samples"]
+        self.runs_dir = runs_dir
+
+        self._lock = threading.Lock()
+        # Piso por agente tras truncamientos en este proceso
+        self._floors: Dict[str, int] = {}
+        self._last: Dict[str, Dict[str, Any]] = {}
+        # Clave -> historia -> completion_tokens de sus respuestas (historia más reciente primero)
+        self._history: Dict[str, "OrderedDict[Path, List[int]]"] = {}
+
+    def recommend(self, key: str, configured: int) -> int:
+        """
+        max_tokens a pedir para un agente
+
+        Args:
+            key: Nombre del agente; admite patrones glob para logs por
+                página (ver PAGE_SIZING_KEY)
+            configured: max_tokens configurado (tope y valor por defecto)
+
+        Returns:
+            max_tokens recomendado (nunca mayor que configured)
+        """
+        if not LLM_SIZING_CONFIG["enabled"]:
+            return configured
+        samples = self._samples(key)
+        with self._lock:
+            floor = self._floors.get(key, 0)
+
+        info = {"configured": configured, "samples": len(samples), "floor": floor or None}
+        if len(samples) < self.min_samples:
+            recommended = configured
+        else:
+            ordered = sorted(samples)
+            p = ordered[min(len(ordered) - 1, max(0, math.ceil(self.percentile * len(ordered)) - 1))]
+            round_to = LLM_SIZING_CONFIG["round_to"]
+            recommended = math.ceil(p * (1 + self.margin) / round_to) * round_to
+            recommended = min(configured, max(recommended, LLM_SIZING_CONFIG["min_tokens"], floor))
+            info["percentile_tokens"] = p
+            if recommended < configured:
+                logger.info(f"📏 max_tokens aprendido para {key}: {recommended} "
+                            f"(configurado {configured}, p{round(self.percentile * 100)}={p} en {len(samples)} respuestas)")
+
+        info["recommended"] = recommended
+        with self._lock:
+            self._last[key] = info
+        return recommended
+
+    def record_truncation(self, key: str, escalated_to: int):
+        """
+        Registra que una respuesta del agente se truncó y se escaló max_tokens
+
+        Args:
+            key: Misma clave usada en recommend()
+            escalated_to: max_tokens con el que la llamada terminó
+        """
+        with self._lock:
+            self._floors[key] = max(self._floors.get(key, 0), escalated_to)
+        logger.warning(f"📈 {key}: respuesta truncada, max_tokens mínimo en este proceso = {escalated_to}")
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Última recomendación por agente"""
+        with self._lock:
+            return {key: dict(info) for key, info in self._last.items()}
+
+    def refresh_run(self, story_path: Path):
+        """
+        Incorpora al historial los logs de una historia que terminó
+
+        Solo lee runs/<id>/logs/ de esa historia, para las claves ya
+        consultadas (las demás se leerán completas la primera vez que se usen).
+        Volver a llamarla para la misma historia reemplaza sus muestras.
+
+        Args:
+            story_path: Carpeta de la historia en runs/
+        """
+        story_path = Path(story_path).resolve()
+        with self._lock:
+            keys = list(self._history)
+        for key in keys:
+            samples = self._completions(load_run_log_entries(story_path, f"{key}.log"))
+            with self._lock:
+                runs = self._history[key]
+                runs.pop(story_path, None)
+                if samples:
+                    runs[story_path] = samples
+                    runs.move_to_end(story_path, last=False)
+                while len(runs) > LLM_SIZING_CONFIG["max_files"]:
+                    runs.popitem()
+
+    def _samples(self, key: str) -> List[int]:
+        """completion_tokens más recientes de la clave (como máximo LLM_SIZING_WINDOW)"""
+        with self._lock:
+            runs = self._history.get(key)
+        if runs is None:
+            runs = self._load_history(key)
+            with self._lock:
+                runs = self._history.setdefault(key, runs)
+        with self._lock:
+            samples = [tokens for run_samples in runs.values() for tokens in run_samples]
+        return samples[:LLM_SIZING_CONFIG["window"]]
+
+    def _load_history(self, key: str) -> "OrderedDict[Path, List[int]]":
+        """Historial inicial de la clave: recorre runs/ (una vez por proceso)"""
+        runs: "OrderedDict[Path, List[int]]" = OrderedDict()
+        for path in find_log_files(f"{key}.log", LLM_SIZING_CONFIG["max_files"], self.runs_dir):
+            samples = self._completions(read_log_entries(path))
+            if samples:
+                runs.setdefault(path.parent.parent.resolve(), []).extend(samples)
+        return runs
+
+    @staticmethod
+    def _completions(entries: List[Dict[str, Any]]) -> List[int]:
+        samples = []
+        for entry in entries:
+            tokens = _completion_tokens(entry)
+            if tokens:
+                samples.append(tokens)
+        return samples
+
+
+# Singleton compartido por todo el proceso
+_sizer_instance = None
+_sizer_lock = threading.Lock()
+
+def get_max_tokens_sizer() -> MaxTokensSizer:
+    """
+    Obtiene la instancia singleton del dimensionador de max_tokens
+
+    Returns:
+        Instancia de MaxTokensSizer
+    """
+    global _sizer_instance
+    if _sizer_instance is None:
+        with _sizer_lock:
+            if _sizer_instance is None:
+                _sizer_instance = MaxTokensSizer()
+    return _sizer_instance
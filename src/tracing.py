@@ -0,0 +1,187 @@
+"""
+Spans livianos por historia, exportados en formato Chrome trace-event
+
+manifest["timestamps"] solo guarda inicio y fin de cada agente; lo que pasa
+adentro (verificador, páginas, reintentos, pausas, escrituras a disco) no
+queda registrado. Cada historia activa un Tracer y el código instrumentado
+abre spans con span() o @traced: si no hay un tracer activo en el contexto
+(tests, scripts sueltos) no se registra nada.
+
+El tracer activo viaja en un ContextVar, así que cada hilo de la API ve el
+de su propia historia. El resultado se guarda en runs/<id>/trace.json y se
+abre en chrome://tracing o https://ui.perfetto.dev: cada hilo es una fila y
+los huecos entre spans son tiempo sin trabajo instrumentado.
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from config import TRACE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_current_tracer: ContextVar[Optional["Tracer"]] = ContextVar("tracer", default=None)
+
+
+def _json_safe(value: Any) -> Any:
+    """Valores de args que json puede serializar (el resto como texto)"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+class Tracer:
+    """Registro de spans de una historia"""
+
+    def __init__(self, name: str, max_events: Optional[int] = None):
+        """
+        Args:
+            name: Nombre del proceso en el visor (el story_id)
+            max_events: Tope de spans (por defecto TRACE_CONFIG)
+        """
+        self.name = name
+        self.max_events = max_events if max_events is not None else TRACE_CONFIG["max_events"]
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.events: List[Dict[str, Any]] = []
+        self.threads: Dict[int, str] = {}
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def now(self) -> float:
+        """Microsegundos desde el inicio de la traza"""
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def add(self, name: str, cat: str, start: float, duration: float, args: Optional[Dict[str, Any]] = None):
+        """
+        Registra un span ya terminado
+
+        Args:
+            name: Nombre del span
+            cat: Categoría (pipeline, agent, llm, qa, io, sleep...)
+            start: Inicio en microsegundos (ver now())
+            duration: Duración en microsegundos
+            args: Datos adicionales que muestra el visor
+        """
+        thread = threading.current_thread()
+        event = {
+            "name": name, "cat": cat, "ph": "X",
+            "ts": round(start, 1), "dur": round(max(duration, 0.0), 1),
+            "pid": self.pid, "tid": thread.ident
+        }
+        if args:
+            event["args"] = {key: _json_safe(value) for key, value in args.items()}
+        with self.lock:
+            if len(self.events) >= self.max_events:
+                self.dropped += 1
+                return
+            self.events.append(event)
+            self.threads.setdefault(thread.ident, thread.name)
+
+    @contextmanager
+    def activate(self) -> Iterator["Tracer"]:
+        """Hace de este tracer el activo en el contexto actual"""
+        token = _current_tracer.set(self)
+        try:
+            yield self
+        finally:
+            _current_tracer.reset(token)
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """Traza en formato Chrome trace-event (JSON Object Format)"""
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        metadata = [{"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0, "args": {"name": self.name}}]
+        metadata += [
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": thread_name}}
+            for tid, thread_name in threads.items()
+        ]
+        return {
+            "traceEvents": metadata + sorted(events, key=lambda e: e["ts"]),
+            "displayTimeUnit": "ms",
+            "otherData": {"story_id": self.name, "dropped_events": self.dropped}
+        }
+
+    def save(self, path: Path):
+        """Escribe la traza en path (no interrumpe la historia si falla)"""
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.to_chrome_trace(), f, ensure_ascii=False)
+            logger.info(f"🧭 Traza guardada en {path} ({len(self.events)} spans)")
+        except OSError as e:
+            logger.warning(f"No se pudo guardar la traza {path}: {e}")
+
+
+def current_tracer() -> Optional[Tracer]:
+    """Tracer activo en el contexto actual, o None"""
+    return _current_tracer.get()
+
+
+@contextmanager
+def span(name: str, cat: str = "pipeline", **args) -> Iterator[Dict[str, Any]]:
+    """
+    Mide el bloque como un span del tracer activo
+
+    Args:
+        name: Nombre del span
+        cat: Categoría
+        **args: Datos del span
+
+    Yields:
+        Dict de args; lo que se agregue dentro del bloque queda en el span
+    """
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield args
+        return
+    start = tracer.now()
+    try:
+        yield args
+    except BaseException as e:
+        args["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        tracer.add(name, cat, start, tracer.now() - start, args)
+
+
+def traced(cat: str, *arg_names: str, name: Optional[str] = None) -> Callable:
+    """
+    Decorador que registra cada llamada a la función como un span
+
+    Args:
+        cat: Categoría del span
+        *arg_names: Parámetros de la función que se copian a los args del span
+        name: Nombre del span (por defecto el de la función)
+    """
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*call_args, **call_kwargs):
+            if _current_tracer.get() is None:
+                return func(*call_args, **call_kwargs)
+            args = {}
+            if arg_names:
+                bound = signature.bind_partial(*call_args, **call_kwargs)
+                args = {arg: bound.arguments[arg] for arg in arg_names if arg in bound.arguments}
+            with span(span_name, cat, **args):
+                return func(*call_args, **call_kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def new_tracer(name: str) -> Optional[Tracer]:
+    """Tracer para una historia, o None si TRACE_CONFIG lo deshabilita"""
+    return Tracer(name) if TRACE_CONFIG["enabled"] else None
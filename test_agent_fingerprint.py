@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Prueba offline de las huellas de entradas de los agentes (re-ejecución incremental).
+"""
+import copy
+import json
+import shutil
+import sys
+import uuid
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from agent_fingerprint import agent_fingerprint, changed_inputs, fingerprint_inputs
+from config import get_story_path, load_version_config
+
+
+def make_story():
+    story_id = f"test-huella-{uuid.uuid4().hex[:8]}"
+    story_path = get_story_path(story_id)
+    story_path.mkdir(parents=True)
+    (story_path / "brief.json").write_text(json.dumps({"historia": "un gato"}), encoding="utf-8")
+    (story_path / "01_director.json").write_text(json.dumps({"leitmotiv": "luz"}), encoding="utf-8")
+    return story_id, story_path
+
+
+def test_huella_estable_y_sensible_a_dependencias():
+    config = load_version_config("v2")
+    story_id, story_path = make_story()
+    try:
+        inputs = fingerprint_inputs(story_id, "02_psicoeducador", "v2", config)
+        assert inputs == fingerprint_inputs(story_id, "02_psicoeducador", "v2", config)
+        assert inputs["prompt"] is not None and inputs["01_director.json"] is not None
+
+        # Cambia un artefacto del que depende: cambia la huella y se sabe por qué
+        (story_path / "01_director.json").write_text(json.dumps({"leitmotiv": "sombra"}), encoding="utf-8")
+        changed = fingerprint_inputs(story_id, "02_psicoeducador", "v2", config)
+        assert agent_fingerprint(changed) != agent_fingerprint(inputs)
+        assert changed_inputs(inputs, changed) == ["01_director.json"]
+
+        # Un artefacto que no es dependencia del agente no lo afecta
+        (story_path / "09_sensibilidad.json").write_text("{}", encoding="utf-8")
+        assert fingerprint_inputs(story_id, "02_psicoeducador", "v2", config) == changed
+
+        # Dependencia que aún no existe
+        assert fingerprint_inputs(story_id, "03_cuentacuentos", "v2", config)["02_psicoeducador.json"] is None
+    finally:
+        shutil.rmtree(story_path, ignore_errors=True)
+
+
+def test_huella_cambia_con_parametros_y_configuracion():
+    config = load_version_config("v2")
+    story_id, story_path = make_story()
+    try:
+        base = fingerprint_inputs(story_id, "01_director", "v2", config)
+
+        hotter = copy.deepcopy(config)
+        hotter["agent_config"].setdefault("01_director", {})["temperature"] = 1.37
+        assert changed_inputs(base, fingerprint_inputs(story_id, "01_director", "v2", hotter)) == [
+            "sampling", "version_config"
+        ]
+        # La configuración de otro agente no invalida a este
+        other = copy.deepcopy(config)
+        other["agent_config"].setdefault("12_validador", {})["temperature"] = 1.37
+        assert fingerprint_inputs(story_id, "01_director", "v2", other) == base
+
+        without_qa = fingerprint_inputs(story_id, "01_director", "v2", config, mode_verificador_qa=False)
+        assert "verificador_qa" not in without_qa and agent_fingerprint(without_qa) != agent_fingerprint(base)
+    finally:
+        shutil.rmtree(story_path, ignore_errors=True)
+
+
+def test_agente_al_dia_conserva_sus_tiempos():
+    from datetime import datetime
+    from orchestrator import StoryOrchestrator
+
+    story_id, story_path = make_story()
+    previos = {"start": "2026-01-01T12:00:00", "end": "2026-01-01T12:00:04", "duration": 4.0}
+    (story_path / "manifest.json").write_text(json.dumps({
+        "story_id": story_id, "estado": "completo", "timestamps": {"01_director": previos}, "fingerprints": {}
+    }), encoding="utf-8")
+    try:
+        orchestrator = StoryOrchestrator(story_id, pipeline_version="v2", use_timestamp=False)
+        orchestrator._agent_starts = {"01_director": datetime.now()}
+        orchestrator._rerun_agents = []
+        assert orchestrator._record_agent_result("01_director", {
+            "status": "up_to_date", "agent": "01_director", "fingerprint": {"hash": "abc", "inputs": {}}
+        })
+        entrada = orchestrator.manifest.get("timestamps")["01_director"]
+        assert entrada["up_to_date"] is True and "reused_at" in entrada
+        assert {k: entrada[k] for k in previos} == previos
+        assert orchestrator._rerun_agents == []
+    finally:
+        shutil.rmtree(story_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Prueba offline del grafo de agentes y del scheduler del orquestador.
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from agent_scheduler import AgentScheduler, build_agent_graph
+from config import load_version_config
+
+
+def test_grafo_v2_desde_dependencies_json():
+    config = load_version_config("v2")
+    graph = build_agent_graph(config["pipeline"], config["dependencies"], config["parallel_groups"])
+    assert graph["01_director"] == set()
+    assert graph["03_cuentacuentos"] == {"01_director", "02_psicoeducador"}
+    # 08 usa la salida de 07 aunque parallel_groups los declare paralelos
+    assert "07_diseno_escena" in graph["08_direccion_arte"]
+    # sensibilidad y portadista no dependen entre sí
+    assert "10_portadista" not in graph["09_sensibilidad"] and "09_sensibilidad" not in graph["10_portadista"]
+    assert {"09_sensibilidad", "10_portadista", "11_loader"} <= graph["12_validador"]
+
+
+def test_agentes_sin_dependencias_respetan_parallel_groups():
+    graph = build_agent_graph(["a", "b", "c", "d"], {"a": ["brief.json"]}, [["b", "c"]])
+    assert graph == {"a": set(), "b": {"a"}, "c": {"a"}, "d": {"a", "b", "c"}}
+
+
+def run_graph(graph, width, fail=(), skipped=()):
+    events, active, peak = [], set(), [0]
+    lock = threading.Lock()
+
+    def execute(agent):
+        with lock:
+            active.add(agent)
+            peak[0] = max(peak[0], len(active))
+        time.sleep(0.05)
+        with lock:
+            active.discard(agent)
+        if agent in fail:
+            raise RuntimeError("boom")
+        return {"status": "success"}
+
+    main = threading.current_thread()
+
+    def on_result(agent, result):
+        assert threading.current_thread() is main
+        events.append((agent, result["status"]))
+        return result["status"] != "error"
+
+    pending = AgentScheduler(graph, width).run(
+        execute, on_start=lambda agent: events.append((agent, "start")), on_result=on_result,
+        skipped=skipped, on_skip=lambda agent: events.append((agent, "skipped"))
+    )
+    return events, peak[0], pending
+
+
+def test_ejecuta_ramas_en_paralelo_hasta_el_ancho():
+    graph = {"a": set(), "b": {"a"}, "c": {"a"}, "d": {"a"}, "e": {"b", "c", "d"}}
+    start = time.perf_counter()
+    events, peak, pending = run_graph(graph, width=2)
+    assert peak == 2 and pending == []
+    assert events.index(("e", "start")) > max(events.index((x, "success")) for x in "bcd")
+    assert time.perf_counter() - start < 0.05 * 5
+
+    # Ancho 1: orden del pipeline, un agente a la vez
+    events, peak, _ = run_graph(graph, width=1)
+    assert peak == 1 and [a for a, kind in events if kind == "start"] == list("abcde")
+
+
+def test_error_detiene_y_reporta_los_agentes_en_curso():
+    graph = {"a": set(), "b": {"a"}, "c": {"a"}, "d": {"b", "c"}}
+    events, _, pending = run_graph(graph, width=2, fail={"b"}, skipped={"c"})
+    assert ("b", "error") in events and ("c", "skipped") in events
+    assert pending == ["d"]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
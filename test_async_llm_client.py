@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Prueba offline del cliente asíncrono y del envoltorio síncrono LLMClient.
+Usa un servidor local que imita /v1/chat/completions - no requiere el modelo real.
+"""
+import asyncio
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from async_llm_client import AsyncLLMClient, run_sync
+from llm_admission import AdmissionController
+from llm_client import LLMClient
+
+# Contenidos que devolverá el servidor, en orden (el último se repite)
+RESPUESTAS = []
+# Requests recibidos por el servidor
+LLAMADAS = []
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length))
+        LLAMADAS.append(request)
+        content = RESPUESTAS.pop(0) if len(RESPUESTAS) > 1 else RESPUESTAS[0]
+        if request.get("stream"):
+            return self.stream_content(content)
+        if content == "__lento__":
+            time.sleep(0.2)
+            content = json.dumps({"ok": True})
+        body = json.dumps({
+            "choices": [{"message": {"content": content}}],
+            "usage": {"prompt_tokens": 7, "completion_tokens": 3, "total_tokens": 10}
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_content(self, content):
+        """Envía el contenido como event stream, un carácter por evento (lento)"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            for char in content:
+                event = {"choices": [{"delta": {"content": char}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(0.01)
+            final = {"choices": [{"delta": {}, "finish_reason": "stop"}],
+                     "usage": {"prompt_tokens": 7, "completion_tokens": len(content), "total_tokens": 7 + len(content)}}
+            self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # El cliente abortó el streaming
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+
+def make_client(url):
+    client = LLMClient()
+    client.endpoint = url
+    client.retry_delay = 0
+    client.async_client.cache = None  # Cada prueba debe llegar al servidor
+    return client
+
+
+def test_json_valido_con_metadata_tokens():
+    server, url = start_server()
+    RESPUESTAS[:] = [json.dumps({"titulo": "Hola"})]
+    client = make_client(url)
+    result = client.generate("sistema", "usuario")
+    assert result["titulo"] == "Hola"
+    assert result["_metadata_tokens"]["total_tokens"] == 10
+    client.close()
+    server.shutdown()
+
+
+def test_contenido_vacio_primer_intento_es_stop():
+    server, url = start_server()
+    RESPUESTAS[:] = [""]
+    client = make_client(url)
+    try:
+        client.generate("sistema", "usuario")
+        assert False, "Debió lanzar STOP"
+    except ValueError as e:
+        assert "STOP:" in str(e)
+    client.close()
+    server.shutdown()
+
+
+def test_json_con_texto_extra_se_limpia():
+    server, url = start_server()
+    RESPUESTAS[:] = ['Aquí está:\n```json\n{"a": 1}\n```']
+    client = make_client(url)
+    assert client.generate("s", "u")["a"] == 1
+    client.close()
+    server.shutdown()
+
+
+def test_reintenta_tras_json_invalido():
+    server, url = start_server()
+    RESPUESTAS[:] = ["{esto no es json" + "x" * 300, json.dumps({"ok": 1})]
+    client = make_client(url)
+    assert client.generate("s", "u")["ok"] == 1
+    client.close()
+    server.shutdown()
+
+
+def test_llamadas_concurrentes_en_un_loop():
+    server, url = start_server()
+    RESPUESTAS[:] = ["__lento__"]
+    client = AsyncLLMClient()
+    client.endpoint = url
+    client.cache = None
+    # Solo se mide la multiplexación: sin el límite global que ajustaron las pruebas anteriores
+    client.concurrency = None
+    client.admission = AdmissionController(max_in_flight=20, token_budget=0, policy="fifo")
+
+    async def muchas():
+        return await asyncio.gather(*[client.generate("s", f"u{i}") for i in range(20)])
+
+    start = time.time()
+    results = run_sync(muchas())
+    elapsed = time.time() - start
+    assert len(results) == 20 and all(r["ok"] for r in results)
+    # 20 llamadas de 0.2s multiplexadas deben tardar bastante menos que 4s
+    assert elapsed < 2.0, elapsed
+    run_sync(client.close())
+    server.shutdown()
+
+
+def test_streaming_registra_ttft_y_tokens_por_segundo():
+    server, url = start_server()
+    RESPUESTAS[:] = [json.dumps({"versos": ["uno", "dos"]})]
+    client = make_client(url)
+    result = client.generate("s", "u", stream=True)
+    assert result["versos"] == ["uno", "dos"]
+    assert result["_metadata_tokens"]["time_to_first_token"] is not None
+    assert result["_metadata_tokens"]["tokens_per_second"] > 0
+    client.close()
+    server.shutdown()
+
+
+def test_streaming_aborta_texto_que_no_es_json():
+    server, url = start_server()
+    RESPUESTAS[:] = ["Claro, aquí tienes tu cuento: había una vez {" + "x" * 400]
+    client = make_client(url)
+    client.retry_attempts = 1
+    start = time.time()
+    try:
+        client.generate("s", "u", stream=True)
+        assert False, "Debió fallar"
+    except Exception as e:
+        assert "streaming abortado" in str(e)
+    # Aborta al primer carácter inválido fuera de string, sin esperar los ~450 eventos
+    assert time.time() - start < 2.0
+    client.close()
+    server.shutdown()
+
+
+def test_streaming_rechazo_en_primer_intento_es_stop():
+    server, url = start_server()
+    RESPUESTAS[:] = ["Lo siento, no puedo ayudar con eso." + " bla" * 100]
+    client = make_client(url)
+    try:
+        client.generate("s", "u", stream=True)
+        assert False, "Debió lanzar STOP"
+    except ValueError as e:
+        assert str(e).startswith("STOP:")
+    client.close()
+    server.shutdown()
+
+
+def test_llamadas_identicas_simultaneas_se_coalescen():
+    server, url = start_server()
+    RESPUESTAS[:] = ["__lento__"]
+    LLAMADAS.clear()
+    client = AsyncLLMClient()
+    client.endpoint = url
+    client.cache = None
+    antes = dict(client.single_flight.stats)
+
+    async def identicas():
+        return await asyncio.gather(*[client.generate("s", "mismo prompt") for _ in range(5)])
+
+    results = run_sync(identicas())
+    assert len(LLAMADAS) == 1
+    assert all(r["ok"] for r in results)
+    assert sum(1 for r in results if r["_metadata_tokens"].get("coalesced")) == 4
+    # Cada llamador recibe su propia copia
+    results[0]["ok"] = False
+    assert results[1]["ok"] is True
+    assert client.single_flight.stats["coalesced"] - antes["coalesced"] == 4
+    assert client.single_flight.in_flight == 0
+
+    # use_cache=False pide generaciones independientes
+    LLAMADAS.clear()
+    async def independientes():
+        return await asyncio.gather(*[client.generate("s", "mismo prompt", use_cache=False) for _ in range(3)])
+    run_sync(independientes())
+    assert len(LLAMADAS) == 3
+    run_sync(client.close())
+    server.shutdown()
+
+
+def test_llamadas_coalescidas_reciben_la_misma_excepcion():
+    server, url = start_server()
+    RESPUESTAS[:] = [""]
+    LLAMADAS.clear()
+    client = AsyncLLMClient()
+    client.endpoint = url
+    client.cache = None
+
+    async def identicas():
+        return await asyncio.gather(*[client.generate("s", "vacío") for _ in range(3)], return_exceptions=True)
+
+    errores = run_sync(identicas())
+    assert len(LLAMADAS) == 1
+    assert all(isinstance(e, ValueError) and "STOP:" in str(e) for e in errores)
+    run_sync(client.close())
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
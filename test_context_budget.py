@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Prueba offline del plan de presupuesto de contexto previo a cada llamada.
+"""
+import sys
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from context_budget import drop_field, dump_dependency, plan_context
+from token_counter import TokenCounter
+
+DEPENDENCIAS = {
+    "01_director.json": {
+        "beat_sheet": [{"pagina": i, "objetivo": "Emilia descubre que el miedo se hace pequeño al nombrarlo",
+                        "conflicto": "La oscuridad del cuarto parece un monstruo gigante"} for i in range(1, 11)],
+        "variantes": [{"climax_alternativo": "Felipe enciende una linterna mágica " * 20} for _ in range(5)],
+        "qa": {"coherencia": 5, "originalidad": 4, "notas": "autoevaluación " * 200}
+    }
+}
+
+
+def build_prompt(deps, compact):
+    partes = ["CONTEXTO DE LA HISTORIA:"]
+    for nombre, contenido in deps.items():
+        partes.append(f"### {nombre}:")
+        partes.append(dump_dependency(contenido, compact))
+    return "\n".join(partes)
+
+
+def plan(context_window, max_tokens=2000):
+    return plan_context("Eres el psicoeducador.", DEPENDENCIAS, build_prompt, max_tokens,
+                        counter=TokenCounter(backend="heuristic"), context_window=context_window,
+                        drop_fields=["metadata", "qa", "variantes"])
+
+
+def test_drop_field_a_cualquier_profundidad_sin_modificar_el_original():
+    datos = {"a": {"qa": 1, "b": [{"qa": 2, "c": 3}]}, "qa": 0}
+    limpio, quitados = drop_field(datos, "qa")
+    assert quitados == 3 and limpio == {"a": {"b": [{"c": 3}]}}
+    assert datos["a"]["qa"] == 1
+
+
+def test_sin_ajustes_si_cabe():
+    user_prompt, max_tokens, resultado = plan(200000)
+    assert resultado["fits"] and resultado["steps"] == []
+    assert max_tokens == 2000 and user_prompt == build_prompt(DEPENDENCIAS, False)
+
+
+def test_orden_de_reducciones():
+    _, _, inicial = plan(200000)
+    completo = inicial["prompt_tokens"]
+
+    # Basta con quitar la autoevaluación (metadata no aparece y se omite)
+    user_prompt, _, resultado = plan(completo + 2000 + 1024 - 100)
+    assert [s.get("field") for s in resultado["steps"]] == ["qa"]
+    assert "autoevaluación" not in user_prompt and resultado["fits"]
+
+    # Sin espacio para la respuesta: quitar todo, compactar y reducir max_tokens
+    user_prompt, max_tokens, resultado = plan(completo + 1024 + 3000, max_tokens=8000)
+    acciones = [s["action"] for s in resultado["steps"]]
+    assert acciones == ["drop_field", "drop_field", "compact_json", "shrink_max_tokens"]
+    assert resultado["fits"] and 2000 <= max_tokens < 8000
+    assert resultado["prompt_tokens"] + max_tokens <= resultado["context_window"] - resultado["safety_margin"]
+    assert '":' in user_prompt and '": ' not in user_prompt
+
+
+def test_no_cabe_ni_reduciendo():
+    _, _, resultado = plan(1500)
+    assert not resultado["fits"]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Prueba offline de los plazos por llamada (Deadline) del cliente LLM.
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from async_llm_client import AsyncLLMClient, run_sync
+from config import LLM_DEADLINE_CONFIG
+from deadlines import Deadline, DeadlineExceeded
+
+LLAMADAS = []
+
+
+def start_server(delay):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            LLAMADAS.append(json.loads(self.rfile.read(length)))
+            time.sleep(delay)
+            body = json.dumps({"choices": [{"message": {"content": json.dumps({"ok": True})}}]}).encode("utf-8")
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # El cliente abandonó la llamada por timeout
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+
+def new_client(url):
+    client = AsyncLLMClient()
+    client.endpoint = url
+    client.cache = None
+    client.concurrency = None
+    client.hedging = None
+    client.retry_delay = 0
+    return client
+
+
+def test_timeout_de_lectura_crece_con_max_tokens_y_tiene_tope():
+    base = LLM_DEADLINE_CONFIG["read_timeout_base"]
+    ritmo = LLM_DEADLINE_CONFIG["min_tokens_per_second"]
+    corto = Deadline().for_completion(500, 900)
+    largo = Deadline().for_completion(10000, 900)
+    assert corto.read_timeout == base + 500 / ritmo
+    assert largo.read_timeout == min(900, base + 10000 / ritmo)
+    assert corto.read_timeout < largo.read_timeout
+    assert Deadline().for_completion(10 ** 6, 900).read_timeout == 900
+    assert corto.connect_timeout == LLM_DEADLINE_CONFIG["connect_timeout"]
+    assert Deadline().remaining() is None and not Deadline().expired
+
+
+def test_timeout_de_lectura_incluye_el_prefill_del_prompt():
+    base = LLM_DEADLINE_CONFIG["read_timeout_base"]
+    ritmo = LLM_DEADLINE_CONFIG["min_tokens_per_second"]
+    prefill = LLM_DEADLINE_CONFIG["min_prefill_tokens_per_second"]
+    # Un agente con mucho contexto y una respuesta corta
+    contexto = Deadline().for_completion(1000, 900, prompt_tokens=60000)
+    assert contexto.read_timeout == min(900, base + 60000 / prefill + 1000 / ritmo)
+    assert contexto.read_timeout > Deadline().for_completion(1000, 900).read_timeout
+
+
+def test_presupuesto_restante_acota_los_timeouts():
+    deadline = Deadline.after(5)
+    call = deadline.for_completion(30000, 900)
+    assert call.read_timeout <= 5
+    assert call.connect_timeout <= call.read_timeout
+    assert call.expires_at == deadline.expires_at
+    assert Deadline.after(0).remaining() is None
+
+
+def test_plazo_vencido_no_llama_al_servidor():
+    server, url = start_server(0)
+    client = new_client(url)
+    LLAMADAS.clear()
+    try:
+        run_sync(client.generate("s", "u", deadline=Deadline(expires_at=time.monotonic() - 1)))
+        assert False, "Debió fallar por plazo vencido"
+    except DeadlineExceeded:
+        pass
+    assert LLAMADAS == []
+    run_sync(client.close())
+    server.shutdown()
+
+
+def test_servidor_lento_agota_el_plazo_sin_tocar_el_cliente():
+    server, url = start_server(2.0)
+    client = new_client(url)
+    start = time.time()
+    try:
+        run_sync(client.generate("s", "lento", deadline=Deadline.after(0.5)))
+        assert False, "Debió fallar por plazo agotado"
+    except DeadlineExceeded:
+        pass
+    assert time.time() - start < 1.5
+    assert client.timeout == 900  # Ninguna llamada modifica el estado compartido
+    # Una llamada sin plazo sobre el mismo cliente sigue funcionando
+    assert run_sync(client.generate("s", "sin plazo"))["ok"] is True
+    run_sync(client.close())
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
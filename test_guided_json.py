@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Prueba offline del JSON Schema por agente y de la decodificación guiada con fallback.
+"""
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from async_llm_client import AsyncLLMClient, run_sync
+from json_schemas import PAGE_SCHEMA_NAME, get_agent_schema
+from quality_gates import REQUIRED_FIELDS
+
+FLUJO = Path(__file__).parent / "flujo"
+PAYLOADS = []
+
+
+def test_schema_por_agente_de_cada_version():
+    for version, patron in (("v2", "[01]*.json"), ("v3", "*.json")):
+        for archivo in (FLUJO / version / "agentes").glob(patron):
+            if archivo.stem in ("13_critico", "14_verificador_qa"):
+                continue
+            schema = get_agent_schema(archivo.stem)
+            assert schema and schema["type"] == "object" and schema["required"], archivo.stem
+
+    # v1 se deriva de los campos requeridos del quality gate
+    for agente, campos in REQUIRED_FIELDS.items():
+        assert get_agent_schema(agente)["required"] == campos
+    assert get_agent_schema("loader")["properties"]["loader"]["minItems"] == 10
+    assert get_agent_schema(PAGE_SCHEMA_NAME)["properties"]["versos"]["maxItems"] == 4
+    assert get_agent_schema("verificador_qa_01_director") is None
+
+
+def start_server(rechaza_schema):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            PAYLOADS.append(payload)
+            if rechaza_schema and "response_format" in payload:
+                status, body = 400, {"error": {"message": "response_format type json_schema is not supported"}}
+            else:
+                status, body = 200, {"choices": [{"message": {"content": '{"loader": ["hola"]}'}, "finish_reason": "stop"}]}
+            body = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = AsyncLLMClient()
+    client.endpoint = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    client.cache = None
+    client.concurrency = None
+    client.hedging = None
+    client.retry_delay = 0
+    return server, client
+
+
+def test_envia_schema_como_response_format():
+    PAYLOADS.clear()
+    server, client = start_server(rechaza_schema=False)
+    schema = get_agent_schema("11_loader")
+    result = run_sync(client.generate("s", "u", agent_name="11_loader", json_schema=schema, use_cache=False))
+    formato = PAYLOADS[0]["response_format"]
+    assert formato["type"] == "json_schema" and formato["json_schema"]["schema"] == schema
+    assert formato["json_schema"]["name"] == "11_loader"
+    assert result["_metadata_tokens"]["guided_json"] == "response_format"
+    run_sync(client.close())
+    server.shutdown()
+
+
+def test_servidor_sin_soporte_continua_sin_schema_en_el_mismo_intento():
+    PAYLOADS.clear()
+    server, client = start_server(rechaza_schema=True)
+    schema = get_agent_schema("11_loader")
+    result = run_sync(client.generate("s", "u", agent_name="11_loader", json_schema=schema, use_cache=False))
+    assert result["loader"] == ["hola"] and "guided_json" not in result["_metadata_tokens"]
+    assert ["response_format" in p for p in PAYLOADS] == [True, False]
+    assert not client.guided_json_supported
+
+    # Las llamadas siguientes ya no envían el schema
+    run_sync(client.generate("s", "u2", agent_name="11_loader", json_schema=schema, use_cache=False))
+    assert len(PAYLOADS) == 3 and "response_format" not in PAYLOADS[2]
+    run_sync(client.close())
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
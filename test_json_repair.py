@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Prueba offline de la reparación de JSON de las respuestas del modelo.
+"""
+import json
+import sys
+import time
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from async_llm_client import parse_completion
+from json_stream import JSONRepairer, loads_tolerant, repair_json
+
+PAGINAS = {"paginas_texto": {str(i): "Emilia {mira} el mar\n[con] su linterna" for i in range(1, 11)},
+           "leitmotiv_usado_en": [2, 5, 10]}
+
+
+def test_llaves_dentro_de_strings_no_son_estructura():
+    texto = json.dumps(PAGINAS, ensure_ascii=False, indent=2)
+    envuelto = f"Aquí está el cuento:\n```json\n{texto[:-1].rstrip()},\n}}\n```\n¡Espero que te guste!"
+    valor, reparaciones = loads_tolerant(envuelto)
+    assert valor == PAGINAS
+    assert reparaciones == {"bloque_de_codigo": 1, "texto_previo": 1, "coma_colgante": 1, "texto_posterior": 1}
+
+
+def test_truncada_se_cierra_en_orden():
+    texto = json.dumps(PAGINAS, ensure_ascii=False)
+    corte = texto.index('"5"') + 15
+    valor, reparaciones = loads_tolerant(texto[:corte])
+    assert list(valor["paginas_texto"]) == ["1", "2", "3", "4", "5"]
+    assert valor["paginas_texto"]["5"] == "Emilia {m"
+    assert reparaciones == {"string_truncado": 1, "cierre_truncado": 2}
+
+    for resto, esperado in (('{"a": [1, {"b": tr', {"a": [1, {"b": True}]}),
+                            ('{"a": "x", "b":', {"a": "x", "b": None}),
+                            ('{"a": 1.', {"a": 1})):
+        assert loads_tolerant(resto)[0] == esperado
+
+
+def test_errores_tipicos_del_modelo():
+    casos = {
+        '{"a": "linea\nsiguiente", "b": True, "c": None}': {"a": "linea\nsiguiente", "b": True, "c": None},
+        '[{"x": 1}\n{"x": 2}]': [{"x": 1}, {"x": 2}],
+        '{clave: "v", "n": [1, 2}': {"clave": "v", "n": [1, 2]},
+        '{"a": "it\\\'s"}': {"a": "it's"}
+    }
+    for texto, esperado in casos.items():
+        assert loads_tolerant(texto)[0] == esperado, texto
+    assert repair_json("Lo siento, no puedo ayudar con eso.") == ("", {})
+
+
+def test_por_fragmentos_igual_que_de_una_vez():
+    texto = "```json\n" + json.dumps(PAGINAS, ensure_ascii=False)[:-40]
+    repairer = JSONRepairer()
+    for i in range(0, len(texto), 7):
+        repairer.feed(texto[i:i + 7])
+    assert repairer.finish() == repair_json(texto)
+
+
+def test_tiempo_lineal():
+    def medir(n):
+        texto = json.dumps({"k": [PAGINAS] * n}, ensure_ascii=False, indent=2)[:-30]
+        inicio = time.perf_counter()
+        json.loads(repair_json(texto)[0])
+        return len(texto), time.perf_counter() - inicio
+
+    medir(5)
+    chico, t_chico = medir(15)
+    grande, t_grande = medir(150)
+    assert grande >= 100_000
+    # 10 veces más texto no puede costar más de ~30 veces más (cuadrático serían 100)
+    assert t_grande / t_chico < 3 * grande / chico
+
+
+def test_parse_completion_reporta_reparaciones():
+    result = {"choices": [{"message": {"content": 'Claro:\n{"loader": ["hola",]}'}, "finish_reason": "stop"}],
+              "usage": {"prompt_tokens": 10, "completion_tokens": 5}}
+    parsed = parse_completion(result, 0, "s", "u", 0.7, 100, 60)
+    assert parsed["loader"] == ["hola"]
+    assert parsed["_metadata_tokens"]["json_repairs"] == {"texto_previo": 1, "coma_colgante": 1}
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
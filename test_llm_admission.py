@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Prueba offline del control de admisión global de llamadas al LLM.
+"""
+import asyncio
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from async_llm_client import AsyncLLMClient, run_sync
+from llm_admission import AdmissionController
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    activos = 0
+    max_activos = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        with SlowHandler.lock:
+            SlowHandler.activos += 1
+            SlowHandler.max_activos = max(SlowHandler.max_activos, SlowHandler.activos)
+        time.sleep(0.1)
+        with SlowHandler.lock:
+            SlowHandler.activos -= 1
+        body = json.dumps({"choices": [{"message": {"content": json.dumps({"ok": True})}}]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_limita_requests_en_curso_y_respeta_fifo():
+    controller = AdmissionController(max_in_flight=2, token_budget=0, policy="fifo")
+    orden = []
+
+    async def llamada(i):
+        await controller.acquire(10)
+        orden.append(i)
+        await asyncio.sleep(0.02)
+        assert controller.in_flight <= 2
+        controller.release(10)
+
+    async def main():
+        await asyncio.gather(*[llamada(i) for i in range(6)])
+
+    asyncio.run(main())
+    assert orden == list(range(6))
+    assert controller.in_flight == 0 and controller.outstanding_tokens == 0
+    assert controller.stats["queued"] == 4
+
+
+def test_presupuesto_de_tokens():
+    controller = AdmissionController(max_in_flight=10, token_budget=100, policy="fifo")
+
+    async def main():
+        await controller.acquire(60)
+        # No cabe junto al primero: espera
+        segundo = asyncio.ensure_future(controller.acquire(60))
+        await asyncio.sleep(0.02)
+        assert not segundo.done()
+        controller.release(60)
+        espera = await segundo
+        assert espera > 0
+        controller.release(60)
+        # Un request mayor que el presupuesto pasa si está solo
+        assert await controller.acquire(500) == 0.0
+        controller.release(500)
+
+    asyncio.run(main())
+
+
+def test_politica_de_prioridad_y_cancelacion():
+    controller = AdmissionController(max_in_flight=1, token_budget=0, policy="priority")
+    orden = []
+
+    async def llamada(nombre, prioridad):
+        await controller.acquire(1, prioridad)
+        orden.append(nombre)
+        controller.release(1)
+
+    async def main():
+        await controller.acquire(1)
+        tareas = [asyncio.ensure_future(llamada("baja", 0)),
+                  asyncio.ensure_future(llamada("cancelada", 9)),
+                  asyncio.ensure_future(llamada("alta", 5))]
+        await asyncio.sleep(0.01)
+        tareas[1].cancel()
+        await asyncio.sleep(0.01)
+        controller.release(1)
+        await asyncio.gather(*tareas, return_exceptions=True)
+
+    asyncio.run(main())
+    assert orden == ["alta", "baja"]
+    assert controller.in_flight == 0
+
+
+def test_cliente_respeta_el_limite_global_y_reporta_espera():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = AsyncLLMClient()
+    client.endpoint = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    client.cache = None
+    client.admission = AdmissionController(max_in_flight=2, token_budget=0, policy="fifo")
+    client.concurrency = None
+    SlowHandler.max_activos = 0
+
+    async def muchas():
+        return await asyncio.gather(*[client.generate("s", f"u{i}") for i in range(6)])
+
+    results = run_sync(muchas())
+    assert SlowHandler.max_activos <= 2
+    metas = [r["_metadata_tokens"] for r in results]
+    assert all(m["llm_latency"] >= 0.1 for m in metas)
+    # Con 2 cupos y 6 llamadas, las últimas esperan al menos dos rondas
+    assert max(m["queue_wait"] for m in metas) >= 0.15
+    run_sync(client.close())
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Prueba offline de generate_batch: orden, errores por item y n candidatos.
+"""
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from async_llm_client import AsyncLLMClient, run_sync
+from parallel_cuentacuentos import ParallelCuentacuentos
+
+PAYLOADS = []
+
+
+def start_server():
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            PAYLOADS.append(payload)
+            prompt = payload["messages"][1]["content"]
+            if prompt == "falla":
+                status, body = 500, {"error": {"message": "boom"}}
+            else:
+                # El candidato 1 de "mixto" no es JSON
+                choices = [{"message": {"content": "sin json" if prompt == "mixto" and i == 1
+                                        else json.dumps({"prompt": prompt, "candidato": i})},
+                            "finish_reason": "stop"}
+                           for i in range(payload.get("n", 1))]
+                status, body = 200, {"choices": choices, "usage": {"prompt_tokens": 10, "completion_tokens": 5}}
+            body = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = AsyncLLMClient()
+    client.endpoint = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    client.cache = None
+    client.concurrency = None
+    client.hedging = None
+    client.retry_delay = 0
+    client.retry_attempts = 1
+    return server, client
+
+
+def test_resultados_en_orden_con_errores_por_item():
+    PAYLOADS.clear()
+    server, client = start_server()
+    requests = [{"system_prompt": "s", "user_prompt": prompt, "temperature": 0.7}
+                for prompt in ("uno", "falla", "dos", "uno")]
+    results = run_sync(client.generate_batch(requests))
+
+    assert [r["status"] for r in results] == ["success", "error", "success", "success"]
+    assert results[0]["output"]["prompt"] == "uno" and results[2]["output"]["prompt"] == "dos"
+    assert "boom" in results[1]["error"] or "500" in results[1]["error"]
+    # Los dos "uno" idénticos van en un solo request con n=2 y reciben candidatos distintos
+    assert len(PAYLOADS) == 3
+    assert sorted(p.get("n", 1) for p in PAYLOADS) == [1, 1, 2]
+    assert {results[0]["output"]["candidato"], results[3]["output"]["candidato"]} == {0, 1}
+    run_sync(client.close())
+    server.shutdown()
+
+
+def test_n_candidatos_descarta_los_invalidos():
+    PAYLOADS.clear()
+    server, client = start_server()
+    results = run_sync(client.generate_batch(
+        [{"system_prompt": "s", "user_prompt": "mixto"}, {"system_prompt": "s", "user_prompt": "otro", "n": 1}],
+        n=3
+    ))
+    assert [p.get("n", 1) for p in sorted(PAYLOADS, key=lambda p: p["messages"][1]["content"])] == [3, 1]
+    assert [c["candidato"] for c in results[0]["candidates"]] == [0, 2]
+    assert results[0]["output"]["_metadata_tokens"]["prompt_tokens"] == 10
+    assert len(results[1]["candidates"]) == 1
+    run_sync(client.close())
+    server.shutdown()
+
+
+def test_paginas_posteriores_reciben_las_rimas_anteriores():
+    class FakeClient:
+        lotes = []
+
+        def generate_batch(self, requests):
+            self.lotes.append([r["user_prompt"] for r in requests])
+            return [{"status": "success", "output": {
+                "versos": ["a", "b", "c", "d"],
+                "palabras_finales": [f"rima{len(self.lotes)}_{i}_{j}" for j in range(4)]
+            }} for i in range(len(requests))]
+
+    processor = ParallelCuentacuentos.__new__(ParallelCuentacuentos)
+    processor.story_id = "prueba-lotes"
+    processor.deadline = None
+    processor.mode_verificador_qa = False
+    processor.config = {"max_workers": 3, "max_retries_per_page": 1, "max_tokens": 1000,
+                        "temperature": 0.75, "top_p": 0.95}
+    processor.director_data = {"leitmotiv": "Brilla", "beat_sheet": [{"objetivo": f"o{i}"} for i in range(10)]}
+    processor.psicoeducador_data = {"edad_objetivo": 4, "mapa_psico_narrativo": [{} for _ in range(10)]}
+    processor.brief_data = {"personajes": ["Emilia"]}
+    processor.rima_config = {"default_scheme": "AABB"}
+    processor.used_rimas_lock = threading.Lock()
+    processor.used_rimas = set()
+    processor.llm_client = FakeClient()
+    # Sin escrituras en runs/
+    processor.save_page_input = lambda *args: None
+    processor.save_page_output = lambda *args: None
+    processor.save_partial_progress = lambda *args: None
+    processor.finalize_results = lambda results, start_time: results
+
+    results = processor.process_parallel()
+    assert len(results) == 10 and all(r["success"] for r in results)
+    # Oleadas de max_workers páginas: 3 + 3 + 3 + 1
+    assert [len(lote) for lote in FakeClient.lotes] == [3, 3, 3, 1]
+    assert "YA USADAS" not in FakeClient.lotes[0][0]
+    # La página 4 ya no puede repetir las rimas de las páginas 1 a 3, ni la 10 las de la 9
+    assert "rima1_0_0" in FakeClient.lotes[1][0] and "rima1_2_3" in FakeClient.lotes[1][0]
+    assert "rima3_2_3" in FakeClient.lotes[3][0]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Prueba offline de la caché de respuestas del LLM (memoria + disco).
+Usa un servidor local que imita /v1/chat/completions y cuenta las llamadas.
+"""
+import json
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from llm_cache import LLMResponseCache, request_fingerprint
+from llm_client import LLMClient
+
+LLAMADAS = []
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        LLAMADAS.append(json.loads(self.rfile.read(length)))
+        body = json.dumps({
+            "choices": [{"message": {"content": json.dumps({"n": len(LLAMADAS)})}}],
+            "usage": {"prompt_tokens": 7, "completion_tokens": 3, "total_tokens": 10}
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+
+def make_client(url, cache_dir):
+    client = LLMClient()
+    client.endpoint = url
+    client.retry_delay = 0
+    # Sin control adaptativo: estas llamadas no deben ajustar la concurrencia global de otras pruebas
+    client.async_client.concurrency = None
+    client.async_client.cache = LLMResponseCache(cache_dir=cache_dir, memory_entries=8,
+                                                 disk_max_bytes=1024 * 1024, ttl_seconds=3600)
+    return client
+
+
+def test_huella_depende_de_los_parametros_de_muestreo():
+    base = {"model": "m", "messages": [{"role": "user", "content": "hola"}], "temperature": 0.7, "max_tokens": 100}
+    assert request_fingerprint(base) == request_fingerprint(dict(base))
+    assert request_fingerprint(base) != request_fingerprint(dict(base, temperature=0.8))
+    assert request_fingerprint(base) != request_fingerprint(dict(base, seed=1))
+    # Campos que no afectan la respuesta no cambian la clave
+    assert request_fingerprint(base) == request_fingerprint(dict(base, stream=True))
+
+
+def test_lru_en_memoria_y_nivel_de_disco():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = LLMResponseCache(cache_dir=tmp, memory_entries=2, disk_max_bytes=1024 * 1024, ttl_seconds=0)
+        for i in range(3):
+            cache.put(f"{i:064x}", {"i": i})
+        assert len(cache._memory) == 2
+        # La primera entrada salió de memoria pero sigue en disco
+        assert cache.get(f"{0:064x}") == {"i": 0}
+        assert cache.stats["disk_hits"] == 1
+        # Las copias devueltas no alteran la caché
+        cache.get(f"{0:064x}")["i"] = 99
+        assert cache.get(f"{0:064x}") == {"i": 0}
+
+
+def test_expiracion_y_tamano_maximo_en_disco():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = LLMResponseCache(cache_dir=tmp, memory_entries=0, disk_max_bytes=1024 * 1024, ttl_seconds=1)
+        cache.put("a" * 64, {"v": 1})
+        cache.ttl_seconds = 0.01
+        time.sleep(0.05)
+        assert cache.get("a" * 64) is None
+
+        cache = LLMResponseCache(cache_dir=tmp, memory_entries=0, disk_max_bytes=400, ttl_seconds=0)
+        for i in range(10):
+            cache.put(f"{i:064x}", {"texto": "x" * 50})
+            time.sleep(0.01)
+        total = sum(p.stat().st_size for p in Path(tmp).glob("*/*.json"))
+        assert total <= 400
+        assert cache.stats["evictions"] > 0
+        # Las más recientes sobreviven
+        assert cache.get(f"{9:064x}") is not None
+        assert cache.get(f"{0:064x}") is None
+
+
+def test_cliente_reutiliza_respuesta_cacheada():
+    server, url = start_server()
+    LLAMADAS.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_client(url, tmp)
+        primera = client.generate("sistema", "usuario", temperature=0.0)
+        segunda = client.generate("sistema", "usuario", temperature=0.0)
+        assert len(LLAMADAS) == 1
+        assert segunda["n"] == primera["n"] == 1
+        assert segunda["_metadata_tokens"]["cache_hit"] is True
+        assert "cache_hit" not in primera["_metadata_tokens"]
+
+        # Otro proceso (caché nueva sobre el mismo directorio) usa el nivel de disco
+        client.async_client.cache = LLMResponseCache(cache_dir=tmp)
+        assert client.generate("sistema", "usuario", temperature=0.0)["n"] == 1
+        assert len(LLAMADAS) == 1
+
+        # Cambiar un parámetro de muestreo es una clave distinta
+        client.generate("sistema", "usuario", temperature=0.0, max_tokens=50)
+        assert len(LLAMADAS) == 2
+        client.close()
+    server.shutdown()
+
+
+def test_opt_out_por_llamada_y_por_temperatura():
+    import async_llm_client
+    server, url = start_server()
+    LLAMADAS.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_client(url, tmp)
+        client.generate("s", "u", temperature=0.3, use_cache=False)
+        client.generate("s", "u", temperature=0.3, use_cache=False)
+        assert len(LLAMADAS) == 2
+
+        original = async_llm_client.LLM_CACHE_CONFIG["max_temperature"]
+        async_llm_client.LLM_CACHE_CONFIG["max_temperature"] = 0.5
+        try:
+            client.generate("s", "u", temperature=0.9)
+            client.generate("s", "u", temperature=0.9)
+            assert len(LLAMADAS) == 4
+            # use_cache=True fuerza la caché aunque la temperatura sea alta
+            client.generate("s", "u", temperature=0.9, use_cache=True)
+            client.generate("s", "u", temperature=0.9, use_cache=True)
+            assert len(LLAMADAS) == 5
+        finally:
+            async_llm_client.LLM_CACHE_CONFIG["max_temperature"] = original
+        client.close()
+    server.shutdown()
+
+
+def test_disco_fuera_del_event_loop():
+    class RecordingCache(LLMResponseCache):
+        hilos = {}
+
+        def get_memory(self, key):
+            self.hilos["memoria"] = threading.get_ident()
+            return super().get_memory(key)
+
+        def _disk_get(self, key, now):
+            self.hilos["lectura"] = threading.get_ident()
+            return super()._disk_get(key, now)
+
+        def _disk_put(self, key, value, created_at):
+            self.hilos["escritura"] = threading.get_ident()
+            return super()._disk_put(key, value, created_at)
+
+    server, url = start_server()
+    LLAMADAS.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_client(url, tmp)
+        client.async_client.cache = RecordingCache(cache_dir=tmp, memory_entries=8,
+                                                   disk_max_bytes=1024 * 1024, ttl_seconds=3600)
+        client.generate("s", "u", temperature=0.0)
+        loop_thread = RecordingCache.hilos["memoria"]
+        assert RecordingCache.hilos["lectura"] != loop_thread
+        assert RecordingCache.hilos["escritura"] != loop_thread
+        client.close()
+    server.shutdown()
+
+
+def test_agentes_creativos_no_usan_la_cache_por_defecto():
+    import async_llm_client
+    server, url = start_server()
+    LLAMADAS.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_client(url, tmp)
+        # Con la configuración por defecto un brief idéntico no repite la misma historia
+        for _ in range(2):
+            resultado = client.generate("s", "u", temperature=0.8, agent_name="03_cuentacuentos")
+        assert len(LLAMADAS) == 2
+        assert "cache_hit" not in resultado["_metadata_tokens"]
+
+        # Opt-in explícito por agente
+        async_llm_client.LLM_CACHE_CONFIG["agents"].append("03_cuentacuentos")
+        try:
+            client.generate("s", "u", temperature=0.8, agent_name="03_cuentacuentos")
+            resultado = client.generate("s", "u", temperature=0.8, agent_name="03_cuentacuentos")
+            assert len(LLAMADAS) == 3
+            assert resultado["_metadata_tokens"]["cache_hit"] is True
+        finally:
+            async_llm_client.LLM_CACHE_CONFIG["agents"].remove("03_cuentacuentos")
+        client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Prueba offline del control adaptativo (AIMD) de concurrencia hacia el LLM.
+"""
+import sys
+import time
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from llm_admission import AdmissionController
+from llm_concurrency import AdaptiveConcurrencyController
+
+
+def make_controller(**kwargs):
+    admission = AdmissionController(max_in_flight=1, token_budget=0, policy="fifo")
+    params = dict(min_limit=1, max_limit=16, initial_limit=2, decrease_factor=0.5,
+                  latency_tolerance=2.0, error_threshold=0.1, window_size=20)
+    params.update(kwargs)
+    return admission, AdaptiveConcurrencyController(admission, **params)
+
+
+def test_crece_aditivamente_con_respuestas_sanas():
+    admission, aimd = make_controller()
+    assert admission.max_in_flight == 2
+    for _ in range(2 + 3 + 4):
+        aimd.record_success(1.0, 100, "01_director")
+    assert aimd.get_stats()["limit"] == 5
+    assert admission.max_in_flight == 5
+
+
+def test_no_supera_el_maximo():
+    admission, aimd = make_controller(max_limit=3)
+    for _ in range(50):
+        aimd.record_success(1.0, 100)
+    assert admission.max_in_flight == 3
+
+
+def test_reduce_a_la_mitad_ante_congestion_una_vez_por_latencia():
+    admission, aimd = make_controller(initial_limit=8)
+    aimd.record_success(0.2, 100)
+    aimd.record_overload("timeout")
+    assert admission.max_in_flight == 4
+    # Una ráfaga de errores de la misma ventana no vuelve a reducir
+    aimd.record_overload("503")
+    assert admission.max_in_flight == 4
+    time.sleep(0.25)
+    aimd.record_overload("503")
+    assert admission.max_in_flight == 2
+    for _ in range(10):
+        aimd.record_overload("503")
+        time.sleep(0.01)
+    assert admission.max_in_flight >= 1
+
+
+def test_pico_de_latencia_relativo_a_la_linea_base_del_agente():
+    admission, aimd = make_controller(initial_limit=8)
+    # Agentes con latencias muy distintas pero estables no se confunden con picos
+    for _ in range(10):
+        aimd.record_success(0.01, 10, "01_director")
+        aimd.record_success(3.0, 100, "verificador_qa")
+    assert aimd.stats["latency_spikes"] == 0
+    limite = admission.max_in_flight
+    # El mismo agente se vuelve 5 veces más lento por token
+    for _ in range(5):
+        aimd.record_success(0.05, 10, "01_director")
+    assert aimd.stats["latency_spikes"] >= 1
+    assert admission.max_in_flight < limite
+
+
+def test_respuestas_cortas_y_largas_no_son_picos():
+    admission, aimd = make_controller(initial_limit=4, max_limit=4)
+    # Servidor a velocidad constante: 0.3s de prefill + 20ms por token generado
+    largos = [5, 800, 12, 1500, 3, 400, 30, 2000, 8, 900] * 5
+    for tokens in largos:
+        aimd.record_success(0.3 + 0.02 * tokens, tokens, "05_editor")
+    assert aimd.stats["latency_spikes"] == 0 and aimd.stats["decreases"] == 0
+    assert admission.max_in_flight == 4
+
+
+def test_un_outlier_aislado_no_reduce():
+    admission, aimd = make_controller(initial_limit=4, max_limit=4)
+    for i in range(20):
+        # Cada tanto una respuesta lenta (GC, otra réplica), pero nunca seguidas
+        aimd.record_success(0.5 if i % 5 == 4 else 0.1, 100, "01_director")
+    assert aimd.stats["decreases"] == 0
+    assert admission.max_in_flight == 4
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Prueba offline de los requests de cobertura (hedging) del cliente LLM.
+"""
+import json
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+import log_history
+from async_llm_client import AsyncLLMClient, run_sync
+from llm_admission import AdmissionController
+from llm_hedging import HedgingPolicy
+
+
+def start_replica(name, delay):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            time.sleep(delay)
+            body = json.dumps({"choices": [{"message": {"content": json.dumps({"replica": name})}}]}).encode("utf-8")
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # El cliente canceló la llamada perdedora
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+
+def test_percentil_requiere_muestras_y_presupuesto_limita():
+    policy = HedgingPolicy(agents=["11_loader"], percentile=0.9, budget=0.1, min_samples=3)
+    assert policy.hedge_delay("11_loader") is None
+    for latency in [1.0, 2.0, 3.0, 4.0, 10.0]:
+        policy.record_latency("11_loader", latency)
+    assert policy.hedge_delay("11_loader") == 10.0
+    assert not policy.enabled_for("03_cuentacuentos")
+
+    for _ in range(20):
+        policy.record_request()
+    assert policy.try_acquire() and policy.try_acquire()
+    assert not policy.try_acquire()
+    assert policy.get_stats()["budget_denied"] == 1
+
+
+def test_percentil_se_aprende_de_los_logs():
+    with tempfile.TemporaryDirectory() as tmp:
+        logs = Path(tmp) / "historia-1" / "logs"
+        logs.mkdir(parents=True)
+        entradas = [{"status": "success", "execution_time": 9.0, "tokens_consumed": {"llm_latency": float(i)}}
+                    for i in range(1, 11)]
+        entradas.append({"status": "error", "execution_time": 500.0})
+        (logs / "10_portadista.log").write_text(json.dumps(entradas), encoding="utf-8")
+
+        original = log_history.RUNS_DIR
+        log_history.RUNS_DIR = Path(tmp)
+        try:
+            policy = HedgingPolicy(agents=["10_portadista"], percentile=0.5, budget=0.1, min_samples=5)
+            assert policy.hedge_delay("10_portadista") == 5.0
+        finally:
+            log_history.RUNS_DIR = original
+
+
+def test_duplica_en_otra_replica_y_gana_la_rapida():
+    lenta, url_lenta = start_replica("lenta", 2.0)
+    rapida, url_rapida = start_replica("rapida", 0.05)
+    client = AsyncLLMClient()
+    client.endpoint = [url_lenta, url_rapida]  # La primera llamada va a la lenta
+    client.cache = None
+    client.concurrency = None
+    client.admission = AdmissionController(max_in_flight=4, token_budget=0, policy="fifo")
+    client.hedging = HedgingPolicy(agents=["11_loader"], percentile=0.95, budget=1.0, min_samples=1)
+    client.hedging.record_latency("11_loader", 0.1)
+
+    start = time.time()
+    result = run_sync(client.generate("s", "u", agent_name="11_loader"))
+    elapsed = time.time() - start
+
+    assert result["replica"] == "rapida"
+    assert elapsed < 1.0, elapsed
+    stats = client.hedging.get_stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+    # La llamada perdedora se canceló y liberó su réplica y su cupo de admisión
+    assert all(s["outstanding_requests"] == 0 for s in client.router.get_stats())
+    assert client.admission.get_stats()["admitted"] == 2
+    assert client.admission.in_flight == 0 and client.admission.outstanding_tokens == 0
+
+    # Agentes no habilitados nunca se duplican
+    client.endpoint = [url_lenta, url_rapida]
+    assert run_sync(client.generate("s", "u2", agent_name="03_cuentacuentos"))["replica"] == "lenta"
+    assert client.hedging.get_stats()["hedges"] == 1
+    run_sync(client.close())
+    lenta.shutdown()
+    rapida.shutdown()
+
+
+def test_sin_cupo_de_admision_no_duplica():
+    lenta, url_lenta = start_replica("lenta", 0.5)
+    rapida, url_rapida = start_replica("rapida", 0.05)
+    client = AsyncLLMClient()
+    client.endpoint = [url_lenta, url_rapida]
+    client.cache = None
+    client.concurrency = None
+    # La llamada original ocupa el único cupo
+    client.admission = AdmissionController(max_in_flight=1, token_budget=0, policy="fifo")
+    client.hedging = HedgingPolicy(agents=["11_loader"], percentile=0.95, budget=1.0, min_samples=1)
+    client.hedging.record_latency("11_loader", 0.1)
+
+    result = run_sync(client.generate("s", "u", agent_name="11_loader"))
+    assert result["replica"] == "lenta"
+    stats = client.hedging.get_stats()
+    assert stats["hedges"] == 0 and stats["admission_denied"] == 1
+    assert client.admission.in_flight == 0
+    assert client.admission.get_stats()["admitted"] == 1
+    run_sync(client.close())
+    lenta.shutdown()
+    rapida.shutdown()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Prueba offline del enrutamiento entre varias réplicas LLM.
+"""
+import asyncio
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from async_llm_client import AsyncLLMClient, run_sync
+from llm_router import EndpointRouter
+
+
+def start_replica(name):
+    """Réplica falsa; state["fail"] = True la hace responder 503"""
+    state = {"fail": False, "posts": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.reply(503 if state["fail"] else 200, {"data": []})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            state["posts"] += 1
+            if state["fail"]:
+                return self.reply(503, {"error": "caída"})
+            self.reply(200, {"choices": [{"message": {"content": json.dumps({"replica": name})}}]})
+
+        def reply(self, status, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions", state
+
+
+def test_elige_la_replica_con_menos_tokens_comprometidos():
+    router = EndpointRouter(["http://a/v1/chat/completions", "http://b/v1/chat/completions"])
+    a = router.pick(1000)
+    b = router.pick(10)
+    assert a is not b
+    # La siguiente va a la que tiene menos tokens comprometidos
+    assert router.pick(10) is b
+    router.finish(a, 1000, latency=0.5)
+    assert router.pick(10) is a
+    stats = {s["url"]: s for s in router.get_stats()}
+    assert stats["http://a/v1/chat/completions"]["latency_p50"] == 0.5
+
+
+def test_expulsa_tras_fallos_y_falla_abierto():
+    router = EndpointRouter(["http://a/v1/chat/completions", "http://b/v1/chat/completions"],
+                            eject_after_failures=2, probe_interval=3600)
+    a = router.endpoints[0]
+    for _ in range(2):
+        router.finish(router.pick(0, exclude=router.endpoints[1]), 0, failed=True)
+    assert not a.healthy and a.ejections == 1
+    assert all(router.pick(0) is router.endpoints[1] for _ in range(3))
+    # Si todas están expulsadas se intenta igualmente
+    for _ in range(2):
+        router.finish(router.endpoints[1], 0, failed=True)
+    assert router.pick(0) in router.endpoints
+
+
+def test_cliente_evita_replica_caida_y_la_readmite_por_sondeo():
+    server_a, url_a, state_a = start_replica("a")
+    server_b, url_b, state_b = start_replica("b")
+    client = AsyncLLMClient()
+    client.endpoint = f"{url_a},{url_b}"
+    client.router.eject_after_failures = 1
+    client.router.probe_interval = 0.05
+    client.retry_delay = 0
+    client.cache = None
+    client.concurrency = None
+    state_a["fail"] = True
+
+    async def escenario():
+        replicas = [(await client.generate("s", f"u{i}"))["replica"] for i in range(6)]
+        assert set(replicas) == {"b"}
+        assert not client.router.endpoints[0].healthy
+        state_a["fail"] = False
+        await asyncio.sleep(0.3)
+        assert client.router.endpoints[0].healthy
+        replicas = [(await client.generate("s", f"v{i}"))["replica"] for i in range(4)]
+        assert "a" in replicas
+        await client.close()
+
+    run_sync(escenario())
+    stats = client.get_metrics()["endpoints"]
+    assert stats[0]["errors"] >= 1 and stats[0]["ejections"] == 1
+    assert stats[1]["latency_mean"] is not None
+    server_a.shutdown()
+    server_b.shutdown()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Prueba offline del manifest con escritor único, escrituras agrupadas y atómicas.
+"""
+import json
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from manifest_store import ManifestStore, get_manifest_store, read_manifest
+
+
+def _on_disk(store: ManifestStore):
+    return json.loads(store.path.read_text(encoding="utf-8"))
+
+
+def test_agrupa_escrituras_dentro_del_intervalo():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ManifestStore(Path(tmp), debounce=0.2)
+        store.initialize({"estado": "iniciado", "timestamps": {}})
+        assert not store.path.exists()
+
+        for i in range(50):
+            store.set_in("timestamps", f"agente_{i}", {"duration": i})
+        assert store.writes == 0
+        time.sleep(0.5)
+        assert store.writes == 1
+        assert len(_on_disk(store)["timestamps"]) == 50
+
+        # flush escribe de inmediato, y sin cambios pendientes no vuelve a escribir
+        store.set("estado", "completo")
+        assert store.flush() and _on_disk(store)["estado"] == "completo"
+        assert not store.flush() and store.writes == 2
+
+
+def test_cambios_concurrentes_no_se_pierden():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ManifestStore(Path(tmp), debounce=0)
+        store.initialize({"devoluciones": []})
+
+        def worker(n):
+            for i in range(25):
+                store.append_to("devoluciones", {"paso": n, "i": i})
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(store.get("devoluciones")) == 200
+        assert len(_on_disk(store)["devoluciones"]) == 200
+        assert [p.name for p in Path(tmp).iterdir()] == ["manifest.json"]
+
+
+def test_lecturas_son_copias_e_instancia_compartida():
+    with tempfile.TemporaryDirectory() as tmp:
+        story = Path(tmp)
+        (story / "manifest.json").write_text('{"fingerprints": {"01_director": {"hash": "abc"}}}', encoding="utf-8")
+        store = get_manifest_store(story)
+        assert get_manifest_store(story / ".") is store
+
+        fingerprints = store.get("fingerprints")
+        fingerprints.pop("01_director")
+        assert "01_director" in store.get("fingerprints")
+        # initialize no pisa un manifest cargado de disco
+        store.initialize({"fingerprints": {}})
+        assert store["fingerprints"]["01_director"]["hash"] == "abc"
+
+
+def test_consultas_leen_el_estado_en_memoria():
+    with tempfile.TemporaryDirectory() as tmp:
+        story = Path(tmp)
+        assert read_manifest(story) is None
+        (story / "manifest.json").write_text('{"estado": "iniciado"}', encoding="utf-8")
+        # Sin store abierto se lee el archivo
+        assert read_manifest(story)["estado"] == "iniciado"
+
+        store = get_manifest_store(story)
+        store.debounce = 60
+        store.set("estado", "en_progreso")
+        assert _on_disk(store)["estado"] == "iniciado"
+        assert read_manifest(story)["estado"] == "en_progreso"
+        store.flush()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Prueba offline del servidor LLM simulado: replay, síntesis, fallas, streaming y cola.
+"""
+import json
+import sys
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from async_llm_client import AsyncLLMClient, run_sync
+from mock_llm_server import REFUSAL_TEXT, ReplayStore, start_mock_server
+
+FAST = {"time_scale": 0, "cassettes": []}
+
+
+def client_for(url: str, **overrides) -> AsyncLLMClient:
+    client = AsyncLLMClient()
+    client.endpoint = url
+    client.cache = None
+    client.concurrency = None
+    client.hedging = None
+    client.retry_delay = 0
+    for key, value in overrides.items():
+        setattr(client, key, value)
+    return client
+
+
+def post(url: str, payload: dict):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def write_json(path: Path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+def test_replay_de_una_historia_grabada():
+    with tempfile.TemporaryDirectory() as runs_dir:
+        story = Path(runs_dir) / "historia-1"
+        write_json(story / "inputs" / "agents" / "01_director_request.json",
+                   {"agent": "01_director", "system_prompt": "Eres el director", "user_prompt": "brief"})
+        write_json(story / "outputs" / "agents" / "01_director.json", {"leitmotiv": "grabado"})
+        write_json(story / "inputs" / "pages" / "pagina_02_intento_1_request.json",
+                   {"prompts": {"system": "Contrato", "user": "página 2"}})
+        write_json(story / "outputs" / "pages" / "pagina_02_intento_1_result.json",
+                   {"response": {"texto": "verso grabado", "_metadata_tokens": {"completion_tokens": 9}}})
+
+        store = ReplayStore()
+        assert store.load_runs(Path(runs_dir)) == 2
+
+        server, mock, url = start_mock_server(store=store, **FAST)
+        client = client_for(url, retry_attempts=1)
+        # El cliente agrega la instrucción JSON y max_tokens: la clave no depende de eso
+        director = run_sync(client.generate("Eres el director", "brief", max_tokens=4000))
+        page = run_sync(client.generate("Contrato", "página 2", stream=True))
+        assert director["leitmotiv"] == "grabado"
+        assert page["texto"] == "verso grabado"
+        assert mock.get_stats()["replayed"] == 2
+        run_sync(client.close())
+        server.shutdown()
+
+
+def test_sintetiza_segun_el_schema_y_reporta_cached_tokens():
+    server, mock, url = start_mock_server(store=ReplayStore(), **FAST)
+    client = client_for(url, retry_attempts=1)
+    schema = {"type": "object", "properties": {"texto": {"type": "string"}, "nota": {"type": "number"}}}
+    first = run_sync(client.generate("Contrato fijo", "página 1", json_schema=schema, agent_name="x"))
+    second = run_sync(client.generate("Contrato fijo", "página 2", json_schema=schema, agent_name="x"))
+    assert isinstance(first["texto"], str) and 4 <= first["nota"] <= 5
+    # El segundo request comparte system prompt: el mock lo reporta en caché
+    assert second["_metadata_tokens"]["cached_tokens"] > 0
+    assert "cached_tokens" not in first["_metadata_tokens"] or first["_metadata_tokens"]["cached_tokens"] == 0
+
+    qa = post(url, {"messages": [{"role": "system", "content": "s"}, {"role": "user", "content": "u"}],
+                    "response_format": {"type": "json_schema", "json_schema": {"name": "verificador_qa"}}})
+    assert json.loads(qa["choices"][0]["message"]["content"])["pasa_umbral"] is True
+    run_sync(client.close())
+    server.shutdown()
+
+
+def test_fallas_inyectadas():
+    server, mock, url = start_mock_server(store=ReplayStore(), refusal_rate=1.0, **FAST)
+    result = post(url, {"messages": [{"role": "user", "content": "hola"}]})
+    assert result["choices"][0]["message"]["content"] == REFUSAL_TEXT
+    mock.config.update(refusal_rate=0, truncation_rate=1.0)
+    result = post(url, {"messages": [{"role": "user", "content": "hola"}]})
+    assert result["choices"][0]["finish_reason"] == "length"
+    mock.config.update(truncation_rate=0, server_error_rate=1.0)
+    try:
+        post(url, {"messages": [{"role": "user", "content": "hola"}]})
+        assert False, "se esperaba un 500"
+    except urllib.error.HTTPError as e:
+        assert e.code == 500
+    assert mock.get_stats()["faults"] == {"timeout": 0, "empty": 0, "refusal": 1, "truncation": 1, "server_error": 1}
+    server.shutdown()
+
+
+def test_max_tokens_trunca_la_respuesta():
+    store = ReplayStore()
+    store.add("s", "largo", json.dumps({"texto": "palabra " * 400}))
+    server, mock, url = start_mock_server(store=store, **FAST)
+    result = post(url, {"messages": [{"role": "system", "content": "s"}, {"role": "user", "content": "largo"}],
+                        "max_tokens": 50})
+    assert result["choices"][0]["finish_reason"] == "length"
+    assert result["usage"]["completion_tokens"] <= 55
+    server.shutdown()
+
+
+def test_limite_de_concurrencia_y_cola():
+    server, mock, url = start_mock_server(store=ReplayStore(), max_concurrency=2, max_queue=1,
+                                          latency_distribution="fixed", latency_median=0.3,
+                                          time_scale=1.0, cassettes=[])
+    statuses = []
+
+    def call():
+        try:
+            post(url, {"messages": [{"role": "user", "content": "hola"}]})
+            statuses.append(200)
+        except urllib.error.HTTPError as e:
+            statuses.append(e.code)
+
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = mock.get_stats()
+    assert stats["max_active"] == 2
+    assert sorted(statuses) == [200, 200, 200, 503, 503]
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
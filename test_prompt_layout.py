@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Prueba offline del orden de los prompts (prefijo estable) y de cached_tokens.
+"""
+import os
+import sys
+import threading
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from async_llm_client import AsyncLLMClient, JSON_INSTRUCTION, parse_completion
+from parallel_cuentacuentos import ParallelCuentacuentos
+from prompt_layout import build_prompt
+
+
+def common_prefix(a: str, b: str) -> int:
+    return len(os.path.commonprefix([a, b]))
+
+
+def page_processor() -> ParallelCuentacuentos:
+    """Procesador de páginas con los datos de la historia en memoria"""
+    processor = ParallelCuentacuentos.__new__(ParallelCuentacuentos)
+    processor.director_data = {
+        "leitmotiv": "Brilla, brilla",
+        "beat_sheet": [{"objetivo": f"objetivo {i}", "emocion": "calma"} for i in range(1, 11)]
+    }
+    processor.psicoeducador_data = {
+        "edad_objetivo": 4,
+        "mapa_psico_narrativo": [{"micro_habilidad": f"habilidad {i}"} for i in range(1, 11)]
+    }
+    processor.brief_data = {"personajes": ["Emilia", "Caty"]}
+    processor.rima_config = {"default_scheme": "AABB", "pages": {"3": {"scheme": "ABAB", "nombre": "Cruzada"}}}
+    processor.used_rimas_lock = threading.Lock()
+    processor.used_rimas = set()
+    return processor
+
+
+def test_build_prompt_ordena_de_estable_a_variable():
+    system, user = build_prompt("CONTRATO", criteria="CRITERIOS", shared_context="HISTORIA", call="PÁGINA 3")
+    assert system == "CONTRATO\n\nCRITERIOS"
+    assert user == "HISTORIA\n\nPÁGINA 3"
+    assert build_prompt("CONTRATO", call="x") == ("CONTRATO", "x")
+
+
+def test_paginas_comparten_prefijo():
+    processor = page_processor()
+    prompts = [processor.create_page_prompt(page) for page in range(1, 11)]
+
+    # El system prompt (con la instrucción JSON del cliente) es idéntico para las 10 páginas
+    assert len({system + JSON_INSTRUCTION for system, _ in prompts}) == 1
+    assert "ABAB" not in prompts[2][0] and "página 3" not in prompts[2][0].lower()
+
+    # El user prompt abre con el contexto de la historia y la página va después
+    shared = prompts[0][1].index("PÁGINA 1")
+    assert all(common_prefix(prompts[0][1], user) >= shared for _, user in prompts[1:])
+    assert "ABAB" in prompts[2][1][shared:]
+
+
+def test_cached_tokens_en_metadata_y_metricas():
+    usage = {"prompt_tokens": 1000, "completion_tokens": 50, "prompt_tokens_details": {"cached_tokens": 768}}
+    result = {"choices": [{"message": {"content": '{"a": 1}'}, "finish_reason": "stop"}], "usage": usage}
+    parsed = parse_completion(result, 0, "s", "u", 0.7, 100, 60)
+    assert parsed["_metadata_tokens"]["cached_tokens"] == 768
+
+    sin_detalle = dict(result, usage={"prompt_tokens": 10, "completion_tokens": 5})
+    assert "cached_tokens" not in parse_completion(sin_detalle, 0, "s", "u", 0.7, 100, 60)["_metadata_tokens"]
+
+    client = AsyncLLMClient()
+    client._record_prefix_cache(usage)
+    client._record_prefix_cache({"prompt_tokens": 1000, "prompt_tokens_details": {"cached_tokens": 232}})
+    client._record_prefix_cache({"prompt_tokens": 500})
+    metrics = client.get_metrics()["prefix_cache"]
+    assert metrics == {"requests": 2, "prompt_tokens": 2000, "cached_tokens": 1000, "hit_rate": 0.5}
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Prueba offline del journal por historia, la recuperación y las escrituras atómicas.
+"""
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from atomic_io import atomic_write_json
+from story_journal import StoryJournal, file_sha256, find_interrupted_stories, journal_state, read_journal
+
+
+def test_escritura_atomica_no_deja_archivos_a_medias():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "manifest.json"
+        atomic_write_json(path, {"estado": "en_progreso", "texto": "ñandú"})
+        assert json.loads(path.read_text(encoding="utf-8"))["texto"] == "ñandú"
+
+        # Si la escritura falla, queda el archivo anterior y ningún temporal
+        try:
+            atomic_write_json(path, {"no_serializable": {1, 2}})
+        except TypeError:
+            pass
+        assert json.loads(path.read_text(encoding="utf-8"))["estado"] == "en_progreso"
+        assert [p.name for p in Path(tmp).iterdir()] == ["manifest.json"]
+
+
+def test_estado_del_journal_y_linea_cortada():
+    with tempfile.TemporaryDirectory() as tmp:
+        story = Path(tmp)
+        (story / "01_director.json").write_text('{"a": 1}', encoding="utf-8")
+        journal = StoryJournal(story, fsync=False)
+        journal.append("story_started", commit=True, pid=os.getpid(), pipeline_version="v2")
+        for agent in ("01_director", "02_psicoeducador"):
+            journal.append("agent_started", agent=agent)
+        journal.append("artifact", agent="01_director", file="01_director.json",
+                       sha256=file_sha256(story / "01_director.json"))
+        journal.append("agent_finished", commit=True, agent="01_director", status="success",
+                       fingerprint={"hash": "abc", "inputs": {}})
+        # La caída corta la última línea a la mitad
+        with open(journal.path, "a", encoding="utf-8") as f:
+            f.write('{"ts": "2026-01-01", "event": "agent_fini')
+
+        events = read_journal(journal.path)
+        assert [e["event"] for e in events][-1] == "agent_finished"
+        state = journal_state(events)
+        assert state["interrumpida"] and state["inicio"]["pipeline_version"] == "v2"
+        assert state["en_curso"] == ["02_psicoeducador"]
+        assert state["confirmados"]["01_director"]["fingerprint"]["hash"] == "abc"
+
+        # Un nuevo inicio del agente invalida su confirmación; el fin de la historia cierra el journal
+        events += [{"event": "agent_started", "agent": "01_director"}, {"event": "story_finished"}]
+        state = journal_state(events)
+        assert not state["interrumpida"] and "01_director" not in state["confirmados"]
+
+
+def test_reanudacion_no_repite_el_inicio():
+    events = [
+        {"event": "story_started", "pid": 1, "pipeline_version": "v2", "webhook_url": "http://hook"},
+        {"event": "story_finished", "estado": "completo"},
+        {"event": "story_resumed", "pid": 2, "pipeline_version": "v2"},
+        {"event": "agent_started", "agent": "08_direccion_arte"}
+    ]
+    state = journal_state(events)
+    # Una caída durante /retry deja la historia interrumpida con los datos de la solicitud original
+    assert state["interrumpida"] and state["en_curso"] == ["08_direccion_arte"]
+    assert state["inicio"]["webhook_url"] == "http://hook" and state["inicio"]["pid"] == 2
+    assert events[0]["pid"] == 1
+
+    state = journal_state(events + [{"event": "story_finished", "estado": "completo"}])
+    assert not state["interrumpida"]
+
+
+def test_busca_historias_interrumpidas():
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = Path(tmp)
+        for name, events in {
+            "a-terminada": [("story_started", {"pid": 999999999}), ("story_finished", {})],
+            "b-interrumpida": [("story_started", {"pid": 999999999}), ("agent_started", {"agent": "01_director"})],
+            # Otro proceso vivo la sigue ejecutando
+            "c-en-otro-proceso": [("story_started", {"pid": os.getppid()})],
+        }.items():
+            journal = StoryJournal(runs / name, fsync=False)
+            for event, fields in events:
+                journal.append(event, **fields)
+        (runs / "d-sin-journal").mkdir()
+
+        found = find_interrupted_stories(runs)
+        assert [path.name for path, _ in found] == ["b-interrumpida"]
+        assert found[0][1]["en_curso"] == ["01_director"]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
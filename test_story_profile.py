@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Prueba offline de la ruta crítica y del desglose de latencia por historia.
+"""
+import json
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from story_profile import critical_path, format_profile, profile_story
+
+
+def test_ruta_critica_y_holgura():
+    graph = {"a": set(), "b": {"a"}, "c": {"a"}, "d": {"b", "c"}}
+    path, total, slack = critical_path(graph, {"a": 1.0, "b": 3.0, "c": 1.0, "d": 2.0})
+    assert path == ["a", "b", "d"] and total == 6.0
+    assert slack == {"a": 0.0, "b": 0.0, "c": 2.0, "d": 0.0}
+
+
+def write_story(story_dir: Path, with_trace: bool):
+    """Historia v2 con 09 y 10 en paralelo y los agentes 04-06 saltados"""
+    config_pipeline = ["01_director", "02_psicoeducador", "03_cuentacuentos", "04_editor_claridad",
+                       "05_ritmo_rima", "06_continuidad", "07_diseno_escena", "08_direccion_arte",
+                       "09_sensibilidad", "10_portadista", "11_loader", "12_validador"]
+    origin = datetime(2026, 1, 1, 12, 0, 0)
+    spans = {
+        "01_director": (0.0, 1.0), "02_psicoeducador": (1.0, 2.0), "03_cuentacuentos": (2.0, 5.0),
+        "07_diseno_escena": (5.5, 6.0), "08_direccion_arte": (6.0, 7.0),
+        "09_sensibilidad": (7.0, 7.5), "10_portadista": (7.0, 8.0),
+        "11_loader": (8.0, 8.5), "12_validador": (8.5, 9.0)
+    }
+    timestamps = {}
+    for agent in config_pipeline:
+        if agent in spans:
+            start, end = spans[agent]
+            timestamps[agent] = {"start": (origin + timedelta(seconds=start)).isoformat(),
+                                 "end": (origin + timedelta(seconds=end)).isoformat()}
+        else:
+            timestamps[agent] = {"skipped": True, "source_file": "03_cuentacuentos.json"}
+    manifest = {"story_id": story_dir.name, "pipeline_version": "v2", "estado": "completo",
+                "timestamps": timestamps, "reintentos": {"03_cuentacuentos": 1}}
+    story_dir.mkdir()
+    (story_dir / "manifest.json").write_text(json.dumps(manifest), encoding="utf-8")
+    (story_dir / "logs").mkdir()
+    (story_dir / "logs" / "03_cuentacuentos.log").write_text(json.dumps([
+        {"status": "success", "tokens_consumed": {"queue_wait": 0.5, "llm_latency": 2.0}}
+    ]), encoding="utf-8")
+
+    if with_trace:
+        us = 1_000_000
+        events = [
+            {"name": "03_cuentacuentos", "cat": "agent", "ph": "X", "ts": 2 * us, "dur": 3 * us, "pid": 1, "tid": 1},
+            {"name": "run_agent", "cat": "agent", "ph": "X", "ts": 2 * us, "dur": 1 * us, "pid": 1, "tid": 1,
+             "args": {"retry_count": 0}},
+            {"name": "llm 03_cuentacuentos", "cat": "llm", "ph": "X", "ts": 2 * us, "dur": 1 * us, "pid": 1,
+             "tid": 1, "args": {"agent": "03_cuentacuentos", "queue_wait": 0.25}},
+            {"name": "run_agent", "cat": "agent", "ph": "X", "ts": 3 * us, "dur": 2 * us, "pid": 1, "tid": 1,
+             "args": {"retry_count": 1}},
+            {"name": "llm 03_cuentacuentos", "cat": "llm", "ph": "X", "ts": 3 * us, "dur": 1 * us, "pid": 1,
+             "tid": 1, "args": {"agent": "03_cuentacuentos"}},
+            {"name": "llm verificador_qa", "cat": "llm", "ph": "X", "ts": 4 * us, "dur": us // 2, "pid": 1,
+             "tid": 1, "args": {"agent": "verificador_qa"}},
+            {"name": "_save_output", "cat": "io", "ph": "X", "ts": 4.5 * us, "dur": us // 4, "pid": 1, "tid": 1},
+            # Otro hilo: no cuenta para 03
+            {"name": "llm otro", "cat": "llm", "ph": "X", "ts": 2 * us, "dur": 1 * us, "pid": 1, "tid": 2},
+        ]
+        (story_dir / "trace.json").write_text(json.dumps({"traceEvents": events}), encoding="utf-8")
+
+
+def test_perfil_desde_traza():
+    with tempfile.TemporaryDirectory() as tmp:
+        story_dir = Path(tmp) / "historia-traza"
+        write_story(story_dir, with_trace=True)
+        profile = profile_story(story_dir)
+
+    assert profile["tiempo_total"] == 9.0 and profile["suma_duraciones"] == 9.0
+    assert profile["ruta_critica"] == ["01_director", "02_psicoeducador", "03_cuentacuentos", "07_diseno_escena",
+                                       "08_direccion_arte", "10_portadista", "11_loader", "12_validador"]
+    agents = profile["agentes"]
+    assert agents["09_sensibilidad"]["holgura"] == 1.0 and not agents["09_sensibilidad"]["critico"]
+    assert agents["05_ritmo_rima"] == {"saltado": True, "copia_de": "03_cuentacuentos.json"}
+    # 07 espera desde que terminó 03 aunque sus dependencias directas estén saltadas
+    assert agents["07_diseno_escena"]["espera"] == 0.5
+
+    desglose = agents["03_cuentacuentos"]["desglose"]
+    assert profile["fuente_desglose"] == "trace"
+    assert desglose["cola_llm"] == 0.25 and desglose["generacion"] == 1.75
+    assert desglose["verificacion_qa"] == 0.5 and desglose["io_local"] == 0.25
+    assert desglose["otro"] == 0.25 and desglose["reintentos"] == 2.0
+    assert "* ruta crítica" in format_profile(profile)
+
+
+def test_perfil_sin_traza_usa_logs():
+    with tempfile.TemporaryDirectory() as tmp:
+        story_dir = Path(tmp) / "historia-logs"
+        write_story(story_dir, with_trace=False)
+        profile = profile_story(story_dir)
+
+    desglose = profile["agentes"]["03_cuentacuentos"]["desglose"]
+    assert profile["fuente_desglose"] == "logs"
+    assert desglose["cola_llm"] == 0.5 and desglose["generacion"] == 2.0 and desglose["otro"] == 0.5
+    assert profile["agentes"]["03_cuentacuentos"]["reintentos"] == 1
+
+
+def test_agentes_al_dia_no_cuentan_en_el_tiempo_de_esta_ejecucion():
+    with tempfile.TemporaryDirectory() as tmp:
+        story_dir = Path(tmp) / "historia-al-dia"
+        write_story(story_dir, with_trace=False)
+        manifest = json.loads((story_dir / "manifest.json").read_text(encoding="utf-8"))
+        # 01 se reutilizó: conserva los tiempos de la ejecución del día anterior
+        manifest["timestamps"]["01_director"] = {
+            "start": "2025-12-31T12:00:00", "end": "2025-12-31T12:00:07", "duration": 7.0,
+            "up_to_date": True, "reused_at": "2026-01-01T12:00:00"
+        }
+        (story_dir / "manifest.json").write_text(json.dumps(manifest), encoding="utf-8")
+        profile = profile_story(story_dir)
+
+    assert profile["agentes"]["01_director"] == {"al_dia": True, "duracion_previa": 7.0}
+    assert profile["tiempo_total"] == 8.0 and profile["suma_duraciones"] == 8.0
+    assert "01_director" not in profile["ruta_critica"]
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
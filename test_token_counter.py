@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Prueba offline del conteo de tokens (heurística calibrada y memoización).
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from token_counter import TokenCounter, heuristic_count, tiktoken_cached
+
+PAGINA = {
+    "pagina": 3,
+    "texto": "Emilia miró el cielo estrellado y sonrió: ¡mañana viajaría a Marte con su chupete mágico!",
+    "ilustracion": {"personajes": ["Emilia", "Felipe"], "colores": ["azul", "dorado"]}
+}
+
+
+def test_indentacion_no_infla_el_conteo():
+    compacto = json.dumps(PAGINA, ensure_ascii=False)
+    indentado = json.dumps(PAGINA, ensure_ascii=False, indent=8)
+    # Con chars // 4 la indentación casi duplica la estimación; en o200k cada
+    # salto de línea con su indentación es un token (más el que separa la
+    # puntuación que antes iba junta, como `{"`)
+    extra = heuristic_count(indentado) - heuristic_count(compacto)
+    assert len(indentado) // 4 - len(compacto) // 4 > 2 * extra
+    assert extra <= 2 * indentado.count("\n")
+    assert heuristic_count("") == 0
+    assert heuristic_count("año 2024") == 3
+    assert heuristic_count("hola_mundo") == 3
+
+
+def test_heuristica_sin_tokenizer_y_memoizada():
+    counter = TokenCounter(backend="heuristic", memo_entries=2)
+    assert counter.backend_name == "heuristic" and not counter.exact
+    texto = json.dumps(PAGINA, ensure_ascii=False)
+    assert counter.count(texto) == heuristic_count(texto)
+    counter.count(texto)
+    assert counter.get_stats()["memo_hits"] == 1
+    counter.count("a")
+    counter.count("b")
+    assert counter.get_stats()["memo_size"] == 2
+
+    mensajes = [{"role": "system", "content": "s"}, {"role": "user", "content": texto}]
+    assert counter.count_messages(mensajes) > counter.count(texto)
+
+
+def test_tiktoken_sin_cache_no_descarga():
+    previous = os.environ.get("TIKTOKEN_CACHE_DIR")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["TIKTOKEN_CACHE_DIR"] = tmp
+        try:
+            assert not tiktoken_cached("o200k_harmony")
+            counter = TokenCounter(backend="tiktoken", encoding="o200k_harmony")
+            assert counter.backend_name == "heuristic"
+
+            # Con el BPE en la caché (mismo nombre que usa tiktoken) sí se intenta
+            blob = "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken"
+            (Path(tmp) / hashlib.sha1(blob.encode()).hexdigest()).write_text("", encoding="utf-8")
+            assert tiktoken_cached("o200k_harmony") and not tiktoken_cached("desconocida")
+        finally:
+            if previous is None:
+                os.environ.pop("TIKTOKEN_CACHE_DIR", None)
+            else:
+                os.environ["TIKTOKEN_CACHE_DIR"] = previous
+
+
+def test_calibracion_con_prompt_tokens_reales():
+    counter = TokenCounter(backend="heuristic")
+    texto = json.dumps([PAGINA] * 10, ensure_ascii=False, indent=2)
+    mensajes = [{"role": "user", "content": texto}]
+    estimado = counter.count_messages(mensajes)
+    real = int(estimado * 1.3)
+    for _ in range(30):
+        counter.observe(mensajes, real)
+    assert abs(counter.count_messages(mensajes) - real) / real < 0.03
+
+    # Prompts cortos no calibran (la plantilla domina)
+    factor = counter.heuristic_factor
+    counter.observe([{"role": "user", "content": "hola"}], 500)
+    assert counter.heuristic_factor == factor
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Prueba offline del max_tokens aprendido por agente y de su escalado al truncarse.
+"""
+import json
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from async_llm_client import AsyncLLMClient, run_sync
+from token_sizing import PAGE_SIZING_KEY, MaxTokensSizer
+
+MAX_TOKENS_RECIBIDOS = []
+
+
+def write_runs(tmp, agent_tokens, page_tokens):
+    for i, tokens in enumerate(agent_tokens):
+        logs = Path(tmp) / f"historia-{i}" / "logs"
+        logs.mkdir(parents=True, exist_ok=True)
+        entradas = [
+            {"status": "success", "max_tokens": 20000, "tokens_consumed": {"completion_tokens": tokens}},
+            {"status": "error", "max_tokens": 20000}
+        ]
+        (logs / "01_director.log").write_text(json.dumps(entradas), encoding="utf-8")
+    for i, tokens in enumerate(page_tokens):
+        logs = Path(tmp) / f"historia-{i}" / "logs"
+        logs.mkdir(parents=True, exist_ok=True)
+        pagina = {"status": "success", "response": {"versos": [], "_metadata_tokens": {"completion_tokens": tokens}}}
+        (logs / "03_cuentacuentos_pagina_01_intento_1.log").write_text(json.dumps(pagina), encoding="utf-8")
+
+
+def test_percentil_con_margen_y_tope_configurado():
+    with tempfile.TemporaryDirectory() as tmp:
+        write_runs(tmp, [1000 + 10 * i for i in range(30)], [300] * 25)
+        sizer = MaxTokensSizer(percentile=0.99, margin=0.25, min_samples=20, runs_dir=tmp)
+
+        # p99 = 1290 -> 1290 * 1.25 = 1612.5 -> múltiplo de 256 = 1792
+        assert sizer.recommend("01_director", 20000) == 1792
+        assert sizer.recommend("01_director", 1500) == 1500
+        # Las páginas se leen de sus logs individuales; nunca por debajo del mínimo
+        assert sizer.recommend(PAGE_SIZING_KEY, 30000) == 1024
+        # Sin historial suficiente se usa el configurado
+        assert sizer.recommend("02_psicoeducador", 20000) == 20000
+        assert sizer.get_stats()["01_director"]["samples"] == 30
+
+
+def test_truncamiento_sube_el_piso_del_agente():
+    with tempfile.TemporaryDirectory() as tmp:
+        write_runs(tmp, [1000] * 25, [])
+        sizer = MaxTokensSizer(percentile=0.99, margin=0.25, min_samples=20, runs_dir=tmp)
+        assert sizer.recommend("01_director", 20000) == 1280
+        sizer.record_truncation("01_director", 2560)
+        assert sizer.recommend("01_director", 20000) == 2560
+
+
+def test_historial_se_lee_una_vez_y_se_actualiza_por_historia():
+    import token_sizing
+    with tempfile.TemporaryDirectory() as tmp:
+        write_runs(tmp, [1000] * 25, [])
+        sizer = MaxTokensSizer(percentile=0.99, margin=0.25, min_samples=20, runs_dir=tmp)
+
+        scans = []
+        original = token_sizing.find_log_files
+        token_sizing.find_log_files = lambda *args: scans.append(args) or original(*args)
+        try:
+            assert sizer.recommend("01_director", 20000) == 1280
+            for _ in range(10):
+                sizer.recommend("01_director", 20000)
+            assert len(scans) == 1
+
+            # Una historia nueva con respuestas más largas: solo se lee su carpeta
+            logs = Path(tmp) / "historia-nueva" / "logs"
+            logs.mkdir(parents=True)
+            entradas = [{"status": "success", "tokens_consumed": {"completion_tokens": 3000}}]
+            (logs / "01_director.log").write_text(json.dumps(entradas), encoding="utf-8")
+            sizer.refresh_run(logs.parent)
+            sizer.refresh_run(logs.parent)  # Repetirla no duplica muestras
+            assert sizer.recommend("01_director", 20000) == 3840
+            assert sizer.get_stats()["01_director"]["samples"] == 26
+            assert len(scans) == 1
+        finally:
+            token_sizing.find_log_files = original
+
+
+def test_cliente_escala_max_tokens_al_truncarse():
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            MAX_TOKENS_RECIBIDOS.append(payload["max_tokens"])
+            if payload["max_tokens"] < 1000:
+                choice = {"message": {"content": '{"versos": ["Emilia mira'}, "finish_reason": "length"}
+            else:
+                choice = {"message": {"content": '{"versos": ["Emilia mira el mar"]}'}, "finish_reason": "stop"}
+            body = json.dumps({"choices": [choice]}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = AsyncLLMClient()
+    client.endpoint = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    client.cache = None
+    client.concurrency = None
+    client.hedging = None
+    client.retry_delay = 0
+
+    result = run_sync(client.generate("s", "u", max_tokens=500, max_tokens_ceiling=4000, use_cache=False))
+    assert result["versos"] == ["Emilia mira el mar"]
+    assert MAX_TOKENS_RECIBIDOS == [500, 1000]
+    assert result["_metadata_tokens"]["max_tokens_escalated"] == 1000
+
+    # Sin tope no se escala: el truncamiento agota los reintentos
+    MAX_TOKENS_RECIBIDOS.clear()
+    try:
+        run_sync(client.generate("s", "u2", max_tokens=500, use_cache=False))
+        assert False, "Debió fallar por respuesta truncada"
+    except Exception as e:
+        assert "truncada" in str(e)
+    assert MAX_TOKENS_RECIBIDOS == [500] * client.retry_attempts
+    run_sync(client.close())
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Prueba offline de los spans por historia y del export Chrome trace-event.
+"""
+import json
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+# Agregar src al path
+sys.path.append(str(Path(__file__).parent / "src"))
+
+from tracing import Tracer, current_tracer, span, traced
+
+
+@traced("io", "page_num")
+def save_page(page_num: int, content: str = "") -> int:
+    with span("serialize", "cpu"):
+        return page_num * 2
+
+
+def test_sin_tracer_activo_no_registra():
+    assert current_tracer() is None
+    with span("suelto") as args:
+        args["x"] = 1
+    assert save_page(3) == 6
+
+
+def test_spans_anidados_con_args():
+    tracer = Tracer("historia-1")
+    with tracer.activate():
+        with span("process_story", "pipeline", version="v2") as root:
+            assert save_page(4, content="texto") == 8
+            root["status"] = "success"
+        try:
+            with span("falla", "agent"):
+                raise ValueError("boom")
+        except ValueError:
+            pass
+    assert current_tracer() is None
+
+    events = {e["name"]: e for e in tracer.events}
+    assert events["process_story"]["args"] == {"version": "v2", "status": "success"}
+    assert events["save_page"]["args"] == {"page_num": 4} and events["save_page"]["cat"] == "io"
+    assert events["falla"]["args"]["error"] == "ValueError: boom"
+    # El hijo queda contenido en el padre
+    parent, child = events["save_page"], events["serialize"]
+    assert parent["ts"] <= child["ts"] and child["ts"] + child["dur"] <= parent["ts"] + parent["dur"] + 1
+
+
+def test_export_chrome_trace_con_hilos():
+    tracer = Tracer("historia-2", max_events=3)
+
+    def worker():
+        with tracer.activate(), span("pagina", "page"):
+            pass
+
+    thread = threading.Thread(target=worker, name="pagina-1")
+    thread.start()
+    thread.join()
+    with tracer.activate():
+        for i in range(3):
+            with span(f"io {i}", "io"):
+                pass
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "trace.json"
+        tracer.save(path)
+        trace = json.loads(path.read_text(encoding="utf-8"))
+
+    spans = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    names = {e["args"]["name"] for e in trace["traceEvents"] if e["name"] == "thread_name"}
+    assert len(spans) == 3 and trace["otherData"]["dropped_events"] == 1
+    assert {"pagina-1", threading.current_thread().name} <= names
+    assert all({"ts", "dur", "pid", "tid"} <= set(e) for e in spans)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")